@@ -1,1618 +1,4945 @@
-import streamlit as st
-import pandas as pd
-import numpy as np
-import datetime
-import plotly.express as px
-from streamlit_option_menu import option_menu
-import unicodedata
-import re
-import io
-
-# --- Configurações Iniciais do Streamlit ---
-st.set_page_config(
-    page_title="Monitoramento Inteligente da Rede de Prestadores A24h",
-    layout="wide",
-    initial_sidebar_state="expanded",
-    page_icon="favicon.ico"
-)
-
-# --- Gerenciamento do Estado da Sessão ---
-if 'logged_in' not in st.session_state:
-    st.session_state['logged_in'] = False
-
-# --- Constantes ---
-MIN_ATTENDANCES_FOR_RANKING = 1 # Contagem mínima de atendimentos para rankings de prestador/segmento/seguradora
-MIN_ATTENDANCES_FOR_CITY_ANALYSIS = 10 # Atendimentos mínimos padrão para análise de cidade em Capilaridade
-ALL_OPTION = "TODOS" # Constante para a opção "TODOS" nos filtros
-FINANCIAL_KPI_FILE = "https://github.com/vinikrebs/ScrorePrestador/raw/main/processed_financeiro.parquet"
-ATENDIMENTO_FILE_PATH = 'https://github.com/vinikrebs/ScrorePrestador/raw/main/processed_atendimentos.parquet'
-NPS_CIDADE_PATH = "https://github.com/vinikrebs/ScrorePrestador/raw/main/processed_nps_by_city.parquet"
-NPS_PRESTADOR_PATH = "https://github.com/vinikrebs/ScrorePrestador/raw/main/processed_nps_by_provider.parquet"
-LOGO_PATH = "https://github.com/vinikrebs/ScrorePrestador/raw/main/logo.png"
-
-# --- Função da Página de Login ---
-def login_page():
-    """Renderiza a página de login."""
-    col_logo_left, col_logo_center, col_logo_right = st.columns([1.5, 3, 1.5])
-    with col_logo_center:
-        # Caminho da imagem no servidor em produção pode ser diferente
-        # Centralizando a imagem usando markdown e HTML
-        st.markdown("<div style='text-align: center;'>", unsafe_allow_html=True)
-        st.image(LOGO_PATH, use_container_width=False, width=1600)
-        st.markdown("</div>", unsafe_allow_html=True)
-
-
-    st.markdown("<h1 style='text-align: center; color: #333333;'>Acesso ao Dashboard Score do Prestador A24h</h1>", unsafe_allow_html=True)
-    st.empty() # Adiciona espaço vertical
-    st.empty() # Adiciona espaço vertical
-
-    with st.form("login_form"):
-        st.markdown("<p style='text-align: center;'>Por favor, insira suas credenciais.</p>", unsafe_allow_html=True)
-        username = st.text_input("Usuário", key="username_input")
-        password = st.text_input("Senha", type="password", key="password_input")
-
-        col_login_btn, col_forgot_btn = st.columns(2)
-        with col_login_btn:
-            login_button = st.form_submit_button("Entrar")
-        with col_forgot_btn:
-            # Botão "Criar uma nova conta"
-            create_account_button = st.form_submit_button("Criar uma nova conta")
-
-        if login_button:
-            if username == "maxpar" and password == "Max!Q@W":
-                st.session_state['logged_in'] = True
-                st.session_state['username'] = username
-                st.success("Login realizado com sucesso!")
-                st.rerun()
-            else:
-                st.error("Usuário ou senha inválidos. Tente novamente.")
-
-        if create_account_button:
-            # Mensagem para "Criar uma nova conta"
-            st.info("Por favor, envie um e-mail para vinicius.krebs@autoglass.com.br para criar uma nova conta.")
-
-# --- Função de Carregamento e Preparação de Dados (com cache para performance) ---
-@st.cache_data
-def load_and_prepare_data(atendimentos_file_path, nps_cidade_path, nps_prestador_path):
-    pd.set_option('future.no_silent_downcasting', True)
-
-    # Carrega e processa df_final
-    try:
-        df_final = pd.read_parquet(atendimentos_file_path)
-    except FileNotFoundError:
-        st.error(f"Erro: Arquivo '{atendimentos_file_path}' não encontrado. Verifique o caminho.")
-        st.stop()
-    except Exception as e:
-        st.error(f"Erro ao ler o arquivo Parquet de atendimentos: {e}. Verifique se o arquivo está no formato correto.")
-        st.stop()
-
-    if 'data_abertura_atendimento' in df_final.columns:
-        df_final['data_abertura_atendimento'] = pd.to_datetime(df_final['data_abertura_atendimento'], errors='coerce')
-    else:
-        st.error("Coluna 'data_abertura_atendimento' não encontrada no DataFrame de atendimentos.")
-        st.stop()
-
-    df_final = df_final.dropna(subset=['data_abertura_atendimento']).copy()
-
-    for col in ['segmento', 'seguradora', 'uf', 'municipio', 'nome_do_prestador', 'protocolo_atendimento']:
-        if col in df_final.columns:
-            df_final[col] = df_final[col].astype(str).fillna('NAO INFORMADO').str.upper()
-            if col not in ['protocolo_atendimento']:
-                df_final[col] = df_final[col].astype('category')
-
-    if 'gerou_reembolso' in df_final.columns:
-        df_final['gerou_reembolso'] = df_final['gerou_reembolso'].astype(bool)
-    if 'val_reembolso' in df_final.columns:
-        df_final['val_reembolso'] = df_final['val_reembolso'].astype(float)
-    if 'is_reembolso' in df_final.columns:
-        df_final['is_reembolso'] = df_final['is_reembolso'].astype(bool)
-    if 'is_intermediacao' in df_final.columns:
-        df_final['is_intermediacao'] = df_final['is_intermediacao'].astype(bool)
-    if 'tempo_chegada_min' in df_final.columns:
-        df_final['tempo_chegada_min'] = df_final['tempo_chegada_min'].astype(float)
-    if 'val_total_items' in df_final.columns:
-        df_final['val_total_items'] = df_final['val_total_items'].astype(float)
-    
-    # --- Carrega e processa df_nps_cidade ---
-    try:
-        df_nps_cidade = pd.read_parquet(nps_cidade_path)
-        # Ajustar tipos e lidar com NaNs nas colunas de NPS
-        for col in ['nps_score_calculado', 'nps_promotores', 'nps_neutros', 'nps_detratores']:
-            if col in df_nps_cidade.columns:
-                df_nps_cidade[col] = pd.to_numeric(df_nps_cidade[col], errors='coerce').fillna(0) # Trata ' ' como NaN e preenche com 0
-        if 'mes_ano' in df_nps_cidade.columns:
-             df_nps_cidade['mes_ano'] = pd.to_datetime(df_nps_cidade['mes_ano'], errors='coerce').dt.to_period('M')
-        else:
-             st.warning("Coluna 'mes_ano' não encontrada no arquivo NPS por cidade.")
-    except FileNotFoundError:
-        st.warning(f"Aviso: Arquivo '{nps_cidade_path}' não encontrado. A análise de NPS por cidade pode estar incompleta.")
-        df_nps_cidade = pd.DataFrame() # Retorna DataFrame vazio para evitar erros
-    except Exception as e:
-        st.error(f"Erro ao ler o arquivo Parquet de NPS por cidade: {e}.")
-        df_nps_cidade = pd.DataFrame()
-
-    # --- Carrega e processa df_nps_prestador ---
-    try:
-        df_nps_prestador = pd.read_parquet(nps_prestador_path)
-        # Ajustar tipos e lidar com NaNs nas colunas de NPS
-        for col in ['nps_score_calculado', 'nps_promotores', 'nps_neutros', 'nps_detratores']:
-            if col in df_nps_prestador.columns:
-                df_nps_prestador[col] = pd.to_numeric(df_nps_prestador[col], errors='coerce').fillna(0) # Trata ' ' como NaN e preenche com 0
-        if 'mes_ano' in df_nps_prestador.columns:
-            df_nps_prestador['mes_ano'] = pd.to_datetime(df_nps_prestador['mes_ano'], errors='coerce').dt.to_period('M')
-        else:
-            st.warning("Coluna 'mes_ano' não encontrada no arquivo NPS por prestador.")
-    except FileNotFoundError:
-        st.warning(f"Aviso: Arquivo '{nps_prestador_path}' não encontrado. A análise de NPS por prestador pode estar incompleta.")
-        df_nps_prestador = pd.DataFrame() # Retorna DataFrame vazio para evitar erros
-    except Exception as e:
-        st.error(f"Erro ao ler o arquivo Parquet de NPS por prestador: {e}.")
-        df_nps_prestador = pd.DataFrame()
-
-    return df_final, df_nps_cidade, df_nps_prestador,
-
-# --- Função Geral de Aplicação de Filtros ---
-def apply_filters(df, selected_segments, selected_insurers, selected_states, selected_municipios, start_date, end_date):
-    """Aplica filtros comuns ao DataFrame."""
-    df_filtrado = df[
-        (df['segmento'].isin(selected_segments)) &
-        (df['seguradora'].isin(selected_insurers)) &
-        (df['uf'].isin(selected_states)) &
-        (df['municipio'].isin(selected_municipios)) &
-        (df['data_abertura_atendimento'].dt.date >= start_date) &
-        (df['data_abertura_atendimento'].dt.date <= end_date)
-    ].copy()
-    return df_filtrado
-
-# --- Funções para Páginas (Pilares) ---
-def page_informacao():
-    """Renderiza a página de informações gerais do dashboard."""
-    st.markdown("""
-    # Monitoramento Inteligente da Rede de Prestadores A24h
-
-    **Bem-vindo ao Dashboard de Monitoramento Inteligente da Rede de Prestadores A24h!** Esta plataforma foi desenhada para transformar dados complexos em *insights acionáveis*, permitindo decisões ágeis e estratégicas para otimizar performance, reduzir custos e garantir a melhor experiência para nossos clientes.
-
-    **Explore os pilares abaixo** e descubra diferentes perspectivas da nossa rede de parceiros:
-
-    ---
-    """)
-
-    st.markdown("## 📍 Pilar Capilaridade")
-    st.markdown("""
-    Monitora a **distribuição** e a **disponibilidade** dos prestadores em relação à demanda da região.
-
-    **Objetivo:** Ajuda a identificar áreas descobertas, equilibrar recursos e evitar sobrecarga em determinados prestadores.
-    """)
-
-    st.subheader("Indicadores de Capilaridade")
-    df_capilaridade_kpis = pd.DataFrame({
-        "KPI": ["Índice de Capilaridade", "Vazio Assistencial", "Intermediações por Atendimento"],
-        "O que mede": [
-            "Equilíbrio entre rede e demanda",
-            "Municípios atendidos sem prestadores disponíveis",
-            "Complexidade operacional"
-        ],
-        "Fórmula": [
-            "Nº de Prestadores / Nº de Atendimentos",
-            "Nº de Atendimentos / Nº de Prestadores",
-            "Nº de Intermediações / Nº de Atendimentos"
-        ]
-    })
-    st.dataframe(df_capilaridade_kpis, hide_index=True)
-
-    st.markdown("---")
-
-    st.markdown("## 💰 Pilar Financeiro")
-    st.markdown("""
-    Analisa a **eficiência econômica** da rede e o impacto no custo médio por serviço (CMS).
-
-    **Objetivo:** Permite controlar custos, identificar oportunidades de economia e evitar distorções regionais.
-    """)
-
-    st.subheader("Indicadores Financeiros")
-    df_financeiro_kpis = pd.DataFrame({
-        "KPI": ["Diferença CMS", "Proporção de Reembolso"],
-        "O que mede": [
-            "Custo médio por serviço em relação à média estadual e segmentada",
-            "Dependência de reembolsos na operação"
-        ],
-        "Fórmula": [
-            "(CMS Cidade Segmento - CMS Estadual Segmento) / CMS Estadual Segmento",
-            "Nº de Reembolsos / Total de Atendimentos"
-        ]
-    })
-    st.dataframe(df_financeiro_kpis, hide_index=True)
-
-    st.markdown("---")
-
-    st.markdown("## ⟳ Pilar Frequência de Uso")
-    st.markdown("""
-    Acompanha o quanto os serviços estão sendo utilizados por apólice em cada região.
-
-    **Objetivo:** Ajuda a identificar padrões de uso, prever demandas futuras e gerenciar melhor a capacidade da rede.
-    """)
-
-    st.subheader("Indicadores de Frequência de Uso")
-    df_frequencia_kpis = pd.DataFrame({
-        "KPI": ["Frequência por Apólice"],
-        "O que mede": ["Média de atendimentos por cliente/apólice"],
-        "Fórmula": ["Nº de Atendimentos / Nº de Apólices"]
-    })
-    st.dataframe(df_frequencia_kpis, hide_index=True)
-
-    st.markdown("---")
-
-    st.markdown("## ✨ Pilar Qualidade")
-    st.markdown("""
-    Avalia a **satisfação do cliente** e a **qualidade do serviço entregue**.
-
-    **Objetivo:** Monitora o nível de confiança do cliente e identifica oportunidades de melhoria.
-    """)
-
-    st.subheader("Indicadores de Qualidade")
-    df_qualidade_kpis = pd.DataFrame({
-        "KPI": ["NPS", "TMC"],
-        "O que mede": [
-            "Índice de satisfação do cliente",
-            "Tempo médio de chegada ao local do sinistro"
-        ],
-        "Fórmula": [
-            "% Promotores - % Detratores",
-            "Média de tempo de chegada ao segurado"
-        ]
-    })
-    st.dataframe(df_qualidade_kpis, hide_index=True)
-
-    st.markdown("""
-    ### 🛠️ Tecnologias Utilizadas
-    * **Python**: Linguagem de programação principal.
-    * **Streamlit**: Framework para construção da interface web interativa.
-    * **Pandas**: Biblioteca para manipulação e análise de dados.
-    * **NumPy**: Biblioteca para operações numéricas.
-    * **Plotly Express**: Biblioteca para criação de gráficos interativos.
-    * **Streamlit-Option-Menu**: Componente para a barra lateral de navegação.
-    * **Unicodedata, re**: Módulos para normalização e limpeza de strings.
-    * **Xlsxwriter**: Engine para exportação de dados para arquivos Excel.
-
-    ### 💡 Contribuição
-    Este dashboard foi desenvolvido por **Vinicius Krebs** como parte do projeto de **Redução de Custos A24H e Aumento de Capilaridade da Rede**.
-    """)
-    st.markdown("---")
-    st.info("Utilize o menu na barra lateral para navegar por cada pilar. Cada seção oferece filtros detalhados para uma análise personalizada.")
-
-
-def calculate_capilaridade_index(df_agregado_cidade):
-    if df_agregado_cidade.empty:
-        return pd.DataFrame()
-
-    max_servicos = df_agregado_cidade['num_servicos'].max()
-    df_agregado_cidade['norm_atendimentos'] = df_agregado_cidade['num_servicos'] / max_servicos if max_servicos > 0 else 0
-    
-    max_prestadores = df_agregado_cidade['num_prestadores'].max()
-    df_agregado_cidade['norm_prestadores'] = df_agregado_cidade['num_prestadores'] / max_prestadores if max_prestadores > 0 else 0
-
-    max_pct_reembolso = df_agregado_cidade['pct_reembolso'].max()
-    df_agregado_cidade['norm_pct_reembolso'] = df_agregado_cidade['pct_reembolso'] / max_pct_reembolso if max_pct_reembolso > 0 else 0
-    df_agregado_cidade['contrib_reembolso'] = (1 - df_agregado_cidade['norm_pct_reembolso']) if max_pct_reembolso > 0 else 1
-
-    max_pct_intermediacao = df_agregado_cidade['pct_intermediacao'].max()
-    df_agregado_cidade['norm_pct_intermediacao'] = df_agregado_cidade['pct_intermediacao'] / max_pct_intermediacao if max_pct_intermediacao > 0 else 0
-    df_agregado_cidade['contrib_intermediacao'] = (1 - df_agregado_cidade['norm_pct_intermediacao']) if max_pct_intermediacao > 0 else 1
-
-    max_tempo_chegada = df_agregado_cidade['media_tempo_chegada'].max()
-    df_agregado_cidade['norm_tempo_chegada'] = df_agregado_cidade['media_tempo_chegada'] / max_tempo_chegada if max_tempo_chegada > 0 else 0
-    df_agregado_cidade['contrib_tempo_chegada'] = (1 - df_agregado_cidade['norm_tempo_chegada']) if max_tempo_chegada > 0 else 1
-
-    df_agregado_cidade['indice_capilaridade'] = (
-        df_agregado_cidade['norm_atendimentos'] * 0.3 +
-        df_agregado_cidade['norm_prestadores'] * 0.3 +
-        df_agregado_cidade['contrib_reembolso'] * 0.2 +
-        df_agregado_cidade['contrib_intermediacao'] * 0.1 +
-        df_agregado_cidade['contrib_tempo_chegada'] * 0.1
-    )
-
-    if not df_agregado_cidade['indice_capilaridade'].empty and df_agregado_cidade['indice_capilaridade'].nunique() > 0:
-        unique_indices = df_agregado_cidade['indice_capilaridade'].nunique()
-        if unique_indices <= 1:
-            df_agregado_cidade['status_capilaridade'] = 'Capilaridade Regular'
-        else:
-            q1 = df_agregado_cidade['indice_capilaridade'].quantile(0.25)
-            q3 = df_agregado_cidade['indice_capilaridade'].quantile(0.75)
-            
-            bins = sorted(list(set([
-                df_agregado_cidade['indice_capilaridade'].min() - 0.001, 
-                q1, 
-                q3, 
-                df_agregado_cidade['indice_capilaridade'].max() + 0.001
-            ])))
-            
-            labels_map = {
-                2: ['Carência Assistencial', 'Boa Capilaridade'],
-                3: ['Carência Assistencial', 'Capilaridade Regular', 'Boa Capilaridade']
-            }
-            labels = labels_map.get(len(bins) - 1, ['Capilaridade Regular']) 
-
-            df_agregado_cidade['status_capilaridade'] = pd.cut(
-                df_agregado_cidade['indice_capilaridade'],
-                bins=bins,
-                labels=labels,
-                right=True,
-                duplicates='drop'
-            )
-            df_agregado_cidade['status_capilaridade'] = df_agregado_cidade['status_capilaridade'].fillna('Capilaridade Regular')
-            
-            df_agregado_cidade['status_capilaridade'] = pd.Categorical(
-                df_agregado_cidade['status_capilaridade'],
-                categories=['Carência Assistencial', 'Capilaridade Regular', 'Boa Capilaridade'],
-                ordered=True
-            )
-    else:
-        df_agregado_cidade['status_capilaridade'] = 'N/A'
-    return df_agregado_cidade
-
-def get_sugestao_acao(row, df_agregado_cidade, min_atendimentos_cidade):
-    sugestoes = set()
-    if row['status_capilaridade'] == 'Carência Assistencial':
-        sugestoes.add("Recrutamento urgente de prestadores. Analisar concorrência local.")
-    
-    if row['num_servicos'] > 0 and row['num_prestadores'] == 0:
-        sugestoes.add("Ausência de prestadores. Foco total em parceria local.")
-    
-    if row['num_servicos'] >= min_atendimentos_cidade: 
-        if df_agregado_cidade['pct_reembolso'].nunique() > 1:
-            pct_reembolso_80 = df_agregado_cidade['pct_reembolso'].quantile(0.80)
-            if row['pct_reembolso'] > pct_reembolso_80:
-                sugestoes.add("Alto % de reembolso. Investigar causas de insatisfação ou deficiência de prestadores.")
-        
-        if df_agregado_cidade['pct_intermediacao'].nunique() > 1:
-            pct_intermediacao_80 = df_agregado_cidade['pct_intermediacao'].quantile(0.80)
-            if row['pct_intermediacao'] > pct_intermediacao_80:
-                sugestoes.add("Alto % de intermediação. Otimizar processos de acionamento ou recrutar prestadores diretos.")
-        
-        if df_agregado_cidade['media_tempo_chegada'].nunique() > 1:
-            tempo_chegada_80 = df_agregado_cidade['media_tempo_chegada'].quantile(0.80)
-            if row['media_tempo_chegada'] > tempo_chegada_80:
-                sugestoes.add("Alto tempo de chegada. Otimizar rotas ou aumentar a densidade de prestadores próximos.")
-
-    return " | ".join(sorted(list(sugestoes))) if sugestoes else "Nenhuma sugestão específica."
-
-def display_specific_problem_rankings(df_agregado_cidade):
-    st.markdown("---")
-    st.header("Classificações de Problemas Específicos")
-    st.markdown("Cidades com os maiores desafios em reembolso e intermediação.")
-    
-    col_reembolso_rank, col_intermediacao_rank = st.columns(2)
-    
-    with col_reembolso_rank:
-        st.subheader("Cidades por % de Reembolso")
-        if 'total_valor_servicos' not in df_agregado_cidade.columns:
-            df_agregado_cidade['total_valor_servicos'] = 0 
-        
-        df_reembolso_rank = df_agregado_cidade.sort_values('pct_reembolso', ascending=False).head(10).copy()
-        
-        df_reembolso_rank_display = df_reembolso_rank.rename(columns={
-            'municipio': 'Cidade',
-            'uf': 'UF',
-            'num_servicos': 'Qtd. Serviços',
-            'pct_reembolso': '% Reembolso',
-            'total_valor_servicos': 'Valor Total'
-        })
-        st.dataframe(
-            df_reembolso_rank_display[['Cidade', 'UF', 'Qtd. Serviços', '% Reembolso', 'Valor Total']].style.format({
-                'Qtd. Serviços': '{:,.0f}',
-                '% Reembolso': '{:.2f}%',
-                'Valor Total': 'R$ {:,.2f}'
-            }),
-            use_container_width=True
-        )
-        st.markdown("**Sugestão:** Busca de novos prestadores para reduzir a taxa de reembolso e diminuir o CMS.")
-    
-    with col_intermediacao_rank:
-        st.subheader("Cidades por % de Intermediação")
-        if 'total_valor_servicos' not in df_agregado_cidade.columns:
-            df_agregado_cidade['total_valor_servicos'] = 0 
-
-        df_intermediacao_rank = df_agregado_cidade.sort_values('pct_intermediacao', ascending=False).head(10).copy()
-        
-        df_intermediacao_rank_display = df_intermediacao_rank.rename(columns={
-            'municipio': 'Cidade',
-            'uf': 'UF',
-            'num_servicos': 'Qtd. Serviços',
-            'pct_intermediacao': '% Intermediação',
-            'total_valor_servicos': 'Valor Total'
-        })
-        st.dataframe(
-            df_intermediacao_rank_display[['Cidade', 'UF', 'Qtd. Serviços', '% Intermediação', 'Valor Total']].style.format({
-                'Qtd. Serviços': '{:,.0f}',
-                '% Intermediacao': '{:.2f}%',
-                'Valor Total': 'R$ {:,.2f}'
-            }),
-            use_container_width=True
-        )
-        st.markdown("**Sugestão:** Otimizar processos de acionamento ou recrutar prestadores diretos para reduzir intermediações.")
-
-
-def display_capilaridade_kpis(df_filtrado_original, df_agregado_cidade_com_indice=None):
-    st.markdown("---")
-    st.header("KPIs Gerais de Capilaridade")
-    
-    total_servicos = len(df_filtrado_original)
-    total_prestadores_unicos = df_filtrado_original['nome_do_prestador'].nunique()
-    total_cidades_atendidas = df_filtrado_original['municipio'].nunique()
-    media_tempo_chegada = df_filtrado_original['tempo_chegada_min'].mean()
-    pct_reembolso = (df_filtrado_original['is_reembolso'].sum() / total_servicos) * 100 if total_servicos > 0 else 0
-    pct_intermediacao = (df_filtrado_original['is_intermediacao'].sum() / total_servicos) * 100 if total_servicos > 0 else 0
-
-    col1, col2, col3, col4, col5, col6 = st.columns(6)
-    col1.metric("Total de Serviços", f"{total_servicos:,}".replace(',', '.'), help="Número total de atendimentos registrados com os filtros aplicados.")
-    col2.metric("Prestadores Únicos", f"{total_prestadores_unicos:,}".replace(',', '.'), help="Número de prestadores distintos que realizaram atendimentos com os filtros aplicados.")
-    col3.metric("Cidades Atendidas", f"{total_cidades_atendidas:,}".replace(',', '.'), help="Número de municípios onde houve atendimentos com os filtros aplicados.")
-    col4.metric("TMC (min)", f"{media_tempo_chegada:.0f} min" if not pd.isna(media_tempo_chegada) else "N/A", help="Tempo Médio de Chegada do prestador ao local do serviço, em minutos.")
-    col5.metric("Perc. Reembolso", f"{pct_reembolso:.2f}%", help="Percentual de serviços que geraram algum tipo de reembolso, indicando falha na cobertura direta ou preferência do cliente.")
-    col6.metric("Perc. Intermediação", f"{pct_intermediacao:.2f}%", help="Percentual de serviços que foram realizados por meio de intermediação, e não por prestadores diretos da rede.")
-
-    if df_agregado_cidade_com_indice is not None and not df_agregado_cidade_com_indice.empty:
-        st.markdown("---")
-        st.header("Dispersão de Capilaridade por Cidade")
-        st.info("Visualize a relação entre o número de serviços e a quantidade de prestadores. Círculos maiores indicam maior volume de atendimentos. As cores representam o status de capilaridade da cidade.")
-
-        category_order = ['Carência Assistencial', 'Capilaridade Regular', 'Boa Capilaridade']
-        status_colors = {
-            'Carência Assistencial': '#EF5350',
-            'Capilaridade Regular': '#FFCA28',
-            'Boa Capilaridade': '#66BB6A'
-        }
-
-        fig_capilaridade = px.scatter(
-            df_agregado_cidade_com_indice, 
-            x='num_servicos',
-            y='num_prestadores',
-            color='status_capilaridade',
-            size='num_servicos',
-            hover_name='municipio',
-            hover_data={
-                'uf': True,
-                'num_servicos': ':.0f',
-                'num_prestadores': ':.0f',
-                'indice_capilaridade': ':.2f',
-                'status_capilaridade': True,
-                'pct_reembolso': ':.2f',
-                'pct_intermediacao': ':.2f',
-                'media_tempo_chegada': ':.0f'
-            },
-            title='Capilaridade: Serviços vs. Prestadores por Cidade e Status',
-            labels={
-                'num_servicos': 'Número de Serviços (Atendimentos)',
-                'num_prestadores': 'Número de Prestadores',
-                'status_capilaridade': 'Status de Capilaridade'
-            },
-            color_discrete_map=status_colors,
-            category_orders={'status_capilaridade': category_order},
-            height=600,
-            log_x=True,
-            )
-
-        fig_capilaridade.update_layout(
-            xaxis_title="Número de Serviços (Atendimentos)",
-            yaxis_title="Número de Prestadores",
-            legend_title="Status de Capilaridade",
-            hovermode="closest",
-            yaxis=dict(showgrid=False) 
-        )
-        
-        st.plotly_chart(fig_capilaridade, use_container_width=True)
-
-def page_capilaridade(df):
-    st.title("Capilaridade da Rede")
-    st.markdown("Esta seção oferece uma visão detalhada da distribuição e cobertura dos nossos prestadores, identificando áreas de alta demanda e oportunidades de expansão.")
-
-
-    st.markdown("---")
-
-    df_agregado_cidade = df.groupby(['uf', 'municipio'], observed=True).agg(
-        num_servicos=('protocolo_atendimento', 'nunique'),
-        num_prestadores=('nome_do_prestador', 'nunique'),
-        num_reembolsos=('is_reembolso', lambda x: x.sum()),
-        num_intermediacoes=('is_intermediacao', lambda x: x.sum()),
-        media_tempo_chegada=('tempo_chegada_min', 'mean'),
-        total_valor_servicos=('val_total_items', 'sum')
-    ).reset_index()
-
-    min_atendimentos_cidade = st.number_input(
-        label="Defina o Mínimo de Atendimentos por Prestador", 
-        min_value=1,
-        max_value=200, 
-        value=MIN_ATTENDANCES_FOR_CITY_ANALYSIS, 
-        step=1,
-        help="Cidades com número de atendimentos abaixo deste valor não serão incluídas na análise de capilaridade detalhada."
-    )
- 
-
-
-    df_agregado_cidade['pct_reembolso'] = np.where(
-        df_agregado_cidade['num_servicos'] > 0,
-        (df_agregado_cidade['num_reembolsos'] / df_agregado_cidade['num_servicos']) * 100,
-        0
-    )
-    df_agregado_cidade['pct_intermediacao'] = np.where(
-        df_agregado_cidade['num_servicos'] > 0,
-        (df_agregado_cidade['num_intermediacoes'] / df_agregado_cidade['num_servicos']) * 100,
-        0
-    )
-    df_agregado_cidade['media_tempo_chegada'] = df_agregado_cidade['media_tempo_chegada'].fillna(0)
-
-    df_agregado_cidade['num_servicos_nao_atendidos'] = df_agregado_cidade['num_servicos'] - \
-                                                        df_agregado_cidade['num_reembolsos'] - \
-                                                        df_agregado_cidade['num_intermediacoes']
-    df_agregado_cidade['num_servicos_nao_atendidos'] = df_agregado_cidade['num_servicos_nao_atendidos'].clip(lower=0)
-
-    df_agregado_cidade_filtrado = df_agregado_cidade[df_agregado_cidade['num_servicos'] >= min_atendimentos_cidade].copy()
-    
-    df_agregado_cidade_com_indice = calculate_capilaridade_index(df_agregado_cidade_filtrado)
-
-    
-
-    display_capilaridade_kpis(df, df_agregado_cidade_com_indice)
-
-    if not df_agregado_cidade_com_indice.empty:
-        df_agregado_cidade_com_indice['sugestao_acao'] = df_agregado_cidade_com_indice.apply(
-            lambda row: get_sugestao_acao(row, df_agregado_cidade_com_indice, min_atendimentos_cidade), axis=1
-        )
-
-        st.markdown("---")
-        st.subheader("Cidades com Necessidade de Atenção na Capilaridade")
-        st.info("Foque nestas cidades para otimizar a cobertura da sua rede.")
-        
-        df_offenders = df_agregado_cidade_com_indice[
-            (df_agregado_cidade_com_indice['status_capilaridade'] == 'Carência Assistencial') |
-            (df_agregado_cidade_com_indice['pct_reembolso'] > df_agregado_cidade_com_indice['pct_reembolso'].quantile(0.75)) |
-            (df_agregado_cidade_com_indice['pct_intermediacao'] > df_agregado_cidade_com_indice['pct_intermediacao'].quantile(0.75)) |
-            (df_agregado_cidade_com_indice['media_tempo_chegada'] > df_agregado_cidade_com_indice['media_tempo_chegada'].quantile(0.75))
-        ].sort_values('indice_capilaridade', ascending=True)
-
-        if not df_offenders.empty:
-            st.dataframe(
-                df_offenders.rename(columns={
-                    'municipio': 'Cidade',
-                    'uf': 'UF',
-                    'num_servicos': 'Qtd. Serviços',
-                    'num_prestadores': 'Qtd. Prestadores',
-                    'num_servicos_nao_atendidos': 'Qtd. Não Atendidos', 
-                    'pct_reembolso': '% Reembolso',
-                    'pct_intermediacao': '% Intermediação',
-                    'media_tempo_chegada': 'TMC Médio (min)',
-                    'indice_capilaridade': 'Índice Capilaridade',
-                    'status_capilaridade': 'Status Capilaridade',
-                    'sugestao_acao': 'Sugestão de Ação'
-                })[[
-                    'Cidade', 
-                    'UF', 
-                    'Qtd. Serviços', 
-                    'Qtd. Não Atendidos', 
-                    'Qtd. Prestadores', 
-                    '% Reembolso', 
-                    '% Intermediação', 
-                    'TMC Médio (min)', 
-                    'Índice Capilaridade', 
-                    'Status Capilaridade', 
-                    'Sugestão de Ação'
-                ]].style.format({
-                        'Qtd. Serviços': '{:,.0f}',
-                        'Qtd. Não Atendidos': '{:,.0f}', 
-                        'Qtd. Prestadores': '{:,.0f}',
-                        '% Reembolso': '{:.2f}%',
-                        '% Intermediacao': '{:.2f}%',
-                        'TMC Médio (min)': '{:.0f}',
-                        'Índice Capilaridade': '{:.2f}'
-                    }),
-                use_container_width=True
-            )
-            
-            col_dl1, col_dl2, col_dl3 = st.columns(3)
-            with col_dl2:
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                    df_offenders.to_excel(writer, index=False, sheet_name='Cidades Ofensoras')
-                output.seek(0)
-                st.download_button(
-                    label="Baixar Cidades Ofensoras (XLSX)",
-                    data=output,
-                    file_name='cidades_ofensoras_capilaridade.xlsx',
-                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    help="Baixa os dados das cidades identificadas como principais ofensoras na capilaridade em formato XLSX."
-                )
-            with col_dl1:
-                output_full = io.BytesIO()
-                with pd.ExcelWriter(output_full, engine='xlsxwriter') as writer:
-                    df_agregado_cidade_com_indice.to_excel(writer, index=False, sheet_name='Capilaridade Completa')
-                output_full.seek(0)
-                st.download_button(
-                    label="Baixar Todos os Dados de Capilaridade (XLSX)",
-                    data=output_full,
-                    file_name='capilaridade_por_cidade_completo.xlsx',
-                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    help="Baixa todos os dados agregados de capilaridade por cidade com os filtros aplicados e sugestões de ação em formato XLSX."
-                )
-        else:
-            st.info("Nenhuma cidade identificada como 'ofensora' com base nos critérios atuais. Excelente!")
-
-        display_specific_problem_rankings(df_agregado_cidade_com_indice)
-
-    else:
-        st.info("Nenhum dado de capilaridade disponível com os filtros e limites selecionados.")
-
-    with st.expander("💡 Como é calculado o Índice de Capilaridade?"):
-        st.markdown(r"""
-        O **Índice de Capilaridade** é um score composto que avalia a eficiência e a cobertura da rede em cada cidade, combinando múltiplos fatores:
-
-        * **Normalização dos Dados:** Todos os componentes são normalizados entre 0 e 1 (ou 0 a 100) para garantir que tenham o mesmo peso e não sejam dominados por valores absolutos.
-        * **Componentes e Pesos:**
-            * **Volume de Serviços (30%):** Cidades com maior volume de serviços contribuem positivamente, pois representam demanda onde a capilaridade é crítica.
-            * **Número de Prestadores (30%):** Uma maior quantidade de prestadores únicos em uma cidade indica melhor oferta de serviços.
-            * **Reembolso (20%):** Menor percentual de serviços que resultam em reembolso indica que a rede está mais eficaz em resolver o problema diretamente. (Peso inverso: quanto menor o reembolso, maior a contribuição positiva).
-            * **Intermediação (10%):** Menor percentual de serviços que necessitam de intermediação (ou seja, resolvidos diretamente pela rede própria) indica maior eficiência. (Peso inverso).
-            * **Tempo Médio de Chegada (10%):** Tempos de chegada menores indicam agilidade e proximidade dos prestadores. (Peso inverso).
-
-        **Fórmula Simplificada:**
-        $$ \text{Índice Capilaridade} = \left( \text{Serviços Normalizados} \times 0.3 \right) + \left( \text{Prestadores Normalizados} \times 0.3 \right) + \left( (1 - \text{Reembolso Normalizado}) \times 0.2 \right) + \left( (1 - \text{Intermediação Normalizada}) \times 0.1 \right) + \left( (1 - \text{TMC Normalizado}) \times 0.1 \right) $$
-
-        **Classificação do Status de Capilaridade:**
-        O status é determinado pelos quartis do Índice de Capilaridade:
-        * **Carência Assistencial:** Cidades no quartil inferior (piores 25%).
-        * **Capilaridade Regular:** Cidades entre o primeiro e o terceiro quartil (25% a 75%).
-        * **Boa Capilaridade:** Cidades no quartil superior (melhores 25%).
-        """)
-
-    with st.expander("💡 Como são geradas as Sugestões de Ação?"):
-        st.markdown("""
-        As sugestões de ação são geradas dinamicamente para cada município com base em suas características e desvios em relação à média:
-        * **Carência Assistencial:** Se o status de capilaridade for 'Carência Assistencial', a sugestão é 'Recrutamento urgente de prestadores. Analisar concorrência local.'
-        * **Ausência de Prestadores:** Se a cidade tem atendimentos, mas nenhum prestador registrado ('Qtd. Prestadores' é zero), a sugestão é 'Ausência de prestadores. Foco total em parceria local.'
-        * **Alto % de Reembolso:** Se o percentual de reembolso da cidade está acima do percentil 80 das cidades analisadas, a sugestão é 'Alto % de reembolso. Investigar causas de insatisfação ou deficiência de prestadores.'
-        * **Alto % de Intermediação:** Se o percentual de intermediação da cidade está acima do percentil 80, a sugestão é 'Alto % de intermediação. Otimizar processos de acionamento ou recrutar prestadores diretos.'
-        * **Alto Tempo Médio de Chegada (TMC):** Se o TMC da cidade está acima do percentil 80, a sugestão é 'Alto tempo de chegada. Otimizar rotas ou aumentar a densidade de prestadores próximos.'
-        As sugestões são combinadas e ordenadas para fornecer um plano de ação abrangente para cada município.
-        """)
-
-def page_financeiro(df):
-    st.title("Análise Financeira da Rede de Prestadores")
-    st.markdown("Monitore os custos, otimize as despesas e melhore a rentabilidade da sua rede.")
-
-    st.markdown("---")
-    st.header("KPIs Financeiros Gerais")
-    st.markdown("Visualize os indicadores financeiros chave da sua rede.")
-
-    total_gasto = df['val_total_items'].sum()
-    total_servicos = len(df)
-    cms_medio = total_gasto / total_servicos if total_servicos > 0 else 0
-    total_reembolso = df['val_reembolso'].sum()
-    pct_gasto_reembolso = (total_reembolso / total_gasto) * 100 if total_gasto > 0 else 0
-    total_intermediacao_servicos = df['is_intermediacao'].sum()
-    pct_intermediacao_servicos = (total_intermediacao_servicos / total_servicos) * 100 if total_servicos > 0 else 0
-
-    col1, col2, col3, col4, col5 = st.columns(5)
-    col1.metric("Gasto Total", f"R$ {total_gasto:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), help="Soma total dos valores dos itens em todos os serviços.")
-    col2.metric("CMS Médio", f"R$ {cms_medio:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), help="Custo Médio por Serviço (CMS) por serviço.")
-    col3.metric("Total de Reembolso", f"R$ {total_reembolso:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), help="Valor total de todos os reembolsos.")
-    col4.metric("% Gasto c/ Reembolso", f"{pct_gasto_reembolso:.2f}%", help="Percentual do gasto total que foi via reembolso.")
-    col5.metric("P/ Serv. Intermediação", f"{pct_intermediacao_servicos:.2f}%", help="Percentual de serviços que foram de intermediação.")
-
-    st.markdown("---")
-    min_servicos_prestador = st.number_input(
-        label="Defina o Mínimo de Atendimentos por Prestador", 
-        min_value=1,
-        max_value=200,
-        value=MIN_ATTENDANCES_FOR_RANKING,
-        step=1,
-        help="Prestadores com um número de serviços abaixo deste valor não serão incluídos nas análises de ranking e ofensores."
-    )
-
-    st.markdown("---")
-    st.header("Ranking de Custo Médio por Serviço (CMS) por Prestador")
-    st.markdown("Identifique os **prestadores com maior e menor CMS**. Uma alta variância pode indicar oportunidades de negociação ou revisão de processos.")
-
-    cms_por_prestador = df.groupby('nome_do_prestador', observed=True).agg(
-        qtd_servicos=('protocolo_atendimento', 'count'),
-        cms=('val_total_items', 'mean')
-    ).reset_index()
-
-    cms_por_prestador = cms_por_prestador[cms_por_prestador['qtd_servicos'] >= min_servicos_prestador]
-
-    cms_por_prestador['cms'] = cms_por_prestador['cms'].fillna(0)
-
-    if not cms_por_prestador.empty:
-        cms_por_prestador_display = cms_por_prestador.rename(columns={
-            'nome_do_prestador': 'Prestador',
-            'qtd_servicos': 'Qtd. Serviços',
-            'cms': 'CMS'
-        })
-
-        st.subheader(f"Top {min(10, len(cms_por_prestador_display))} Prestadores por CMS")
-        top_10_cms = cms_por_prestador_display.sort_values('CMS', ascending=False).head(10)
-        fig_top_cms = px.bar(
-            top_10_cms,
-            x='Prestador',
-            y='CMS',
-            title='Prestadores com Maior Custo Médio por Serviço',
-            labels={'CMS': 'CMS (R$)'},
-            color_discrete_sequence=['#2021D4']
-        )
-        fig_top_cms.update_layout(xaxis_title="", yaxis_title="CMS (R$)", hovermode="x unified")
-        st.plotly_chart(fig_top_cms, use_container_width=True)
-
-        st.subheader("Tabela Completa de CMS por Prestador")
-        st.dataframe(
-            cms_por_prestador_display.sort_values('CMS', ascending=False).style.format({
-                'Qtd. Serviços': '{:,.0f}',
-                'CMS': 'R$ {:,.2f}'
-            }),
-            use_container_width=True
-        )
-    else:
-        st.info(f"Nenhum dado de CMS por prestador (com mais de {min_servicos_prestador} serviços) disponível com os filtros selecionados.")
-
-
-    st.markdown("---")
-    st.header("Custo Médio por Faixa de Tempo de Chegada")
-    st.markdown("Avalie o **impacto do tempo de chegada no custo do serviço**. Tempos de chegada muito curtos (urgência) ou muito longos (ineficiência) podem influenciar o custo final.")
-
-    if 'tempo_chegada_min' in df.columns and pd.api.types.is_numeric_dtype(df['tempo_chegada_min']):
-        df_valid_tempo_chegada = df.dropna(subset=['tempo_chegada_min'])
-
-        if not df_valid_tempo_chegada.empty:
-            bins = [0, 30, 60, 120, np.inf]
-            labels = ['0-30 min', '31-60 min', '61-120 min', '>120 min']
-            df_valid_tempo_chegada['faixa_tempo_chegada'] = pd.cut(df_valid_tempo_chegada['tempo_chegada_min'], bins=bins, labels=labels, right=True, include_lowest=True, ordered=True)
-
-            cms_por_tempo = df_valid_tempo_chegada.groupby('faixa_tempo_chegada', observed=True).agg(
-                qtd_servicos=('protocolo_atendimento', 'count'),
-                cms=('val_total_items', 'mean')
-            ).reset_index()
-
-            cms_por_tempo = cms_por_tempo.dropna(subset=['faixa_tempo_chegada'])
-
-            cms_por_tempo['cms'] = cms_por_tempo['cms'].fillna(0)
-
-            if not cms_por_tempo.empty:
-                cms_por_tempo['faixa_tempo_chegada'] = pd.Categorical(cms_por_tempo['faixa_tempo_chegada'], categories=labels, ordered=True)
-                cms_por_tempo = cms_por_tempo.sort_values('faixa_tempo_chegada')
-
-                cms_por_tempo_display = cms_por_tempo.rename(columns={
-                    'faixa_tempo_chegada': 'Faixa de Tempo de Chegada',
-                    'qtd_servicos': 'Qtd. Serviços',
-                    'cms': 'CMS'
-                })
-
-                st.subheader("CMS por Faixa de Tempo de Chegada")
-                fig_cms_tempo = px.bar(
-                    cms_por_tempo_display,
-                    x='Faixa de Tempo de Chegada',
-                    y='CMS',
-                    title='Custo Médio por Tempo de Chegada',
-                    labels={'CMS': 'CMS (R$)'},
-                    color_discrete_sequence=['#2021D4']
-                )
-                fig_cms_tempo.update_layout(xaxis_title="", yaxis_title="CMS (R$)", hovermode="x unified")
-                st.plotly_chart(fig_cms_tempo, use_container_width=True)
-
-                st.subheader("Tabela de CMS por Faixa de Tempo de Chegada")
-                st.dataframe(
-                    cms_por_tempo_display.style.format({
-                        'Qtd. Serviços': '{:,.0f}',
-                        'CMS': 'R$ {:,.2f}'
-                    }),
-                    use_container_width=True
-                )
-            else:
-                st.info("Nenhum dado de CMS por faixa de tempo de chegada disponível com os filtros selecionados e dados válidos.")
-        else:
-            st.info("Não há dados de 'Tempo de Chegada' válidos para as faixas de tempo após os filtros selecionados.")
-    else:
-        st.warning("Coluna 'tempo_chegada_min' não encontrada ou não é numérica no DataFrame. Não foi possível gerar a análise por tempo de chegada.")
-
-    st.markdown("---")
-    st.header("Análise de Ofensores de CMS por Prestador")
-    st.markdown("Identifique prestadores com CMS acima da **média de sua UF e segmento**, e calcule o potencial de economia.")
-
-    segments_for_analysis = ['AUTO', 'RESID', 'VIDA']
-    df_financeiro_analise = df[df['segmento'].isin(segments_for_analysis)].copy()
-
-    if df_financeiro_analise.empty:
-        st.info("Nenhum dado disponível para os segmentos AUTO, RESID ou VIDA com os filtros selecionados.")
-    else:
-        cms_medio_uf_segmento_df = df_financeiro_analise.groupby(['uf', 'segmento'], observed=True).agg(
-            cms_medio_uf_segmento=('val_total_items', 'mean')
-        ).reset_index()
-
-        cms_ofensores = df_financeiro_analise.groupby(['nome_do_prestador', 'uf', 'segmento'], observed=True).agg(
-            qtd_servicos=('protocolo_atendimento', 'count'),
-            cms_prestador=('val_total_items', 'mean')
-        ).reset_index()
-
-        cms_ofensores = cms_ofensores[cms_ofensores['qtd_servicos'] >= min_servicos_prestador]
-
-        cms_ofensores = pd.merge(cms_ofensores, cms_medio_uf_segmento_df, on=['uf', 'segmento'], how='left')
-
-        cms_ofensores['is_ofensor'] = (cms_ofensores['cms_prestador'] > cms_ofensores['cms_medio_uf_segmento'] * 1.10)
-        
-        cms_ofensores['potencial_economia_rs'] = np.where(
-            cms_ofensores['is_ofensor'],
-            (cms_ofensores['cms_prestador'] - cms_ofensores['cms_medio_uf_segmento']) * cms_ofensores['qtd_servicos'],
-            0
-        )
-
-        cms_ofensores['cms_prestador'] = cms_ofensores['cms_prestador'].fillna(0)
-        cms_ofensores['cms_medio_uf_segmento'] = cms_ofensores['cms_medio_uf_segmento'].fillna(0)
-        cms_ofensores['potencial_economia_rs'] = cms_ofensores['potencial_economia_rs'].fillna(0)
-
-        cms_ofensores_display = cms_ofensores.rename(columns={
-            'nome_do_prestador': 'Prestador',
-            'uf': 'UF',
-            'segmento': 'Segmento',
-            'qtd_servicos': 'Qtd. Serviços',
-            'cms_prestador': 'CMS do Prestador',
-            'cms_medio_uf_segmento': 'CMS Médio UF/Segmento',
-            'is_ofensor': 'Ofensor?',
-            'potencial_economia_rs': 'Potencial de Economia (R$)'
-        })
-
-        prestadores_para_excluir = ['VAZIO', 'MOVIDA', 'LOCALIZA RENT A CAR']
-        
-        cms_ofensores_display = cms_ofensores_display[
-            ~cms_ofensores_display['Prestador'].isin(prestadores_para_excluir)
-        ]
-
-        if not cms_ofensores_display.empty:
-            st.subheader("Tabela de Ofensores de CMS")
-            st.dataframe(
-                cms_ofensores_display.sort_values('Potencial de Economia (R$)', ascending=False).style.format({
-                    'Qtd. Serviços': '{:,.0f}',
-                    'CMS do Prestador': 'R$ {:,.2f}',
-                    'CMS Médio UF/Segmento': 'R$ {:,.2f}',
-                    'Potencial de Economia (R$)': 'R$ {:,.2f}'
-                }),
-                use_container_width=True
-            )
-            total_economia = cms_ofensores_display['Potencial de Economia (R$)'].sum()
-            st.metric("Total Potencial de Economia (Prestadores Ofensores)", f"R$ {total_economia:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-        else:
-            st.info("Nenhum prestador identificado como 'ofensor' de CMS com base nos critérios e filtros selecionados.")
-
-def page_qualidade(df_final_filtrado, df_nps_cidade_full, df_nps_prestador):
-    st.title("✨ Qualidade e NPS")
-    st.markdown("Esta seção exibe a evolução do Net Promoter Score (NPS) e os rankings de qualidade por cidade e prestador.")
-
-    # Função para formatar números no padrão PT-BR
-    def format_pt_br(value, precision=0):
-        if pd.isna(value):
-            return "N/A"
-        if precision == 0:
-            formatted = f"{value:,.0f}"
-        else:
-            formatted = f"{value:,.{precision}f}"
-        # Inverte vírgula e ponto para padrão PT-BR
-        return formatted.replace(",", "X").replace(".", ",").replace("X", ".")
-
-    # Exemplo usando df_nps_cidade_full para evolução do NPS
-    if not df_nps_cidade_full.empty:
-        # Garante que 'mes_ano' seja datetime para o gráfico
-        if pd.api.types.is_period_dtype(df_nps_cidade_full['mes_ano']):
-            df_nps_cidade_full['mes_ano_dt'] = df_nps_cidade_full['mes_ano'].dt.to_timestamp()
-        else:
-            df_nps_cidade_full['mes_ano_dt'] = pd.to_datetime(df_nps_cidade_full['mes_ano'], errors='coerce')
-
-
-        df_nps_evolucao = df_nps_cidade_full.groupby('mes_ano_dt').agg(
-            promotores=('nps_promotores', 'sum'),
-            detratores=('nps_detratores', 'sum'),
-            neutros=('nps_neutros', 'sum')
-        ).reset_index()
-
-        df_nps_evolucao['total_responses'] = df_nps_evolucao['promotores'] + df_nps_evolucao['detratores'] + df_nps_evolucao['neutros']
-        df_nps_evolucao['nps_score'] = np.where(
-            df_nps_evolucao['total_responses'] > 0,
-            ((df_nps_evolucao['promotores'] - df_nps_evolucao['detratores']) / df_nps_evolucao['total_responses']) * 100,
-            np.nan
-        )
-        df_nps_evolucao = df_nps_evolucao.dropna(subset=['nps_score']).sort_values('mes_ano_dt')
-
-        st.markdown("---")
-        st.subheader("Evolução do Net Promoter Score (NPS) Geral")
-        if not df_nps_evolucao.empty:
-            fig_nps = px.line(
-                df_nps_evolucao,
-                x='mes_ano_dt',
-                y='nps_score',
-                title='Evolução Mensal do NPS Geral',
-                labels={'mes_ano_dt': 'Mês/Ano', 'nps_score': 'NPS'},
-                markers=True
-            )
-            fig_nps.update_xaxes(dtick="M1", tickformat="%b\n%Y")
-            fig_nps.update_yaxes(range=[-100, 100])
-            st.plotly_chart(fig_nps, use_container_width=True)
-        else:
-            st.info("Nenhum dado disponível para a evolução mensal do NPS.")
-    else:
-        st.info("Nenhum dado de NPS por cidade disponível para calcular a evolução do NPS geral.")
-    
-    # --- Ranking NPS por Cidade (Top 10 e Piores 10) ---
-    st.markdown("---")
-    st.subheader("NPS por Cidade")
-    st.info("Visualize as cidades com melhor e pior desempenho no NPS. Isso pode indicar onde focar esforços de melhoria de serviço.")
-
-    if df_nps_cidade_full.empty:
-        st.warning("Nenhum dado de NPS por cidade disponível para esta análise. Verifique o arquivo 'processed_nps_by_city.parquet'.")
-    else:
-        # Agregamos o NPS por cidade, considerando as avaliações totais para relevância
-        df_nps_cidade_agg = df_nps_cidade_full.groupby('municipio', observed=True).agg(
-            promotores=('nps_promotores', 'sum'),
-            detratores=('nps_detratores', 'sum'),
-            neutros=('nps_neutros', 'sum')
-        ).reset_index()
-
-        df_nps_cidade_agg['total_avaliacoes'] = df_nps_cidade_agg['promotores'] + df_nps_cidade_agg['detratores'] + df_nps_cidade_agg['neutros']
-        df_nps_cidade_agg['nps_score'] = np.where(
-            df_nps_cidade_agg['total_avaliacoes'] > 0,
-            ((df_nps_cidade_agg['promotores'] - df_nps_cidade_agg['detratores']) / df_nps_cidade_agg['total_avaliacoes']) * 100,
-            np.nan
-        )
-        
-        df_nps_cidade_agg = df_nps_cidade_agg.dropna(subset=['nps_score'])
-
-        min_avaliacoes_cidade = st.slider("Mínimo de Avaliações para Cidades", min_value=1, max_value=50, value=10, key="min_eval_city_nps_table")
-        df_nps_cidade_filtered = df_nps_cidade_agg[df_nps_cidade_agg['total_avaliacoes'] >= min_avaliacoes_cidade]
-
-        if not df_nps_cidade_filtered.empty:
-            col_nps_best_city, col_nps_worst_city = st.columns(2)
-
-            with col_nps_best_city:
-                st.markdown("#### Top 10 Cidades (Melhor NPS)")
-                st.dataframe(
-                    df_nps_cidade_filtered.sort_values('nps_score', ascending=False).head(10)
-                    .rename(columns={'municipio': 'Cidade', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
-                        'NPS Médio': lambda x: format_pt_br(x, 1),
-                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
-                    }),
-                    use_container_width=True
-                )
-            with col_nps_worst_city:
-                st.markdown("#### Top 10 Cidades (Pior NPS)")
-                st.dataframe(
-                    df_nps_cidade_filtered.sort_values('nps_score', ascending=True).head(10) # Piores são os primeiros na ordem crescente
-                    .rename(columns={'municipio': 'Cidade', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
-                        'NPS Médio': lambda x: format_pt_br(x, 1),
-                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
-                    }),
-                    use_container_width=True
-                )
-        else:
-            st.info(f"Nenhuma cidade encontrada com NPS calculado e pelo menos {min_avaliacoes_cidade} avaliações.")
-        st.markdown("**Sugestão:** Implementar programas de incentivo ou treinamento nas cidades com baixo NPS, e replicar as melhores práticas das cidades com alto NPS.")
-
-
-    # --- Ranking NPS por Prestador (Top 10 e Piores 10) ---
-    st.markdown("---")
-    st.subheader("NPS por Prestador")
-    st.info("Identifique os prestadores com melhor e pior performance no NPS. Use esta informação para reconhecimento ou para planos de desenvolvimento.")
-
-    if df_nps_prestador.empty:
-        st.warning("Nenhum dado de NPS por prestador disponível para esta análise. Verifique o arquivo 'processed_nps_by_provider.parquet'.")
-    else:
-        # Agregamos o NPS por prestador, considerando as avaliações totais para relevância
-        df_nps_prestador_agg = df_nps_prestador.groupby('nome_do_prestador', observed=True).agg(
-            promotores=('nps_promotores', 'sum'),
-            detratores=('nps_detratores', 'sum'),
-            neutros=('nps_neutros', 'sum')
-        ).reset_index()
-
-        df_nps_prestador_agg['total_avaliacoes'] = df_nps_prestador_agg['promotores'] + df_nps_prestador_agg['detratores'] + df_nps_prestador_agg['neutros']
-        df_nps_prestador_agg['nps_score'] = np.where(
-            df_nps_prestador_agg['total_avaliacoes'] > 0,
-            ((df_nps_prestador_agg['promotores'] - df_nps_prestador_agg['detratores']) / df_nps_prestador_agg['total_avaliacoes']) * 100,
-            np.nan
-        )
-
-        df_nps_prestador_agg = df_nps_prestador_agg.dropna(subset=['nps_score'])
-
-        min_avaliacoes_prestador = st.slider("Mínimo de Avaliações para Prestadores", min_value=1, max_value=50, value=10, key="min_eval_provider_nps_table")
-        df_nps_prestador_filtered = df_nps_prestador_agg[df_nps_prestador_agg['total_avaliacoes'] >= min_avaliacoes_prestador]
-
-        if not df_nps_prestador_filtered.empty:
-            col_nps_best_prestador, col_nps_worst_prestador = st.columns(2)
-
-            with col_nps_best_prestador:
-                st.markdown("#### Top 10 Prestadores (Melhor NPS)")
-                st.dataframe(
-                    df_nps_prestador_filtered.sort_values('nps_score', ascending=False).head(10)
-                    .rename(columns={'nome_do_prestador': 'Prestador', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
-                        'NPS Médio': lambda x: format_pt_br(x, 1),
-                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
-                    }),
-                    use_container_width=True
-                )
-            with col_nps_worst_prestador:
-                st.markdown("#### Top 10 Prestadores (Pior NPS)")
-                st.dataframe(
-                    df_nps_prestador_filtered.sort_values('nps_score', ascending=True).head(10) # Piores são os primeiros na ordem crescente
-                    .rename(columns={'nome_do_prestador': 'Prestador', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
-                        'NPS Médio': lambda x: format_pt_br(x, 1),
-                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
-                    }),
-                    use_container_width=True
-                )
-        else:
-            st.info(f"Nenhum prestador encontrado com NPS calculado e pelo menos {min_avaliacoes_prestador} avaliações.")
-        st.markdown("**Sugestão:** Avaliar treinamentos específicos ou programas de mentoria para prestadores com baixo NPS. Reconhecer e aprender com os de alto desempenho.")
-
-    # --- Distribuição do TMC (utiliza o df_final_filtrado) ---
-    st.markdown("---")
-    st.header("Distribuição do TMC por Segmento e Seguradora")
-
-    if df_final_filtrado.empty or 'tempo_chegada_min' not in df_final_filtrado.columns:
-        st.warning("Dados de atendimentos ou coluna 'tempo_chegada_min' não disponíveis para a análise de TMC.")
-    else:
-        col_tmc_segmento, col_tmc_seguradora = st.columns(2)
-
-        with col_tmc_segmento:
-            st.subheader("TMC por Segmento")
-            tmc_por_segmento = df_final_filtrado.groupby('segmento', observed=True)['tempo_chegada_min'].mean().reset_index()
-            tmc_por_segmento['tempo_chegada_min'] = tmc_por_segmento['tempo_chegada_min'].fillna(0)
-            st.dataframe(
-                tmc_por_segmento.rename(columns={'tempo_chegada_min': 'TMC Médio (min)'}).style.format(
-                    {'TMC Médio (min)': lambda x: format_pt_br(x, 0)}
-                ),
-                use_container_width=True
-            )
-
-        with col_tmc_seguradora:
-            st.subheader("TMC por Seguradora")
-            tmc_por_seguradora = df_final_filtrado.groupby('seguradora', observed=True)['tempo_chegada_min'].mean().reset_index()
-            tmc_por_seguradora['tempo_chegada_min'] = tmc_por_seguradora['tempo_chegada_min'].fillna(0)
-            st.dataframe(
-                tmc_por_seguradora.rename(columns={'tempo_chegada_min': 'TMC Médio (min)'}).style.format(
-                    {'TMC Médio (min)': lambda x: format_pt_br(x, 0)}
-                ),
-                use_container_width=True
-            )
-
-def calculate_prestador_score(df):
-    if df.empty:
-        df['score_prestador'] = []
-        df['status_score'] = []
-        return df
-
-    # Preenchimento de NaNs para evitar erros, usando a mediana
-    for col in ['media_nps', 'media_tempo_chegada', 'total_atendimentos', 'pct_reembolso', 'pct_intermediacao']:
-        if df[col].isnull().any():
-            df[col] = df[col].fillna(df[col].median())
-
-    # Normalização das métricas
-    max_atendimentos = df['total_atendimentos'].max() if df['total_atendimentos'].max() > 0 else 1
-    max_tempo_chegada = df['media_tempo_chegada'].max() if df['media_tempo_chegada'].max() > 0 else 1
-    max_pct_reembolso = df['pct_reembolso'].max() if df['pct_reembolso'].max() > 0 else 1
-    max_pct_intermediacao = df['pct_intermediacao'].max() if df['pct_intermediacao'].max() > 0 else 1
-    
-    pesos = {'atendimentos': 0.25, 'nps': 0.30, 'tempo_chegada': 0.20, 'reembolso': 0.15, 'intermediacao': 0.10}
-
-    df['score_prestador'] = (
-        (df['total_atendimentos'] / max_atendimentos * pesos['atendimentos']) +
-        (df['media_nps'] / 100 * pesos['nps']) +
-        (1 - (df['media_tempo_chegada'] / max_tempo_chegada)) * pesos['tempo_chegada'] +
-        (1 - (df['pct_reembolso'] / max_pct_reembolso)) * pesos['reembolso'] +
-        (1 - (df['pct_intermediacao'] / max_pct_intermediacao)) * pesos['intermediacao']
-    )
-    
-    min_score, max_score = df['score_prestador'].min(), df['score_prestador'].max()
-    if max_score > min_score:
-        df['score_prestador'] = (df['score_prestador'] - min_score) / (max_score - min_score) * 100
-    else:
-        df['score_prestador'] = 50
-
-    if len(df['score_prestador'].unique()) > 1:
-        df['status_score'] = pd.qcut(df['score_prestador'], 4, labels=['Precisa de Atenção', 'Regular', 'Bom', 'Excelente'], duplicates='drop')
-    else:
-        df['status_score'] = 'Regular'
-        
-    return df
-
-# --- FUNÇÃO DE SUGESTÕES (Texto puro) ---
-def get_prestador_sugestao_acao(row, df_completo):
-    """
-    Gera sugestões de ação simples, em texto puro.
-    """
-    suggestions = []
-    # Usar quartis para limiares dinâmicos
-    q75_reembolso = df_completo['pct_reembolso'].quantile(0.75)
-    q75_intermediacao = df_completo['pct_intermediacao'].quantile(0.75)
-    q75_tmc = df_completo['media_tempo_chegada'].quantile(0.75)
-    q25_nps = df_completo['media_nps'].quantile(0.25)
-
-    if row['status_score'] == 'Precisa de Atenção':
-        suggestions.append('Performance geral crítica. Avaliar treinamento ou revisão de contrato.')
-    
-    if row['media_nps'] <= q25_nps and row['media_nps'] < 75:
-        suggestions.append('NPS baixo. Investigar causas de insatisfação do cliente.')
-    
-    if row['pct_reembolso'] > q75_reembolso and row['pct_reembolso'] > 0:
-        suggestions.append('Alto percentual de reembolso. Rever processos ou precificação.')
-    
-    if row['pct_intermediacao'] > q75_intermediacao and row['pct_intermediacao'] > 0:
-        suggestions.append('Alto percentual de intermediação. Aumentar capacidade ou eficiência.')
-
-    if row['media_tempo_chegada'] > q75_tmc:
-        suggestions.append('Tempo médio de chegada elevado. Otimizar logística ou realocação.')
-        
-    return "; ".join(suggestions) if suggestions else "Bom desempenho. Nenhuma ação crítica necessária."
-
-# --- PÁGINA PRINCIPAL DO STREAMLIT (VERSÃO FINAL AJUSTADA) ---
-def page_score_prestador(df_atendimentos_filtrado, df_nps_prestador):
-    st.title("Score de Performance do Prestador")
-    st.markdown("Análise de performance da rede de prestadores com foco em KPIs e ações corretivas.")
-
-    if df_atendimentos_filtrado.empty:
-        st.info("Nenhum dado de atendimento disponível para os filtros selecionados.")
-        return
-    
-    # --- FILTRO DE ANÁLISE NA PÁGINA PRINCIPAL ---
-    st.markdown("---")
-    min_atendimentos = st.number_input(
-        label="Defina o Mínimo de Atendimentos por Prestador", 
-        min_value=1, 
-        value=5, 
-        step=1,
-        help="Apenas prestadores com um número de atendimentos igual ou superior a este valor serão exibidos na análise."
-    )
-    
-    # --- PROCESSAMENTO DE DADOS ---
-
-    df_atendimentos_filtrado['nome_do_prestador'] = df_atendimentos_filtrado['nome_do_prestador'].astype(str)
-    if not df_nps_prestador.empty and 'nome_do_prestador' in df_nps_prestador.columns:
-        df_nps_prestador['nome_do_prestador'] = df_nps_prestador['nome_do_prestador'].astype(str)
-        df_merged = pd.merge(df_atendimentos_filtrado, df_nps_prestador[['nome_do_prestador', 'nps_score_calculado']], on='nome_do_prestador', how='left')
-        df_merged['nps_score_calculado'] = df_merged['nps_score_calculado'].fillna(0)
-    else:
-        df_merged = df_atendimentos_filtrado.copy()
-        df_merged['nps_score_calculado'] = 0
-
-    df_prestadores_agg = df_merged.groupby('nome_do_prestador', observed=True).agg(
-        total_atendimentos=('protocolo_atendimento', 'nunique'),
-        media_nps=('nps_score_calculado', 'mean'),
-        num_reembolsos=('is_reembolso', 'sum'),
-        num_intermediacoes=('is_intermediacao', 'sum'),
-        media_tempo_chegada=('tempo_chegada_min', 'mean')
-    ).reset_index()
-
-
-    # APLICAÇÃO DO FILTRO DE MÍNIMO DE ATENDIMENTOS
-    df_prestadores_filtrado = df_prestadores_agg[df_prestadores_agg['total_atendimentos'] >= min_atendimentos].copy()
-
-    if df_prestadores_filtrado.empty:
-        st.warning(f"Nenhum prestador encontrado com {min_atendimentos} ou mais atendimentos para os filtros aplicados.")
-        return
-
-    df_prestadores_filtrado['pct_reembolso'] = (df_prestadores_filtrado['num_reembolsos'] / df_prestadores_filtrado['total_atendimentos'] * 100).fillna(0)
-    df_prestadores_filtrado['pct_intermediacao'] = (df_prestadores_filtrado['num_intermediacoes'] / df_prestadores_filtrado['total_atendimentos'] * 100).fillna(0)
-    
-    df_prestadores_scored = calculate_prestador_score(df_prestadores_filtrado)
-    df_prestadores_scored['sugestao_acao'] = df_prestadores_scored.apply(lambda row: get_prestador_sugestao_acao(row, df_prestadores_scored), axis=1)
-
-    # --- KPIs GERAIS DA REDE ---
-    st.markdown("---")
-    st.subheader("Desempenho Geral da Rede")
-    
-    avg_score = df_prestadores_scored['score_prestador'].mean()
-    avg_atendimentos = df_prestadores_scored['total_atendimentos'].mean()
-    avg_nps = df_prestadores_scored['media_nps'].mean()
-    avg_tmc = df_prestadores_scored['media_tempo_chegada'].mean()
-    
-    col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Score Médio da Rede", f"{avg_score:.2f}")
-    col2.metric("Média de Atendimentos", f"{avg_atendimentos:.1f}")
-    col3.metric("NPS Médio", f"{avg_nps:.1f}")
-    col4.metric("TMC Médio (min)", f"{avg_tmc:.0f}")
-
-    # --- RANKING COMPLETO DE PRESTADORES ---
-    st.markdown("---")
-    st.subheader("Ranking Completo de Prestadores")
-    st.markdown("Análise detalhada de todos os prestadores que atendem aos critérios de filtro. Use as setas para ordenar.")
-
-    st.dataframe(
-        df_prestadores_scored.rename(columns={
-            'nome_do_prestador': 'Prestador',
-            'total_atendimentos': 'Atendimentos',
-            'media_nps': 'NPS Médio',
-            'media_tempo_chegada': 'TMC Médio (min)',
-            'pct_reembolso': '% Reembolso',
-            'pct_intermediacao': '% Intermediação',
-            'score_prestador': 'Score',
-            'status_score': 'Status'
-        })[[
-            'Prestador', 'Score', 'Status', 'Atendimentos', 'NPS Médio', 'TMC Médio (min)',
-            '% Reembolso', '% Intermediação'
-        ]]
-        .sort_values('Score', ascending=True)
-        .style
-        .background_gradient(cmap='RdYlGn', subset=['Score'])
-        .bar(subset=['Atendimentos'], color='#1f77b4')
-        .format({
-            'Score': '{:.2f}',
-            'NPS Médio': '{:.2f}',
-            'TMC Médio (min)': '{:.0f}',
-            '% Reembolso': '{:.2f}%',
-            '% Intermediação': '{:.2f}%',
-        }),
-        use_container_width=True,
-        height=600
-    )
-    
-    # DOWNLOAD DOS DADOS
-    output_all = io.BytesIO()
-    with pd.ExcelWriter(output_all, engine='xlsxwriter') as writer:
-        df_prestadores_scored.to_excel(writer, index=False, sheet_name='Score_Prestadores_Completo')
-    output_all.seek(0)
-    st.download_button(
-        label="Baixar Ranking Completo (XLSX)",
-        data=output_all,
-        file_name='score_prestadores_completo.xlsx',
-        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-
-    # --- PLANO DE AÇÃO EM CARDS (APÓS O RANKING) ---
-    st.markdown("---")
-    st.subheader("Plano de Ação: Foco nos Principais Pontos de Melhoria")
-    st.info("Recomendações para os 20 prestadores com os menores scores para direcionamento de ações.")
-    
-    df_offenders = df_prestadores_scored[
-        df_prestadores_scored['status_score'].isin(['Precisa de Atenção', 'Regular'])
-    ].sort_values('score_prestador', ascending=True).head(20)
-
-    if not df_offenders.empty:
-        for index, row in df_offenders.iterrows():
-            with st.container(border=True):
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    st.markdown(f"**Prestador:** {row['nome_do_prestador']}")
-                    st.markdown(f"**Sugestões:** {row['sugestao_acao']}")
-                with col2:
-                    st.metric(label="Score", value=f"{row['score_prestador']:.2f}")
-                    # Usando st.markdown para o status para evitar o delta/seta
-                    st.markdown(f"**Status:** <span style='color: #d62728;'>{row['status_score']}</span>", unsafe_allow_html=True)
-                
-    else:
-        st.success("🎉 Nenhum prestador com status 'Regular' ou 'Precisa de Atenção' encontrado. Ótimo resultado!")
-
-    # --- EXPANDER COM A METODOLOGIA ---
-    with st.expander("💡 Entenda a Metodologia do Score"):
-        st.markdown(r"""
-        O **Score do Prestador** é um índice de 0 a 100 que consolida múltiplos KPIs para avaliar a performance.
-
-        - **Componentes e Pesos:**
-          - **Total de Atendimentos (25%):** Maior volume é positivo.
-          - **NPS Médio (30%):** Satisfação do cliente é crucial.
-          - **Tempo Médio de Chegada (TMC) (20%):** Menor tempo é melhor.
-          - **Percentual de Reembolso (15%):** Menor percentual é melhor.
-          - **Percentual de Intermediação (10%):** Menor percentual é melhor.
-
-        **Fórmula Simplificada:**
-        $$ \text{Score} = f(\text{Atendimentos}, \text{NPS}, \text{TMC}, \text{Reembolso}, \text{Intermediação}) $$
-        """)
-
-def page_qualidade_nps(df_atendimentos_filtrado, df_nps_cidade_full, df_nps_prestador):
-    st.title("Qualidade")
-    st.markdown("Esta seção exibe a evolução do Net Promoter Score (NPS), o Tempo Médio de Chegada do Prestador e os rankings de qualidade por cidade e prestador.")
-
-    def format_pt_br(value, precision=0):
-        if pd.isna(value):
-            return "N/A"
-        if precision == 0:
-            formatted = f"{value:,.0f}"
-        else:
-            formatted = f"{value:,.{precision}f}"
-        return formatted.replace(",", "X").replace(".", ",").replace("X", ".")
-
-    if not df_nps_cidade_full.empty:
-        if pd.api.types.is_period_dtype(df_nps_cidade_full['mes_ano']):
-            df_nps_cidade_full['mes_ano_dt'] = df_nps_cidade_full['mes_ano'].dt.to_timestamp()
-        else:
-            df_nps_cidade_full['mes_ano_dt'] = pd.to_datetime(df_nps_cidade_full['mes_ano'], errors='coerce')
-
-
-        df_nps_evolucao = df_nps_cidade_full.groupby('mes_ano_dt').agg(
-            promotores=('nps_promotores', 'sum'),
-            detratores=('nps_detratores', 'sum'),
-            neutros=('nps_neutros', 'sum')
-        ).reset_index()
-
-        df_nps_evolucao['total_responses'] = df_nps_evolucao['promotores'] + df_nps_evolucao['detratores'] + df_nps_evolucao['neutros']
-        df_nps_evolucao['nps_score'] = np.where(
-            df_nps_evolucao['total_responses'] > 0,
-            ((df_nps_evolucao['promotores'] - df_nps_evolucao['detratores']) / df_nps_evolucao['total_responses']) * 100,
-            np.nan
-        )
-        df_nps_evolucao = df_nps_evolucao.dropna(subset=['nps_score']).sort_values('mes_ano_dt')
-
-        st.markdown("---")
-        st.subheader("Evolução do Net Promoter Score (NPS) Geral")
-        if not df_nps_evolucao.empty:
-            fig_nps = px.line(
-                df_nps_evolucao,
-                x='mes_ano_dt',
-                y='nps_score',
-                title='Evolução Mensal do NPS Geral',
-                labels={'mes_ano_dt': 'Mês/Ano', 'nps_score': 'NPS'},
-                markers=True
-            )
-            fig_nps.update_xaxes(dtick="M1", tickformat="%b\n%Y")
-            fig_nps.update_yaxes(range=[-100, 100])
-            st.plotly_chart(fig_nps, use_container_width=True)
-        else:
-            st.info("Nenhum dado disponível para a evolução mensal do NPS.")
-    else:
-        st.info("Nenhum dado de NPS por cidade disponível para calcular a evolução do NPS geral.")
-    
-    st.markdown("---")
-    st.subheader("NPS por Cidade")
-    st.info("Visualize as cidades com melhor e pior desempenho no NPS. Isso pode indicar onde focar esforços de melhoria de serviço.")
-
-    if df_nps_cidade_full.empty:
-        st.warning("Nenhum dado de NPS por cidade disponível para esta análise. Verifique o arquivo 'processed_nps_by_city.parquet'.")
-    else:
-        df_nps_cidade_agg = df_nps_cidade_full.groupby('municipio', observed=True).agg(
-            promotores=('nps_promotores', 'sum'),
-            detratores=('nps_detratores', 'sum'),
-            neutros=('nps_neutros', 'sum')
-        ).reset_index()
-
-        df_nps_cidade_agg['total_avaliacoes'] = df_nps_cidade_agg['promotores'] + df_nps_cidade_agg['detratores'] + df_nps_cidade_agg['neutros']
-        df_nps_cidade_agg['nps_score'] = np.where(
-            df_nps_cidade_agg['total_avaliacoes'] > 0,
-            ((df_nps_cidade_agg['promotores'] - df_nps_cidade_agg['detratores']) / df_nps_cidade_agg['total_avaliacoes']) * 100,
-            np.nan
-        )
-        
-        df_nps_cidade_agg = df_nps_cidade_agg.dropna(subset=['nps_score'])
-
-        min_avaliacoes_cidade = st.slider("Mínimo de Avaliações para Cidades", min_value=1, max_value=50, value=10, key="min_eval_city_nps_table")
-        df_nps_cidade_filtered = df_nps_cidade_agg[df_nps_cidade_agg['total_avaliacoes'] >= min_avaliacoes_cidade]
-
-        if not df_nps_cidade_filtered.empty:
-            col_nps_best_city, col_nps_worst_city = st.columns(2)
-
-            with col_nps_best_city:
-                st.markdown("#### Top 10 Cidades (Melhor NPS)")
-                st.dataframe(
-                    df_nps_cidade_filtered.sort_values('nps_score', ascending=False).head(10)
-                    .rename(columns={'municipio': 'Cidade', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
-                        'NPS Médio': lambda x: format_pt_br(x, 1),
-                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
-                    }),
-                    use_container_width=True
-                )
-            with col_nps_worst_city:
-                st.markdown("#### Top 10 Cidades (Pior NPS)")
-                st.dataframe(
-                    df_nps_cidade_filtered.sort_values('nps_score', ascending=True).head(10)
-                    .rename(columns={'municipio': 'Cidade', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
-                        'NPS Médio': lambda x: format_pt_br(x, 1),
-                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
-                    }),
-                    use_container_width=True
-                )
-        else:
-            st.info(f"Nenhuma cidade encontrada com NPS calculado e pelo menos {min_avaliacoes_cidade} avaliações.")
-        st.markdown("**Sugestão:** Implementar programas de incentivo ou treinamento nas cidades com baixo NPS, e replicar as melhores práticas das cidades com alto NPS.")
-
-
-    st.markdown("---")
-    st.subheader("NPS por Prestador")
-    st.info("Identifique os prestadores com melhor e pior performance no NPS. Use esta informação para reconhecimento ou para planos de desenvolvimento.")
-
-    if df_nps_prestador.empty:
-        st.warning("Nenhum dado de NPS por prestador disponível para esta análise. Verifique o arquivo 'processed_nps_by_provider.parquet'.")
-    else:
-        df_nps_prestador_agg = df_nps_prestador.groupby('nome_do_prestador', observed=True).agg(
-            promotores=('nps_promotores', 'sum'),
-            detratores=('nps_detratores', 'sum'),
-            neutros=('nps_neutros', 'sum')
-        ).reset_index()
-
-        df_nps_prestador_agg['total_avaliacoes'] = df_nps_prestador_agg['promotores'] + df_nps_prestador_agg['detratores'] + df_nps_prestador_agg['neutros']
-        df_nps_prestador_agg['nps_score'] = np.where(
-            df_nps_prestador_agg['total_avaliacoes'] > 0,
-            ((df_nps_prestador_agg['promotores'] - df_nps_prestador_agg['detratores']) / df_nps_prestador_agg['total_avaliacoes']) * 100,
-            np.nan
-        )
-
-        df_nps_prestador_agg = df_nps_prestador_agg.dropna(subset=['nps_score'])
-
-        min_avaliacoes_prestador = st.slider("Mínimo de Avaliações para Prestadores", min_value=1, max_value=50, value=10, key="min_eval_provider_nps_table")
-        df_nps_prestador_filtered = df_nps_prestador_agg[df_nps_prestador_agg['total_avaliacoes'] >= min_avaliacoes_prestador]
-
-        if not df_nps_prestador_filtered.empty:
-            col_nps_best_prestador, col_nps_worst_prestador = st.columns(2)
-
-            with col_nps_best_prestador:
-                st.markdown("#### Top 10 Prestadores (Melhor NPS)")
-                st.dataframe(
-                    df_nps_prestador_filtered.sort_values('nps_score', ascending=False).head(10)
-                    .rename(columns={'nome_do_prestador': 'Prestador', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
-                        'NPS Médio': lambda x: format_pt_br(x, 1),
-                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
-                    }),
-                    use_container_width=True
-                )
-            with col_nps_worst_prestador:
-                st.markdown("#### Top 10 Prestadores (Pior NPS)")
-                st.dataframe(
-                    df_nps_prestador_filtered.sort_values('nps_score', ascending=True).head(10)
-                    .rename(columns={'nome_do_prestador': 'Prestador', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
-                        'NPS Médio': lambda x: format_pt_br(x, 1),
-                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
-                    }),
-                    use_container_width=True
-                )
-        else:
-            st.info(f"Nenhum prestador encontrado com NPS calculado e pelo menos {min_avaliacoes_prestador} avaliações.")
-        st.markdown("**Sugestão:** Avaliar treinamentos específicos ou programas de mentoria para prestadores com baixo NPS. Reconhecer e aprender com os de alto desempenho.")
-
-    st.markdown("---")
-    st.header("Distribuição do TMC por Segmento e Seguradora")
-
-    if df_atendimentos_filtrado.empty or 'tempo_chegada_min' not in df_atendimentos_filtrado.columns:
-        st.warning("Dados de atendimentos ou coluna 'tempo_chegada_min' não disponíveis para a análise de TMC.")
-    else:
-        col_tmc_segmento, col_tmc_seguradora = st.columns(2)
-
-        with col_tmc_segmento:
-            st.subheader("TMC por Segmento")
-            tmc_por_segmento = df_atendimentos_filtrado.groupby('segmento', observed=True)['tempo_chegada_min'].mean().reset_index()
-            tmc_por_segmento['tempo_chegada_min'] = tmc_por_segmento['tempo_chegada_min'].fillna(0)
-            st.dataframe(
-                tmc_por_segmento.rename(columns={'tempo_chegada_min': 'TMC Médio (min)'}).style.format(
-                    {'TMC Médio (min)': lambda x: format_pt_br(x, 0)}
-                ),
-                use_container_width=True
-            )
-
-        with col_tmc_seguradora:
-            st.subheader("TMC por Seguradora")
-            tmc_por_seguradora = df_atendimentos_filtrado.groupby('seguradora', observed=True)['tempo_chegada_min'].mean().reset_index()
-            tmc_por_seguradora['tempo_chegada_min'] = tmc_por_seguradora['tempo_chegada_min'].fillna(0)
-            st.dataframe(
-                tmc_por_seguradora.rename(columns={'tempo_chegada_min': 'TMC Médio (min)'}).style.format(
-                    {'TMC Médio (min)': lambda x: format_pt_br(x, 0)}
-                ),
-                use_container_width=True
-            )
-
-def main():
-    # Inicializa o estado de login
-    if 'logged_in' not in st.session_state:
-        st.session_state['logged_in'] = False
-
-    if not st.session_state['logged_in']:
-        login_page()
-    else:
-        # Carrega os dados em cache
-        with st.spinner("Carregando e processando dados..."):
-            df_atendimentos_full, df_nps_cidade_full, df_nps_prestador = load_and_prepare_data(
-                ATENDIMENTO_FILE_PATH, NPS_CIDADE_PATH, NPS_PRESTADOR_PATH
-            )
-        
-        if df_atendimentos_full.empty:
-            st.error("Nenhum dado de atendimentos válido disponível. Verifique o arquivo de origem.")
-            st.stop()
-
-        # --- BARRA LATERAL ESTRUTURADA ---
-        with st.sidebar:
-            st.markdown("<h1 style='text-align: center;'>Score do Prestador</h1>", unsafe_allow_html=True)
-            # 1. CABEÇALHO COM LOGO E TÍTULO
-            try:
-                st.image(LOGO_PATH)
-                st.markdown("<div style='margin-top: 1rem;'></div>", unsafe_allow_html=True)
-            except FileNotFoundError:
-                st.warning("Arquivo 'logo.png' não encontrado. Coloque-o na mesma pasta do script.")
-            
-
-            # 2. MENU DE NAVEGAÇÃO PRINCIPAL
-            selected_page = option_menu(
-                menu_title=None,
-                # Ordem ajustada para manter todas as páginas
-                options=["Informações", "Score Prestador", "Capilaridade", "Financeiro", "Qualidade"], 
-                # Ícones correspondentes à nova ordem
-                icons=["info-circle-fill", "graph-up-arrow", "globe2", "currency-dollar", "award"], 
-                menu_icon="cast",
-                default_index=0,
-                styles={
-                    "container": {"padding": "0!important", "background-color": "#FFFFFF"},
-                    "icon": {"color": "#2021D4", "font-size": "20px"},
-                    "nav-link": {"font-size": "16px", "text-align": "left", "margin":"0px", "--hover-color": "#E6F0F8"},
-                    "nav-link-selected": {"background-color": "#2021D4", "color": "white", "font-weight": "bold"},
-                    "icon-selected": {"color": "white"},
-                }
-            )
-
-
-            # 3. FILTROS DE DADOS
-            st.markdown("### ⚙️ Filtros de Dados")
-            
-            segmento_options = [ALL_OPTION] + sorted(df_atendimentos_full['segmento'].dropna().unique().tolist())
-            seguradora_options = [ALL_OPTION] + sorted(df_atendimentos_full['seguradora'].dropna().unique().tolist())
-            estado_options = [ALL_OPTION] + sorted(df_atendimentos_full['uf'].dropna().unique().tolist())
-            
-            min_date_data = df_atendimentos_full['data_abertura_atendimento'].min().date()
-            max_date_data = df_atendimentos_full['data_abertura_atendimento'].max().date()
-
-            segmento_selecionado = st.multiselect("Segmento", segmento_options, default=[ALL_OPTION])
-            if ALL_OPTION in segmento_selecionado:
-                segmento_selecionado = df_atendimentos_full['segmento'].dropna().unique().tolist()
-
-            seguradora_selecionada = st.multiselect("Seguradora", seguradora_options, default=[ALL_OPTION])
-            if ALL_OPTION in seguradora_selecionada:
-                seguradora_selecionada = df_atendimentos_full['seguradora'].dropna().unique().tolist()
-
-            estado_selecionado = st.multiselect("Estado", estado_options, default=[ALL_OPTION])
-            if ALL_OPTION in estado_selecionado:
-                estado_selecionado = df_atendimentos_full['uf'].dropna().unique().tolist()
-
-            municipio_options = [ALL_OPTION]
-            if estado_selecionado and ALL_OPTION not in estado_selecionado:
-                municipio_options += sorted(df_atendimentos_full[df_atendimentos_full['uf'].isin(estado_selecionado)]['municipio'].dropna().unique().tolist())
-            else:
-                municipio_options += sorted(df_atendimentos_full['municipio'].dropna().unique().tolist())
-            
-            municipio_selecionado = st.multiselect("Cidade", municipio_options, default=[ALL_OPTION])
-            if ALL_OPTION in municipio_selecionado:
-                municipio_selecionado = df_atendimentos_full['municipio'].dropna().unique().tolist()
-
-            data_inicio, data_fim = st.date_input(
-                "Período de Análise",
-                value=(min_date_data, max_date_data),
-                min_value=min_date_data,
-                max_value=max_date_data,
-                format="DD/MM/YYYY"
-            )
-
-            # 4. RODAPÉ COM DATA DE ATUALIZAÇÃO E BOTÃO SAIR
-            st.markdown("<div style='margin-top: 1rem;'></div>", unsafe_allow_html=True)
-            st.caption("Última Atualização: 09/07/2025") 
-
-            if st.button("Sair", use_container_width=True):
-                st.session_state['logged_in'] = False
-                st.session_state.pop('username', None)
-                st.rerun()
-            
-            
-
-        # --- APLICAÇÃO DOS FILTROS ---
-        df_filtrado = apply_filters(
-            df_atendimentos_full,
-            segmento_selecionado,
-            seguradora_selecionada,
-            estado_selecionado,
-            municipio_selecionado,
-            data_inicio,
-            data_fim
-        )
-        
-        if df_filtrado.empty:
-            st.info("Nenhum dado corresponde aos filtros selecionados.")
-        
-        # --- RENDERIZAÇÃO DA PÁGINA SELECIONADA (TODAS AS OPÇÕES RESTAURADAS) ---
-        if selected_page == "Informações":
-            page_informacao()
-        elif selected_page == "Score Prestador":
-            page_score_prestador(df_filtrado, df_nps_prestador)
-        elif selected_page == "Capilaridade":
-            page_capilaridade(df_filtrado)
-        elif selected_page == "Financeiro":
-            page_financeiro(df_filtrado)
-        elif selected_page == "Qualidade":
-            page_qualidade_nps(df_filtrado, df_nps_cidade_full, df_nps_prestador)
-
-
-# --- Execução Principal ---
-if __name__ == "__main__":
-    # Supondo que a função inject_css() é chamada aqui
-    # inject_css() 
-    main()
+import streamlit as st
+import datetime
+import unicodedata
+import re
+import io
+import os
+import json
+import functools
+import importlib
+import contextlib
+import threading
+import time
+import tempfile
+
+class LazyModule:
+    """
+    Adia a importação de um módulo até o primeiro acesso a um atributo.
+    Não é registrado em sys.modules, então varreduras como inspect.getmodule não disparam a carga.
+    """
+
+    def __init__(self, nome):
+        self._nome = nome
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nome)
+        return getattr(self._modulo, atributo)
+
+# Bibliotecas pesadas só são carregadas quando uma página autenticada as utiliza,
+# para que a tela de login não pague o custo de importação de pandas/plotly.
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+px = LazyModule('plotly.express')
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Configurações Iniciais do Streamlit ---
+st.set_page_config(
+    page_title="Monitoramento Inteligente da Rede de Prestadores A24h",
+    layout="wide",
+    initial_sidebar_state="expanded",
+    page_icon=os.path.join(APP_DIR, "favicon.ico")
+)
+
+# --- Gerenciamento do Estado da Sessão ---
+if 'logged_in' not in st.session_state:
+    st.session_state['logged_in'] = False
+
+# --- Constantes ---
+MIN_ATTENDANCES_FOR_RANKING = 1 # Contagem mínima de atendimentos para rankings de prestador/segmento/seguradora
+MIN_ATTENDANCES_FOR_CITY_ANALYSIS = 10 # Atendimentos mínimos padrão para análise de cidade em Capilaridade
+ALL_OPTION = "TODOS" # Constante para a opção "TODOS" nos filtros
+FINANCIAL_KPI_FILE = "https://github.com/vinikrebs/ScrorePrestador/raw/main/processed_financeiro.parquet"
+ATENDIMENTO_FILE_PATH = 'https://github.com/vinikrebs/ScrorePrestador/raw/main/processed_atendimentos.parquet'
+NPS_CIDADE_PATH = "https://github.com/vinikrebs/ScrorePrestador/raw/main/processed_nps_by_city.parquet"
+NPS_PRESTADOR_PATH = "https://github.com/vinikrebs/ScrorePrestador/raw/main/processed_nps_by_provider.parquet"
+LOGO_PATH = os.path.join(APP_DIR, "logo.png") # Servido localmente, sem download do GitHub a cada renderização
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+PESOS_SCORE_PRESTADOR = {'atendimentos': 0.25, 'nps': 0.30, 'tempo_chegada': 0.20, 'reembolso': 0.15, 'intermediacao': 0.10}
+TREND_WINDOW_MONTHS = 3 # Janela móvel da tendência do score (3 meses ~ 90 dias)
+TREND_DECLINE_THRESHOLD = -2.0 # Inclinação (pontos de score por mês) abaixo da qual o prestador é considerado em queda
+SKETCH_K = 200 # Parâmetro de precisão dos sketches de quantis (maior = mais preciso e mais memória)
+NORMALIZACAO_OPTIONS = ["Máximo da Seleção", "Percentil (Robusto)"]
+PESOS_CAPILARIDADE = {'atendimentos': 0.3, 'prestadores': 0.3, 'reembolso': 0.2, 'intermediacao': 0.1, 'tempo_chegada': 0.1}
+CAPILARIDADE_COMPONENT_COLUMNS = {
+    'atendimentos': 'norm_atendimentos',
+    'prestadores': 'norm_prestadores',
+    'reembolso': 'contrib_reembolso',
+    'intermediacao': 'contrib_intermediacao',
+    'tempo_chegada': 'contrib_tempo_chegada'
+}
+QUERY_BACKEND = os.environ.get('SCORE_QUERY_BACKEND', 'pandas').lower() # 'pandas' (padrão), 'duckdb' ou 'polars'
+WEIGHT_PROFILES_PATH = os.path.join(APP_DIR, "perfis_pesos.json") # Perfis nomeados de pesos salvos pelo editor What-if
+SNAPSHOTS_DIR = os.path.join(APP_DIR, "snapshots") # Snapshots versionados gerados por snapshots.py (lote noturno)
+RESULT_CACHE_DIR = os.environ.get('SCORE_RESULT_CACHE_DIR', os.path.join(APP_DIR, ".cache_resultados")) # Pode apontar para um volume compartilhado entre réplicas
+RESULT_CACHE_MAX_MB = float(os.environ.get('SCORE_RESULT_CACHE_MAX_MB', 512)) # Acima disto, os resultados menos usados são removidos
+DATA_TTL_SECONDS = 3600 # Intervalo para recarregar as fontes remotas e perceber arquivos alterados na mesma URL
+PRESTADOR_IDS_PATH = os.path.join(APP_DIR, "prestadores_ids.json") # Mapeamento persistido nome normalizado -> ID canônico do prestador
+PRESTADOR_SIMILARIDADE_MINIMA = 0.92 # Similaridade mínima (SequenceMatcher) para casar grafias de um mesmo prestador
+PRESTADOR_BLOCO_MAXIMO = 500 # Blocos maiores que isto (tokens genéricos como AUTO, SOCORRO) não geram candidatos
+CRITERIOS_OFENSOR_CMS = ["Mediana/MAD (Robusto)", "Média UF/Segmento +10%"]
+CMS_Z_ROBUSTO_LIMITE = 2.0 # Z-score robusto (desvio da mediana em unidades de 1,4826*MAD) acima do qual o prestador é ofensor
+FIGURA_PONTOS_MAXIMOS = int(os.environ.get('SCORE_FIGURA_PONTOS', 2000)) # Séries de linha acima disto são reduzidas (LTTB) no servidor
+FIGURA_WEBGL_MIN_PONTOS = 1000 # Traços de dispersão/linha com mais pontos que isto são desenhados em WebGL
+QUALIDADE_DADOS_DIR = os.environ.get('SCORE_QUALIDADE_DIR', os.path.join(APP_DIR, ".qualidade_dados")) # Relatório de qualidade de cada versão dos dados
+QUALIDADE_DADOS_MANTER = 20 # Relatórios (versões) mantidos em disco
+TEMPO_CHEGADA_MAXIMO_MIN = 24 * 60 # Tempo de chegada acima disto é reportado como implausível
+VALOR_ATIPICO_Z_LOG = 5.0 # Z-score robusto (escala log) acima do qual o valor do serviço é reportado como atípico
+NPS_TOLERANCIA_CONTAGENS = 1.0 # Diferença (pontos) tolerada entre o NPS informado e o recalculado das contagens
+MAPAS_DIR = os.path.join(APP_DIR, "mapas") # TopoJSON dos municípios pré-simplificados por mapas.py
+MAPA_NIVEIS = {'baixa': 0.05, 'media': 0.01, 'alta': 0.002} # Nível de detalhe -> grade (graus) da simplificação
+APPROX_MIN_LINHAS = int(os.environ.get('SCORE_APPROX_MIN_LINHAS', 1_000_000)) # Seleções a partir deste tamanho mostram primeiro a prévia amostral (0 desativa)
+APPROX_AMOSTRA_LINHAS = 50_000 # Tamanho esperado da amostra estratificada da prévia
+PREFETCH_ENABLED = os.environ.get('SCORE_PREFETCH', '1') != '0' # Pré-calcula as outras páginas em segundo plano após cada renderização
+METRICS_PORT = int(os.environ.get('SCORE_METRICS_PORT', 9464)) # Porta lateral do endpoint /metrics (0 desativa)
+METRICS_HOST = os.environ.get('SCORE_METRICS_HOST', '127.0.0.1')
+METRICS_DIR = os.environ.get('SCORE_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'score_prestador_metricas')) # Um arquivo por processo, somados no /metrics
+METRICS_FLUSH_SECONDS = 5 # Intervalo de gravação do estado de cada processo
+METRICS_SESSION_WINDOW_SECONDS = 300 # Sessões sem rerun há mais tempo que isto deixam de contar como ativas
+METRICS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # Limites (s) dos histogramas de duração
+
+# --- Função da Página de Login ---
+def login_page():
+    """Renderiza a página de login."""
+    col_logo_left, col_logo_center, col_logo_right = st.columns([1.5, 3, 1.5])
+    with col_logo_center:
+        # Centralizando a imagem usando markdown e HTML
+        st.markdown("<div style='text-align: center;'>", unsafe_allow_html=True)
+        st.image(LOGO_PATH, use_container_width=False, width=1600)
+        st.markdown("</div>", unsafe_allow_html=True)
+
+
+    st.markdown("<h1 style='text-align: center; color: #333333;'>Acesso ao Dashboard Score do Prestador A24h</h1>", unsafe_allow_html=True)
+    st.empty() # Adiciona espaço vertical
+    st.empty() # Adiciona espaço vertical
+
+    with st.form("login_form"):
+        st.markdown("<p style='text-align: center;'>Por favor, insira suas credenciais.</p>", unsafe_allow_html=True)
+        username = st.text_input("Usuário", key="username_input")
+        password = st.text_input("Senha", type="password", key="password_input")
+
+        col_login_btn, col_forgot_btn = st.columns(2)
+        with col_login_btn:
+            login_button = st.form_submit_button("Entrar")
+        with col_forgot_btn:
+            # Botão "Criar uma nova conta"
+            create_account_button = st.form_submit_button("Criar uma nova conta")
+
+        if login_button:
+            if username == "maxpar" and password == "Max!Q@W":
+                st.session_state['logged_in'] = True
+                st.session_state['username'] = username
+                st.success("Login realizado com sucesso!")
+                st.rerun()
+            else:
+                st.error("Usuário ou senha inválidos. Tente novamente.")
+
+        if create_account_button:
+            # Mensagem para "Criar uma nova conta"
+            st.info("Por favor, envie um e-mail para vinicius.krebs@autoglass.com.br para criar uma nova conta.")
+
+# --- Validação de Esquema e Qualidade dos Dados (na carga, um relatório por versão dos dados) ---
+class EsquemaInvalidoError(ValueError):
+    """Coluna com tipo diferente do esquema após a preparação."""
+
+ESQUEMA_ATENDIMENTOS = {
+    'data_abertura_atendimento': 'data', 'segmento': 'categoria', 'seguradora': 'categoria', 'uf': 'categoria',
+    'municipio': 'categoria', 'nome_do_prestador': 'categoria', 'protocolo_atendimento': 'texto',
+    'gerou_reembolso': 'booleano', 'is_reembolso': 'booleano', 'is_intermediacao': 'booleano',
+    'val_reembolso': 'numero', 'tempo_chegada_min': 'numero', 'val_total_items': 'numero'
+}
+ESQUEMA_NPS = {
+    'mes_ano': 'mes', 'nps_score_calculado': 'numero', 'nps_promotores': 'numero', 'nps_neutros': 'numero', 'nps_detratores': 'numero'
+}
+TIPOS_ESQUEMA = {
+    'data': lambda tipo: pd.api.types.is_datetime64_any_dtype(tipo),
+    'categoria': lambda tipo: isinstance(tipo, pd.CategoricalDtype),
+    'texto': lambda tipo: pd.api.types.is_string_dtype(tipo),
+    'booleano': lambda tipo: pd.api.types.is_bool_dtype(tipo),
+    'numero': lambda tipo: pd.api.types.is_numeric_dtype(tipo) and not pd.api.types.is_bool_dtype(tipo),
+    'mes': lambda tipo: isinstance(tipo, pd.PeriodDtype)
+}
+
+def record_quality_check(verificacoes, total, verificacao, coluna, ocorrencias, severidade='aviso', tratamento='mantidos'):
+    """Anota no relatório uma verificação com ocorrências (as sem ocorrências não entram)."""
+    ocorrencias = int(ocorrencias)
+    if ocorrencias:
+        verificacoes.append({
+            'verificacao': verificacao, 'coluna': coluna, 'ocorrencias': ocorrencias,
+            'percentual': round(ocorrencias / total * 100, 3) if total else 0.0,
+            'severidade': severidade, 'tratamento': tratamento
+        })
+
+def validate_schema(df, esquema, verificacoes):
+    """
+    Tipos após a preparação. Coluna ausente é aviso (as páginas já checam a presença); tipo diferente do
+    esquema é erro de carga, para que as agregações possam confiar nos tipos sem conversões defensivas.
+    """
+    for coluna, tipo in esquema.items():
+        if coluna not in df.columns:
+            record_quality_check(verificacoes, len(df), 'Coluna ausente', coluna, len(df), 'aviso', 'análises da coluna indisponíveis')
+        elif not TIPOS_ESQUEMA[tipo](df[coluna].dtype):
+            raise EsquemaInvalidoError(f"Coluna '{coluna}' com tipo {df[coluna].dtype} após a preparação (esperado: {tipo}).")
+
+def check_atendimentos_quality(df, verificacoes):
+    """Faixas, consistência das marcações de reembolso e protocolos duplicados, com máscaras vetorizadas."""
+    registrar = functools.partial(record_quality_check, verificacoes, len(df))
+    if 'tempo_chegada_min' in df.columns:
+        registrar('Tempo de chegada implausível (acima de 24h)', 'tempo_chegada_min', (df['tempo_chegada_min'].to_numpy() > TEMPO_CHEGADA_MAXIMO_MIN).sum())
+    if 'val_total_items' in df.columns:
+        valor = df['val_total_items'].to_numpy()
+        registrar('Valor do serviço negativo', 'val_total_items', (valor < 0).sum())
+        log_valor = np.log(valor[valor > 0])
+        if len(log_valor):
+            mediana = np.median(log_valor)
+            mad = np.median(np.abs(log_valor - mediana)) * 1.4826
+            if mad > 0:
+                registrar(
+                    f'Valor do serviço atípico (z robusto em escala log > {VALOR_ATIPICO_Z_LOG:g})', 'val_total_items',
+                    (np.abs(log_valor - mediana) / mad > VALOR_ATIPICO_Z_LOG).sum(), 'info', 'mantidos (ver ofensores de CMS)'
+                )
+    if 'is_reembolso' in df.columns and 'val_reembolso' in df.columns:
+        reembolso = df['is_reembolso'].to_numpy()
+        com_valor = df['val_reembolso'].to_numpy() > 0
+        registrar('Reembolso marcado sem valor de reembolso', 'is_reembolso', (reembolso & ~com_valor).sum())
+        registrar('Valor de reembolso sem a marcação de reembolso', 'val_reembolso', (~reembolso & com_valor).sum())
+    if 'protocolo_atendimento' in df.columns:
+        registrar('Linha duplicada (todas as colunas iguais)', 'protocolo_atendimento', df.duplicated().sum())
+        chaves = [coluna for coluna in ['protocolo_atendimento', 'nome_do_prestador', 'municipio', 'data_abertura_atendimento'] if coluna in df.columns]
+        distintos = df[chaves].drop_duplicates()['protocolo_atendimento']
+        registrar(
+            'Protocolo repetido com prestador, município ou data diferentes', 'protocolo_atendimento',
+            distintos[distintos.duplicated(keep=False)].nunique()
+        )
+
+def check_nps_quality(df_nps, verificacoes):
+    """Contagens negativas, NPS fora da escala e NPS informado que não bate com as contagens."""
+    registrar = functools.partial(record_quality_check, verificacoes, len(df_nps))
+    contagens = [coluna for coluna in ['nps_promotores', 'nps_neutros', 'nps_detratores'] if coluna in df_nps.columns]
+    for coluna in contagens:
+        registrar('Contagem negativa', coluna, (df_nps[coluna].to_numpy() < 0).sum())
+    if 'nps_score_calculado' in df_nps.columns:
+        nps = df_nps['nps_score_calculado'].to_numpy(dtype=float)
+        registrar('NPS fora de [-100, 100]', 'nps_score_calculado', ((nps < -100) | (nps > 100)).sum())
+        if len(contagens) == 3:
+            promotores, neutros, detratores = (df_nps[coluna].to_numpy(dtype=float) for coluna in contagens)
+            total = promotores + neutros + detratores
+            with np.errstate(divide='ignore', invalid='ignore'):
+                recalculado = (promotores - detratores) / total * 100
+            registrar(
+                'NPS diferente do recalculado pelas contagens', 'nps_score_calculado',
+                ((total > 0) & (np.abs(nps - recalculado) > NPS_TOLERANCIA_CONTAGENS)).sum()
+            )
+
+def save_quality_report(versao, linhas_por_fonte, verificacoes):
+    """Grava o relatório da versão dos dados (temporário + rename) e remove os de versões antigas; falha de disco não impede a carga."""
+    relatorio = {
+        'versao': versao,
+        'gerado_em': datetime.datetime.now().isoformat(timespec='seconds'),
+        'linhas': linhas_por_fonte,
+        'verificacoes': verificacoes
+    }
+    caminho = os.path.join(QUALIDADE_DADOS_DIR, f"{versao}.json")
+    temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(QUALIDADE_DADOS_DIR, exist_ok=True)
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+        os.replace(temporario, caminho)
+        antigos = sorted(
+            (entrada for entrada in os.scandir(QUALIDADE_DADOS_DIR) if entrada.name.endswith('.json')),
+            key=lambda entrada: entrada.stat().st_mtime, reverse=True
+        )[QUALIDADE_DADOS_MANTER:]
+        for entrada in antigos:
+            os.remove(entrada.path)
+    except OSError:
+        pass
+    return relatorio
+
+def load_quality_report(versao):
+    """Relatório de qualidade da versão dos dados, ou None se ela foi carregada antes da validação (ou o disco falhou)."""
+    try:
+        with open(os.path.join(QUALIDADE_DADOS_DIR, f"{versao}.json"), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError):
+        return None
+
+def display_quality_report(relatorio):
+    """Resumo do relatório de qualidade na barra lateral: alerta para erros e a tabela completa num expander."""
+    if relatorio is None:
+        return
+    df_verificacoes = pd.DataFrame(relatorio['verificacoes'], columns=['fonte', 'verificacao', 'coluna', 'ocorrencias', 'percentual', 'severidade', 'tratamento'])
+    erros = (df_verificacoes['severidade'] == 'erro').sum()
+    avisos = (df_verificacoes['severidade'] == 'aviso').sum()
+    if erros:
+        st.warning(f"Qualidade dos dados: {erros} verificação(ões) com erro. Veja o relatório abaixo.")
+    with st.expander(f"🩺 Qualidade dos Dados ({erros} erro(s), {avisos} aviso(s))"):
+        st.caption(
+            f"Versão {relatorio['versao'][:12]}, validada em {relatorio['gerado_em']}. Linhas lidas: "
+            + ", ".join(f"{fonte} {format_pt_br(linhas)}" for fonte, linhas in relatorio['linhas'].items())
+        )
+        if df_verificacoes.empty:
+            st.success("Nenhum problema encontrado nas verificações de esquema, faixas e consistência.")
+        else:
+            st.dataframe(
+                df_verificacoes.rename(columns={
+                    'fonte': 'Fonte', 'verificacao': 'Verificação', 'coluna': 'Coluna', 'ocorrencias': 'Ocorrências',
+                    'percentual': '% Linhas', 'severidade': 'Severidade', 'tratamento': 'Tratamento'
+                }),
+                hide_index=True, use_container_width=True
+            )
+
+# --- Função de Carregamento e Preparação de Dados (com cache para performance) ---
+class ColunaAusenteError(ValueError):
+    """Coluna obrigatória ausente no arquivo de origem."""
+
+# Regras de ingestão dos atendimentos: definidas uma vez, aplicadas pelo pandas em prepare_atendimentos e
+# traduzidas para as views do DuckDB e do Polars, para que uma mudança na carga não separe os backends
+TEXTO_NAO_INFORMADO = 'NAO INFORMADO'
+REGRAS_ATENDIMENTOS = {
+    'data': 'data_abertura_atendimento', # Convertida para data; linhas sem data válida são descartadas
+    'texto': ['segmento', 'seguradora', 'uf', 'municipio', 'nome_do_prestador', 'protocolo_atendimento'], # Maiúsculas; vazio -> TEXTO_NAO_INFORMADO
+    'marcacao': ['gerou_reembolso', 'is_reembolso', 'is_intermediacao'], # Vazia -> False
+    'numero': ['val_reembolso', 'tempo_chegada_min', 'val_total_items'], # Não numérico -> vazio
+    'nao_negativo': ['tempo_chegada_min'], # Negativo -> vazio
+}
+# Colunas expostas pelas views dos backends DuckDB e Polars (as que as agregações consultam)
+ATENDIMENTOS_COLUNAS_BACKEND = [
+    REGRAS_ATENDIMENTOS['data'], *REGRAS_ATENDIMENTOS['texto'], 'is_reembolso', 'is_intermediacao', 'tempo_chegada_min', 'val_total_items'
+]
+
+def prepare_atendimentos(df_final, verificacoes=None):
+    """
+    Tipos e limpeza do arquivo de atendimentos (executado na thread de carga). Cada correção feita aqui
+    (linhas descartadas, valores convertidos) e as verificações de qualidade vão para `verificacoes`.
+    """
+    verificacoes = [] if verificacoes is None else verificacoes
+    coluna_data = REGRAS_ATENDIMENTOS['data']
+    if coluna_data not in df_final.columns:
+        raise ColunaAusenteError(f"Coluna '{coluna_data}' não encontrada no DataFrame de atendimentos.")
+    df_final[coluna_data] = pd.to_datetime(df_final[coluna_data], errors='coerce')
+    record_quality_check(
+        verificacoes, len(df_final), 'Data de abertura vazia ou inválida', coluna_data,
+        df_final[coluna_data].isna().sum(), 'erro', 'linhas descartadas'
+    )
+
+    df_final = df_final.dropna(subset=[coluna_data]).copy()
+    registrar = functools.partial(record_quality_check, verificacoes, len(df_final))
+
+    for col in REGRAS_ATENDIMENTOS['texto']:
+        if col in df_final.columns:
+            registrar('Valor vazio', col, df_final[col].isna().sum(), 'aviso', f"preenchidos com '{TEXTO_NAO_INFORMADO}'")
+            df_final[col] = df_final[col].astype(str).fillna(TEXTO_NAO_INFORMADO).str.upper()
+            if col not in ['protocolo_atendimento']:
+                df_final[col] = df_final[col].astype('category')
+
+    # Marcações vazias contam como False (astype(bool) transformaria NaN em True)
+    for col in REGRAS_ATENDIMENTOS['marcacao']:
+        if col in df_final.columns:
+            registrar('Marcação vazia', col, df_final[col].isna().sum(), 'aviso', 'consideradas False')
+            df_final[col] = df_final[col].fillna(False).astype(bool)
+    for col in REGRAS_ATENDIMENTOS['numero']:
+        if col in df_final.columns:
+            valores = pd.to_numeric(df_final[col], errors='coerce').astype(float)
+            registrar('Valor não numérico', col, (valores.isna() & df_final[col].notna()).sum(), 'erro', 'convertidos em vazio')
+            df_final[col] = valores
+    for col in REGRAS_ATENDIMENTOS['nao_negativo']:
+        if col in df_final.columns:
+            negativos = df_final[col] < 0
+            registrar('Valor negativo', col, negativos.sum(), 'erro', 'convertidos em vazio (fora das médias)')
+            df_final.loc[negativos, col] = np.nan
+
+    check_atendimentos_quality(df_final, verificacoes)
+    validate_schema(df_final, ESQUEMA_ATENDIMENTOS, verificacoes)
+    return df_final
+
+def prepare_nps(df_nps, verificacoes=None):
+    """Tipos do arquivo de NPS (cidade ou prestador), executado na thread de carga; correções e verificações vão para `verificacoes`."""
+    verificacoes = [] if verificacoes is None else verificacoes
+    registrar = functools.partial(record_quality_check, verificacoes, len(df_nps))
+    # Ajustar tipos e lidar com NaNs nas colunas de NPS
+    for col in ['nps_score_calculado', 'nps_promotores', 'nps_neutros', 'nps_detratores']:
+        if col in df_nps.columns:
+            valores = pd.to_numeric(df_nps[col], errors='coerce') # Trata ' ' como NaN
+            registrar('Valor vazio ou não numérico', col, valores.isna().sum(), 'aviso', 'substituídos por 0')
+            df_nps[col] = valores.fillna(0)
+    if 'mes_ano' in df_nps.columns:
+        meses = pd.to_datetime(df_nps['mes_ano'], errors='coerce')
+        registrar('Mês vazio ou inválido', 'mes_ano', meses.isna().sum(), 'aviso', 'fora da evolução mensal')
+        df_nps['mes_ano'] = meses.dt.to_period('M')
+
+    check_nps_quality(df_nps, verificacoes)
+    validate_schema(df_nps, ESQUEMA_NPS, verificacoes)
+    return df_nps
+
+def fetch_source(path, preparar, verificacoes=None):
+    """Baixa, decodifica e prepara uma fonte. O pyarrow libera o GIL, então as fontes rodam em paralelo."""
+    return preparar(pd.read_parquet(path), verificacoes)
+
+@st.cache_data(show_spinner=False, ttl=DATA_TTL_SECONDS)
+def load_and_prepare_data(atendimentos_file_path, nps_cidade_path, nps_prestador_path, _progresso=None):
+    """
+    Carrega as três fontes em threads concorrentes: o tempo de carga a frio passa a ser o da fonte
+    mais lenta, e não a soma das três. `_progresso(rotulo, concluidas, total)` é chamado a cada
+    fonte concluída (na thread do script) e não faz parte da chave do cache.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    get_metrics().contar('carga_dados_execucoes_total')
+    pd.set_option('future.no_silent_downcasting', True)
+
+    fontes = {
+        'atendimentos': (atendimentos_file_path, prepare_atendimentos),
+        'NPS por cidade': (nps_cidade_path, prepare_nps),
+        'NPS por prestador': (nps_prestador_path, prepare_nps)
+    }
+    resultados = {}
+    verificacoes = {rotulo: [] for rotulo in fontes}
+    with ThreadPoolExecutor(max_workers=len(fontes)) as executor:
+        futures = {executor.submit(fetch_source, path, preparar, verificacoes[rotulo]): rotulo for rotulo, (path, preparar) in fontes.items()}
+        for concluidas, future in enumerate(as_completed(futures), start=1):
+            rotulo = futures[future]
+            try:
+                resultados[rotulo] = future.result()
+            except Exception as e:
+                resultados[rotulo] = e
+            if _progresso is not None:
+                _progresso(rotulo, concluidas, len(fontes))
+
+    # Carrega e processa df_final
+    df_final = resultados['atendimentos']
+    if isinstance(df_final, FileNotFoundError):
+        st.error(f"Erro: Arquivo '{atendimentos_file_path}' não encontrado. Verifique o caminho.")
+        st.stop()
+    elif isinstance(df_final, (ColunaAusenteError, EsquemaInvalidoError)):
+        st.error(str(df_final))
+        st.stop()
+    elif isinstance(df_final, Exception):
+        st.error(f"Erro ao ler o arquivo Parquet de atendimentos: {df_final}. Verifique se o arquivo está no formato correto.")
+        st.stop()
+
+    # --- NPS por cidade e por prestador: a ausência de uma fonte não impede o restante do dashboard ---
+    frames_nps = []
+    for rotulo, path in [('NPS por cidade', nps_cidade_path), ('NPS por prestador', nps_prestador_path)]:
+        df_nps = resultados[rotulo]
+        if isinstance(df_nps, FileNotFoundError):
+            st.warning(f"Aviso: Arquivo '{path}' não encontrado. A análise de {rotulo} pode estar incompleta.")
+            df_nps = pd.DataFrame() # Retorna DataFrame vazio para evitar erros
+        elif isinstance(df_nps, Exception):
+            st.error(f"Erro ao ler o arquivo Parquet de {rotulo}: {df_nps}.")
+            df_nps = pd.DataFrame()
+        elif 'mes_ano' not in df_nps.columns:
+            st.warning(f"Coluna 'mes_ano' não encontrada no arquivo {rotulo}.")
+        frames_nps.append(df_nps)
+    df_nps_cidade, df_nps_prestador = frames_nps
+
+    # IDs canônicos de prestador: as junções atendimentos x NPS passam a ser por inteiro, não pelo texto do nome
+    if 'nome_do_prestador' in df_final.columns:
+        nomes_nps = df_nps_prestador['nome_do_prestador'].astype(str) if 'nome_do_prestador' in df_nps_prestador.columns else None
+        ids = resolve_provider_ids(df_final['nome_do_prestador'].unique(), [] if nomes_nps is None else nomes_nps.unique())
+        df_final['id_prestador'] = provider_id_column(df_final['nome_do_prestador'], ids)
+        if nomes_nps is not None:
+            df_nps_prestador['id_prestador'] = provider_id_column(nomes_nps, ids)
+
+    # Relatório de qualidade gravado pela versão (impressão digital) dos dados devolvidos: as páginas leem
+    # o da versão em uso e as agregações confiam nos tipos validados aqui
+    save_quality_report(
+        dataset_fingerprint(df_final, df_nps_cidade, df_nps_prestador),
+        {'atendimentos': len(df_final), 'NPS por cidade': len(df_nps_cidade), 'NPS por prestador': len(df_nps_prestador)},
+        [{'fonte': rotulo, **verificacao} for rotulo, lista in verificacoes.items() for verificacao in lista]
+    )
+
+    return df_final, df_nps_cidade, df_nps_prestador,
+
+# --- Resolução de Nomes de Prestadores (normalização, blocagem e IDs canônicos) ---
+SUFIXOS_RAZAO_SOCIAL = {'LTDA', 'ME', 'EPP', 'EIRELI', 'MEI', 'SA', 'CIA', 'SS', 'SLU'}
+REGRAS_FONETICAS = [
+    (r'PH', 'F'), (r'TH', 'T'), (r'[CS]H', 'X'), (r'LH', 'L'), (r'NH', 'N'), (r'C(?=[EI])', 'S'),
+    (r'QU', 'K'), (r'[CQ]', 'K'), (r'Z', 'S'), (r'Y', 'I'), (r'W', 'V'), (r'H', ''), (r'(.)\1+', r'\1')
+]
+
+def normalize_provider_name(nome):
+    """Nome comparável: sem acentos e pontuação, maiúsculas e sem sufixos de razão social ('LTDA', 'S/A', '- ME')."""
+    texto = re.sub(r'[./]', '', normalize_text_key(nome))
+    tokens = re.sub(r'[^A-Z0-9]+', ' ', texto).split()
+    while len(tokens) > 1 and tokens[-1] in SUFIXOS_RAZAO_SOCIAL:
+        tokens.pop()
+    return ' '.join(tokens)
+
+def phonetic_key(token):
+    """Código fonético simplificado (português): SOUSA/SOUZA, LUIS/LUIZ e THIAGO/TIAGO caem na mesma chave."""
+    if token.isdigit():
+        return token
+    for padrao, substituto in REGRAS_FONETICAS:
+        token = re.sub(padrao, substituto, token)
+    return token[:1] + re.sub(r'[AEIOU]', '', token[1:])
+
+def blocking_keys(nome_normalizado):
+    """
+    Chaves de bloco de um nome: código fonético e prefixo de 4 letras de cada token com 3+ caracteres
+    (números entram como estão). Dois nomes só são comparados se compartilharem alguma chave.
+    """
+    chaves = set()
+    for token in nome_normalizado.split():
+        if token.isdigit():
+            chaves.add(token)
+        elif len(token) >= 3:
+            chaves.update({f"F:{phonetic_key(token)}", f"P:{token[:4]}"})
+    return chaves
+
+def load_provider_ids():
+    """
+    Lê o mapeamento persistido {'proximo_id': n, 'ids': {nome canônico: id}, 'apelidos': {grafia do NPS: id}}.
+    Os nomes canônicos vêm dos atendimentos; os apelidos são grafias do NPS ligadas a um deles (ou a um ID próprio).
+    """
+    try:
+        with open(PRESTADOR_IDS_PATH, encoding='utf-8') as arquivo:
+            mapeamento = json.load(arquivo)
+    except (FileNotFoundError, json.JSONDecodeError):
+        mapeamento = {'proximo_id': 1, 'ids': {}}
+    mapeamento.setdefault('apelidos', {})
+    return mapeamento
+
+def save_provider_ids(mapeamento):
+    try:
+        temporario = f"{PRESTADOR_IDS_PATH}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(mapeamento, arquivo, ensure_ascii=False, indent=0, sort_keys=True)
+        os.replace(temporario, PRESTADOR_IDS_PATH)
+    except OSError:
+        pass # Sem permissão de escrita: os IDs continuam válidos para este processo
+
+def resolve_provider_ids(nomes_atendimentos, nomes_nps):
+    """
+    Resolve os nomes de prestador das duas fontes para IDs canônicos inteiros e retorna {nome: id}.
+    Os nomes dos atendimentos definem os prestadores canônicos (um ID por nome normalizado). Um nome do
+    NPS sem correspondência exata é comparado apenas com os candidatos que compartilham uma chave de bloco,
+    então o custo é quase linear; números no nome (códigos, CNPJ) precisam coincidir exatamente.
+    As grafias do NPS ficam guardadas como apelidos, separadas dos nomes canônicos: se uma delas aparecer
+    depois nos atendimentos, vira um prestador com ID próprio em vez de herdar o do prestador que apelidava.
+    """
+    from collections import defaultdict
+    from difflib import SequenceMatcher
+
+    mapeamento = load_provider_ids()
+    ids, apelidos = mapeamento['ids'], mapeamento['apelidos']
+    original = (dict(ids), dict(apelidos))
+
+    def novo_id():
+        mapeamento['proximo_id'] += 1
+        return mapeamento['proximo_id'] - 1
+
+    normalizados_atendimentos = {nome: normalize_provider_name(nome) for nome in nomes_atendimentos}
+    canonicos = set(normalizados_atendimentos.values())
+    numeros = {chave: re.findall(r'\d+', chave) for chave in canonicos}
+    blocos = defaultdict(list)
+    ids_de_canonicos = set(ids.values())
+    ids_canonicos = set()
+    for chave in sorted(canonicos):
+        id_prestador = ids.get(chave)
+        if id_prestador is None and apelidos.get(chave) not in (None, *ids_de_canonicos):
+            # Grafia antes vista só no NPS, com ID próprio: é promovida a canônica mantendo o ID
+            id_prestador = apelidos[chave]
+        if id_prestador is None or id_prestador in ids_canonicos:
+            # Sem ID, ID de um apelido de outro prestador ou já tomado por outro nome desta carga: ID novo
+            id_prestador = novo_id()
+        ids[chave] = id_prestador
+        apelidos.pop(chave, None)
+        ids_canonicos.add(id_prestador)
+        for bloco in blocking_keys(chave):
+            blocos[bloco].append(chave)
+
+    normalizados_nps = {nome: normalize_provider_name(nome) for nome in nomes_nps}
+    # Nomes canônicos e apelidos já ligados a um prestador dos atendimentos são reaproveitados; os demais são (re)tentados
+    for chave in sorted(set(normalizados_nps.values())):
+        if chave in ids or apelidos.get(chave) in ids_canonicos:
+            continue
+        numeros_chave = re.findall(r'\d+', chave)
+        candidatos = {
+            candidato
+            for bloco in blocking_keys(chave) if len(blocos.get(bloco, ())) <= PRESTADOR_BLOCO_MAXIMO
+            for candidato in blocos.get(bloco, ())
+        }
+        # Um comparador por nome (a segunda sequência fica pré-processada); os limites superiores baratos
+        # (real_quick_ratio, quick_ratio) descartam a maioria dos candidatos antes do ratio() completo
+        comparador = SequenceMatcher(None, b=chave)
+        similaridades = []
+        for candidato in candidatos:
+            if numeros[candidato] != numeros_chave:
+                continue
+            comparador.set_seq1(candidato)
+            if comparador.real_quick_ratio() >= PRESTADOR_SIMILARIDADE_MINIMA and comparador.quick_ratio() >= PRESTADOR_SIMILARIDADE_MINIMA:
+                similaridades.append((comparador.ratio(), candidato))
+        similaridades.sort(reverse=True)
+        # Só casa se o melhor candidato for claramente o melhor (empates próximos ficam sem casar)
+        if similaridades and similaridades[0][0] >= PRESTADOR_SIMILARIDADE_MINIMA and (
+            len(similaridades) == 1 or similaridades[0][0] - similaridades[1][0] > 0.02
+        ):
+            apelidos[chave] = ids[similaridades[0][1]]
+        elif chave not in apelidos:
+            apelidos[chave] = novo_id()
+
+    if (ids, apelidos) != original:
+        save_provider_ids(mapeamento)
+    return {
+        nome: ids[chave] if chave in ids else apelidos[chave]
+        for nome, chave in [*normalizados_atendimentos.items(), *normalizados_nps.items()]
+    }
+
+def provider_id_column(nomes, ids):
+    """Coluna id_prestador (int32) a partir dos nomes, consultando o mapeamento uma vez por valor distinto."""
+    codigos, unicos = pd.factorize(nomes)
+    return np.asarray([ids[nome] for nome in unicos], dtype=np.int32)[codigos]
+
+def provider_id_table(*frames):
+    """Pares distintos (nome_do_prestador, id_prestador) das fontes, para as junções por ID dos backends DuckDB e Polars."""
+    pares = [
+        frame[['nome_do_prestador', 'id_prestador']].drop_duplicates().astype({'nome_do_prestador': str})
+        for frame in frames if 'id_prestador' in frame.columns
+    ]
+    if not pares:
+        return pd.DataFrame({'nome_do_prestador': pd.Series(dtype=str), 'id_prestador': pd.Series(dtype='int32')})
+    return pd.concat(pares, ignore_index=True).drop_duplicates('nome_do_prestador').reset_index(drop=True)
+
+# --- Exportação XLSX (gerada apenas no clique do botão de download) ---
+def to_xlsx_bytes(df, sheet_name):
+    """Serializa o DataFrame em XLSX; o xlsxwriter só é carregado quando o arquivo é pedido."""
+    output = io.BytesIO()
+    with get_metrics().cronometrar('exportacao_segundos', planilha=sheet_name):
+        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return output.getvalue()
+
+# --- Índice de Metadados dos Filtros (construído uma vez por versão dos dados) ---
+@st.cache_data
+def build_filter_index(df):
+    """
+    Pré-calcula as opções ordenadas de cada filtro da barra lateral e as adjacências
+    uf -> municípios e seguradora -> segmentos usadas nos filtros em cascata.
+    """
+    def adjacencia(coluna_chave, coluna_valor):
+        pares = df[[coluna_chave, coluna_valor]].dropna().drop_duplicates()
+        return {
+            str(chave): sorted(grupo[coluna_valor].astype(str).tolist())
+            for chave, grupo in pares.groupby(coluna_chave, observed=True)
+        }
+
+    return {
+        'opcoes': {
+            coluna: sorted(df[coluna].dropna().astype(str).unique().tolist())
+            for coluna in ['segmento', 'seguradora', 'uf', 'municipio']
+        },
+        'municipios_por_uf': adjacencia('uf', 'municipio'),
+        'segmentos_por_seguradora': adjacencia('seguradora', 'segmento'),
+        'data_min': df['data_abertura_atendimento'].min().date(),
+        'data_max': df['data_abertura_atendimento'].max().date(),
+    }
+
+def cascade_options(indice, adjacencia, selecionados, dimensao):
+    """Opções de um filtro dependente: união das adjacências dos itens selecionados (None = todas)."""
+    if selecionados is None:
+        return indice['opcoes'][dimensao]
+    return sorted(set().union(*(indice[adjacencia].get(item, []) for item in selecionados)))
+
+def resolve_selection(selecionados):
+    """Converte a seleção do multiselect em predicado: None quando 'TODOS' está marcado."""
+    return None if ALL_OPTION in selecionados else selecionados
+
+# --- Função Geral de Aplicação de Filtros ---
+def selection_mask(df, selected_segments, selected_insurers, selected_states, selected_municipios):
+    """Máscara das seleções de segmento, seguradora, UF e município (sem o período)."""
+    mask = np.ones(len(df), dtype=bool)
+    for coluna, selecionados in [
+        ('segmento', selected_segments),
+        ('seguradora', selected_insurers),
+        ('uf', selected_states),
+        ('municipio', selected_municipios),
+    ]:
+        if selecionados is not None:
+            mask &= df[coluna].isin(selecionados).to_numpy()
+    return mask
+
+def period_mask(df, start_date, end_date):
+    return (
+        (df['data_abertura_atendimento'] >= pd.Timestamp(start_date)) &
+        (df['data_abertura_atendimento'] < pd.Timestamp(end_date) + pd.Timedelta(days=1))
+    ).to_numpy()
+
+def apply_filters(df, selected_segments, selected_insurers, selected_states, selected_municipios, start_date, end_date):
+    """Aplica filtros comuns ao DataFrame. Seleções None (opção 'TODOS') não geram predicado."""
+    mask = period_mask(df, start_date, end_date) & selection_mask(df, selected_segments, selected_insurers, selected_states, selected_municipios)
+    df_filtrado = df[mask].copy()
+    return df_filtrado
+
+# --- Comparação entre Períodos ---
+PERIODO_BASE = 'Base'
+PERIODO_COMPARACAO = 'Comparação'
+
+def label_periods(df, selected_segments, selected_insurers, selected_states, selected_municipios, periodo_base, periodo_comparacao):
+    """
+    Filtra a união dos dois períodos numa única passada e rotula cada linha na coluna 'periodo',
+    para que cada página agregue uma só vez por (periodo, entidade).
+    """
+    selecao = selection_mask(df, selected_segments, selected_insurers, selected_states, selected_municipios)
+    em_base = period_mask(df, *periodo_base) & selecao
+    em_comparacao = period_mask(df, *periodo_comparacao) & selecao
+
+    uniao = em_base | em_comparacao
+    df_periodos = df[uniao].copy()
+    df_periodos['periodo'] = np.where(em_base[uniao], PERIODO_BASE, PERIODO_COMPARACAO)
+    # Períodos sobrepostos: as linhas em comum também contam para o período de comparação
+    sobreposicao = em_base & em_comparacao
+    if sobreposicao.any():
+        df_periodos = pd.concat([df_periodos, df[sobreposicao].assign(periodo=PERIODO_COMPARACAO)])
+    df_periodos['periodo'] = pd.Categorical(df_periodos['periodo'], categories=[PERIODO_BASE, PERIODO_COMPARACAO])
+    return df_periodos
+
+def delta_percentual(atual, anterior):
+    """Variação percentual para o delta do st.metric (None quando não há base de comparação)."""
+    if anterior is None or pd.isna(anterior) or anterior == 0:
+        return None
+    return f"{(atual - anterior) / abs(anterior) * 100:+.1f}%"
+
+def delta_pontos(atual, anterior, unidade="p.p."):
+    if anterior is None or pd.isna(anterior) or pd.isna(atual):
+        return None
+    return f"{atual - anterior:+.2f} {unidade}".strip()
+
+# --- Backends de Consulta (agregações das páginas) ---
+# As páginas pedem suas agregações a um backend. O PandasBackend agrega o DataFrame em memória;
+# o DuckDBBackend consulta os arquivos Parquet diretamente, em paralelo e fora da memória do processo.
+# O PolarsBackend faz o mesmo com LazyFrames, sem materializar os DataFrames intermediários.
+# Ambos devolvem os mesmos DataFrames (mesmas colunas e valores).
+# O ganho é de tempo nas agregações, não de memória: main() continua carregando as fontes em pandas e
+# filtrando o DataFrame completo a cada rerun (KPIs por linha, drilldown, carga, mapas), então o pico de
+# RSS não cai. Medido com `benchmark.py sessoes --tamanhos 500000 --sessoes 2 --passos 10`:
+# pandas 1074 MB, DuckDB 1307 MB e Polars 1199 MB (as conexões e os planos somam-se ao DataFrame).
+
+FAIXAS_TEMPO_CHEGADA = ['0-30 min', '31-60 min', '61-120 min', '>120 min']
+SEGMENTOS_ANALISE_CMS = ['AUTO', 'RESID', 'VIDA']
+
+def aggregate_cidades(df, por=()):
+    """Agregado por (uf, município) usado na página de Capilaridade; `por` antepõe chaves (ex.: 'periodo')."""
+    return df.groupby([*por, 'uf', 'municipio'], observed=True).agg(
+        num_servicos=('protocolo_atendimento', 'nunique'),
+        num_prestadores=('nome_do_prestador', 'nunique'),
+        num_reembolsos=('is_reembolso', lambda x: x.sum()),
+        num_intermediacoes=('is_intermediacao', lambda x: x.sum()),
+        media_tempo_chegada=('tempo_chegada_min', 'mean'),
+        total_valor_servicos=('val_total_items', 'sum')
+    ).reset_index()
+
+def aggregate_prestadores_base(df_atendimentos_filtrado, df_nps_prestador, por=()):
+    """Agregado por prestador (com o NPS do prestador) usado na página de Score; `por` antepõe chaves."""
+    if not df_nps_prestador.empty and 'id_prestador' in df_nps_prestador.columns:
+        # Junção pelo ID canônico: grafias diferentes do mesmo prestador nas duas fontes não perdem o NPS
+        df_merged = pd.merge(df_atendimentos_filtrado, df_nps_prestador[['id_prestador', 'nps_score_calculado']], on='id_prestador', how='left')
+        df_merged['nps_score_calculado'] = df_merged['nps_score_calculado'].fillna(0)
+    else:
+        df_merged = df_atendimentos_filtrado.copy()
+        df_merged['nps_score_calculado'] = 0
+
+    df_agregado = df_merged.groupby([*por, 'nome_do_prestador'], observed=True).agg(
+        total_atendimentos=('protocolo_atendimento', 'nunique'),
+        media_nps=('nps_score_calculado', 'mean'),
+        num_reembolsos=('is_reembolso', 'sum'),
+        num_intermediacoes=('is_intermediacao', 'sum'),
+        media_tempo_chegada=('tempo_chegada_min', 'mean')
+    ).reset_index()
+    # Tipos validados na carga: agrupa pela categoria e converte para texto só as chaves do resultado
+    df_agregado['nome_do_prestador'] = df_agregado['nome_do_prestador'].astype(str)
+    return df_agregado
+
+def aggregate_cms_prestador(df, por=()):
+    return df.groupby([*por, 'nome_do_prestador'], observed=True).agg(
+        qtd_servicos=('protocolo_atendimento', 'count'),
+        cms=('val_total_items', 'mean')
+    ).reset_index()
+
+def aggregate_cms_faixa_tempo(df):
+    df_valid_tempo_chegada = df.dropna(subset=['tempo_chegada_min']).copy()
+    bins = [0, 30, 60, 120, np.inf]
+    df_valid_tempo_chegada['faixa_tempo_chegada'] = pd.cut(df_valid_tempo_chegada['tempo_chegada_min'], bins=bins, labels=FAIXAS_TEMPO_CHEGADA, right=True, include_lowest=True, ordered=True)
+
+    cms_por_tempo = df_valid_tempo_chegada.groupby('faixa_tempo_chegada', observed=True).agg(
+        qtd_servicos=('protocolo_atendimento', 'count'),
+        cms=('val_total_items', 'mean')
+    ).reset_index()
+    return cms_por_tempo.dropna(subset=['faixa_tempo_chegada'])
+
+def aggregate_cms_ofensores(df):
+    """CMS por (prestador, uf, segmento) com o CMS médio da UF/segmento, para os segmentos analisados."""
+    df_financeiro_analise = df[df['segmento'].isin(SEGMENTOS_ANALISE_CMS)]
+    cms_medio_uf_segmento_df = df_financeiro_analise.groupby(['uf', 'segmento'], observed=True).agg(
+        cms_medio_uf_segmento=('val_total_items', 'mean')
+    ).reset_index()
+
+    cms_ofensores = df_financeiro_analise.groupby(['nome_do_prestador', 'uf', 'segmento'], observed=True).agg(
+        qtd_servicos=('protocolo_atendimento', 'count'),
+        cms_prestador=('val_total_items', 'mean')
+    ).reset_index()
+    return pd.merge(cms_ofensores, cms_medio_uf_segmento_df, on=['uf', 'segmento'], how='left')
+
+def aggregate_tmc(df, coluna):
+    return df.groupby(coluna, observed=True)['tempo_chegada_min'].mean().reset_index()
+
+def aggregate_nps(df_nps, coluna):
+    """Soma promotores, detratores e neutros por coluna (mês, município ou prestador)."""
+    return df_nps.groupby(coluna, observed=True).agg(
+        promotores=('nps_promotores', 'sum'),
+        detratores=('nps_detratores', 'sum'),
+        neutros=('nps_neutros', 'sum')
+    ).reset_index()
+
+def nps_month_column(df_nps):
+    """Garante a coluna 'mes_ano_dt' (datetime) a partir de 'mes_ano'."""
+    if isinstance(df_nps['mes_ano'].dtype, pd.PeriodDtype):
+        df_nps['mes_ano_dt'] = df_nps['mes_ano'].dt.to_timestamp()
+    else:
+        df_nps['mes_ano_dt'] = pd.to_datetime(df_nps['mes_ano'], errors='coerce')
+    return df_nps
+
+class PandasBackend:
+    """Agregações em pandas sobre um DataFrame em memória (já filtrado quando filtros=None)."""
+
+    nome = 'pandas'
+
+    def __init__(self, df, df_nps_cidade=None, df_nps_prestador=None):
+        self.df = df
+        self.df_nps_cidade = df_nps_cidade
+        self.df_nps_prestador = df_nps_prestador
+
+    def selecao(self, filtros=None):
+        return self.df if filtros is None else apply_filters(self.df, **filtros)
+
+    def agregado_cidades(self, filtros=None):
+        return aggregate_cidades(self.selecao(filtros))
+
+    def agregado_prestadores(self, filtros=None):
+        return aggregate_prestadores_base(self.selecao(filtros), self.df_nps_prestador)
+
+    def cms_por_prestador(self, filtros=None):
+        return aggregate_cms_prestador(self.selecao(filtros))
+
+    def cms_por_faixa_tempo(self, filtros=None):
+        return aggregate_cms_faixa_tempo(self.selecao(filtros))
+
+    def cms_ofensores(self, filtros=None):
+        return aggregate_cms_ofensores(self.selecao(filtros))
+
+    def tmc_por(self, coluna, filtros=None):
+        return aggregate_tmc(self.selecao(filtros), coluna)
+
+    def nps_por(self, origem, coluna):
+        df_nps = self.df_nps_cidade if origem == 'cidade' else self.df_nps_prestador
+        if coluna == 'mes_ano_dt':
+            df_nps = nps_month_column(df_nps)
+        return aggregate_nps(df_nps, coluna)
+
+class DuckDBBackend:
+    """
+    Agregações em DuckDB embarcado lendo os Parquet no lugar (multi-thread e fora do núcleo).
+    As views replicam a preparação de load_and_prepare_data (datas, maiúsculas e tipos).
+    """
+
+    nome = 'duckdb'
+
+    def __init__(self, atendimentos_path, nps_cidade_path, nps_prestador_path, ids_prestador):
+        import duckdb
+
+        self.paths = (atendimentos_path, nps_cidade_path, nps_prestador_path)
+        self.con = duckdb.connect()
+        # Tabela (e não um DataFrame registrado) para ficar visível aos cursores de cada consulta
+        self.con.register('ids_prestador_df', ids_prestador)
+        self.con.execute("CREATE TABLE ids_prestador AS SELECT CAST(nome_do_prestador AS VARCHAR) AS nome_do_prestador, CAST(id_prestador AS INTEGER) AS id_prestador FROM ids_prestador_df")
+        self.con.unregister('ids_prestador_df')
+        if any(str(path).startswith(('http://', 'https://')) for path in (atendimentos_path, nps_cidade_path, nps_prestador_path)):
+            self.con.execute("INSTALL httpfs; LOAD httpfs;")
+
+        self.con.execute(f"""
+            CREATE VIEW atendimentos AS
+            SELECT * FROM (
+                SELECT {', '.join(f"{self._coluna_preparada(coluna)} AS {coluna}" for coluna in ATENDIMENTOS_COLUNAS_BACKEND)}
+                FROM read_parquet('{atendimentos_path}')
+            ) WHERE {REGRAS_ATENDIMENTOS['data']} IS NOT NULL
+        """)
+
+        self.nps_disponivel = {}
+        for origem, path, coluna_chave in [('cidade', nps_cidade_path, 'municipio'), ('prestador', nps_prestador_path, 'nome_do_prestador')]:
+            try:
+                self.con.execute(f"""
+                    CREATE VIEW nps_{origem} AS
+                    SELECT
+                        CAST({coluna_chave} AS VARCHAR) AS {coluna_chave},
+                        date_trunc('month', COALESCE(TRY_CAST(mes_ano AS TIMESTAMP), TRY_STRPTIME(CAST(mes_ano AS VARCHAR), '%Y-%m'))) AS mes_ano_dt,
+                        COALESCE(TRY_CAST(nps_score_calculado AS DOUBLE), 0) AS nps_score_calculado,
+                        COALESCE(TRY_CAST(nps_promotores AS DOUBLE), 0) AS nps_promotores,
+                        COALESCE(TRY_CAST(nps_neutros AS DOUBLE), 0) AS nps_neutros,
+                        COALESCE(TRY_CAST(nps_detratores AS DOUBLE), 0) AS nps_detratores
+                    FROM read_parquet('{path}')
+                """)
+                self.con.execute(f"SELECT 1 FROM nps_{origem} LIMIT 1")
+                self.nps_disponivel[origem] = True
+            except duckdb.Error:
+                self.nps_disponivel[origem] = False
+
+    @staticmethod
+    def _coluna_preparada(coluna):
+        """Expressão SQL de uma coluna dos atendimentos segundo REGRAS_ATENDIMENTOS (as mesmas do prepare_atendimentos)."""
+        if coluna == REGRAS_ATENDIMENTOS['data']:
+            return f"TRY_CAST({coluna} AS TIMESTAMP)"
+        if coluna in REGRAS_ATENDIMENTOS['texto']:
+            return f"COALESCE(UPPER(CAST({coluna} AS VARCHAR)), '{TEXTO_NAO_INFORMADO}')"
+        if coluna in REGRAS_ATENDIMENTOS['marcacao']:
+            return f"COALESCE(CAST({coluna} AS BOOLEAN), FALSE)"
+        expressao = f"TRY_CAST({coluna} AS DOUBLE)" if coluna in REGRAS_ATENDIMENTOS['numero'] else coluna
+        if coluna in REGRAS_ATENDIMENTOS['nao_negativo']:
+            expressao = f"CASE WHEN {expressao} >= 0 THEN {expressao} END"
+        return expressao
+
+    def _where(self, filtros, alias=''):
+        """Monta a cláusula WHERE e os parâmetros; seleções None não geram predicado."""
+        prefixo = f"{alias}." if alias else ''
+        if filtros is None:
+            return 'TRUE', []
+        condicoes = [f"{prefixo}data_abertura_atendimento >= ?", f"{prefixo}data_abertura_atendimento < ?"]
+        parametros = [
+            pd.Timestamp(filtros['start_date']).to_pydatetime(),
+            (pd.Timestamp(filtros['end_date']) + pd.Timedelta(days=1)).to_pydatetime()
+        ]
+        for coluna, chave in [('segmento', 'selected_segments'), ('seguradora', 'selected_insurers'), ('uf', 'selected_states'), ('municipio', 'selected_municipios')]:
+            if filtros[chave] is not None:
+                condicoes.append(f"list_contains(?, {prefixo}{coluna})")
+                parametros.append([str(valor) for valor in filtros[chave]])
+        return ' AND '.join(condicoes), parametros
+
+    def _query(self, sql, parametros=()):
+        # Um cursor por consulta: a conexão é compartilhada entre as sessões do servidor
+        return self.con.cursor().execute(sql, parametros).df()
+
+    def selecao(self, filtros=None):
+        where, parametros = self._where(filtros)
+        return self._query(f"SELECT * FROM atendimentos WHERE {where}", parametros)
+
+    def agregado_cidades(self, filtros=None):
+        where, parametros = self._where(filtros)
+        return self._query(f"""
+            SELECT uf, municipio,
+                COUNT(DISTINCT protocolo_atendimento) AS num_servicos,
+                COUNT(DISTINCT nome_do_prestador) AS num_prestadores,
+                SUM(CAST(is_reembolso AS INTEGER)) AS num_reembolsos,
+                SUM(CAST(is_intermediacao AS INTEGER)) AS num_intermediacoes,
+                AVG(tempo_chegada_min) AS media_tempo_chegada,
+                COALESCE(SUM(val_total_items), 0) AS total_valor_servicos
+            FROM atendimentos WHERE {where}
+            GROUP BY uf, municipio ORDER BY uf, municipio
+        """, parametros)
+
+    def agregado_prestadores(self, filtros=None):
+        where, parametros = self._where(filtros, alias='a')
+        if self.nps_disponivel.get('prestador'):
+            juncao = """
+                LEFT JOIN ids_prestador ia ON ia.nome_do_prestador = a.nome_do_prestador
+                LEFT JOIN (
+                    SELECT i.id_prestador, n.nps_score_calculado
+                    FROM nps_prestador n JOIN ids_prestador i ON i.nome_do_prestador = n.nome_do_prestador
+                ) n ON n.id_prestador = ia.id_prestador
+            """
+            nps = "COALESCE(n.nps_score_calculado, 0)"
+        else:
+            juncao, nps = '', '0.0'
+        return self._query(f"""
+            SELECT a.nome_do_prestador,
+                COUNT(DISTINCT a.protocolo_atendimento) AS total_atendimentos,
+                AVG({nps}) AS media_nps,
+                SUM(CAST(a.is_reembolso AS INTEGER)) AS num_reembolsos,
+                SUM(CAST(a.is_intermediacao AS INTEGER)) AS num_intermediacoes,
+                AVG(a.tempo_chegada_min) AS media_tempo_chegada
+            FROM atendimentos a {juncao} WHERE {where}
+            GROUP BY a.nome_do_prestador ORDER BY a.nome_do_prestador
+        """, parametros)
+
+    def cms_por_prestador(self, filtros=None):
+        where, parametros = self._where(filtros)
+        return self._query(f"""
+            SELECT nome_do_prestador, COUNT(protocolo_atendimento) AS qtd_servicos, AVG(val_total_items) AS cms
+            FROM atendimentos WHERE {where}
+            GROUP BY nome_do_prestador ORDER BY nome_do_prestador
+        """, parametros)
+
+    def cms_por_faixa_tempo(self, filtros=None):
+        where, parametros = self._where(filtros)
+        df = self._query(f"""
+            SELECT faixa_tempo_chegada, COUNT(protocolo_atendimento) AS qtd_servicos, AVG(val_total_items) AS cms
+            FROM (
+                SELECT *, CASE
+                    WHEN tempo_chegada_min < 0 THEN NULL
+                    WHEN tempo_chegada_min <= 30 THEN '{FAIXAS_TEMPO_CHEGADA[0]}'
+                    WHEN tempo_chegada_min <= 60 THEN '{FAIXAS_TEMPO_CHEGADA[1]}'
+                    WHEN tempo_chegada_min <= 120 THEN '{FAIXAS_TEMPO_CHEGADA[2]}'
+                    WHEN tempo_chegada_min IS NOT NULL THEN '{FAIXAS_TEMPO_CHEGADA[3]}'
+                END AS faixa_tempo_chegada
+                FROM atendimentos WHERE {where}
+            ) WHERE faixa_tempo_chegada IS NOT NULL
+            GROUP BY faixa_tempo_chegada
+        """, parametros)
+        df['faixa_tempo_chegada'] = pd.Categorical(df['faixa_tempo_chegada'], categories=FAIXAS_TEMPO_CHEGADA, ordered=True)
+        return df.sort_values('faixa_tempo_chegada').reset_index(drop=True)
+
+    def cms_ofensores(self, filtros=None):
+        where, parametros = self._where(filtros)
+        return self._query(f"""
+            WITH base AS (
+                SELECT * FROM atendimentos WHERE {where} AND list_contains(?, segmento)
+            ),
+            medias AS (
+                SELECT uf, segmento, AVG(val_total_items) AS cms_medio_uf_segmento FROM base GROUP BY uf, segmento
+            )
+            SELECT p.nome_do_prestador, p.uf, p.segmento, p.qtd_servicos, p.cms_prestador, m.cms_medio_uf_segmento
+            FROM (
+                SELECT nome_do_prestador, uf, segmento, COUNT(protocolo_atendimento) AS qtd_servicos, AVG(val_total_items) AS cms_prestador
+                FROM base GROUP BY nome_do_prestador, uf, segmento
+            ) p LEFT JOIN medias m USING (uf, segmento)
+            ORDER BY p.nome_do_prestador, p.uf, p.segmento
+        """, parametros + [SEGMENTOS_ANALISE_CMS])
+
+    def tmc_por(self, coluna, filtros=None):
+        where, parametros = self._where(filtros)
+        return self._query(f"""
+            SELECT {coluna}, AVG(tempo_chegada_min) AS tempo_chegada_min
+            FROM atendimentos WHERE {where} GROUP BY {coluna} ORDER BY {coluna}
+        """, parametros)
+
+    def nps_por(self, origem, coluna):
+        if not self.nps_disponivel.get(origem):
+            return pd.DataFrame(columns=[coluna, 'promotores', 'detratores', 'neutros'])
+        return self._query(f"""
+            SELECT {coluna}, SUM(nps_promotores) AS promotores, SUM(nps_detratores) AS detratores, SUM(nps_neutros) AS neutros
+            FROM nps_{origem} WHERE {coluna} IS NOT NULL GROUP BY {coluna} ORDER BY {coluna}
+        """)
+
+@st.cache_resource
+def get_duckdb_backend(atendimentos_path, nps_cidade_path, nps_prestador_path, _fontes_ids=()):
+    """Uma conexão DuckDB por processo, compartilhada entre as sessões. `_fontes_ids` (fora da chave) fornece os IDs de prestador."""
+    return DuckDBBackend(atendimentos_path, nps_cidade_path, nps_prestador_path, provider_id_table(*_fontes_ids))
+
+class PolarsBackend:
+    """
+    Agregações em Polars: cada página monta um único LazyFrame (filtro, projeção e agregação)
+    sobre os Parquet, executado em paralelo; só o resultado agregado é convertido para pandas.
+    """
+
+    nome = 'polars'
+
+    def __init__(self, atendimentos_path, nps_cidade_path, nps_prestador_path, ids_prestador):
+        import polars as pl
+
+        self.pl = pl
+        self.paths = (atendimentos_path, nps_cidade_path, nps_prestador_path)
+        self.ids_prestador = pl.from_pandas(ids_prestador).lazy().with_columns(pl.col('id_prestador').cast(pl.Int32))
+
+        atendimentos = pl.scan_parquet(atendimentos_path)
+        esquema = atendimentos.collect_schema()
+        self.atendimentos = atendimentos.select(
+            *[self._coluna_preparada(coluna, esquema[coluna]).alias(coluna) for coluna in ATENDIMENTOS_COLUNAS_BACKEND]
+        ).filter(pl.col(REGRAS_ATENDIMENTOS['data']).is_not_null())
+
+        self.nps = {}
+        for origem, path, coluna_chave in [('cidade', nps_cidade_path, 'municipio'), ('prestador', nps_prestador_path, 'nome_do_prestador')]:
+            try:
+                nps = pl.scan_parquet(path)
+                mes_ano = pl.col('mes_ano')
+                if nps.collect_schema()['mes_ano'] == pl.String:
+                    mes_ano = pl.coalesce(mes_ano.str.to_datetime('%Y-%m-%d', strict=False), mes_ano.str.to_datetime('%Y-%m', strict=False))
+                self.nps[origem] = nps.select(
+                    pl.col(coluna_chave).cast(pl.String),
+                    mes_ano.cast(pl.Datetime('us')).dt.truncate('1mo').alias('mes_ano_dt'),
+                    *[pl.col(coluna).cast(pl.Float64, strict=False).fill_null(0) for coluna in ['nps_score_calculado', 'nps_promotores', 'nps_neutros', 'nps_detratores']]
+                )
+                self.nps[origem].head(1).collect()
+            except Exception:
+                self.nps[origem] = None
+
+    def _coluna_preparada(self, coluna, tipo):
+        """Expressão Polars de uma coluna dos atendimentos segundo REGRAS_ATENDIMENTOS (as mesmas do prepare_atendimentos)."""
+        pl = self.pl
+        expressao = pl.col(coluna)
+        if coluna == REGRAS_ATENDIMENTOS['data']:
+            return (expressao.str.to_datetime(strict=False) if tipo == pl.String else expressao).cast(pl.Datetime('us'))
+        if coluna in REGRAS_ATENDIMENTOS['texto']:
+            return expressao.cast(pl.String).str.to_uppercase().fill_null(TEXTO_NAO_INFORMADO)
+        if coluna in REGRAS_ATENDIMENTOS['marcacao']:
+            return expressao.cast(pl.Boolean).fill_null(False)
+        if coluna in REGRAS_ATENDIMENTOS['numero']:
+            expressao = expressao.cast(pl.Float64, strict=False)
+        if coluna in REGRAS_ATENDIMENTOS['nao_negativo']:
+            expressao = pl.when(expressao >= 0).then(expressao)
+        return expressao
+
+    def _predicado(self, filtros):
+        """Expressão de filtro equivalente a apply_filters; seleções None não geram predicado."""
+        pl = self.pl
+        if filtros is None:
+            return pl.lit(True)
+        data = pl.col('data_abertura_atendimento')
+        predicado = (
+            (data >= pd.Timestamp(filtros['start_date']).to_pydatetime()) &
+            (data < (pd.Timestamp(filtros['end_date']) + pd.Timedelta(days=1)).to_pydatetime())
+        )
+        for coluna, chave in [('segmento', 'selected_segments'), ('seguradora', 'selected_insurers'), ('uf', 'selected_states'), ('municipio', 'selected_municipios')]:
+            if filtros[chave] is not None:
+                predicado &= pl.col(coluna).is_in([str(valor) for valor in filtros[chave]])
+        return predicado
+
+    def _coletar(self, consulta):
+        # A conversão para pandas acontece só aqui, na borda da renderização
+        return consulta.collect().to_pandas()
+
+    def selecao(self, filtros=None):
+        return self._coletar(self.atendimentos.filter(self._predicado(filtros)))
+
+    def agregado_cidades(self, filtros=None):
+        pl = self.pl
+        return self._coletar(
+            self.atendimentos.filter(self._predicado(filtros))
+            .group_by(['uf', 'municipio']).agg(
+                num_servicos=pl.col('protocolo_atendimento').n_unique(),
+                num_prestadores=pl.col('nome_do_prestador').n_unique(),
+                num_reembolsos=pl.col('is_reembolso').sum(),
+                num_intermediacoes=pl.col('is_intermediacao').sum(),
+                media_tempo_chegada=pl.col('tempo_chegada_min').mean(),
+                total_valor_servicos=pl.col('val_total_items').sum()
+            ).sort(['uf', 'municipio'])
+        )
+
+    def agregado_prestadores(self, filtros=None):
+        pl = self.pl
+        base = self.atendimentos.filter(self._predicado(filtros))
+        if self.nps.get('prestador') is not None:
+            nps_por_id = self.nps['prestador'].join(self.ids_prestador, on='nome_do_prestador').select('id_prestador', 'nps_score_calculado')
+            base = base.join(self.ids_prestador, on='nome_do_prestador', how='left').join(nps_por_id, on='id_prestador', how='left')
+            nps = pl.col('nps_score_calculado').fill_null(0)
+        else:
+            nps = pl.lit(0.0)
+        return self._coletar(
+            base.group_by('nome_do_prestador').agg(
+                total_atendimentos=pl.col('protocolo_atendimento').n_unique(),
+                media_nps=nps.mean(),
+                num_reembolsos=pl.col('is_reembolso').sum(),
+                num_intermediacoes=pl.col('is_intermediacao').sum(),
+                media_tempo_chegada=pl.col('tempo_chegada_min').mean()
+            ).sort('nome_do_prestador')
+        )
+
+    def cms_por_prestador(self, filtros=None):
+        pl = self.pl
+        return self._coletar(
+            self.atendimentos.filter(self._predicado(filtros))
+            .group_by('nome_do_prestador').agg(
+                qtd_servicos=pl.col('protocolo_atendimento').count(),
+                cms=pl.col('val_total_items').mean()
+            ).sort('nome_do_prestador')
+        )
+
+    def cms_por_faixa_tempo(self, filtros=None):
+        pl = self.pl
+        tempo = pl.col('tempo_chegada_min')
+        faixa = (
+            pl.when(tempo < 0).then(None)
+            .when(tempo <= 30).then(pl.lit(FAIXAS_TEMPO_CHEGADA[0]))
+            .when(tempo <= 60).then(pl.lit(FAIXAS_TEMPO_CHEGADA[1]))
+            .when(tempo <= 120).then(pl.lit(FAIXAS_TEMPO_CHEGADA[2]))
+            .when(tempo.is_not_null()).then(pl.lit(FAIXAS_TEMPO_CHEGADA[3]))
+        )
+        df = self._coletar(
+            self.atendimentos.filter(self._predicado(filtros))
+            .with_columns(faixa_tempo_chegada=faixa)
+            .filter(pl.col('faixa_tempo_chegada').is_not_null())
+            .group_by('faixa_tempo_chegada').agg(
+                qtd_servicos=pl.col('protocolo_atendimento').count(),
+                cms=pl.col('val_total_items').mean()
+            )
+        )
+        df['faixa_tempo_chegada'] = pd.Categorical(df['faixa_tempo_chegada'], categories=FAIXAS_TEMPO_CHEGADA, ordered=True)
+        return df.sort_values('faixa_tempo_chegada').reset_index(drop=True)
+
+    def cms_ofensores(self, filtros=None):
+        pl = self.pl
+        base = self.atendimentos.filter(self._predicado(filtros) & pl.col('segmento').is_in(SEGMENTOS_ANALISE_CMS))
+        medias = base.group_by(['uf', 'segmento']).agg(cms_medio_uf_segmento=pl.col('val_total_items').mean())
+        return self._coletar(
+            base.group_by(['nome_do_prestador', 'uf', 'segmento']).agg(
+                qtd_servicos=pl.col('protocolo_atendimento').count(),
+                cms_prestador=pl.col('val_total_items').mean()
+            ).join(medias, on=['uf', 'segmento'], how='left')
+            .sort(['nome_do_prestador', 'uf', 'segmento'])
+        )
+
+    def tmc_por(self, coluna, filtros=None):
+        pl = self.pl
+        return self._coletar(
+            self.atendimentos.filter(self._predicado(filtros))
+            .group_by(coluna).agg(pl.col('tempo_chegada_min').mean()).sort(coluna)
+        )
+
+    def nps_por(self, origem, coluna):
+        pl = self.pl
+        if self.nps.get(origem) is None:
+            return pd.DataFrame(columns=[coluna, 'promotores', 'detratores', 'neutros'])
+        return self._coletar(
+            self.nps[origem].filter(pl.col(coluna).is_not_null())
+            .group_by(coluna).agg(
+                promotores=pl.col('nps_promotores').sum(),
+                detratores=pl.col('nps_detratores').sum(),
+                neutros=pl.col('nps_neutros').sum()
+            ).sort(coluna)
+        )
+
+@st.cache_resource
+def get_polars_backend(atendimentos_path, nps_cidade_path, nps_prestador_path, _fontes_ids=()):
+    """Planos preguiçosos montados uma vez por processo; os dados são lidos a cada consulta."""
+    return PolarsBackend(atendimentos_path, nps_cidade_path, nps_prestador_path, provider_id_table(*_fontes_ids))
+
+class SnapshotBackend:
+    """
+    Agregados pré-calculados por snapshots.py para uma combinação exata de UF e segmento.
+    As consultas que o snapshot não cobre são delegadas ao backend de origem.
+    """
+
+    nome = 'snapshot'
+
+    def __init__(self, tabelas, origem, versao, combinacao):
+        self.tabelas = tabelas
+        self.origem = origem
+        self.versao = versao
+        self.combinacao = combinacao
+
+    def agregado_cidades(self, filtros=None):
+        return self.tabelas['agregado_cidades'].copy()
+
+    def agregado_prestadores(self, filtros=None):
+        return self.tabelas['agregado_prestadores'].copy()
+
+    def cms_por_prestador(self, filtros=None):
+        return self.tabelas['cms_por_prestador'].copy()
+
+    def cms_ofensores(self, filtros=None):
+        return self.tabelas['cms_ofensores'].copy()
+
+    def selecao(self, filtros=None):
+        return self.origem.selecao(filtros)
+
+    def cms_por_faixa_tempo(self, filtros=None):
+        return self.origem.cms_por_faixa_tempo(filtros)
+
+    def tmc_por(self, coluna, filtros=None):
+        return self.origem.tmc_por(coluna, filtros)
+
+    def nps_por(self, origem, coluna):
+        return self.origem.nps_por(origem, coluna)
+
+# --- Métricas (formato de texto do Prometheus, porta lateral, somadas entre processos) ---
+METRICAS_DESCRICOES = {
+    'carga_dados_segundos': ('histogram', "Duração de load_and_prepare_data vista pelo rerun (inclui acertos do cache em memória)"),
+    'carga_dados_execucoes_total': ('counter', "Execuções efetivas de load_and_prepare_data (falhas do cache em memória)"),
+    'filtros_segundos': ('histogram', "Duração da aplicação dos filtros da barra lateral"),
+    'pagina_segundos': ('histogram', "Duração da renderização de cada página"),
+    'cache_resultados_total': ('counter', "Consultas aos caches de resultados (snapshot e disco), por acerto ou falha"),
+    'exportacao_segundos': ('histogram', "Duração da geração dos arquivos XLSX"),
+    'prefetch_segundos': ('histogram', "Duração do pré-cálculo em segundo plano de cada página não visitada"),
+    'reruns_total': ('counter', "Execuções do script (reruns), autenticadas ou não"),
+    'figuras_total': ('counter', "Figuras do Plotly pedidas por gráfico, por acerto (reaproveitada) ou falha (construída)"),
+    'sessoes_ativas': ('gauge', f"Sessões com ao menos um rerun nos últimos {METRICS_SESSION_WINDOW_SECONDS}s"),
+}
+
+class Metrics:
+    """
+    Contadores, histogramas e sessões ativas de um processo. Um thread grava o estado em
+    METRICS_DIR/<pid>.json a cada METRICS_FLUSH_SECONDS; o endpoint /metrics (servido pelo processo
+    que conseguir a porta) soma os arquivos de todos os processos que gravaram recentemente.
+    """
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.lock = threading.Lock()
+        self.contadores = {}   # (nome, rótulos) -> valor
+        self.histogramas = {}  # (nome, rótulos) -> [contagens por bucket..., soma, total]
+        self.sessoes = {}      # id da sessão -> instante do último rerun
+
+    def contar(self, nome, valor=1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self.lock:
+            self.contadores[chave] = self.contadores.get(chave, 0) + valor
+
+    def observar(self, nome, segundos, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self.lock:
+            histograma = self.histogramas.setdefault(chave, [0] * len(METRICS_BUCKETS) + [0.0, 0])
+            for i, limite in enumerate(METRICS_BUCKETS):
+                if segundos <= limite:
+                    histograma[i] += 1 # Buckets cumulativos, como no formato do Prometheus
+            histograma[-2] += segundos
+            histograma[-1] += 1
+
+    @contextlib.contextmanager
+    def cronometrar(self, nome, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nome, time.perf_counter() - inicio, **rotulos)
+
+    def registrar_sessao(self, sessao):
+        with self.lock:
+            self.sessoes[sessao] = time.time()
+
+    def estado(self):
+        limite = time.time() - METRICS_SESSION_WINDOW_SECONDS
+        with self.lock:
+            self.sessoes = {sessao: visto for sessao, visto in self.sessoes.items() if visto >= limite}
+            return {
+                'contadores': [[nome, dict(rotulos), valor] for (nome, rotulos), valor in self.contadores.items()],
+                'histogramas': [[nome, dict(rotulos), list(valores)] for (nome, rotulos), valores in self.histogramas.items()],
+                'sessoes_ativas': len(self.sessoes)
+            }
+
+    def gravar(self):
+        caminho = os.path.join(self.pasta, f"{os.getpid()}.json")
+        try:
+            os.makedirs(self.pasta, exist_ok=True)
+            with open(f"{caminho}.tmp", 'w', encoding='utf-8') as arquivo:
+                json.dump(self.estado(), arquivo)
+            os.replace(f"{caminho}.tmp", caminho)
+        except OSError:
+            pass # Sem pasta gravável as métricas deste processo só não entram na soma dos outros
+
+    def gravar_periodicamente(self):
+        while True:
+            self.gravar()
+            time.sleep(METRICS_FLUSH_SECONDS)
+
+    def estados_processos(self):
+        """Estado deste processo (em memória) e dos outros processos vivos (arquivos recentes na pasta)."""
+        estados = [self.estado()]
+        proprio = f"{os.getpid()}.json"
+        agora = time.time()
+        try:
+            nomes = os.listdir(self.pasta)
+        except OSError:
+            nomes = []
+        for nome in nomes:
+            if not nome.endswith('.json') or nome == proprio:
+                continue
+            caminho = os.path.join(self.pasta, nome)
+            try:
+                idade = agora - os.stat(caminho).st_mtime
+                if idade > 3 * METRICS_FLUSH_SECONDS:
+                    if idade > 3600:
+                        os.remove(caminho) # Processo encerrado há muito tempo
+                    continue
+                with open(caminho, encoding='utf-8') as arquivo:
+                    estados.append(json.load(arquivo))
+            except (OSError, ValueError):
+                continue
+        return estados
+
+def render_prometheus(estados):
+    """Soma os estados dos processos e os serializa no formato de texto do Prometheus (versão 0.0.4)."""
+    def rotulos_texto(rotulos):
+        if not rotulos:
+            return ''
+        escapados = {chave: str(valor).replace('\\', '\\\\').replace('"', '\\"') for chave, valor in rotulos.items()}
+        return '{' + ','.join(f'{chave}="{valor}"' for chave, valor in sorted(escapados.items())) + '}'
+
+    contadores, histogramas = {}, {}
+    sessoes_ativas = 0
+    for estado in estados:
+        for nome, rotulos, valor in estado.get('contadores', []):
+            chave = (nome, tuple(sorted(rotulos.items())))
+            contadores[chave] = contadores.get(chave, 0) + valor
+        for nome, rotulos, valores in estado.get('histogramas', []):
+            chave = (nome, tuple(sorted(rotulos.items())))
+            acumulado = histogramas.setdefault(chave, [0] * len(valores))
+            histogramas[chave] = [a + b for a, b in zip(acumulado, valores)]
+        sessoes_ativas += estado.get('sessoes_ativas', 0)
+
+    linhas = []
+    for nome, (tipo, descricao) in METRICAS_DESCRICOES.items():
+        metrica = f"score_prestador_{nome}"
+        linhas += [f"# HELP {metrica} {descricao}", f"# TYPE {metrica} {tipo}"]
+        if tipo == 'gauge':
+            linhas.append(f"{metrica} {sessoes_ativas}")
+        elif tipo == 'counter':
+            for (chave_nome, rotulos), valor in sorted(contadores.items()):
+                if chave_nome == nome:
+                    linhas.append(f"{metrica}{rotulos_texto(dict(rotulos))} {valor}")
+        else:
+            for (chave_nome, rotulos), valores in sorted(histogramas.items()):
+                if chave_nome != nome:
+                    continue
+                for limite, contagem in zip(METRICS_BUCKETS, valores):
+                    linhas.append(f"{metrica}_bucket{rotulos_texto({**dict(rotulos), 'le': limite})} {contagem}")
+                linhas.append(f"{metrica}_bucket{rotulos_texto({**dict(rotulos), 'le': '+Inf'})} {valores[-1]}")
+                linhas.append(f"{metrica}_sum{rotulos_texto(dict(rotulos))} {valores[-2]}")
+                linhas.append(f"{metrica}_count{rotulos_texto(dict(rotulos))} {valores[-1]}")
+    return '\n'.join(linhas) + '\n'
+
+def start_metrics_server(metricas, host, porta):
+    """Endpoint GET /metrics numa porta lateral; com vários workers, só o primeiro consegue a porta e soma os demais."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            corpo = render_prometheus(metricas.estados_processos()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass # Raspagens periódicas não poluem o log do Streamlit
+
+    try:
+        servidor = ThreadingHTTPServer((host, porta), MetricsHandler)
+    except OSError:
+        return None # Porta ocupada por outro worker: este processo só grava seu arquivo
+    threading.Thread(target=servidor.serve_forever, name='metricas-http', daemon=True).start()
+    return servidor
+
+@st.cache_resource
+def get_metrics():
+    """
+    Métricas do processo (globais do módulo são recriadas a cada rerun, por isso o cache_resource).
+    Fora de uma sessão do Streamlit (snapshots.py, benchmark.py) só registra, sem thread nem porta.
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    metricas = Metrics(METRICS_DIR)
+    if get_script_run_ctx() is not None:
+        threading.Thread(target=metricas.gravar_periodicamente, name='metricas-gravacao', daemon=True).start()
+        if METRICS_PORT:
+            start_metrics_server(metricas, METRICS_HOST, METRICS_PORT)
+    return metricas
+
+# --- Cache de Resultados em Disco (endereçado por conteúdo, sobrevive a reinícios) ---
+@st.cache_data(show_spinner=False)
+def dataset_fingerprint(*frames):
+    """Impressão digital do conteúdo das fontes carregadas (e não da URL): muda quando o arquivo remoto muda."""
+    import hashlib
+
+    digest = hashlib.blake2b(digest_size=16)
+    for df in frames:
+        digest.update(repr(list(df.columns)).encode())
+        if not df.empty:
+            digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    DataFrames em arquivos Arrow (Feather v2) endereçados pelo sha256 de (impressão digital dos dados,
+    nome da computação, parâmetros). Réplicas no mesmo host ou volume compartilhado reaproveitam os
+    resultados; acima de `limite_bytes` os arquivos menos usados recentemente são removidos.
+    O tamanho da pasta é uma estimativa somada a cada gravação: a varredura (os.walk + stat) só roda
+    quando a estimativa passa do limite ou a cada `intervalo_varredura` segundos, para incorporar o que
+    outras réplicas gravaram.
+    """
+
+    def __init__(self, pasta, limite_bytes, metricas=None, intervalo_varredura=60):
+        self.pasta = pasta
+        self.limite_bytes = limite_bytes
+        self.metricas = metricas
+        self.intervalo_varredura = intervalo_varredura
+        self._bytes_estimados = None # Desconhecido até a primeira varredura
+        self._ultima_varredura = 0.0
+        self._trava = threading.Lock() # Gravações concorrentes das threads de pré-cálculo
+
+    @staticmethod
+    def chave(versao_dados, nome, parametros):
+        import hashlib
+        return hashlib.sha256(json.dumps([versao_dados, nome, parametros], default=str, sort_keys=True).encode()).hexdigest()
+
+    def _caminho(self, chave):
+        return os.path.join(self.pasta, chave[:2], f"{chave}.arrow")
+
+    def ler(self, chave):
+        caminho = self._caminho(chave)
+        try:
+            df = pd.read_feather(caminho)
+            os.utime(caminho) # Uso recente: o arquivo fica por último na fila de remoção
+            return df
+        except Exception:
+            return None # Ausente, removido por outra réplica ou ilegível: recalcula
+
+    def gravar(self, chave, df):
+        caminho = self._caminho(chave)
+        temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp" # Únicos também entre threads (pré-cálculo)
+        try:
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            df.reset_index(drop=True).to_feather(temporario)
+            tamanho = os.path.getsize(temporario)
+            os.replace(temporario, caminho) # Leitores nunca veem um arquivo pela metade
+        except Exception:
+            return # O cache é opcional: sem disco gravável (ou tipo não suportado pelo Arrow) o resultado só não é reaproveitado
+        with self._trava:
+            if self._bytes_estimados is not None:
+                self._bytes_estimados += tamanho # Sobrescritas contam em dobro: no pior caso adiantam a varredura
+            varrer = (self._bytes_estimados is None or self._bytes_estimados > self.limite_bytes
+                      or time.monotonic() - self._ultima_varredura >= self.intervalo_varredura)
+        if varrer:
+            self.remover_excedente()
+
+    def remover_excedente(self):
+        """
+        Acima de `limite_bytes`, remove os arquivos menos usados até 90% do limite (a folga evita uma nova
+        varredura a cada gravação com o cache cheio) e ressincroniza a estimativa com o disco.
+        """
+        with self._trava:
+            self._ultima_varredura = time.monotonic()
+        arquivos = []
+        for raiz, _, nomes in os.walk(self.pasta):
+            for nome in nomes:
+                if nome.endswith('.arrow'):
+                    try:
+                        info = os.stat(os.path.join(raiz, nome))
+                    except OSError:
+                        continue
+                    arquivos.append((info.st_mtime, info.st_size, os.path.join(raiz, nome)))
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        alvo = self.limite_bytes if total <= self.limite_bytes else 0.9 * self.limite_bytes
+        for _, tamanho, caminho in sorted(arquivos):
+            if total <= alvo:
+                break
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+            total -= tamanho
+        with self._trava:
+            self._bytes_estimados = total
+
+    def obter(self, versao_dados, nome, parametros, calcular):
+        """Resultado em cache ou `calcular()`, gravado para as próximas sessões, reinícios e réplicas."""
+        chave = self.chave(versao_dados, nome, parametros)
+        df = self.ler(chave)
+        if self.metricas is not None:
+            self.metricas.contar('cache_resultados_total', camada='disco', resultado='falha' if df is None else 'acerto')
+        if df is None:
+            df = calcular()
+            self.gravar(chave, df)
+        return df
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_MB * 1024 * 1024, get_metrics())
+
+class ResultCacheBackend:
+    """
+    Consultas de outro backend memorizadas no ResultCache. A seleção da barra lateral (`parametros`)
+    identifica o resultado, já que o backend pandas recebe o DataFrame já filtrado (filtros=None).
+    """
+
+    nome = 'cache'
+
+    def __init__(self, origem, cache, versao_dados, parametros):
+        self.origem = origem
+        self.cache = cache
+        self.versao_dados = versao_dados
+        self.parametros = parametros
+
+    def _memorizar(self, consulta, argumentos, calcular):
+        return self.cache.obter(self.versao_dados, f"{self.origem.nome}.{consulta}", [self.parametros, argumentos], calcular)
+
+    def selecao(self, filtros=None):
+        return self.origem.selecao(filtros)
+
+    def agregado_cidades(self, filtros=None):
+        return self._memorizar('agregado_cidades', [], lambda: self.origem.agregado_cidades(filtros))
+
+    def agregado_prestadores(self, filtros=None):
+        return self._memorizar('agregado_prestadores', [], lambda: self.origem.agregado_prestadores(filtros))
+
+    def cms_por_prestador(self, filtros=None):
+        return self._memorizar('cms_por_prestador', [], lambda: self.origem.cms_por_prestador(filtros))
+
+    def cms_por_faixa_tempo(self, filtros=None):
+        return self._memorizar('cms_por_faixa_tempo', [], lambda: self.origem.cms_por_faixa_tempo(filtros))
+
+    def cms_ofensores(self, filtros=None):
+        return self._memorizar('cms_ofensores', [], lambda: self.origem.cms_ofensores(filtros))
+
+    def tmc_por(self, coluna, filtros=None):
+        return self._memorizar('tmc_por', [coluna], lambda: self.origem.tmc_por(coluna, filtros))
+
+    def nps_por(self, origem, coluna):
+        return self._memorizar('nps_por', [origem, coluna], lambda: self.origem.nps_por(origem, coluna))
+
+# --- Pré-cálculo Especulativo das Outras Páginas (thread em segundo plano) ---
+PREFETCH_CONSULTAS = {
+    "Score Prestador": [lambda backend, filtros: backend.agregado_prestadores(filtros)],
+    "Capilaridade": [lambda backend, filtros: backend.agregado_cidades(filtros)],
+    "Financeiro": [
+        lambda backend, filtros: backend.cms_por_faixa_tempo(filtros),
+        lambda backend, filtros: backend.cms_por_prestador(filtros),
+        lambda backend, filtros: backend.cms_ofensores(filtros),
+    ],
+    "Qualidade": [
+        lambda backend, filtros: backend.nps_por('cidade', 'mes_ano_dt'),
+        lambda backend, filtros: backend.nps_por('cidade', 'municipio'),
+        lambda backend, filtros: backend.nps_por('prestador', 'nome_do_prestador'),
+        lambda backend, filtros: backend.tmc_por('segmento', filtros),
+        lambda backend, filtros: backend.tmc_por('seguradora', filtros),
+    ],
+}
+
+class Prefetcher:
+    """
+    Depois que a página atual renderiza, um único thread por processo executa as consultas das outras
+    páginas para a mesma seleção por um ResultCacheBackend, que as grava no cache em disco: a troca de
+    página passa a ler o resultado em vez de recalculá-lo. Cada seleção é agendada uma vez.
+    """
+
+    def __init__(self, metricas, limite_selecoes=256):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self.metricas = metricas
+        self.limite_selecoes = limite_selecoes
+        self.lock = threading.Lock()
+        self.agendadas = {} # chave da seleção -> None (dict como conjunto ordenado por inserção)
+
+    def agendar(self, backend, filtros, pagina_atual):
+        """Agenda as páginas diferentes de `pagina_atual`; devolve o Future, ou None se a seleção já foi agendada."""
+        chave = ResultCache.chave(backend.versao_dados, f"prefetch.{backend.origem.nome}", backend.parametros)
+        with self.lock:
+            if chave in self.agendadas:
+                return None
+            self.agendadas[chave] = None
+            if len(self.agendadas) > self.limite_selecoes:
+                self.agendadas.pop(next(iter(self.agendadas)))
+        paginas = [pagina for pagina in PREFETCH_CONSULTAS if pagina != pagina_atual]
+        future = self.executor.submit(self._executar, backend, filtros, paginas)
+        future.add_done_callback(lambda f: f.cancelled() and self._descartar(chave))
+        return future
+
+    def _descartar(self, chave):
+        # Cancelada antes de começar: a seleção pode ser agendada de novo
+        with self.lock:
+            self.agendadas.pop(chave, None)
+
+    def _executar(self, backend, filtros, paginas):
+        for pagina in paginas:
+            with self.metricas.cronometrar('prefetch_segundos', pagina=pagina):
+                for consulta in PREFETCH_CONSULTAS[pagina]:
+                    try:
+                        consulta(backend, filtros)
+                    except Exception:
+                        pass # Especulativo: se falhar, a página calcula (e mostra o erro) quando for aberta
+
+@st.cache_resource
+def get_prefetcher():
+    return Prefetcher(get_metrics())
+
+# --- Camada de Figuras (cache por gráfico e dados, WebGL e redução LTTB no servidor) ---
+FIGURA_PROPRIEDADES_POR_PONTO = ('x', 'y', 'customdata', 'text', 'hovertext', 'ids')
+
+def figure_fingerprint(*partes):
+    """Impressão digital dos dados de um gráfico: DataFrames pelo hash das linhas (com índice), o resto pelo repr."""
+    import hashlib
+
+    digest = hashlib.blake2b(digest_size=16)
+    for parte in partes:
+        if isinstance(parte, pd.DataFrame):
+            digest.update(repr((list(parte.columns), [str(tipo) for tipo in parte.dtypes])).encode())
+            if not parte.empty:
+                digest.update(pd.util.hash_pandas_object(parte, index=True).to_numpy().tobytes())
+        else:
+            digest.update(repr(parte).encode())
+    return digest.hexdigest()
+
+def lttb_indices(x, y, limite):
+    """
+    Índices mantidos pelo Largest-Triangle-Three-Buckets: o primeiro e o último ponto e, em cada um dos
+    `limite - 2` baldes, o ponto que forma o maior triângulo com o escolhido no balde anterior e a média
+    do balde seguinte. Mantém picos e vales que uma amostragem a passo fixo perderia.
+    """
+    n = len(x)
+    if limite < 3 or n <= limite:
+        return np.arange(n)
+    bordas = np.linspace(1, n - 1, limite - 1).astype(np.int64)
+    escolhidos = np.empty(limite, dtype=np.int64)
+    escolhidos[0], escolhidos[-1] = 0, n - 1
+    anterior = 0
+    for balde in range(limite - 2):
+        inicio, fim = bordas[balde], bordas[balde + 1]
+        proximo_fim = bordas[balde + 2] if balde + 2 < len(bordas) else n
+        media_x, media_y = x[fim:proximo_fim].mean(), y[fim:proximo_fim].mean()
+        areas = np.abs(
+            (x[anterior] - media_x) * (y[inicio:fim] - y[anterior])
+            - (x[anterior] - x[inicio:fim]) * (media_y - y[anterior])
+        )
+        anterior = inicio + int(np.argmax(areas))
+        escolhidos[balde + 1] = anterior
+    return escolhidos
+
+def series_downsample_indices(x, y, limite):
+    """Índices LTTB de uma série de linha, ou None se ela não é reduzível (x não numérico/data, fora de ordem ou y com lacunas)."""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64) or (x.dtype == object and len(x) and isinstance(x[0], (datetime.date, pd.Timestamp))):
+        x = pd.to_datetime(x).to_numpy('datetime64[ns]').astype(np.int64).astype(float)
+    try:
+        x = x.astype(float)
+        y = np.asarray(y, dtype=float)
+    except (TypeError, ValueError):
+        return None
+    if not (np.isfinite(y).all() and np.isfinite(x).all() and (np.diff(x) >= 0).all()):
+        return None
+    return lttb_indices(x, y, limite)
+
+def optimize_figure(figura):
+    """
+    Reduz por LTTB as séries de linha com mais de FIGURA_PONTOS_MAXIMOS pontos e troca por WebGL (scattergl)
+    os traços de dispersão/linha com mais de FIGURA_WEBGL_MIN_PONTOS: menos JSON a serializar e enviar, e
+    o navegador desenha na GPU em vez de um elemento SVG por ponto.
+    """
+    go = importlib.import_module('plotly.graph_objects')
+    tracos, alterada = [], False
+    for traco in figura.data:
+        if traco.type not in ('scatter', 'scattergl') or traco.x is None or traco.y is None:
+            tracos.append(traco)
+            continue
+        n = len(traco.y)
+        if n > FIGURA_PONTOS_MAXIMOS and 'lines' in (traco.mode or 'lines'):
+            indices = series_downsample_indices(traco.x, traco.y, FIGURA_PONTOS_MAXIMOS)
+            if indices is not None:
+                por_ponto = {
+                    propriedade: np.asarray(valor)[indices]
+                    for propriedade in FIGURA_PROPRIEDADES_POR_PONTO
+                    if (valor := getattr(traco, propriedade)) is not None and not isinstance(valor, str) and len(valor) == n
+                }
+                marcador = {
+                    propriedade: np.asarray(valor)[indices]
+                    for propriedade in ('color', 'size')
+                    if (valor := getattr(traco.marker, propriedade)) is not None and not isinstance(valor, str) and np.ndim(valor) and len(valor) == n
+                }
+                traco.update(**por_ponto, marker=marcador)
+                n, alterada = len(indices), True
+        if traco.type == 'scatter' and n > FIGURA_WEBGL_MIN_PONTOS:
+            propriedades = traco.to_plotly_json()
+            propriedades.pop('type', None)
+            traco, alterada = go.Scattergl(propriedades, skip_invalid=True), True
+        tracos.append(traco)
+    return go.Figure(data=tracos, layout=figura.layout) if alterada else figura
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def cached_figure(grafico, impressao, _construir):
+    """Figura construída e otimizada uma vez por (gráfico, impressão digital dos dados); nos reruns o Streamlit só a serializa."""
+    return optimize_figure(_construir())
+
+def plotly_figure(grafico, dados, construir, *parametros):
+    """
+    `construir(dados)` em cache por (gráfico, impressão digital de `dados` e `parametros`): com os mesmos
+    dados o rerun reaproveita a figura pronta. Tudo o que `construir` usa além de `dados` vai em
+    `parametros`. A figura é compartilhada entre sessões e não deve ser alterada depois de devolvida.
+    """
+    construida = []
+
+    def construir_figura():
+        construida.append(True)
+        return construir(dados)
+
+    figura = cached_figure(grafico, figure_fingerprint(dados, *parametros), _construir=construir_figura)
+    get_metrics().contar('figuras_total', grafico=grafico, resultado='falha' if construida else 'acerto')
+    return figura
+
+# --- Drilldown por Entidade (índice CSR construído na carga) ---
+def normalize_text_key(valor):
+    """Chave de texto para casar nomes entre as fontes: sem acentos, maiúsculas e espaços simples."""
+    texto = unicodedata.normalize('NFKD', str(valor)).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'\s+', ' ', texto).strip().upper()
+
+def build_entity_index(df, colunas):
+    """
+    Índice CSR por entidade: as posições das linhas ordenadas pelo código da entidade e um vetor de
+    offsets, de modo que as linhas da entidade c são ordem[offsets[c]:offsets[c + 1]].
+    """
+    chaves_linha = [df[coluna].map(normalize_text_key) for coluna in colunas]
+    agrupado = pd.DataFrame({coluna: chave for coluna, chave in zip(colunas, chaves_linha)}).groupby(colunas, observed=True, sort=True)
+    codigos = agrupado.ngroup().to_numpy()
+    chaves = agrupado.size().index
+
+    validos = np.flatnonzero(codigos >= 0)
+    ordem = validos[np.argsort(codigos[validos], kind='stable')]
+    offsets = np.zeros(len(chaves) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codigos[validos], minlength=len(chaves)), out=offsets[1:])
+    return {'chaves': chaves, 'ordem': ordem, 'offsets': offsets}
+
+def entity_rows(df, indice, *valores):
+    """Linhas de uma entidade em O(k) pelo índice CSR, sem varrer o DataFrame."""
+    if indice is None:
+        return df.iloc[0:0]
+    chave = tuple(normalize_text_key(valor) for valor in valores)
+    chave = chave[0] if len(chave) == 1 else chave
+    if chave not in indice['chaves']:
+        return df.iloc[0:0]
+    codigo = indice['chaves'].get_loc(chave)
+    return df.iloc[indice['ordem'][indice['offsets'][codigo]:indice['offsets'][codigo + 1]]]
+
+@st.cache_data
+def build_drilldown_indices(df_atendimentos, df_nps_cidade, df_nps_prestador):
+    """Índices CSR de prestador e município (atendimentos e NPS), uma vez por versão dos dados."""
+    return {
+        'prestador': build_entity_index(df_atendimentos, ['nome_do_prestador']),
+        'municipio': build_entity_index(df_atendimentos, ['uf', 'municipio']),
+        'nps_prestador': build_entity_index(df_nps_prestador, ['id_prestador']) if 'id_prestador' in df_nps_prestador.columns else None,
+        'nps_municipio': build_entity_index(df_nps_cidade, ['uf', 'municipio']) if {'uf', 'municipio'} <= set(df_nps_cidade.columns) else None
+    }
+
+def display_entity_drilldown(drilldown, tipo, *chave):
+    """Atendimentos, distribuições de tempo de chegada e custo e NPS mensal de um prestador ou município."""
+    indices = drilldown['indices']
+    if tipo == 'prestador':
+        titulo = f"Detalhamento do Prestador: {chave[0]}"
+        df_linhas = entity_rows(drilldown['df'], indices['prestador'], *chave)
+        # O NPS do prestador é localizado pelo ID canônico, não pela grafia do nome
+        ids = df_linhas['id_prestador'].unique()
+        df_nps_linhas = entity_rows(drilldown['df_nps_prestador'], indices['nps_prestador'], ids[0] if len(ids) else -1)
+    else:
+        titulo = f"Detalhamento do Município: {chave[1]} ({chave[0]})"
+        df_linhas = entity_rows(drilldown['df'], indices['municipio'], *chave)
+        df_nps_linhas = entity_rows(drilldown['df_nps_cidade'], indices['nps_municipio'], *chave)
+
+    # Os filtros da barra lateral são aplicados só às k linhas da entidade
+    df_linhas = apply_filters(df_linhas, **drilldown['filtros'])
+
+    st.markdown("---")
+    st.subheader(titulo)
+    if df_linhas.empty:
+        st.info("Nenhum atendimento desta entidade com os filtros selecionados.")
+        return
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Atendimentos", f"{len(df_linhas):,.0f}".replace(",", "."))
+    col2.metric("CMS Médio", f"R$ {df_linhas['val_total_items'].mean():,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+    col3.metric("TMC Médio (min)", f"{df_linhas['tempo_chegada_min'].mean():.0f}")
+    col4.metric("% Reembolso", f"{df_linhas['is_reembolso'].mean() * 100:.2f}%")
+
+    col_tempo, col_custo = st.columns(2)
+    with col_tempo:
+        fig_tempo = plotly_figure(
+            'drilldown.tempo_chegada', df_linhas[['tempo_chegada_min']].dropna(),
+            lambda dados: px.histogram(
+                dados, x='tempo_chegada_min', nbins=30,
+                title='Distribuição do Tempo de Chegada', labels={'tempo_chegada_min': 'Tempo de Chegada (min)'},
+                color_discrete_sequence=['#2021D4']
+            ).update_layout(yaxis_title="Atendimentos")
+        )
+        st.plotly_chart(fig_tempo, use_container_width=True)
+    with col_custo:
+        fig_custo = plotly_figure(
+            'drilldown.custo', df_linhas[['val_total_items']].dropna(),
+            lambda dados: px.histogram(
+                dados, x='val_total_items', nbins=30,
+                title='Distribuição do Custo por Serviço', labels={'val_total_items': 'Valor do Serviço (R$)'},
+                color_discrete_sequence=['#2021D4']
+            ).update_layout(yaxis_title="Atendimentos")
+        )
+        st.plotly_chart(fig_custo, use_container_width=True)
+
+    if not df_nps_linhas.empty:
+        df_nps_mensal = aggregate_nps(nps_month_column(df_nps_linhas.copy()), 'mes_ano_dt')
+        df_nps_mensal['total_avaliacoes'] = df_nps_mensal['promotores'] + df_nps_mensal['detratores'] + df_nps_mensal['neutros']
+        df_nps_mensal['nps_score'] = np.where(
+            df_nps_mensal['total_avaliacoes'] > 0,
+            ((df_nps_mensal['promotores'] - df_nps_mensal['detratores']) / df_nps_mensal['total_avaliacoes']) * 100,
+            np.nan
+        )
+        inicio = pd.Timestamp(drilldown['filtros']['start_date']).to_period('M').to_timestamp()
+        df_nps_mensal = df_nps_mensal[
+            (df_nps_mensal['mes_ano_dt'] >= inicio) & (df_nps_mensal['mes_ano_dt'] <= pd.Timestamp(drilldown['filtros']['end_date']))
+        ].dropna(subset=['nps_score'])
+        if not df_nps_mensal.empty:
+            fig_nps = plotly_figure(
+                'drilldown.nps_mensal', df_nps_mensal[['mes_ano_dt', 'nps_score']],
+                lambda dados: px.line(
+                    dados, x='mes_ano_dt', y='nps_score', markers=True,
+                    title='NPS Mensal', labels={'mes_ano_dt': 'Mês/Ano', 'nps_score': 'NPS'}
+                ).update_xaxes(dtick="M1", tickformat="%b\n%Y").update_yaxes(range=[-100, 100])
+            )
+            st.plotly_chart(fig_nps, use_container_width=True)
+    else:
+        st.info("Sem avaliações de NPS registradas para esta entidade.")
+
+    colunas_atendimento = [coluna for coluna in [
+        'data_abertura_atendimento', 'protocolo_atendimento', 'segmento', 'seguradora', 'uf', 'municipio',
+        'nome_do_prestador', 'tempo_chegada_min', 'val_total_items', 'is_reembolso', 'is_intermediacao'
+    ] if coluna in df_linhas.columns]
+    st.dataframe(
+        df_linhas[colunas_atendimento].sort_values('data_abertura_atendimento', ascending=False).rename(columns={
+            'data_abertura_atendimento': 'Abertura',
+            'protocolo_atendimento': 'Protocolo',
+            'segmento': 'Segmento',
+            'seguradora': 'Seguradora',
+            'uf': 'UF',
+            'municipio': 'Cidade',
+            'nome_do_prestador': 'Prestador',
+            'tempo_chegada_min': 'Tempo de Chegada (min)',
+            'val_total_items': 'Valor (R$)',
+            'is_reembolso': 'Reembolso?',
+            'is_intermediacao': 'Intermediação?'
+        }),
+        hide_index=True,
+        use_container_width=True
+    )
+
+# --- Quantis Agrupados e SLA do Tempo de Chegada (vetores ordenados por grupo) ---
+SLA_LIMITES_PADRAO = "30; 60; 120"
+SLA_PERCENTIS_OPCOES = [50, 75, 90, 95, 99]
+SLA_DIMENSOES = {
+    'Prestador': ['nome_do_prestador'],
+    'Cidade': ['uf', 'municipio'],
+    'Segmento': ['segmento'],
+    'Seguradora': ['seguradora']
+}
+
+def sort_by_group(codigos, valores, chaves):
+    """
+    Kernel de quantis agrupados: ordena uma vez por (grupo, valor) num vetor contíguo com offsets por grupo.
+    Somando (grupo * passo) a cada valor deslocado, o vetor inteiro fica crescente e uma única chamada de
+    searchsorted responde a qualquer limite para todos os grupos de uma vez.
+    """
+    ordem = np.lexsort((valores, codigos))
+    valores, codigos = valores[ordem], codigos[ordem]
+    offsets = np.zeros(len(chaves) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codigos, minlength=len(chaves)), out=offsets[1:])
+    minimo = valores.min() if len(valores) else 0.0
+    passo = (valores.max() - minimo + 1) if len(valores) else 1.0
+    return {'chaves': chaves, 'valores': valores, 'offsets': offsets, 'minimo': minimo, 'passo': passo, 'chave_global': codigos * passo + (valores - minimo)}
+
+def build_group_index(df, colunas, coluna_valor):
+    """Índice de valores ordenados por grupo para `coluna_valor` (linhas sem valor são ignoradas)."""
+    df_validos = df.loc[df[coluna_valor].notna(), [*colunas, coluna_valor]]
+    agrupado = df_validos.groupby(colunas, observed=True, sort=True)
+    return sort_by_group(agrupado.ngroup().to_numpy(), df_validos[coluna_valor].to_numpy(dtype=float), agrupado.size().index)
+
+@st.cache_data(max_entries=16)
+def build_arrival_index(df, colunas):
+    """Tempos de chegada válidos (>= 0) ordenados por grupo, para as consultas de SLA."""
+    return build_group_index(df[df['tempo_chegada_min'] >= 0], colunas, 'tempo_chegada_min')
+
+def grouped_share_within(indice, limites):
+    """Fração de valores <= limite, por grupo (linhas) e limite (colunas)."""
+    grupos = np.arange(len(indice['chaves']))
+    deslocados = np.clip(np.asarray(limites, dtype=float) - indice['minimo'], -0.5, indice['passo'] - 1)
+    alvos = grupos[:, None] * indice['passo'] + deslocados[None, :]
+    dentro = np.searchsorted(indice['chave_global'], alvos, side='right') - indice['offsets'][:-1, None]
+    tamanhos = np.diff(indice['offsets'])[:, None]
+    return np.divide(dentro, tamanhos, out=np.zeros(dentro.shape), where=tamanhos > 0)
+
+def grouped_quantiles(indice, percentis):
+    """Percentis (interpolação linear, como np.percentile) por grupo, lidos direto das fatias ordenadas."""
+    inicio = indice['offsets'][:-1, None]
+    tamanhos = np.diff(indice['offsets'])[:, None]
+    posicao = np.maximum(tamanhos - 1, 0) * (np.asarray(percentis, dtype=float)[None, :] / 100)
+    baixo = np.floor(posicao).astype(np.int64)
+    alto = np.minimum(baixo + 1, np.maximum(tamanhos - 1, 0))
+    valores = indice['valores']
+    if not len(valores):
+        return np.full(posicao.shape, np.nan)
+    valor_baixo = valores[np.clip(inicio + baixo, 0, len(valores) - 1)]
+    valor_alto = valores[np.clip(inicio + alto, 0, len(valores) - 1)]
+    return np.where(tamanhos > 0, valor_baixo + (valor_alto - valor_baixo) * (posicao - baixo), np.nan)
+
+def grouped_mad(indice):
+    """Desvio absoluto mediano (MAD) por grupo: reordena os desvios dentro de cada grupo e lê a mediana."""
+    medianas = grouped_quantiles(indice, [50])[:, 0]
+    codigos = np.repeat(np.arange(len(indice['chaves'])), np.diff(indice['offsets']))
+    desvios = np.abs(indice['valores'] - medianas[codigos])
+    return grouped_quantiles(sort_by_group(codigos, desvios, indice['chaves']), [50])[:, 0]
+
+def parse_sla_limits(texto):
+    """
+    Converte '30; 60,5; 120' em ([30.0, 60.5, 120.0], []). Limites separados por ';' ou espaço; a vírgula é
+    o separador decimal (pt-BR), e uma vírgula solta no fim do limite ('30, 60') é tolerada como separador.
+    Devolve também as entradas que não puderam ser lidas, para o aviso na tela.
+    """
+    limites, invalidas = [], []
+    for parte in re.split(r'[;\s]+', texto.strip()):
+        valor = parte.rstrip(',')
+        if not valor:
+            continue
+        if not re.fullmatch(r'\d+([.,]\d+)?', valor):
+            invalidas.append(parte)
+            continue
+        limites.append(float(valor.replace(',', '.')))
+    return sorted(set(limites)), invalidas
+
+@st.fragment
+def sla_fragment(df):
+    """SLA do tempo de chegada por dimensão. Fragmento: limites e percentis reexecutam só esta seção."""
+    col_dimensao, col_limites, col_percentis, col_minimo = st.columns([1, 1, 1, 1])
+    dimensao = col_dimensao.selectbox("Agrupar por", list(SLA_DIMENSOES), key="sla_dimensao")
+    limites, invalidas = parse_sla_limits(col_limites.text_input("Limites de SLA (min)", SLA_LIMITES_PADRAO, key="sla_limites", help="Separe os limites por ponto e vírgula ou espaço e use vírgula como decimal, ex.: 30; 60,5; 120."))
+    percentis = col_percentis.multiselect("Percentis do TMC", SLA_PERCENTIS_OPCOES, default=[50, 90, 95], key="sla_percentis")
+    minimo = col_minimo.number_input("Mínimo de Atendimentos", min_value=1, value=MIN_ATTENDANCES_FOR_RANKING, step=1, key="sla_minimo")
+    if invalidas:
+        st.warning(f"Limites ignorados (use ';' ou espaço entre limites e vírgula como decimal): {', '.join(invalidas)}")
+
+    if not limites and not percentis:
+        st.info("Informe ao menos um limite de SLA ou um percentil.")
+        return
+
+    colunas = SLA_DIMENSOES[dimensao]
+    indice = build_arrival_index(df, colunas)
+    chaves = indice['chaves']
+    df_sla = (chaves.to_frame(index=False) if isinstance(chaves, pd.MultiIndex) else pd.DataFrame({colunas[0]: chaves}))
+    df_sla['atendimentos'] = np.diff(indice['offsets'])
+
+    # Novos limites ou percentis são apenas um lote de buscas nos vetores já ordenados
+    for percentil, valores in zip(percentis, grouped_quantiles(indice, percentis).T if percentis else []):
+        df_sla[f"p{percentil} TMC (min)"] = valores
+    for limite, fracao in zip(limites, grouped_share_within(indice, limites).T if limites else []):
+        df_sla[f"% ≤ {limite:g} min"] = fracao * 100
+
+    df_sla = df_sla[df_sla['atendimentos'] >= minimo]
+    if df_sla.empty:
+        st.info(f"Nenhum grupo com pelo menos {minimo} atendimentos com tempo de chegada válido.")
+        return
+
+    ordenacao = f"% ≤ {limites[0]:g} min" if limites else f"p{percentis[-1]} TMC (min)"
+    df_sla = df_sla.sort_values(ordenacao, ascending=bool(limites)).rename(columns={
+        'nome_do_prestador': 'Prestador', 'uf': 'UF', 'municipio': 'Cidade', 'segmento': 'Segmento',
+        'seguradora': 'Seguradora', 'atendimentos': 'Atendimentos'
+    })
+    st.dataframe(df_sla.round(2), hide_index=True, use_container_width=True)
+    st.download_button(
+        label="Baixar Análise de SLA (XLSX)",
+        data=functools.partial(to_xlsx_bytes, df_sla, 'SLA Tempo de Chegada'),
+        file_name=f"sla_tempo_chegada_{dimensao.lower()}.xlsx",
+        mime=XLSX_MIME
+    )
+
+# --- Carga de Trabalho e Concentração (varredura sobre atendimentos ordenados por prestador e data) ---
+SOBRECARGA_PERCENTIL_REDE = 99 # Prestador sobrecarregado: pico diário acima deste percentil dos dias (prestador, dia) de toda a rede
+SOBRECARGA_PICO_MINIMO = 5 # ... e pico diário de pelo menos tantos atendimentos (evita marcar redes de baixo volume)
+SOBRECARGA_PENALIDADE = 0.10 # Fração do score ponderado descontada dos prestadores sobrecarregados
+HHI_DEPENDENCIA = 5000 # HHI (0-10.000) a partir do qual a cidade depende de um único prestador
+DEPENDENCIA_MIN_SERVICOS = 10 # Cidades com menos serviços não entram na análise de dependência
+
+def runs_sorted(codigos, chaves_tempo):
+    """
+    Sequências (grupo, balde de tempo) de vetores já ordenados por (grupo, tempo): uma passada que
+    marca onde o grupo ou o balde muda. Devolve o grupo e o tamanho (atendimentos) de cada sequência.
+    """
+    if not len(codigos):
+        return codigos, np.zeros(0, dtype=np.int64)
+    inicio = np.flatnonzero(np.r_[True, (codigos[1:] != codigos[:-1]) | (chaves_tempo[1:] != chaves_tempo[:-1])])
+    return codigos[inicio], np.diff(np.r_[inicio, len(codigos)])
+
+@st.cache_data(max_entries=16)
+def provider_workload(df):
+    """
+    Carga diária e horária por prestador a partir de uma ordenação por (prestador, data de abertura):
+    cada sequência de atendimentos do mesmo prestador no mesmo dia (ou hora) é um dia (hora) de carga.
+    Percentis por prestador saem do kernel de quantis agrupados, sem groupby por dia.
+    """
+    agrupado = df.groupby('nome_do_prestador', observed=True, sort=True)
+    codigos = agrupado.ngroup().to_numpy(np.int64)
+    chaves = agrupado.size().index.astype(str)
+    segundos = df['data_abertura_atendimento'].to_numpy('datetime64[s]').astype(np.int64)
+    validos = codigos >= 0
+    ordem = np.lexsort((segundos[validos], codigos[validos]))
+    codigos, segundos = codigos[validos][ordem], segundos[validos][ordem]
+
+    prestador_dia, carga_dia = runs_sorted(codigos, segundos // 86400)
+    prestador_hora, carga_hora = runs_sorted(codigos, segundos // 3600)
+    indice_dia = sort_by_group(prestador_dia, carga_dia.astype(float), chaves)
+    p50, p90 = grouped_quantiles(indice_dia, [50, 90]).T
+    dias_ativos = np.diff(indice_dia['offsets'])
+
+    pico_diario = np.zeros(len(chaves), dtype=np.int64)
+    np.maximum.at(pico_diario, prestador_dia, carga_dia)
+    pico_horario = np.zeros(len(chaves), dtype=np.int64)
+    np.maximum.at(pico_horario, prestador_hora, carga_hora)
+
+    limite_rede = np.percentile(carga_dia, SOBRECARGA_PERCENTIL_REDE) if len(carga_dia) else np.inf
+    return pd.DataFrame({
+        'nome_do_prestador': chaves,
+        'dias_ativos': dias_ativos,
+        'carga_media_diaria': np.divide(np.bincount(prestador_dia, weights=carga_dia, minlength=len(chaves)), dias_ativos, out=np.zeros(len(chaves)), where=dias_ativos > 0),
+        'carga_p50_diaria': p50,
+        'carga_p90_diaria': p90,
+        'pico_diario': pico_diario,
+        'pico_horario': pico_horario,
+        'sobrecarga': (pico_diario > limite_rede) & (pico_diario >= SOBRECARGA_PICO_MINIMO)
+    }).set_index('nome_do_prestador')
+
+def add_provider_workload(df_prestadores, df_atendimentos):
+    """Anexa carga diária/horária e a marcação de sobrecarga às linhas por prestador, qualquer que seja o dtype do nome."""
+    carga = provider_workload(df_atendimentos).reindex(df_prestadores['nome_do_prestador'].astype(str))
+    for coluna in ['carga_p90_diaria', 'pico_diario', 'pico_horario']:
+        df_prestadores[coluna] = carga[coluna].to_numpy()
+    df_prestadores['sobrecarga'] = carga['sobrecarga'].fillna(False).to_numpy(dtype=bool)
+    return df_prestadores
+
+def overload_factor(sobrecarga):
+    """Fator do score ponderado: prestadores sobrecarregados perdem SOBRECARGA_PENALIDADE."""
+    return np.where(sobrecarga, 1 - SOBRECARGA_PENALIDADE, 1.0)
+
+def overload_by_month(df, nomes, meses, janela_meses=1):
+    """
+    Marcação de sobrecarga por (prestador, mês) para a tendência do score: o critério de provider_workload
+    aplicado aos dias de cada janela de `janela_meses` meses terminada no mês (pico diário do prestador
+    na janela contra o percentil dos dias (prestador, dia) de toda a rede na mesma janela).
+    """
+    sobrecarga = np.zeros((len(nomes), len(meses)), dtype=bool)
+    codigos, distintos = pd.factorize(df['nome_do_prestador'])
+    dias = df['data_abertura_atendimento'].to_numpy('datetime64[D]').astype(np.int64)
+    validos = codigos >= 0
+    if not validos.any():
+        return sobrecarga
+
+    # Dias (prestador, dia) da rede inteira, com o mês de cada dia relativo ao primeiro mês da série
+    inicio_dia = dias[validos].min()
+    n_dias = dias[validos].max() - inicio_dia + 1
+    pares, carga_dia = np.unique(codigos[validos] * n_dias + (dias[validos] - inicio_dia), return_counts=True)
+    prestador_dia = pares // n_dias
+    mes_dia = (pares % n_dias + inicio_dia).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) - meses[0].ordinal
+    linha_por_codigo = nomes.get_indexer(pd.Index(distintos).astype(str))
+
+    ordem = np.argsort(mes_dia, kind='stable')
+    prestador_dia, carga_dia, mes_dia = prestador_dia[ordem], carga_dia[ordem], mes_dia[ordem]
+    for mes in range(len(meses)):
+        fatia = slice(*np.searchsorted(mes_dia, [mes - janela_meses + 1, mes + 1]))
+        if fatia.start == fatia.stop:
+            continue
+        limite_rede = np.percentile(carga_dia[fatia], SOBRECARGA_PERCENTIL_REDE)
+        pico = np.zeros(len(distintos), dtype=np.int64)
+        np.maximum.at(pico, prestador_dia[fatia], carga_dia[fatia])
+        linhas = linha_por_codigo[(pico > limite_rede) & (pico >= SOBRECARGA_PICO_MINIMO)]
+        sobrecarga[linhas[linhas >= 0], mes] = True
+    return sobrecarga
+
+@st.cache_data(max_entries=16)
+def city_provider_concentration(df):
+    """
+    HHI (0-10.000) das participações dos prestadores nos serviços de cada (uf, município), com o prestador
+    dominante e sua participação: um bincount sobre o código combinado (cidade, prestador).
+    """
+    agrupado = df.groupby(['uf', 'municipio'], observed=True, sort=True)
+    cidade = agrupado.ngroup().to_numpy(np.int64)
+    cidades = agrupado.size().index
+    # factorize e não .cat.codes: também funciona com o nome do prestador já convertido para texto
+    prestador, nomes_prestadores = pd.factorize(df['nome_do_prestador'], sort=True)
+    validos = (cidade >= 0) & (prestador >= 0)
+    n_prestadores = max(len(nomes_prestadores), 1)
+
+    pares, contagem = np.unique(cidade[validos] * n_prestadores + prestador[validos], return_counts=True)
+    cidade_par = pares // n_prestadores
+    total = np.bincount(cidade_par, weights=contagem, minlength=len(cidades))
+    participacao = contagem / total[cidade_par]
+    hhi = np.bincount(cidade_par, weights=participacao ** 2, minlength=len(cidades)) * 10000
+
+    # Prestador dominante: o par de maior contagem dentro de cada cidade (pares já ordenados por cidade)
+    ordem = np.lexsort((-contagem, cidade_par))
+    primeiro = ordem[np.r_[True, cidade_par[ordem][1:] != cidade_par[ordem][:-1]]]
+    dominante = np.full(len(cidades), '', dtype=object)
+    participacao_dominante = np.zeros(len(cidades))
+    dominante[cidade_par[primeiro]] = np.asarray(nomes_prestadores.astype(str))[pares[primeiro] % n_prestadores]
+    participacao_dominante[cidade_par[primeiro]] = participacao[primeiro]
+
+    df_concentracao = pd.DataFrame({
+        'hhi_prestadores': hhi,
+        'prestador_dominante': dominante,
+        'participacao_dominante': participacao_dominante * 100,
+        'dependencia_prestador': (hhi >= HHI_DEPENDENCIA) & (total >= DEPENDENCIA_MIN_SERVICOS)
+    }, index=pd.MultiIndex.from_arrays([cidades.get_level_values(0).astype(str), cidades.get_level_values(1).astype(str)], names=['uf', 'municipio']))
+    return df_concentracao
+
+def add_city_concentration(df_cidades, df_atendimentos):
+    """Anexa HHI, prestador dominante e dependência às linhas por (uf, municipio), qualquer que seja o dtype das chaves."""
+    concentracao = city_provider_concentration(df_atendimentos)
+    chaves = pd.MultiIndex.from_arrays([df_cidades['uf'].astype(str), df_cidades['municipio'].astype(str)])
+    alinhado = concentracao.reindex(chaves)
+    for coluna in concentracao.columns:
+        df_cidades[coluna] = alinhado[coluna].to_numpy()
+    df_cidades['dependencia_prestador'] = df_cidades['dependencia_prestador'].fillna(False).astype(bool)
+    return df_cidades
+
+# --- Comparação entre Períodos: agregações por (periodo, entidade) ---
+def compare_periods(df_longo, chaves, metricas):
+    """Passa de uma linha por (periodo, entidade) para colunas _base, _comparacao e delta_ (Base − Comparação)."""
+    if df_longo.empty:
+        return pd.DataFrame(columns=[*chaves, *[f"{m}_{sufixo}" for m in metricas for sufixo in ('base', 'comparacao')], *[f"delta_{m}" for m in metricas]])
+    base = df_longo[df_longo['periodo'] == PERIODO_BASE].set_index(chaves)[metricas]
+    comparacao = df_longo[df_longo['periodo'] == PERIODO_COMPARACAO].set_index(chaves)[metricas]
+    df_comparacao = base.add_suffix('_base').join(comparacao.add_suffix('_comparacao'), how='outer')
+    for metrica in metricas:
+        df_comparacao[f"delta_{metrica}"] = df_comparacao[f"{metrica}_base"] - df_comparacao[f"{metrica}_comparacao"]
+    return df_comparacao.reset_index()
+
+def financial_kpis_by_period(df_periodos):
+    """KPIs financeiros gerais dos dois períodos numa única agregação."""
+    kpis = df_periodos.groupby('periodo', observed=False).agg(
+        total_gasto=('val_total_items', 'sum'),
+        total_servicos=('val_total_items', 'size'),
+        total_reembolso=('val_reembolso', 'sum'),
+        total_intermediacao_servicos=('is_intermediacao', 'sum')
+    )
+    kpis['cms_medio'] = (kpis['total_gasto'] / kpis['total_servicos'].where(kpis['total_servicos'] > 0)).fillna(0)
+    kpis['pct_gasto_reembolso'] = (kpis['total_reembolso'] / kpis['total_gasto'].where(kpis['total_gasto'] > 0) * 100).fillna(0)
+    kpis['pct_intermediacao_servicos'] = (kpis['total_intermediacao_servicos'] / kpis['total_servicos'].where(kpis['total_servicos'] > 0) * 100).fillna(0)
+    return kpis
+
+def score_by_period(df_periodos, df_nps_prestador, min_atendimentos, sketches=None, pesos=None):
+    """Score de cada prestador nos dois períodos a partir de uma única agregação por (periodo, prestador)."""
+    df_agg = aggregate_prestadores_base(df_periodos, df_nps_prestador, por=['periodo'])
+    df_agg['pct_reembolso'] = (df_agg['num_reembolsos'] / df_agg['total_atendimentos'] * 100).fillna(0)
+    df_agg['pct_intermediacao'] = (df_agg['num_intermediacoes'] / df_agg['total_atendimentos'] * 100).fillna(0)
+    if sketches is not None:
+        df_agg = add_monthly_count_means(df_agg, df_periodos, 'prestador', por=['periodo'])
+
+    scores = []
+    for periodo, df_periodo in df_agg.groupby('periodo', observed=True):
+        df_periodo = df_periodo[df_periodo['total_atendimentos'] >= min_atendimentos].copy()
+        if not df_periodo.empty:
+            atendimentos_periodo = df_periodos[df_periodos['periodo'] == periodo]
+            scores.append(calculate_prestador_score(df_periodo, sketches, pesos, atendimentos_periodo)[['periodo', 'nome_do_prestador', 'score_prestador', 'total_atendimentos']])
+    df_longo = pd.concat(scores, ignore_index=True) if scores else pd.DataFrame(columns=['periodo', 'nome_do_prestador', 'score_prestador', 'total_atendimentos'])
+    return compare_periods(df_longo, ['nome_do_prestador'], ['score_prestador', 'total_atendimentos'])
+
+def capilaridade_by_period(df_periodos, min_atendimentos, sketches=None, pesos=None):
+    """Índice de capilaridade por cidade nos dois períodos a partir de uma única agregação por (periodo, uf, município)."""
+    df_agregado = add_capilaridade_rates(aggregate_cidades(df_periodos, por=['periodo']))
+    if sketches is not None:
+        df_agregado = add_monthly_count_means(df_agregado, df_periodos, 'cidade', por=['periodo'])
+
+    indices = []
+    for _, df_periodo in df_agregado.groupby('periodo', observed=True):
+        df_periodo = df_periodo[df_periodo['num_servicos'] >= min_atendimentos].copy()
+        if not df_periodo.empty:
+            indices.append(calculate_capilaridade_index(df_periodo, sketches, pesos)[['periodo', 'uf', 'municipio', 'indice_capilaridade', 'num_servicos']])
+    df_longo = pd.concat(indices, ignore_index=True) if indices else pd.DataFrame(columns=['periodo', 'uf', 'municipio', 'indice_capilaridade', 'num_servicos'])
+    return compare_periods(df_longo, ['uf', 'municipio'], ['indice_capilaridade', 'num_servicos'])
+
+def cms_by_period(df_periodos, min_servicos):
+    """CMS por prestador nos dois períodos a partir de uma única agregação por (periodo, prestador)."""
+    df_longo = aggregate_cms_prestador(df_periodos, por=['periodo'])
+    df_longo = df_longo[df_longo['qtd_servicos'] >= min_servicos]
+    return compare_periods(df_longo, ['nome_do_prestador'], ['cms', 'qtd_servicos'])
+
+def display_period_comparison(df_comparacao, colunas, ordenar_por, rotulos, crescente=True):
+    """Tabela de variação por entidade entre os períodos, ordenada pela maior piora."""
+    st.markdown("---")
+    st.subheader("Comparação entre Períodos")
+    st.caption(f"Base: {rotulos[PERIODO_BASE]} · Comparação: {rotulos[PERIODO_COMPARACAO]} · Δ = Base − Comparação")
+    if df_comparacao.empty:
+        st.info("Nenhuma entidade com dados suficientes nos períodos selecionados.")
+        return
+    st.dataframe(
+        df_comparacao.sort_values(ordenar_por, ascending=crescente)[list(colunas)].rename(columns=colunas).round(2),
+        hide_index=True,
+        use_container_width=True
+    )
+
+# --- Funções para Páginas (Pilares) ---
+def page_informacao():
+    """Renderiza a página de informações gerais do dashboard."""
+    st.markdown("""
+    # Monitoramento Inteligente da Rede de Prestadores A24h
+
+    **Bem-vindo ao Dashboard de Monitoramento Inteligente da Rede de Prestadores A24h!** Esta plataforma foi desenhada para transformar dados complexos em *insights acionáveis*, permitindo decisões ágeis e estratégicas para otimizar performance, reduzir custos e garantir a melhor experiência para nossos clientes.
+
+    **Explore os pilares abaixo** e descubra diferentes perspectivas da nossa rede de parceiros:
+
+    ---
+    """)
+
+    st.markdown("## 📍 Pilar Capilaridade")
+    st.markdown("""
+    Monitora a **distribuição** e a **disponibilidade** dos prestadores em relação à demanda da região.
+
+    **Objetivo:** Ajuda a identificar áreas descobertas, equilibrar recursos e evitar sobrecarga em determinados prestadores.
+    """)
+
+    st.subheader("Indicadores de Capilaridade")
+    df_capilaridade_kpis = pd.DataFrame({
+        "KPI": ["Índice de Capilaridade", "Vazio Assistencial", "Intermediações por Atendimento"],
+        "O que mede": [
+            "Equilíbrio entre rede e demanda",
+            "Municípios atendidos sem prestadores disponíveis",
+            "Complexidade operacional"
+        ],
+        "Fórmula": [
+            "Nº de Prestadores / Nº de Atendimentos",
+            "Nº de Atendimentos / Nº de Prestadores",
+            "Nº de Intermediações / Nº de Atendimentos"
+        ]
+    })
+    st.dataframe(df_capilaridade_kpis, hide_index=True)
+
+    st.markdown("---")
+
+    st.markdown("## 💰 Pilar Financeiro")
+    st.markdown("""
+    Analisa a **eficiência econômica** da rede e o impacto no custo médio por serviço (CMS).
+
+    **Objetivo:** Permite controlar custos, identificar oportunidades de economia e evitar distorções regionais.
+    """)
+
+    st.subheader("Indicadores Financeiros")
+    df_financeiro_kpis = pd.DataFrame({
+        "KPI": ["Diferença CMS", "Proporção de Reembolso"],
+        "O que mede": [
+            "Custo médio por serviço em relação à média estadual e segmentada",
+            "Dependência de reembolsos na operação"
+        ],
+        "Fórmula": [
+            "(CMS Cidade Segmento - CMS Estadual Segmento) / CMS Estadual Segmento",
+            "Nº de Reembolsos / Total de Atendimentos"
+        ]
+    })
+    st.dataframe(df_financeiro_kpis, hide_index=True)
+
+    st.markdown("---")
+
+    st.markdown("## ⟳ Pilar Frequência de Uso")
+    st.markdown("""
+    Acompanha o quanto os serviços estão sendo utilizados por apólice em cada região.
+
+    **Objetivo:** Ajuda a identificar padrões de uso, prever demandas futuras e gerenciar melhor a capacidade da rede.
+    """)
+
+    st.subheader("Indicadores de Frequência de Uso")
+    df_frequencia_kpis = pd.DataFrame({
+        "KPI": ["Frequência por Apólice"],
+        "O que mede": ["Média de atendimentos por cliente/apólice"],
+        "Fórmula": ["Nº de Atendimentos / Nº de Apólices"]
+    })
+    st.dataframe(df_frequencia_kpis, hide_index=True)
+
+    st.markdown("---")
+
+    st.markdown("## ✨ Pilar Qualidade")
+    st.markdown("""
+    Avalia a **satisfação do cliente** e a **qualidade do serviço entregue**.
+
+    **Objetivo:** Monitora o nível de confiança do cliente e identifica oportunidades de melhoria.
+    """)
+
+    st.subheader("Indicadores de Qualidade")
+    df_qualidade_kpis = pd.DataFrame({
+        "KPI": ["NPS", "TMC"],
+        "O que mede": [
+            "Índice de satisfação do cliente",
+            "Tempo médio de chegada ao local do sinistro"
+        ],
+        "Fórmula": [
+            "% Promotores - % Detratores",
+            "Média de tempo de chegada ao segurado"
+        ]
+    })
+    st.dataframe(df_qualidade_kpis, hide_index=True)
+
+    st.markdown("""
+    ### 🛠️ Tecnologias Utilizadas
+    * **Python**: Linguagem de programação principal.
+    * **Streamlit**: Framework para construção da interface web interativa.
+    * **Pandas**: Biblioteca para manipulação e análise de dados.
+    * **NumPy**: Biblioteca para operações numéricas.
+    * **Plotly Express**: Biblioteca para criação de gráficos interativos.
+    * **Streamlit-Option-Menu**: Componente para a barra lateral de navegação.
+    * **Unicodedata, re**: Módulos para normalização e limpeza de strings.
+    * **Xlsxwriter**: Engine para exportação de dados para arquivos Excel.
+
+    ### 💡 Contribuição
+    Este dashboard foi desenvolvido por **Vinicius Krebs** como parte do projeto de **Redução de Custos A24H e Aumento de Capilaridade da Rede**.
+    """)
+    st.markdown("---")
+    st.info("Utilize o menu na barra lateral para navegar por cada pilar. Cada seção oferece filtros detalhados para uma análise personalizada.")
+
+
+# --- Normalização por Percentil (Sketches de Quantis Mescláveis) ---
+class QuantileSketch:
+    """
+    Sketch de quantis no estilo KLL: mantém poucas amostras ponderadas por nível e pode ser
+    atualizado em lotes e mesclado com outros sketches sem revisitar as linhas originais.
+    """
+
+    def __init__(self, k=SKETCH_K, seed=0):
+        self.k = k
+        self.n = 0
+        self.niveis = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacidade(self, nivel):
+        profundidade = len(self.niveis) - nivel - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** profundidade)))
+
+    def _compactar(self):
+        nivel = 0
+        while nivel < len(self.niveis):
+            if len(self.niveis[nivel]) > self._capacidade(nivel):
+                if nivel + 1 == len(self.niveis):
+                    self.niveis.append(np.empty(0))
+                itens = np.sort(self.niveis[nivel])
+                resto = itens[len(itens) - len(itens) % 2:]
+                itens = itens[:len(itens) - len(itens) % 2]
+                # Metade dos itens sobe de nível com o dobro do peso
+                self.niveis[nivel] = resto
+                self.niveis[nivel + 1] = np.concatenate([self.niveis[nivel + 1], itens[self._rng.integers(2)::2]])
+            nivel += 1
+
+    def update(self, valores):
+        valores = np.asarray(valores, dtype=float)
+        valores = valores[~np.isnan(valores)]
+        self.niveis[0] = np.concatenate([self.niveis[0], valores])
+        self.n += len(valores)
+        self._compactar()
+        return self
+
+    def merge(self, outro):
+        while len(self.niveis) < len(outro.niveis):
+            self.niveis.append(np.empty(0))
+        for nivel, itens in enumerate(outro.niveis):
+            self.niveis[nivel] = np.concatenate([self.niveis[nivel], itens])
+        self.n += outro.n
+        self._compactar()
+        return self
+
+    def _distribuicao(self):
+        itens = np.concatenate(self.niveis)
+        pesos = np.concatenate([np.full(len(nivel), 2.0 ** i) for i, nivel in enumerate(self.niveis)])
+        ordem = np.argsort(itens, kind='stable')
+        return itens[ordem], np.cumsum(pesos[ordem])
+
+    def rank(self, valores):
+        """Percentil (0 a 1) de cada valor, usando o posto médio para empates."""
+        valores = np.asarray(valores, dtype=float)
+        if self.n == 0:
+            return np.full(valores.shape, 0.5)
+        itens, acumulado = self._distribuicao()
+        acumulado = np.concatenate([[0.0], acumulado])
+        abaixo = acumulado[np.searchsorted(itens, valores, side='left')]
+        ate = acumulado[np.searchsorted(itens, valores, side='right')]
+        return np.where(np.isnan(valores), np.nan, (abaixo + ate) / 2 / acumulado[-1])
+
+    def quantile(self, q):
+        if self.n == 0:
+            return np.full(np.shape(q), np.nan)
+        itens, acumulado = self._distribuicao()
+        posicao = np.searchsorted(acumulado, np.asarray(q, dtype=float) * acumulado[-1], side='left')
+        return itens[np.minimum(posicao, len(itens) - 1)]
+
+SKETCH_METRICS = {
+    'prestador': ['total_atendimentos', 'pct_reembolso', 'pct_intermediacao', 'media_tempo_chegada'],
+    'cidade': ['num_servicos', 'num_prestadores', 'pct_reembolso', 'pct_intermediacao', 'media_tempo_chegada'],
+}
+SKETCH_ENTIDADES = {'prestador': 'nome_do_prestador', 'cidade': 'municipio'}
+SKETCH_CHAVES = {'prestador': ['nome_do_prestador'], 'cidade': ['uf', 'municipio']}
+# Métricas de contagem: ranqueadas pela média por mês ativo, não pelo total do período
+SKETCH_CONTAGENS = {'prestador': ['total_atendimentos'], 'cidade': ['num_servicos', 'num_prestadores']}
+
+def entity_month_observations(df, tipo, por=()):
+    """
+    Métricas de cada entidade (prestador ou cidade) por célula (uf, segmento, mês) com atendimento.
+    É a granularidade das observações dos sketches de referência.
+    """
+    df_mes = df.assign(mes=df['data_abertura_atendimento'].dt.to_period('M'))
+    df_obs = df_mes.groupby([*por, 'uf', 'segmento', SKETCH_ENTIDADES[tipo], 'mes'], observed=True).agg(
+        total_atendimentos=('protocolo_atendimento', 'nunique'),
+        num_prestadores=('nome_do_prestador', 'nunique'),
+        num_reembolsos=('is_reembolso', 'sum'),
+        num_intermediacoes=('is_intermediacao', 'sum'),
+        media_tempo_chegada=('tempo_chegada_min', 'mean')
+    ).reset_index()
+    df_obs['num_servicos'] = df_obs['total_atendimentos']
+    df_obs['pct_reembolso'] = df_obs['num_reembolsos'] / df_obs['total_atendimentos'] * 100
+    df_obs['pct_intermediacao'] = df_obs['num_intermediacoes'] / df_obs['total_atendimentos'] * 100
+    return df_obs
+
+def update_partition_sketches(sketches, df_novos):
+    """
+    Incorpora novos atendimentos aos sketches de referência por partição (uf, segmento).
+
+    Cada observação é a métrica de uma entidade (prestador ou cidade) em um mês, de modo
+    que um lote com meses novos só acrescenta observações, sem recalcular as anteriores.
+    """
+    if df_novos.empty:
+        return sketches
+
+    for tipo in SKETCH_ENTIDADES:
+        df_obs = entity_month_observations(df_novos, tipo)
+        sketches_tipo = sketches.setdefault(tipo, {})
+        for particao, df_particao in df_obs.groupby(['uf', 'segmento'], observed=True):
+            sketches_particao = sketches_tipo.setdefault(particao, {})
+            for metrica in SKETCH_METRICS[tipo]:
+                sketches_particao.setdefault(metrica, QuantileSketch()).update(df_particao[metrica].to_numpy(dtype=float))
+    return sketches
+
+@st.cache_data
+def build_partition_sketches(df):
+    """Constrói, uma vez por versão dos dados, os sketches de referência por (uf, segmento)."""
+    return update_partition_sketches({}, df)
+
+@st.cache_data(max_entries=16)
+def monthly_count_means(df, tipo, por=()):
+    """
+    Média, por entidade, das contagens em cada célula (uf, segmento, mês) com atendimento.
+    Contagens do período inteiro crescem com o número de meses e cairiam sempre no topo
+    da distribuição mensal dos sketches; a média por célula fica na mesma escala.
+    """
+    chaves = [*por, *SKETCH_CHAVES[tipo]]
+    df_obs = entity_month_observations(df, tipo, por)
+    df_medias = df_obs.groupby(chaves, observed=True)[SKETCH_CONTAGENS[tipo]].mean().add_suffix('_mensal').reset_index()
+    df_medias[chaves] = df_medias[chaves].astype(str)
+    return df_medias
+
+def add_monthly_count_means(df_agregado, df_atendimentos, tipo, por=()):
+    """Acrescenta ao agregado as colunas '<contagem>_mensal' comparáveis aos sketches de referência."""
+    chaves = [*por, *SKETCH_CHAVES[tipo]]
+    df_medias = monthly_count_means(df_atendimentos, tipo, tuple(por))
+    posicoes = pd.MultiIndex.from_frame(df_medias[chaves]).get_indexer(pd.MultiIndex.from_frame(df_agregado[chaves].astype(str)))
+    for coluna in SKETCH_CONTAGENS[tipo]:
+        valores = df_medias[f'{coluna}_mensal'].to_numpy(dtype=float)
+        df_agregado[f'{coluna}_mensal'] = np.where(posicoes >= 0, valores[posicoes], np.nan)
+    return df_agregado
+
+def merge_partition_sketches(sketches, tipo, ufs=None, segmentos=None):
+    """Mescla os sketches das partições selecionadas (None = todas) em um sketch por métrica."""
+    mesclados = {metrica: QuantileSketch() for metrica in SKETCH_METRICS[tipo]}
+    for (uf, segmento), sketches_particao in sketches.get(tipo, {}).items():
+        if (ufs is None or uf in ufs) and (segmentos is None or segmento in segmentos):
+            for metrica, sketch in sketches_particao.items():
+                mesclados[metrica].merge(sketch)
+    return mesclados
+
+def calculate_capilaridade_index(df_agregado_cidade, sketches=None, pesos=None):
+    if df_agregado_cidade.empty:
+        return pd.DataFrame()
+
+    if sketches is not None:
+        # Normalização por percentil frente à distribuição de referência (robusta a outliers)
+        # Contagens entram como média por (uf, segmento, mês) ativo, a granularidade dos sketches
+        df_agregado_cidade['norm_atendimentos'] = sketches['num_servicos'].rank(df_agregado_cidade['num_servicos_mensal'])
+        df_agregado_cidade['norm_prestadores'] = sketches['num_prestadores'].rank(df_agregado_cidade['num_prestadores_mensal'])
+        df_agregado_cidade['norm_pct_reembolso'] = sketches['pct_reembolso'].rank(df_agregado_cidade['pct_reembolso'])
+        df_agregado_cidade['contrib_reembolso'] = 1 - df_agregado_cidade['norm_pct_reembolso']
+        df_agregado_cidade['norm_pct_intermediacao'] = sketches['pct_intermediacao'].rank(df_agregado_cidade['pct_intermediacao'])
+        df_agregado_cidade['contrib_intermediacao'] = 1 - df_agregado_cidade['norm_pct_intermediacao']
+        df_agregado_cidade['norm_tempo_chegada'] = sketches['media_tempo_chegada'].rank(df_agregado_cidade['media_tempo_chegada'])
+        df_agregado_cidade['contrib_tempo_chegada'] = 1 - df_agregado_cidade['norm_tempo_chegada']
+    else:
+        df_agregado_cidade = normalize_capilaridade_by_max(df_agregado_cidade)
+
+    pesos = pesos or PESOS_CAPILARIDADE
+    componentes = df_agregado_cidade[list(CAPILARIDADE_COMPONENT_COLUMNS.values())].to_numpy(dtype=float)
+    df_agregado_cidade['indice_capilaridade'] = componentes @ np.array([pesos[nome] for nome in CAPILARIDADE_COMPONENT_COLUMNS])
+
+    if not df_agregado_cidade['indice_capilaridade'].empty and df_agregado_cidade['indice_capilaridade'].nunique() > 0:
+        unique_indices = df_agregado_cidade['indice_capilaridade'].nunique()
+        if unique_indices <= 1:
+            df_agregado_cidade['status_capilaridade'] = 'Capilaridade Regular'
+        else:
+            q1 = df_agregado_cidade['indice_capilaridade'].quantile(0.25)
+            q3 = df_agregado_cidade['indice_capilaridade'].quantile(0.75)
+            
+            bins = sorted(list(set([
+                df_agregado_cidade['indice_capilaridade'].min() - 0.001, 
+                q1, 
+                q3, 
+                df_agregado_cidade['indice_capilaridade'].max() + 0.001
+            ])))
+            
+            labels_map = {
+                2: ['Carência Assistencial', 'Boa Capilaridade'],
+                3: ['Carência Assistencial', 'Capilaridade Regular', 'Boa Capilaridade']
+            }
+            labels = labels_map.get(len(bins) - 1, ['Capilaridade Regular']) 
+
+            df_agregado_cidade['status_capilaridade'] = pd.cut(
+                df_agregado_cidade['indice_capilaridade'],
+                bins=bins,
+                labels=labels,
+                right=True,
+                duplicates='drop'
+            )
+            df_agregado_cidade['status_capilaridade'] = df_agregado_cidade['status_capilaridade'].fillna('Capilaridade Regular')
+            
+            df_agregado_cidade['status_capilaridade'] = pd.Categorical(
+                df_agregado_cidade['status_capilaridade'],
+                categories=['Carência Assistencial', 'Capilaridade Regular', 'Boa Capilaridade'],
+                ordered=True
+            )
+    else:
+        df_agregado_cidade['status_capilaridade'] = 'N/A'
+    return df_agregado_cidade
+
+def normalize_capilaridade_by_max(df_agregado_cidade):
+    """Normaliza os componentes do índice de capilaridade pelo máximo de cada coluna."""
+    max_servicos = df_agregado_cidade['num_servicos'].max()
+    df_agregado_cidade['norm_atendimentos'] = df_agregado_cidade['num_servicos'] / max_servicos if max_servicos > 0 else 0
+    
+    max_prestadores = df_agregado_cidade['num_prestadores'].max()
+    df_agregado_cidade['norm_prestadores'] = df_agregado_cidade['num_prestadores'] / max_prestadores if max_prestadores > 0 else 0
+
+    max_pct_reembolso = df_agregado_cidade['pct_reembolso'].max()
+    df_agregado_cidade['norm_pct_reembolso'] = df_agregado_cidade['pct_reembolso'] / max_pct_reembolso if max_pct_reembolso > 0 else 0
+    df_agregado_cidade['contrib_reembolso'] = (1 - df_agregado_cidade['norm_pct_reembolso']) if max_pct_reembolso > 0 else 1
+
+    max_pct_intermediacao = df_agregado_cidade['pct_intermediacao'].max()
+    df_agregado_cidade['norm_pct_intermediacao'] = df_agregado_cidade['pct_intermediacao'] / max_pct_intermediacao if max_pct_intermediacao > 0 else 0
+    df_agregado_cidade['contrib_intermediacao'] = (1 - df_agregado_cidade['norm_pct_intermediacao']) if max_pct_intermediacao > 0 else 1
+
+    max_tempo_chegada = df_agregado_cidade['media_tempo_chegada'].max()
+    df_agregado_cidade['norm_tempo_chegada'] = df_agregado_cidade['media_tempo_chegada'] / max_tempo_chegada if max_tempo_chegada > 0 else 0
+    df_agregado_cidade['contrib_tempo_chegada'] = (1 - df_agregado_cidade['norm_tempo_chegada']) if max_tempo_chegada > 0 else 1
+
+    return df_agregado_cidade
+
+def get_sugestao_acao(row, df_agregado_cidade, min_atendimentos_cidade):
+    sugestoes = set()
+    if row['status_capilaridade'] == 'Carência Assistencial':
+        sugestoes.add("Recrutamento urgente de prestadores. Analisar concorrência local.")
+    
+    if row['num_servicos'] > 0 and row['num_prestadores'] == 0:
+        sugestoes.add("Ausência de prestadores. Foco total em parceria local.")
+
+    if row.get('dependencia_prestador', False):
+        sugestoes.add(f"Dependência de um único prestador ({row['participacao_dominante']:.0f}% dos serviços com {row['prestador_dominante']}). Credenciar prestadores alternativos.")
+    
+    if row['num_servicos'] >= min_atendimentos_cidade: 
+        if df_agregado_cidade['pct_reembolso'].nunique() > 1:
+            pct_reembolso_80 = df_agregado_cidade['pct_reembolso'].quantile(0.80)
+            if row['pct_reembolso'] > pct_reembolso_80:
+                sugestoes.add("Alto % de reembolso. Investigar causas de insatisfação ou deficiência de prestadores.")
+        
+        if df_agregado_cidade['pct_intermediacao'].nunique() > 1:
+            pct_intermediacao_80 = df_agregado_cidade['pct_intermediacao'].quantile(0.80)
+            if row['pct_intermediacao'] > pct_intermediacao_80:
+                sugestoes.add("Alto % de intermediação. Otimizar processos de acionamento ou recrutar prestadores diretos.")
+        
+        if df_agregado_cidade['media_tempo_chegada'].nunique() > 1:
+            tempo_chegada_80 = df_agregado_cidade['media_tempo_chegada'].quantile(0.80)
+            if row['media_tempo_chegada'] > tempo_chegada_80:
+                sugestoes.add("Alto tempo de chegada. Otimizar rotas ou aumentar a densidade de prestadores próximos.")
+
+    return " | ".join(sorted(list(sugestoes))) if sugestoes else "Nenhuma sugestão específica."
+
+def display_specific_problem_rankings(df_agregado_cidade):
+    st.markdown("---")
+    st.header("Classificações de Problemas Específicos")
+    st.markdown("Cidades com os maiores desafios em reembolso e intermediação.")
+    
+    col_reembolso_rank, col_intermediacao_rank = st.columns(2)
+    
+    with col_reembolso_rank:
+        st.subheader("Cidades por % de Reembolso")
+        if 'total_valor_servicos' not in df_agregado_cidade.columns:
+            df_agregado_cidade['total_valor_servicos'] = 0 
+        
+        df_reembolso_rank = df_agregado_cidade.sort_values('pct_reembolso', ascending=False).head(10).copy()
+        
+        df_reembolso_rank_display = df_reembolso_rank.rename(columns={
+            'municipio': 'Cidade',
+            'uf': 'UF',
+            'num_servicos': 'Qtd. Serviços',
+            'pct_reembolso': '% Reembolso',
+            'total_valor_servicos': 'Valor Total'
+        })
+        st.dataframe(
+            df_reembolso_rank_display[['Cidade', 'UF', 'Qtd. Serviços', '% Reembolso', 'Valor Total']].style.format({
+                'Qtd. Serviços': '{:,.0f}',
+                '% Reembolso': '{:.2f}%',
+                'Valor Total': 'R$ {:,.2f}'
+            }),
+            use_container_width=True
+        )
+        st.markdown("**Sugestão:** Busca de novos prestadores para reduzir a taxa de reembolso e diminuir o CMS.")
+    
+    with col_intermediacao_rank:
+        st.subheader("Cidades por % de Intermediação")
+        if 'total_valor_servicos' not in df_agregado_cidade.columns:
+            df_agregado_cidade['total_valor_servicos'] = 0 
+
+        df_intermediacao_rank = df_agregado_cidade.sort_values('pct_intermediacao', ascending=False).head(10).copy()
+        
+        df_intermediacao_rank_display = df_intermediacao_rank.rename(columns={
+            'municipio': 'Cidade',
+            'uf': 'UF',
+            'num_servicos': 'Qtd. Serviços',
+            'pct_intermediacao': '% Intermediação',
+            'total_valor_servicos': 'Valor Total'
+        })
+        st.dataframe(
+            df_intermediacao_rank_display[['Cidade', 'UF', 'Qtd. Serviços', '% Intermediação', 'Valor Total']].style.format({
+                'Qtd. Serviços': '{:,.0f}',
+                '% Intermediacao': '{:.2f}%',
+                'Valor Total': 'R$ {:,.2f}'
+            }),
+            use_container_width=True
+        )
+        st.markdown("**Sugestão:** Otimizar processos de acionamento ou recrutar prestadores diretos para reduzir intermediações.")
+
+
+def add_capilaridade_rates(df_agregado_cidade):
+    """Percentuais de reembolso/intermediação e serviços não atendidos sobre o agregado por cidade."""
+    df_agregado_cidade['pct_reembolso'] = np.where(
+        df_agregado_cidade['num_servicos'] > 0,
+        (df_agregado_cidade['num_reembolsos'] / df_agregado_cidade['num_servicos']) * 100,
+        0
+    )
+    df_agregado_cidade['pct_intermediacao'] = np.where(
+        df_agregado_cidade['num_servicos'] > 0,
+        (df_agregado_cidade['num_intermediacoes'] / df_agregado_cidade['num_servicos']) * 100,
+        0
+    )
+    df_agregado_cidade['media_tempo_chegada'] = df_agregado_cidade['media_tempo_chegada'].fillna(0)
+
+    df_agregado_cidade['num_servicos_nao_atendidos'] = df_agregado_cidade['num_servicos'] - \
+                                                        df_agregado_cidade['num_reembolsos'] - \
+                                                        df_agregado_cidade['num_intermediacoes']
+    df_agregado_cidade['num_servicos_nao_atendidos'] = df_agregado_cidade['num_servicos_nao_atendidos'].clip(lower=0)
+    return df_agregado_cidade
+
+def display_capilaridade_kpis(df_filtrado_original, df_agregado_cidade_com_indice=None):
+    st.markdown("---")
+    st.header("KPIs Gerais de Capilaridade")
+    
+    total_servicos = len(df_filtrado_original)
+    total_prestadores_unicos = df_filtrado_original['nome_do_prestador'].nunique()
+    total_cidades_atendidas = df_filtrado_original['municipio'].nunique()
+    media_tempo_chegada = df_filtrado_original['tempo_chegada_min'].mean()
+    pct_reembolso = (df_filtrado_original['is_reembolso'].sum() / total_servicos) * 100 if total_servicos > 0 else 0
+    pct_intermediacao = (df_filtrado_original['is_intermediacao'].sum() / total_servicos) * 100 if total_servicos > 0 else 0
+
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+    col1.metric("Total de Serviços", f"{total_servicos:,}".replace(',', '.'), help="Número total de atendimentos registrados com os filtros aplicados.")
+    col2.metric("Prestadores Únicos", f"{total_prestadores_unicos:,}".replace(',', '.'), help="Número de prestadores distintos que realizaram atendimentos com os filtros aplicados.")
+    col3.metric("Cidades Atendidas", f"{total_cidades_atendidas:,}".replace(',', '.'), help="Número de municípios onde houve atendimentos com os filtros aplicados.")
+    col4.metric("TMC (min)", f"{media_tempo_chegada:.0f} min" if not pd.isna(media_tempo_chegada) else "N/A", help="Tempo Médio de Chegada do prestador ao local do serviço, em minutos.")
+    col5.metric("Perc. Reembolso", f"{pct_reembolso:.2f}%", help="Percentual de serviços que geraram algum tipo de reembolso, indicando falha na cobertura direta ou preferência do cliente.")
+    col6.metric("Perc. Intermediação", f"{pct_intermediacao:.2f}%", help="Percentual de serviços que foram realizados por meio de intermediação, e não por prestadores diretos da rede.")
+
+    if df_agregado_cidade_com_indice is not None and not df_agregado_cidade_com_indice.empty:
+        st.markdown("---")
+        st.header("Dispersão de Capilaridade por Cidade")
+        st.info("Visualize a relação entre o número de serviços e a quantidade de prestadores. Círculos maiores indicam maior volume de atendimentos. As cores representam o status de capilaridade da cidade.")
+
+        category_order = ['Carência Assistencial', 'Capilaridade Regular', 'Boa Capilaridade']
+        status_colors = {
+            'Carência Assistencial': '#EF5350',
+            'Capilaridade Regular': '#FFCA28',
+            'Boa Capilaridade': '#66BB6A'
+        }
+
+        def construir_dispersao(dados):
+            return px.scatter(
+                dados,
+                x='num_servicos',
+                y='num_prestadores',
+                color='status_capilaridade',
+                size='num_servicos',
+                hover_name='municipio',
+                hover_data={
+                    'uf': True,
+                    'num_servicos': ':.0f',
+                    'num_prestadores': ':.0f',
+                    'indice_capilaridade': ':.2f',
+                    'status_capilaridade': True,
+                    'pct_reembolso': ':.2f',
+                    'pct_intermediacao': ':.2f',
+                    'media_tempo_chegada': ':.0f'
+                },
+                title='Capilaridade: Serviços vs. Prestadores por Cidade e Status',
+                labels={
+                    'num_servicos': 'Número de Serviços (Atendimentos)',
+                    'num_prestadores': 'Número de Prestadores',
+                    'status_capilaridade': 'Status de Capilaridade'
+                },
+                color_discrete_map=status_colors,
+                category_orders={'status_capilaridade': category_order},
+                height=600,
+                log_x=True,
+            ).update_layout(
+                xaxis_title="Número de Serviços (Atendimentos)",
+                yaxis_title="Número de Prestadores",
+                legend_title="Status de Capilaridade",
+                hovermode="closest",
+                yaxis=dict(showgrid=False)
+            )
+
+        colunas_dispersao = [
+            'municipio', 'uf', 'num_servicos', 'num_prestadores', 'indice_capilaridade', 'status_capilaridade',
+            'pct_reembolso', 'pct_intermediacao', 'media_tempo_chegada'
+        ]
+        fig_capilaridade = plotly_figure('capilaridade.dispersao', df_agregado_cidade_com_indice[colunas_dispersao], construir_dispersao)
+        st.plotly_chart(fig_capilaridade, use_container_width=True)
+
+@st.fragment
+def capilaridade_cidades_fragment(df, df_agregado_cidade, sketches=None, drilldown=None, comparacao=None):
+    """Índice, KPIs e rankings de capilaridade. Fragmento: pesos e mínimo de atendimentos reexecutam só esta seção."""
+    pesos_capilaridade = weight_editor('capilaridade', PESOS_CAPILARIDADE, {
+        'atendimentos': 'Volume de Serviços',
+        'prestadores': 'Número de Prestadores',
+        'reembolso': '% Reembolso',
+        'intermediacao': '% Intermediação',
+        'tempo_chegada': 'Tempo Médio de Chegada'
+    })
+
+    st.markdown("---")
+
+    min_atendimentos_cidade = st.number_input(
+        label="Defina o Mínimo de Atendimentos por Prestador", 
+        min_value=1,
+        max_value=200, 
+        value=MIN_ATTENDANCES_FOR_CITY_ANALYSIS, 
+        step=1,
+        help="Cidades com número de atendimentos abaixo deste valor não serão incluídas na análise de capilaridade detalhada."
+    )
+
+    df_agregado_cidade_filtrado = df_agregado_cidade[df_agregado_cidade['num_servicos'] >= min_atendimentos_cidade].copy()
+    if sketches is not None:
+        df_agregado_cidade_filtrado = add_monthly_count_means(df_agregado_cidade_filtrado, df, 'cidade')
+    
+    df_agregado_cidade_com_indice = calculate_capilaridade_index(df_agregado_cidade_filtrado, sketches, pesos_capilaridade)
+
+    
+
+    display_capilaridade_kpis(df, df_agregado_cidade_com_indice)
+
+    if not df_agregado_cidade_com_indice.empty:
+        st.markdown("---")
+        st.subheader("Mapa de Capilaridade por Município")
+        metrica_mapa = st.radio(
+            "Métrica do mapa", ['indice_capilaridade', 'status_capilaridade'], horizontal=True,
+            format_func=lambda metrica: MAPA_METRICAS[metrica]['rotulo'], key="mapa_capilaridade_metrica"
+        )
+        municipality_map(df_agregado_cidade_com_indice, metrica_mapa)
+
+    if comparacao is not None:
+        df_capilaridade_periodos = capilaridade_by_period(comparacao['df'], min_atendimentos_cidade, sketches, pesos_capilaridade)
+        st.metric(
+            "Índice Médio de Capilaridade",
+            f"{df_capilaridade_periodos['indice_capilaridade_base'].mean():.2f}",
+            delta=delta_pontos(df_capilaridade_periodos['indice_capilaridade_base'].mean(), df_capilaridade_periodos['indice_capilaridade_comparacao'].mean(), "")
+        )
+        display_period_comparison(
+            df_capilaridade_periodos,
+            {
+                'municipio': 'Cidade',
+                'uf': 'UF',
+                'indice_capilaridade_base': 'Índice (Base)',
+                'indice_capilaridade_comparacao': 'Índice (Comparação)',
+                'delta_indice_capilaridade': 'Δ Índice',
+                'num_servicos_base': 'Qtd. Serviços (Base)',
+                'num_servicos_comparacao': 'Qtd. Serviços (Comparação)'
+            },
+            'delta_indice_capilaridade', comparacao['rotulos']
+        )
+
+    if not df_agregado_cidade_com_indice.empty:
+        df_agregado_cidade_com_indice = add_city_concentration(df_agregado_cidade_com_indice, df)
+        df_agregado_cidade_com_indice['sugestao_acao'] = df_agregado_cidade_com_indice.apply(
+            lambda row: get_sugestao_acao(row, df_agregado_cidade_com_indice, min_atendimentos_cidade), axis=1
+        )
+
+        st.markdown("---")
+        st.subheader("Cidades com Necessidade de Atenção na Capilaridade")
+        st.info("Foque nestas cidades para otimizar a cobertura da sua rede.")
+        
+        df_offenders = df_agregado_cidade_com_indice[
+            (df_agregado_cidade_com_indice['status_capilaridade'] == 'Carência Assistencial') |
+            df_agregado_cidade_com_indice['dependencia_prestador'] |
+            (df_agregado_cidade_com_indice['pct_reembolso'] > df_agregado_cidade_com_indice['pct_reembolso'].quantile(0.75)) |
+            (df_agregado_cidade_com_indice['pct_intermediacao'] > df_agregado_cidade_com_indice['pct_intermediacao'].quantile(0.75)) |
+            (df_agregado_cidade_com_indice['media_tempo_chegada'] > df_agregado_cidade_com_indice['media_tempo_chegada'].quantile(0.75))
+        ].sort_values('indice_capilaridade', ascending=True)
+
+        if not df_offenders.empty:
+            if drilldown is not None:
+                st.caption("Selecione uma linha para ver o detalhamento do município.")
+            evento_ofensoras = st.dataframe(
+                df_offenders.rename(columns={
+                    'municipio': 'Cidade',
+                    'uf': 'UF',
+                    'num_servicos': 'Qtd. Serviços',
+                    'num_prestadores': 'Qtd. Prestadores',
+                    'num_servicos_nao_atendidos': 'Qtd. Não Atendidos', 
+                    'pct_reembolso': '% Reembolso',
+                    'pct_intermediacao': '% Intermediação',
+                    'media_tempo_chegada': 'TMC Médio (min)',
+                    'indice_capilaridade': 'Índice Capilaridade',
+                    'status_capilaridade': 'Status Capilaridade',
+                    'hhi_prestadores': 'HHI Prestadores',
+                    'participacao_dominante': '% Maior Prestador',
+                    'sugestao_acao': 'Sugestão de Ação'
+                })[[
+                    'Cidade', 
+                    'UF', 
+                    'Qtd. Serviços', 
+                    'Qtd. Não Atendidos', 
+                    'Qtd. Prestadores', 
+                    '% Reembolso', 
+                    '% Intermediação', 
+                    'TMC Médio (min)', 
+                    'Índice Capilaridade', 
+                    'Status Capilaridade', 
+                    'HHI Prestadores',
+                    '% Maior Prestador',
+                    'Sugestão de Ação'
+                ]].style.format({
+                        'Qtd. Serviços': '{:,.0f}',
+                        'Qtd. Não Atendidos': '{:,.0f}', 
+                        'Qtd. Prestadores': '{:,.0f}',
+                        '% Reembolso': '{:.2f}%',
+                        '% Intermediacao': '{:.2f}%',
+                        'TMC Médio (min)': '{:.0f}',
+                        'Índice Capilaridade': '{:.2f}',
+                        'HHI Prestadores': '{:,.0f}',
+                        '% Maior Prestador': '{:.1f}%'
+                    }),
+                use_container_width=True,
+                on_select='rerun' if drilldown is not None else 'ignore',
+                selection_mode='single-row',
+                key='cidades_ofensoras'
+            )
+            
+            col_dl1, col_dl2, col_dl3 = st.columns(3)
+            with col_dl2:
+                st.download_button(
+                    label="Baixar Cidades Ofensoras (XLSX)",
+                    data=functools.partial(to_xlsx_bytes, df_offenders, 'Cidades Ofensoras'),
+                    file_name='cidades_ofensoras_capilaridade.xlsx',
+                    mime=XLSX_MIME,
+                    help="Baixa os dados das cidades identificadas como principais ofensoras na capilaridade em formato XLSX."
+                )
+            with col_dl1:
+                st.download_button(
+                    label="Baixar Todos os Dados de Capilaridade (XLSX)",
+                    data=functools.partial(to_xlsx_bytes, df_agregado_cidade_com_indice, 'Capilaridade Completa'),
+                    file_name='capilaridade_por_cidade_completo.xlsx',
+                    mime=XLSX_MIME,
+                    help="Baixa todos os dados agregados de capilaridade por cidade com os filtros aplicados e sugestões de ação em formato XLSX."
+                )
+
+            if drilldown is not None and evento_ofensoras.selection.rows:
+                cidade = df_offenders.iloc[evento_ofensoras.selection.rows[0]]
+                display_entity_drilldown(drilldown, 'municipio', cidade['uf'], cidade['municipio'])
+        else:
+            st.info("Nenhuma cidade identificada como 'ofensora' com base nos critérios atuais. Excelente!")
+
+        display_specific_problem_rankings(df_agregado_cidade_com_indice)
+
+    else:
+        st.info("Nenhum dado de capilaridade disponível com os filtros e limites selecionados.")
+
+# --- Previsão de Demanda por Cidade (matrizes cidade × mês, todas as cidades de uma vez) ---
+PREVISAO_MODELOS = ["Automático (menor erro recente)", "Sazonal Ingênuo (12 meses)", "Suavização Exponencial"]
+PREVISAO_ALFAS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9) # Grade de alfas da suavização exponencial
+PREVISAO_MESES_VALIDACAO = 3 # Meses finais usados para escolher o modelo de cada cidade no modo automático
+PREVISAO_MESES_PRESTADORES = 3 # Prestadores "atuais" da cidade: os que atenderam nos últimos meses completos
+
+def build_city_month_matrix(df):
+    """
+    Matrizes cidade × mês de serviços (protocolos distintos) e de prestadores distintos, só com meses
+    completos e com zeros nos meses sem atendimento. Devolve também as chaves (uf, municipio) das
+    linhas, o rótulo do próximo mês e os prestadores distintos de cada cidade nos últimos meses.
+    """
+    df_servicos = df[~df['protocolo_atendimento'].duplicated()]
+    datas = df_servicos['data_abertura_atendimento']
+    mes_ordinal = (datas.dt.year * 12 + datas.dt.month - 1).to_numpy(np.int64)
+    ultima_data = datas.max()
+    ultimo_completo = mes_ordinal.max() if ultima_data.is_month_end else mes_ordinal.max() - 1
+    completos = mes_ordinal <= ultimo_completo
+
+    agrupado = df_servicos[completos].groupby(['uf', 'municipio'], observed=True, sort=True)
+    cidade = agrupado.ngroup().to_numpy(np.int64)
+    cidades = agrupado.size().index
+    primeiro = mes_ordinal[completos].min() if completos.any() else ultimo_completo
+    mes = mes_ordinal[completos] - primeiro
+    n_cidades, n_meses = len(cidades), int(ultimo_completo - primeiro + 1)
+
+    servicos = np.bincount(cidade * n_meses + mes, minlength=n_cidades * n_meses).reshape(n_cidades, n_meses)
+
+    prestador = pd.factorize(df_servicos['nome_do_prestador'])[0][completos]
+    n_prestadores = int(prestador.max()) + 1 if len(prestador) else 1
+    com_prestador = prestador >= 0
+    trincas = np.unique(((cidade * n_meses + mes) * n_prestadores + prestador)[com_prestador])
+    prestadores = np.bincount(trincas // n_prestadores, minlength=n_cidades * n_meses).reshape(n_cidades, n_meses)
+
+    recentes = (mes >= n_meses - PREVISAO_MESES_PRESTADORES) & com_prestador
+    pares = np.unique(cidade[recentes] * n_prestadores + prestador[recentes])
+    prestadores_atuais = np.bincount(pares // n_prestadores, minlength=n_cidades)
+
+    proximo_mes = pd.Period(year=int((ultimo_completo + 1) // 12), month=int((ultimo_completo + 1) % 12 + 1), freq='M')
+    return servicos, prestadores, prestadores_atuais, cidades, proximo_mes
+
+def seasonal_naive_forecast(servicos, periodo=12):
+    """Previsão de um passo: o mesmo mês do ano anterior, ou o último mês quando o histórico é mais curto."""
+    return servicos[:, -periodo].astype(float) if servicos.shape[1] >= periodo else servicos[:, -1].astype(float)
+
+def exponential_smoothing_forecast(servicos, alfas=PREVISAO_ALFAS):
+    """
+    Suavização exponencial simples para todas as cidades e alfas ao mesmo tempo: o laço percorre só os
+    meses, com um array (alfa × cidade). Cada cidade usa o alfa de menor erro quadrático de um passo.
+    """
+    alfas = np.asarray(alfas, dtype=float)[:, None]
+    nivel = np.repeat(servicos[None, :, 0].astype(float), len(alfas), axis=0)
+    erro = np.zeros_like(nivel)
+    for t in range(1, servicos.shape[1]):
+        residuo = servicos[:, t] - nivel
+        erro += residuo ** 2
+        nivel += alfas * residuo
+    return nivel[erro.argmin(axis=0), np.arange(servicos.shape[0])]
+
+@st.cache_data(max_entries=8)
+def forecast_city_demand(df, modelo):
+    """
+    Serviços previstos para o próximo mês por (uf, municipio) e o risco de carência: a carga prevista por
+    prestador atual acima do maior volume mensal por prestador que a cidade já absorveu (ou demanda
+    prevista sem nenhum prestador recente). No modo automático, cada cidade usa o modelo de menor erro
+    absoluto nos últimos PREVISAO_MESES_VALIDACAO meses (previsões de um passo).
+    """
+    servicos, prestadores, prestadores_atuais, cidades, proximo_mes = build_city_month_matrix(df)
+    if servicos.shape[1] < 2 or servicos.shape[0] == 0:
+        return pd.DataFrame(), str(proximo_mes)
+
+    modelos = {
+        PREVISAO_MODELOS[1]: seasonal_naive_forecast,
+        PREVISAO_MODELOS[2]: exponential_smoothing_forecast,
+    }
+    if modelo in modelos:
+        previsao = modelos[modelo](servicos)
+        modelo_cidade = np.full(servicos.shape[0], modelo, dtype=object)
+    else:
+        validacao = min(PREVISAO_MESES_VALIDACAO, servicos.shape[1] - 2)
+        erros = np.zeros((len(modelos), servicos.shape[0]))
+        for t in range(servicos.shape[1] - validacao, servicos.shape[1]):
+            for i, previsor in enumerate(modelos.values()):
+                erros[i] += np.abs(previsor(servicos[:, :t]) - servicos[:, t])
+        escolhido = erros.argmin(axis=0) # Empate: sazonal ingênuo, o mais simples
+        previsoes = np.stack([previsor(servicos) for previsor in modelos.values()])
+        previsao = previsoes[escolhido, np.arange(servicos.shape[0])]
+        modelo_cidade = np.asarray(list(modelos), dtype=object)[escolhido]
+
+    carga_historica = np.where(prestadores > 0, servicos / np.maximum(prestadores, 1), 0).max(axis=1)
+    carga_prevista = np.divide(previsao, prestadores_atuais, out=np.full(len(previsao), np.inf), where=prestadores_atuais > 0)
+    risco = (previsao >= 1) & ((prestadores_atuais == 0) | (carga_prevista > carga_historica))
+
+    df_previsao = cidades.to_frame(index=False).assign(
+        servicos_ultimo_mes=servicos[:, -1],
+        previsao_servicos=np.round(previsao, 1),
+        prestadores_atuais=prestadores_atuais,
+        carga_prevista_por_prestador=np.round(carga_prevista, 1),
+        carga_maxima_historica=np.round(carga_historica, 1),
+        modelo=modelo_cidade,
+        risco_carencia=risco
+    )
+    return df_previsao, str(proximo_mes)
+
+@st.fragment
+def demand_forecast_fragment(df):
+    """Previsão do próximo mês por cidade e cidades em risco de carência. Fragmento: trocar o modelo reexecuta só esta seção."""
+    st.markdown("---")
+    st.header("Previsão de Demanda e Risco de Carência")
+    modelo = st.radio("Modelo de previsão", PREVISAO_MODELOS, horizontal=True, key="previsao_modelo")
+    df_previsao, proximo_mes = forecast_city_demand(df, modelo)
+    if df_previsao.empty:
+        st.info("São necessários ao menos dois meses completos no período selecionado para prever a demanda.")
+        return
+
+    df_risco = df_previsao[df_previsao['risco_carencia']].sort_values('previsao_servicos', ascending=False)
+    col1, col2 = st.columns(2)
+    col1.metric(f"Serviços Previstos ({proximo_mes})", format_pt_br(df_previsao['previsao_servicos'].sum()))
+    col2.metric("Cidades em Risco de Carência", format_pt_br(len(df_risco)))
+    st.caption(
+        "Risco de carência: a demanda prevista por prestador atual (ativos nos últimos "
+        f"{PREVISAO_MESES_PRESTADORES} meses completos) supera o maior volume mensal por prestador já absorvido pela cidade, "
+        "ou há demanda prevista sem prestadores recentes."
+    )
+    if df_risco.empty:
+        st.success("Nenhuma cidade com risco de carência previsto para o próximo mês.")
+    else:
+        st.dataframe(
+            df_risco.rename(columns={
+                'municipio': 'Cidade',
+                'uf': 'UF',
+                'servicos_ultimo_mes': 'Serviços (Último Mês)',
+                'previsao_servicos': 'Serviços Previstos',
+                'prestadores_atuais': 'Prestadores Atuais',
+                'carga_prevista_por_prestador': 'Carga Prevista/Prestador',
+                'carga_maxima_historica': 'Carga Máx. Histórica/Prestador',
+                'modelo': 'Modelo'
+            }).drop(columns='risco_carencia').style.format({
+                'Serviços Previstos': '{:,.1f}',
+                'Carga Prevista/Prestador': '{:,.1f}',
+                'Carga Máx. Histórica/Prestador': '{:,.1f}'
+            }),
+            use_container_width=True
+        )
+    st.download_button(
+        label="Baixar Previsão por Cidade (XLSX)",
+        data=functools.partial(to_xlsx_bytes, df_previsao, 'Previsao Demanda'),
+        file_name=f"previsao_demanda_{proximo_mes}.xlsx",
+        mime=XLSX_MIME
+    )
+
+# --- Mapa Coroplético por Município (TopoJSON local pré-simplificado, recolorido por vetor de códigos) ---
+MAPA_METRICAS = {
+    'indice_capilaridade': {'rotulo': 'Índice de Capilaridade', 'escala': 'RdYlGn'},
+    'status_capilaridade': {'rotulo': 'Status de Capilaridade', 'categorias': {
+        'Carência Assistencial': '#EF5350', 'Capilaridade Regular': '#FFCA28', 'Boa Capilaridade': '#66BB6A'
+    }},
+    'nps_score': {'rotulo': 'NPS', 'escala': 'RdYlGn', 'faixa': (-100, 100)},
+}
+
+def topojson_features(topologia):
+    """
+    Features GeoJSON de um TopoJSON (arcos quantizados em deltas): uma soma acumulada sobre todos os arcos
+    concatenados, descontada no início de cada arco, em vez de um laço por arco.
+    """
+    arcos = topologia['arcs']
+    tamanhos = np.fromiter((len(arco) for arco in arcos), dtype=np.int64, count=len(arcos))
+    pontos = np.concatenate([np.asarray(arco, dtype=float).reshape(-1, 2) for arco in arcos]) if arcos else np.zeros((0, 2))
+    if 'transform' in topologia:
+        acumulado = np.cumsum(pontos, axis=0)
+        inicio = np.r_[0, np.cumsum(tamanhos)[:-1]]
+        base = np.vstack([np.zeros((1, 2)), acumulado])[inicio]
+        pontos = acumulado - np.repeat(base, tamanhos, axis=0)
+        pontos = pontos * topologia['transform']['scale'] + topologia['transform']['translate']
+    coordenadas_arcos = np.split(pontos.round(5), np.cumsum(tamanhos)[:-1])
+
+    def anel(indices):
+        partes = [coordenadas_arcos[i] if i >= 0 else coordenadas_arcos[~i][::-1] for i in indices]
+        return np.concatenate([partes[0]] + [parte[1:] for parte in partes[1:]]).tolist()
+
+    features = []
+    for posicao, geometria in enumerate(topologia['objects']['municipios']['geometries']):
+        if geometria['type'] == 'Polygon':
+            coordenadas = [anel(indices) for indices in geometria['arcs']]
+        else:
+            coordenadas = [[anel(indices) for indices in poligono] for poligono in geometria['arcs']]
+        features.append({
+            'type': 'Feature', 'id': posicao, 'properties': geometria.get('properties', {}),
+            'geometry': {'type': geometria['type'], 'coordinates': coordenadas}
+        })
+    return features
+
+@st.cache_resource
+def load_municipio_geometry(nivel):
+    """Geometrias de um nível de detalhe, decodificadas uma vez por processo, com a chave 'UF|MUNICÍPIO' de cada posição."""
+    caminho = os.path.join(MAPAS_DIR, f"municipios_{nivel}.topo.json")
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding='utf-8') as arquivo:
+        features = topojson_features(json.load(arquivo))
+    ufs = np.array([normalize_text_key(feature['properties'].get('uf', '')) for feature in features])
+    chaves = pd.Index([f"{uf}|{normalize_text_key(feature['properties'].get('nome', ''))}" for uf, feature in zip(ufs, features)])
+    posicoes = pd.Series(np.arange(len(features)), index=chaves)
+    return {'features': features, 'uf': ufs, 'posicoes': posicoes[~chaves.duplicated()]}
+
+def map_level(n_ufs):
+    """
+    Nível de detalhe pelo zoom que a seleção implica: o Brasil (ou muitas UFs) na grade grossa, poucas UFs na
+    média e uma UF na fina. Sem o arquivo do nível ideal, usa o mais próximo disponível.
+    """
+    niveis = list(MAPA_NIVEIS)
+    ideal = 0 if n_ufs > 3 else (1 if n_ufs > 1 else 2)
+    for nivel in sorted(niveis, key=lambda nivel: abs(niveis.index(nivel) - ideal)):
+        if os.path.exists(os.path.join(MAPAS_DIR, f"municipios_{nivel}.topo.json")):
+            return nivel
+    return None
+
+@st.cache_resource(max_entries=16)
+def choropleth_base(nivel, ufs):
+    """Figura-base (dict do Plotly) com as geometrias das UFs exibidas; compartilhada entre métricas e nunca alterada."""
+    geometria = load_municipio_geometry(nivel)
+    posicoes = np.flatnonzero(np.isin(geometria['uf'], ufs))
+    features = [geometria['features'][posicao] for posicao in posicoes]
+    return {
+        'posicoes': posicoes,
+        'figura': {
+            'data': [{
+                'type': 'choropleth',
+                'geojson': {'type': 'FeatureCollection', 'features': features},
+                'featureidkey': 'id',
+                'locations': posicoes.tolist(),
+                'text': [f"{feature['properties'].get('nome', '')} ({feature['properties'].get('uf', '')})" for feature in features],
+                'hovertemplate': '%{text}<br>%{z}<extra></extra>',
+                'marker': {'line': {'width': 0.2, 'color': '#FFFFFF'}}
+            }],
+            'layout': {
+                'geo': {'fitbounds': 'locations', 'visible': False, 'projection': {'type': 'mercator'}},
+                'margin': {'l': 0, 'r': 0, 't': 0, 'b': 0},
+                'height': 600
+            }
+        }
+    }
+
+@st.cache_resource(max_entries=32)
+def choropleth_figure(nivel, ufs, metrica, assinatura, _valores):
+    """
+    Figura da métrica em cache por (nível, UFs, métrica, assinatura dos valores). `_valores` é indexado pelo
+    código (posição) do município: recolorir é trocar o z do traço, sem reconstruir as geometrias.
+    """
+    base = choropleth_base(nivel, ufs)
+    config = MAPA_METRICAS[metrica]
+    z = _valores[base['posicoes']]
+    traco = {**base['figura']['data'][0], 'z': [None if np.isnan(valor) else float(valor) for valor in z]}
+    if 'categorias' in config:
+        cores = list(config['categorias'].values())
+        passo = 1 / len(cores)
+        traco['colorscale'] = [[limite, cor] for i, cor in enumerate(cores) for limite in (i * passo, (i + 1) * passo)]
+        traco.update(zmin=-0.5, zmax=len(cores) - 0.5, colorbar={'title': config['rotulo'], 'tickvals': list(range(len(cores))), 'ticktext': list(config['categorias'])})
+        traco['hovertemplate'] = '%{text}<extra></extra>'
+    else:
+        traco.update(colorscale=config['escala'], colorbar={'title': config['rotulo']})
+        if 'faixa' in config:
+            traco.update(zmin=config['faixa'][0], zmax=config['faixa'][1])
+    # Já como Figure: um dict seria validado e convertido pelo Streamlit a cada rerun
+    return importlib.import_module('plotly.graph_objects').Figure({'data': [traco], 'layout': base['figura']['layout']})
+
+def municipality_map(df_municipios, metrica):
+    """Mapa coroplético de uma métrica de MAPA_METRICAS por (uf, municipio)."""
+    import hashlib
+
+    ufs = tuple(sorted(set(df_municipios['uf'].astype(str).map(normalize_text_key))))
+    nivel = map_level(len(ufs))
+    if nivel is None:
+        st.info("Mapa indisponível: gere as geometrias dos municípios com `python mapas.py <malha municipal do IBGE>.geojson`.")
+        return
+    geometria = load_municipio_geometry(nivel)
+    chaves = df_municipios['uf'].astype(str).map(normalize_text_key) + '|' + df_municipios['municipio'].astype(str).map(normalize_text_key)
+    codigos = geometria['posicoes'].reindex(chaves).to_numpy()
+    encontrados = ~np.isnan(codigos)
+
+    config = MAPA_METRICAS[metrica]
+    if 'categorias' in config:
+        valores_linhas = pd.Categorical(df_municipios[metrica].astype(str), categories=list(config['categorias'])).codes.astype(float)
+        valores_linhas[valores_linhas < 0] = np.nan
+    else:
+        valores_linhas = df_municipios[metrica].to_numpy(dtype=float)
+    valores = np.full(len(geometria['features']), np.nan)
+    valores[codigos[encontrados].astype(np.int64)] = valores_linhas[encontrados]
+
+    assinatura = hashlib.blake2b(valores.tobytes(), digest_size=16).hexdigest()
+    st.plotly_chart(choropleth_figure(nivel, ufs, metrica, assinatura, _valores=valores), use_container_width=True)
+    if not encontrados.all():
+        st.caption(f"{(~encontrados).sum()} município(s) sem geometria correspondente não aparecem no mapa (nível de detalhe: {nivel}).")
+
+def page_capilaridade(df, sketches=None, backend=None, filtros=None, drilldown=None, comparacao=None):
+    st.title("Capilaridade da Rede")
+    st.markdown("Esta seção oferece uma visão detalhada da distribuição e cobertura dos nossos prestadores, identificando áreas de alta demanda e oportunidades de expansão.")
+
+    backend = backend or PandasBackend(df)
+    df_agregado_cidade = backend.agregado_cidades(filtros)
+
+    df_agregado_cidade = add_capilaridade_rates(df_agregado_cidade)
+
+    # Pesos e mínimo de atendimentos vivem no fragmento: mudá-los não reagrega as cidades
+    capilaridade_cidades_fragment(df, df_agregado_cidade, sketches, drilldown, comparacao)
+
+    if not df.empty:
+        demand_forecast_fragment(df)
+
+    with st.expander("💡 Como é calculado o Índice de Capilaridade?"):
+        st.markdown(r"""
+        O **Índice de Capilaridade** é um score composto que avalia a eficiência e a cobertura da rede em cada cidade, combinando múltiplos fatores:
+
+        * **Normalização dos Dados:** Todos os componentes são normalizados entre 0 e 1 (ou 0 a 100) para garantir que tenham o mesmo peso e não sejam dominados por valores absolutos.
+        * **Normalização por Percentil (opcional):** Com a opção 'Percentil (Robusto)' na barra lateral, cada componente passa a ser o percentil da cidade na distribuição histórica mensal das UFs e segmentos selecionados, mantida em sketches de quantis por partição. Atendimentos e prestadores entram como média por mês com atendimento, na mesma escala da distribuição. Assim uma única cidade atípica não distorce a escala das demais.
+        * **Componentes e Pesos (padrão, ajustáveis em 'Simulação de Pesos'):**
+            * **Volume de Serviços (30%):** Cidades com maior volume de serviços contribuem positivamente, pois representam demanda onde a capilaridade é crítica.
+            * **Número de Prestadores (30%):** Uma maior quantidade de prestadores únicos em uma cidade indica melhor oferta de serviços.
+            * **Reembolso (20%):** Menor percentual de serviços que resultam em reembolso indica que a rede está mais eficaz em resolver o problema diretamente. (Peso inverso: quanto menor o reembolso, maior a contribuição positiva).
+            * **Intermediação (10%):** Menor percentual de serviços que necessitam de intermediação (ou seja, resolvidos diretamente pela rede própria) indica maior eficiência. (Peso inverso).
+            * **Tempo Médio de Chegada (10%):** Tempos de chegada menores indicam agilidade e proximidade dos prestadores. (Peso inverso).
+
+        **Fórmula Simplificada:**
+        $$ \text{Índice Capilaridade} = \left( \text{Serviços Normalizados} \times 0.3 \right) + \left( \text{Prestadores Normalizados} \times 0.3 \right) + \left( (1 - \text{Reembolso Normalizado}) \times 0.2 \right) + \left( (1 - \text{Intermediação Normalizada}) \times 0.1 \right) + \left( (1 - \text{TMC Normalizado}) \times 0.1 \right) $$
+
+        **Classificação do Status de Capilaridade:**
+        O status é determinado pelos quartis do Índice de Capilaridade:
+        * **Carência Assistencial:** Cidades no quartil inferior (piores 25%).
+        * **Capilaridade Regular:** Cidades entre o primeiro e o terceiro quartil (25% a 75%).
+        * **Boa Capilaridade:** Cidades no quartil superior (melhores 25%).
+        """)
+
+    with st.expander("💡 Como são geradas as Sugestões de Ação?"):
+        st.markdown("""
+        As sugestões de ação são geradas dinamicamente para cada município com base em suas características e desvios em relação à média:
+        * **Carência Assistencial:** Se o status de capilaridade for 'Carência Assistencial', a sugestão é 'Recrutamento urgente de prestadores. Analisar concorrência local.'
+        * **Ausência de Prestadores:** Se a cidade tem atendimentos, mas nenhum prestador registrado ('Qtd. Prestadores' é zero), a sugestão é 'Ausência de prestadores. Foco total em parceria local.'
+        * **Dependência de um Único Prestador:** Se a concentração dos serviços entre os prestadores da cidade (HHI, de 0 a 10.000) é de pelo menos 5.000, com ao menos 10 serviços, a sugestão é credenciar prestadores alternativos ao prestador dominante.
+        * **Alto % de Reembolso:** Se o percentual de reembolso da cidade está acima do percentil 80 das cidades analisadas, a sugestão é 'Alto % de reembolso. Investigar causas de insatisfação ou deficiência de prestadores.'
+        * **Alto % de Intermediação:** Se o percentual de intermediação da cidade está acima do percentil 80, a sugestão é 'Alto % de intermediação. Otimizar processos de acionamento ou recrutar prestadores diretos.'
+        * **Alto Tempo Médio de Chegada (TMC):** Se o TMC da cidade está acima do percentil 80, a sugestão é 'Alto tempo de chegada. Otimizar rotas ou aumentar a densidade de prestadores próximos.'
+        As sugestões são combinadas e ordenadas para fornecer um plano de ação abrangente para cada município.
+        """)
+
+@st.cache_data(max_entries=16)
+def cms_robust_stats(df):
+    """
+    Mediana e p90 do valor por serviço por (prestador, UF, segmento), junto com mediana, p90 e MAD
+    da UF/segmento de referência. Usa o kernel de quantis agrupados: uma ordenação por nível.
+    """
+    df_analise = df[df['segmento'].isin(SEGMENTOS_ANALISE_CMS)]
+    chaves_segmento = ['uf', 'segmento']
+    chaves_prestador = ['nome_do_prestador', *chaves_segmento]
+
+    indice_segmento = build_group_index(df_analise, chaves_segmento, 'val_total_items')
+    quantis_segmento = grouped_quantiles(indice_segmento, [50, 90])
+    df_segmento = indice_segmento['chaves'].to_frame(index=False)
+    df_segmento['mediana_uf_segmento'] = quantis_segmento[:, 0]
+    df_segmento['p90_uf_segmento'] = quantis_segmento[:, 1]
+    df_segmento['mad_uf_segmento'] = grouped_mad(indice_segmento)
+
+    indice_prestador = build_group_index(df_analise, chaves_prestador, 'val_total_items')
+    quantis_prestador = grouped_quantiles(indice_prestador, [50, 90])
+    df_robusto = indice_prestador['chaves'].to_frame(index=False)
+    df_robusto['mediana_prestador'] = quantis_prestador[:, 0]
+    df_robusto['p90_prestador'] = quantis_prestador[:, 1]
+
+    # Chaves como texto: o resultado é combinado com as saídas de qualquer backend (categorias ou strings)
+    for chaves, frame in ((chaves_prestador, df_robusto), (chaves_segmento, df_segmento)):
+        frame[chaves] = frame[chaves].astype(str)
+    return df_robusto.merge(df_segmento, on=chaves_segmento, how='left')
+
+def flag_cms_offenders(cms_ofensores, cms_robusto=None):
+    """
+    Marca os ofensores de CMS e o potencial de economia. Com `cms_robusto` (de cms_robust_stats) usa o
+    critério Mediana/MAD; sem ele, o critério do CMS médio da UF/segmento +10%.
+    """
+    cms_ofensores = cms_ofensores.copy()
+    if cms_robusto is not None:
+        chaves = ['nome_do_prestador', 'uf', 'segmento']
+        cms_ofensores[chaves] = cms_ofensores[chaves].astype(str)
+        cms_ofensores = cms_ofensores.merge(cms_robusto, on=chaves, how='left')
+        excesso = cms_ofensores['mediana_prestador'] - cms_ofensores['mediana_uf_segmento']
+        escala = 1.4826 * cms_ofensores['mad_uf_segmento']
+        # MAD zero (valores tabelados): qualquer mediana acima da referência já é um desvio
+        cms_ofensores['z_robusto'] = np.where(escala > 0, excesso / escala.where(escala > 0), np.where(excesso > 0, np.inf, 0.0))
+        cms_ofensores['is_ofensor'] = cms_ofensores['z_robusto'] > CMS_Z_ROBUSTO_LIMITE
+        cms_ofensores['potencial_economia_rs'] = np.where(cms_ofensores['is_ofensor'], excesso * cms_ofensores['qtd_servicos'], 0)
+    else:
+        cms_ofensores['is_ofensor'] = (cms_ofensores['cms_prestador'] > cms_ofensores['cms_medio_uf_segmento'] * 1.10)
+
+        cms_ofensores['potencial_economia_rs'] = np.where(
+            cms_ofensores['is_ofensor'],
+            (cms_ofensores['cms_prestador'] - cms_ofensores['cms_medio_uf_segmento']) * cms_ofensores['qtd_servicos'],
+            0
+        )
+
+    cms_ofensores['cms_prestador'] = cms_ofensores['cms_prestador'].fillna(0)
+    cms_ofensores['cms_medio_uf_segmento'] = cms_ofensores['cms_medio_uf_segmento'].fillna(0)
+    cms_ofensores['potencial_economia_rs'] = cms_ofensores['potencial_economia_rs'].fillna(0)
+    return cms_ofensores
+
+def page_financeiro(df, backend=None, filtros=None, comparacao=None):
+    st.title("Análise Financeira da Rede de Prestadores")
+    st.markdown("Monitore os custos, otimize as despesas e melhore a rentabilidade da sua rede.")
+
+    st.markdown("---")
+    st.header("KPIs Financeiros Gerais")
+    st.markdown("Visualize os indicadores financeiros chave da sua rede.")
+
+    total_gasto = df['val_total_items'].sum()
+    total_servicos = len(df)
+    cms_medio = total_gasto / total_servicos if total_servicos > 0 else 0
+    total_reembolso = df['val_reembolso'].sum()
+    pct_gasto_reembolso = (total_reembolso / total_gasto) * 100 if total_gasto > 0 else 0
+    total_intermediacao_servicos = df['is_intermediacao'].sum()
+    pct_intermediacao_servicos = (total_intermediacao_servicos / total_servicos) * 100 if total_servicos > 0 else 0
+
+    # No modo de comparação, base e comparação vêm de uma única agregação sobre a união dos períodos
+    deltas = {}
+    if comparacao is not None:
+        kpis_periodos = financial_kpis_by_period(comparacao['df'])
+        kpis_base, kpis_comparacao = kpis_periodos.loc[PERIODO_BASE], kpis_periodos.loc[PERIODO_COMPARACAO]
+        deltas = {
+            'total_gasto': delta_percentual(kpis_base['total_gasto'], kpis_comparacao['total_gasto']),
+            'cms_medio': delta_percentual(kpis_base['cms_medio'], kpis_comparacao['cms_medio']),
+            'total_reembolso': delta_percentual(kpis_base['total_reembolso'], kpis_comparacao['total_reembolso']),
+            'pct_gasto_reembolso': delta_pontos(kpis_base['pct_gasto_reembolso'], kpis_comparacao['pct_gasto_reembolso']),
+            'pct_intermediacao_servicos': delta_pontos(kpis_base['pct_intermediacao_servicos'], kpis_comparacao['pct_intermediacao_servicos'])
+        }
+        st.caption(f"Deltas em relação ao período de comparação ({comparacao['rotulos'][PERIODO_COMPARACAO]}).")
+
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Gasto Total", f"R$ {total_gasto:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), delta=deltas.get('total_gasto'), delta_color="inverse", help="Soma total dos valores dos itens em todos os serviços.")
+    col2.metric("CMS Médio", f"R$ {cms_medio:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), delta=deltas.get('cms_medio'), delta_color="inverse", help="Custo Médio por Serviço (CMS) por serviço.")
+    col3.metric("Total de Reembolso", f"R$ {total_reembolso:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), delta=deltas.get('total_reembolso'), delta_color="inverse", help="Valor total de todos os reembolsos.")
+    col4.metric("% Gasto c/ Reembolso", f"{pct_gasto_reembolso:.2f}%", delta=deltas.get('pct_gasto_reembolso'), delta_color="inverse", help="Percentual do gasto total que foi via reembolso.")
+    col5.metric("P/ Serv. Intermediação", f"{pct_intermediacao_servicos:.2f}%", delta=deltas.get('pct_intermediacao_servicos'), delta_color="inverse", help="Percentual de serviços que foram de intermediação.")
+
+    backend = backend or PandasBackend(df)
+
+    st.markdown("---")
+    st.header("Custo Médio por Faixa de Tempo de Chegada")
+    st.markdown("Avalie o **impacto do tempo de chegada no custo do serviço**. Tempos de chegada muito curtos (urgência) ou muito longos (ineficiência) podem influenciar o custo final.")
+
+    if 'tempo_chegada_min' in df.columns and pd.api.types.is_numeric_dtype(df['tempo_chegada_min']):
+        if df['tempo_chegada_min'].notna().any():
+            labels = FAIXAS_TEMPO_CHEGADA
+            cms_por_tempo = backend.cms_por_faixa_tempo(filtros)
+
+            cms_por_tempo['cms'] = cms_por_tempo['cms'].fillna(0)
+
+            if not cms_por_tempo.empty:
+                cms_por_tempo['faixa_tempo_chegada'] = pd.Categorical(cms_por_tempo['faixa_tempo_chegada'], categories=labels, ordered=True)
+                cms_por_tempo = cms_por_tempo.sort_values('faixa_tempo_chegada')
+
+                cms_por_tempo_display = cms_por_tempo.rename(columns={
+                    'faixa_tempo_chegada': 'Faixa de Tempo de Chegada',
+                    'qtd_servicos': 'Qtd. Serviços',
+                    'cms': 'CMS'
+                })
+
+                st.subheader("CMS por Faixa de Tempo de Chegada")
+                fig_cms_tempo = plotly_figure(
+                    'financeiro.cms_por_tempo', cms_por_tempo_display,
+                    lambda dados: px.bar(
+                        dados,
+                        x='Faixa de Tempo de Chegada',
+                        y='CMS',
+                        title='Custo Médio por Tempo de Chegada',
+                        labels={'CMS': 'CMS (R$)'},
+                        color_discrete_sequence=['#2021D4']
+                    ).update_layout(xaxis_title="", yaxis_title="CMS (R$)", hovermode="x unified")
+                )
+                st.plotly_chart(fig_cms_tempo, use_container_width=True)
+
+                st.subheader("Tabela de CMS por Faixa de Tempo de Chegada")
+                st.dataframe(
+                    cms_por_tempo_display.style.format({
+                        'Qtd. Serviços': '{:,.0f}',
+                        'CMS': 'R$ {:,.2f}'
+                    }),
+                    use_container_width=True
+                )
+            else:
+                st.info("Nenhum dado de CMS por faixa de tempo de chegada disponível com os filtros selecionados e dados válidos.")
+        else:
+            st.info("Não há dados de 'Tempo de Chegada' válidos para as faixas de tempo após os filtros selecionados.")
+    else:
+        st.warning("Coluna 'tempo_chegada_min' não encontrada ou não é numérica no DataFrame. Não foi possível gerar a análise por tempo de chegada.")
+
+    # As agregações ficam fora do fragmento: mudar o mínimo de atendimentos só refiltra os resultados
+    financeiro_prestadores_fragment(backend.cms_por_prestador(filtros), backend.cms_ofensores(filtros), cms_robust_stats(df), comparacao)
+
+@st.fragment
+def financeiro_prestadores_fragment(cms_por_prestador, cms_ofensores, cms_robusto, comparacao=None):
+    """Ranking de CMS e ofensores por prestador. Fragmento: o mínimo de atendimentos reexecuta só esta seção."""
+    st.markdown("---")
+    min_servicos_prestador = st.number_input(
+        label="Defina o Mínimo de Atendimentos por Prestador", 
+        min_value=1,
+        max_value=200,
+        value=MIN_ATTENDANCES_FOR_RANKING,
+        step=1,
+        help="Prestadores com um número de serviços abaixo deste valor não serão incluídos nas análises de ranking e ofensores."
+    )
+
+    st.markdown("---")
+    st.header("Ranking de Custo Médio por Serviço (CMS) por Prestador")
+    st.markdown("Identifique os **prestadores com maior e menor CMS**. Uma alta variância pode indicar oportunidades de negociação ou revisão de processos.")
+
+    cms_por_prestador = cms_por_prestador[cms_por_prestador['qtd_servicos'] >= min_servicos_prestador]
+
+    cms_por_prestador['cms'] = cms_por_prestador['cms'].fillna(0)
+
+    if not cms_por_prestador.empty:
+        cms_por_prestador_display = cms_por_prestador.rename(columns={
+            'nome_do_prestador': 'Prestador',
+            'qtd_servicos': 'Qtd. Serviços',
+            'cms': 'CMS'
+        })
+
+        st.subheader(f"Top {min(10, len(cms_por_prestador_display))} Prestadores por CMS")
+        top_10_cms = cms_por_prestador_display.sort_values('CMS', ascending=False).head(10)
+        fig_top_cms = plotly_figure(
+            'financeiro.top_cms', top_10_cms,
+            lambda dados: px.bar(
+                dados,
+                x='Prestador',
+                y='CMS',
+                title='Prestadores com Maior Custo Médio por Serviço',
+                labels={'CMS': 'CMS (R$)'},
+                color_discrete_sequence=['#2021D4']
+            ).update_layout(xaxis_title="", yaxis_title="CMS (R$)", hovermode="x unified")
+        )
+        st.plotly_chart(fig_top_cms, use_container_width=True)
+
+        st.subheader("Tabela Completa de CMS por Prestador")
+        st.dataframe(
+            cms_por_prestador_display.sort_values('CMS', ascending=False).style.format({
+                'Qtd. Serviços': '{:,.0f}',
+                'CMS': 'R$ {:,.2f}'
+            }),
+            use_container_width=True
+        )
+    else:
+        st.info(f"Nenhum dado de CMS por prestador (com mais de {min_servicos_prestador} serviços) disponível com os filtros selecionados.")
+
+    if comparacao is not None:
+        display_period_comparison(
+            cms_by_period(comparacao['df'], min_servicos_prestador),
+            {
+                'nome_do_prestador': 'Prestador',
+                'cms_base': 'CMS (Base)',
+                'cms_comparacao': 'CMS (Comparação)',
+                'delta_cms': 'Δ CMS',
+                'qtd_servicos_base': 'Qtd. Serviços (Base)',
+                'qtd_servicos_comparacao': 'Qtd. Serviços (Comparação)'
+            },
+            'delta_cms', comparacao['rotulos'], crescente=False
+        )
+
+
+    st.markdown("---")
+    st.header("Análise de Ofensores de CMS por Prestador")
+    st.markdown("Identifique prestadores com CMS acima do **padrão de sua UF e segmento**, e calcule o potencial de economia.")
+    criterio = st.radio(
+        "Critério de Ofensor",
+        CRITERIOS_OFENSOR_CMS,
+        horizontal=True,
+        key="criterio_ofensor_cms",
+        help=(
+            f"Mediana/MAD: o prestador é ofensor quando a mediana do seu valor por serviço excede a mediana da UF/segmento "
+            f"em mais de {CMS_Z_ROBUSTO_LIMITE:g} desvios robustos (1,4826 × MAD), o que não é distorcido por poucos serviços caros. "
+            "Média +10%: critério anterior, CMS médio do prestador acima de 110% da média da UF/segmento."
+        )
+    )
+    robusto = criterio == CRITERIOS_OFENSOR_CMS[0]
+
+    if cms_ofensores.empty:
+        st.info("Nenhum dado disponível para os segmentos AUTO, RESID ou VIDA com os filtros selecionados.")
+    else:
+        cms_ofensores = flag_cms_offenders(
+            cms_ofensores[cms_ofensores['qtd_servicos'] >= min_servicos_prestador],
+            cms_robusto if robusto else None
+        )
+
+        cms_ofensores_display = cms_ofensores.rename(columns={
+            'nome_do_prestador': 'Prestador',
+            'uf': 'UF',
+            'segmento': 'Segmento',
+            'qtd_servicos': 'Qtd. Serviços',
+            'cms_prestador': 'CMS do Prestador',
+            'cms_medio_uf_segmento': 'CMS Médio UF/Segmento',
+            'mediana_prestador': 'Mediana do Prestador',
+            'p90_prestador': 'p90 do Prestador',
+            'mediana_uf_segmento': 'Mediana UF/Segmento',
+            'p90_uf_segmento': 'p90 UF/Segmento',
+            'mad_uf_segmento': 'MAD UF/Segmento',
+            'z_robusto': 'Z Robusto',
+            'is_ofensor': 'Ofensor?',
+            'potencial_economia_rs': 'Potencial de Economia (R$)'
+        })
+
+        prestadores_para_excluir = ['VAZIO', 'MOVIDA', 'LOCALIZA RENT A CAR']
+        
+        cms_ofensores_display = cms_ofensores_display[
+            ~cms_ofensores_display['Prestador'].isin(prestadores_para_excluir)
+        ]
+
+        if not cms_ofensores_display.empty:
+            st.subheader("Tabela de Ofensores de CMS")
+            st.dataframe(
+                cms_ofensores_display.sort_values('Potencial de Economia (R$)', ascending=False).style.format({
+                    'Qtd. Serviços': '{:,.0f}',
+                    'CMS do Prestador': 'R$ {:,.2f}',
+                    'CMS Médio UF/Segmento': 'R$ {:,.2f}',
+                    'Mediana do Prestador': 'R$ {:,.2f}',
+                    'p90 do Prestador': 'R$ {:,.2f}',
+                    'Mediana UF/Segmento': 'R$ {:,.2f}',
+                    'p90 UF/Segmento': 'R$ {:,.2f}',
+                    'MAD UF/Segmento': 'R$ {:,.2f}',
+                    'Z Robusto': '{:,.2f}',
+                    'Potencial de Economia (R$)': 'R$ {:,.2f}'
+                }),
+                use_container_width=True
+            )
+            total_economia = cms_ofensores_display['Potencial de Economia (R$)'].sum()
+            st.metric("Total Potencial de Economia (Prestadores Ofensores)", f"R$ {total_economia:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+        else:
+            st.info("Nenhum prestador identificado como 'ofensor' de CMS com base nos critérios e filtros selecionados.")
+
+def page_qualidade(df_final_filtrado, df_nps_cidade_full, df_nps_prestador):
+    st.title("✨ Qualidade e NPS")
+    st.markdown("Esta seção exibe a evolução do Net Promoter Score (NPS) e os rankings de qualidade por cidade e prestador.")
+
+    # Função para formatar números no padrão PT-BR
+    def format_pt_br(value, precision=0):
+        if pd.isna(value):
+            return "N/A"
+        if precision == 0:
+            formatted = f"{value:,.0f}"
+        else:
+            formatted = f"{value:,.{precision}f}"
+        # Inverte vírgula e ponto para padrão PT-BR
+        return formatted.replace(",", "X").replace(".", ",").replace("X", ".")
+
+    # Exemplo usando df_nps_cidade_full para evolução do NPS
+    if not df_nps_cidade_full.empty:
+        # Garante que 'mes_ano' seja datetime para o gráfico
+        if pd.api.types.is_period_dtype(df_nps_cidade_full['mes_ano']):
+            df_nps_cidade_full['mes_ano_dt'] = df_nps_cidade_full['mes_ano'].dt.to_timestamp()
+        else:
+            df_nps_cidade_full['mes_ano_dt'] = pd.to_datetime(df_nps_cidade_full['mes_ano'], errors='coerce')
+
+
+        df_nps_evolucao = df_nps_cidade_full.groupby('mes_ano_dt').agg(
+            promotores=('nps_promotores', 'sum'),
+            detratores=('nps_detratores', 'sum'),
+            neutros=('nps_neutros', 'sum')
+        ).reset_index()
+
+        df_nps_evolucao['total_responses'] = df_nps_evolucao['promotores'] + df_nps_evolucao['detratores'] + df_nps_evolucao['neutros']
+        df_nps_evolucao['nps_score'] = np.where(
+            df_nps_evolucao['total_responses'] > 0,
+            ((df_nps_evolucao['promotores'] - df_nps_evolucao['detratores']) / df_nps_evolucao['total_responses']) * 100,
+            np.nan
+        )
+        df_nps_evolucao = df_nps_evolucao.dropna(subset=['nps_score']).sort_values('mes_ano_dt')
+
+        st.markdown("---")
+        st.subheader("Evolução do Net Promoter Score (NPS) Geral")
+        if not df_nps_evolucao.empty:
+            fig_nps = plotly_figure(
+                'qualidade.nps_evolucao', df_nps_evolucao[['mes_ano_dt', 'nps_score']],
+                lambda dados: px.line(
+                    dados,
+                    x='mes_ano_dt',
+                    y='nps_score',
+                    title='Evolução Mensal do NPS Geral',
+                    labels={'mes_ano_dt': 'Mês/Ano', 'nps_score': 'NPS'},
+                    markers=True
+                ).update_xaxes(dtick="M1", tickformat="%b\n%Y").update_yaxes(range=[-100, 100])
+            )
+            st.plotly_chart(fig_nps, use_container_width=True)
+        else:
+            st.info("Nenhum dado disponível para a evolução mensal do NPS.")
+    else:
+        st.info("Nenhum dado de NPS por cidade disponível para calcular a evolução do NPS geral.")
+    
+    # --- Ranking NPS por Cidade (Top 10 e Piores 10) ---
+    st.markdown("---")
+    st.subheader("NPS por Cidade")
+    st.info("Visualize as cidades com melhor e pior desempenho no NPS. Isso pode indicar onde focar esforços de melhoria de serviço.")
+
+    if df_nps_cidade_full.empty:
+        st.warning("Nenhum dado de NPS por cidade disponível para esta análise. Verifique o arquivo 'processed_nps_by_city.parquet'.")
+    else:
+        # Agregamos o NPS por cidade, considerando as avaliações totais para relevância
+        df_nps_cidade_agg = df_nps_cidade_full.groupby('municipio', observed=True).agg(
+            promotores=('nps_promotores', 'sum'),
+            detratores=('nps_detratores', 'sum'),
+            neutros=('nps_neutros', 'sum')
+        ).reset_index()
+
+        df_nps_cidade_agg['total_avaliacoes'] = df_nps_cidade_agg['promotores'] + df_nps_cidade_agg['detratores'] + df_nps_cidade_agg['neutros']
+        df_nps_cidade_agg['nps_score'] = np.where(
+            df_nps_cidade_agg['total_avaliacoes'] > 0,
+            ((df_nps_cidade_agg['promotores'] - df_nps_cidade_agg['detratores']) / df_nps_cidade_agg['total_avaliacoes']) * 100,
+            np.nan
+        )
+        
+        df_nps_cidade_agg = df_nps_cidade_agg.dropna(subset=['nps_score'])
+
+        min_avaliacoes_cidade = st.slider("Mínimo de Avaliações para Cidades", min_value=1, max_value=50, value=10, key="min_eval_city_nps_table")
+        df_nps_cidade_filtered = df_nps_cidade_agg[df_nps_cidade_agg['total_avaliacoes'] >= min_avaliacoes_cidade]
+
+        if not df_nps_cidade_filtered.empty:
+            col_nps_best_city, col_nps_worst_city = st.columns(2)
+
+            with col_nps_best_city:
+                st.markdown("#### Top 10 Cidades (Melhor NPS)")
+                st.dataframe(
+                    df_nps_cidade_filtered.sort_values('nps_score', ascending=False).head(10)
+                    .rename(columns={'municipio': 'Cidade', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
+                        'NPS Médio': lambda x: format_pt_br(x, 1),
+                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
+                    }),
+                    use_container_width=True
+                )
+            with col_nps_worst_city:
+                st.markdown("#### Top 10 Cidades (Pior NPS)")
+                st.dataframe(
+                    df_nps_cidade_filtered.sort_values('nps_score', ascending=True).head(10) # Piores são os primeiros na ordem crescente
+                    .rename(columns={'municipio': 'Cidade', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
+                        'NPS Médio': lambda x: format_pt_br(x, 1),
+                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
+                    }),
+                    use_container_width=True
+                )
+        else:
+            st.info(f"Nenhuma cidade encontrada com NPS calculado e pelo menos {min_avaliacoes_cidade} avaliações.")
+        st.markdown("**Sugestão:** Implementar programas de incentivo ou treinamento nas cidades com baixo NPS, e replicar as melhores práticas das cidades com alto NPS.")
+
+
+    # --- Ranking NPS por Prestador (Top 10 e Piores 10) ---
+    st.markdown("---")
+    st.subheader("NPS por Prestador")
+    st.info("Identifique os prestadores com melhor e pior performance no NPS. Use esta informação para reconhecimento ou para planos de desenvolvimento.")
+
+    if df_nps_prestador.empty:
+        st.warning("Nenhum dado de NPS por prestador disponível para esta análise. Verifique o arquivo 'processed_nps_by_provider.parquet'.")
+    else:
+        # Agregamos o NPS por prestador, considerando as avaliações totais para relevância
+        df_nps_prestador_agg = df_nps_prestador.groupby('nome_do_prestador', observed=True).agg(
+            promotores=('nps_promotores', 'sum'),
+            detratores=('nps_detratores', 'sum'),
+            neutros=('nps_neutros', 'sum')
+        ).reset_index()
+
+        df_nps_prestador_agg['total_avaliacoes'] = df_nps_prestador_agg['promotores'] + df_nps_prestador_agg['detratores'] + df_nps_prestador_agg['neutros']
+        df_nps_prestador_agg['nps_score'] = np.where(
+            df_nps_prestador_agg['total_avaliacoes'] > 0,
+            ((df_nps_prestador_agg['promotores'] - df_nps_prestador_agg['detratores']) / df_nps_prestador_agg['total_avaliacoes']) * 100,
+            np.nan
+        )
+
+        df_nps_prestador_agg = df_nps_prestador_agg.dropna(subset=['nps_score'])
+
+        min_avaliacoes_prestador = st.slider("Mínimo de Avaliações para Prestadores", min_value=1, max_value=50, value=10, key="min_eval_provider_nps_table")
+        df_nps_prestador_filtered = df_nps_prestador_agg[df_nps_prestador_agg['total_avaliacoes'] >= min_avaliacoes_prestador]
+
+        if not df_nps_prestador_filtered.empty:
+            col_nps_best_prestador, col_nps_worst_prestador = st.columns(2)
+
+            with col_nps_best_prestador:
+                st.markdown("#### Top 10 Prestadores (Melhor NPS)")
+                st.dataframe(
+                    df_nps_prestador_filtered.sort_values('nps_score', ascending=False).head(10)
+                    .rename(columns={'nome_do_prestador': 'Prestador', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
+                        'NPS Médio': lambda x: format_pt_br(x, 1),
+                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
+                    }),
+                    use_container_width=True
+                )
+            with col_nps_worst_prestador:
+                st.markdown("#### Top 10 Prestadores (Pior NPS)")
+                st.dataframe(
+                    df_nps_prestador_filtered.sort_values('nps_score', ascending=True).head(10) # Piores são os primeiros na ordem crescente
+                    .rename(columns={'nome_do_prestador': 'Prestador', 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
+                        'NPS Médio': lambda x: format_pt_br(x, 1),
+                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
+                    }),
+                    use_container_width=True
+                )
+        else:
+            st.info(f"Nenhum prestador encontrado com NPS calculado e pelo menos {min_avaliacoes_prestador} avaliações.")
+        st.markdown("**Sugestão:** Avaliar treinamentos específicos ou programas de mentoria para prestadores com baixo NPS. Reconhecer e aprender com os de alto desempenho.")
+
+    # --- Distribuição do TMC (utiliza o df_final_filtrado) ---
+    st.markdown("---")
+    st.header("Distribuição do TMC por Segmento e Seguradora")
+
+    if df_final_filtrado.empty or 'tempo_chegada_min' not in df_final_filtrado.columns:
+        st.warning("Dados de atendimentos ou coluna 'tempo_chegada_min' não disponíveis para a análise de TMC.")
+    else:
+        col_tmc_segmento, col_tmc_seguradora = st.columns(2)
+
+        with col_tmc_segmento:
+            st.subheader("TMC por Segmento")
+            tmc_por_segmento = df_final_filtrado.groupby('segmento', observed=True)['tempo_chegada_min'].mean().reset_index()
+            tmc_por_segmento['tempo_chegada_min'] = tmc_por_segmento['tempo_chegada_min'].fillna(0)
+            st.dataframe(
+                tmc_por_segmento.rename(columns={'tempo_chegada_min': 'TMC Médio (min)'}).style.format(
+                    {'TMC Médio (min)': lambda x: format_pt_br(x, 0)}
+                ),
+                use_container_width=True
+            )
+
+        with col_tmc_seguradora:
+            st.subheader("TMC por Seguradora")
+            tmc_por_seguradora = df_final_filtrado.groupby('seguradora', observed=True)['tempo_chegada_min'].mean().reset_index()
+            tmc_por_seguradora['tempo_chegada_min'] = tmc_por_seguradora['tempo_chegada_min'].fillna(0)
+            st.dataframe(
+                tmc_por_seguradora.rename(columns={'tempo_chegada_min': 'TMC Médio (min)'}).style.format(
+                    {'TMC Médio (min)': lambda x: format_pt_br(x, 0)}
+                ),
+                use_container_width=True
+            )
+
+def fill_prestador_metrics(df):
+    """Preenche NaNs das métricas do prestador com a mediana de cada coluna."""
+    for col in ['media_nps', 'media_tempo_chegada', 'total_atendimentos', 'pct_reembolso', 'pct_intermediacao']:
+        if df[col].isnull().any():
+            df[col] = df[col].fillna(df[col].median())
+    return df
+
+def build_prestador_components(df, sketches=None):
+    """
+    Monta a matriz normalizada prestadores x componentes do score, na ordem de PESOS_SCORE_PRESTADOR.
+    Cada coluna já está orientada para que valores maiores sejam melhores.
+    """
+    if sketches is not None:
+        # Percentil de cada componente frente à distribuição de referência das partições selecionadas
+        componentes = {
+            'atendimentos': sketches['total_atendimentos'].rank(df['total_atendimentos_mensal']),
+            'nps': df['media_nps'].to_numpy(dtype=float) / 100,
+            'tempo_chegada': 1 - sketches['media_tempo_chegada'].rank(df['media_tempo_chegada']),
+            'reembolso': 1 - sketches['pct_reembolso'].rank(df['pct_reembolso']),
+            'intermediacao': 1 - sketches['pct_intermediacao'].rank(df['pct_intermediacao']),
+        }
+    else:
+        # Normalização das métricas
+        max_atendimentos = df['total_atendimentos'].max() if df['total_atendimentos'].max() > 0 else 1
+        max_tempo_chegada = df['media_tempo_chegada'].max() if df['media_tempo_chegada'].max() > 0 else 1
+        max_pct_reembolso = df['pct_reembolso'].max() if df['pct_reembolso'].max() > 0 else 1
+        max_pct_intermediacao = df['pct_intermediacao'].max() if df['pct_intermediacao'].max() > 0 else 1
+        componentes = {
+            'atendimentos': df['total_atendimentos'] / max_atendimentos,
+            'nps': df['media_nps'] / 100,
+            'tempo_chegada': 1 - (df['media_tempo_chegada'] / max_tempo_chegada),
+            'reembolso': 1 - (df['pct_reembolso'] / max_pct_reembolso),
+            'intermediacao': 1 - (df['pct_intermediacao'] / max_pct_intermediacao),
+        }
+    return np.column_stack([np.asarray(componentes[nome], dtype=float) for nome in PESOS_SCORE_PRESTADOR])
+
+@st.cache_data(max_entries=32)
+def cached_prestador_components(df_prestadores, normalizacao, _sketches=None):
+    """Matriz de componentes em cache por seleção de filtros, reaproveitada a cada ajuste de pesos."""
+    return build_prestador_components(df_prestadores, _sketches)
+
+def score_from_components(df, componentes, pesos=None, percentil=False, fator=None):
+    """
+    Aplica os pesos à matriz de componentes (um produto matriz-vetor) e classifica o status.
+    `fator` multiplica o score ponderado de cada prestador antes da escala (ex.: penalidade por sobrecarga).
+    """
+    pesos = pesos or PESOS_SCORE_PRESTADOR
+    vetor_pesos = np.array([pesos[nome] for nome in PESOS_SCORE_PRESTADOR], dtype=float)
+    score = componentes @ vetor_pesos
+    if fator is not None:
+        score = score * fator
+    status_labels = ['Precisa de Atenção', 'Regular', 'Bom', 'Excelente']
+
+    if percentil:
+        df['score_prestador'] = np.clip(score * 100, 0, 100)
+        if len(df['score_prestador'].unique()) > 1:
+            quartis = np.nanquantile(df['score_prestador'].to_numpy(dtype=float), [0.25, 0.5, 0.75])
+            df['status_score'] = pd.Categorical.from_codes(
+                np.searchsorted(quartis, df['score_prestador'].to_numpy(), side='left'), categories=status_labels, ordered=True
+            )
+        else:
+            df['status_score'] = 'Regular'
+        return df
+
+    df['score_prestador'] = score
+    min_score, max_score = df['score_prestador'].min(), df['score_prestador'].max()
+    if max_score > min_score:
+        df['score_prestador'] = (df['score_prestador'] - min_score) / (max_score - min_score) * 100
+    else:
+        df['score_prestador'] = 50
+
+    if len(df['score_prestador'].unique()) > 1:
+        df['status_score'] = pd.qcut(df['score_prestador'], 4, labels=status_labels, duplicates='drop')
+    else:
+        df['status_score'] = 'Regular'
+
+    return df
+
+def calculate_prestador_score(df, sketches=None, pesos=None, df_atendimentos=None):
+    """
+    Score dos prestadores de `df`. Com `df_atendimentos` (os atendimentos da mesma fatia), os prestadores
+    sobrecarregados perdem SOBRECARGA_PENALIDADE do score ponderado, como no ranking da página.
+    """
+    if df.empty:
+        df['score_prestador'] = []
+        df['status_score'] = []
+        return df
+
+    # Preenchimento de NaNs para evitar erros, usando a mediana
+    df = fill_prestador_metrics(df)
+    componentes = build_prestador_components(df, sketches)
+    fator = None
+    if df_atendimentos is not None:
+        df = add_provider_workload(df, df_atendimentos)
+        fator = overload_factor(df['sobrecarga'])
+    return score_from_components(df, componentes, pesos, percentil=sketches is not None, fator=fator)
+
+def calculate_prestador_score_trend(df_atendimentos, df_nps_prestador, prestadores, janela_meses=1, pesos=None):
+    """
+    Calcula o score de cada prestador mês a mês (janela_meses=1) ou em janela móvel
+    (janela_meses=TREND_WINDOW_MONTHS) em uma única passada vetorizada.
+
+    Os agregados mensais são montados uma vez em uma matriz prestador x mês e as janelas
+    são obtidas por somas acumuladas, sem chamar calculate_prestador_score por janela. A penalidade
+    por sobrecarga usa o pico diário de cada janela (overload_by_month), como o ranking usa o do período.
+    Retorna um DataFrame com a série do score (para sparkline) e a inclinação da tendência.
+    """
+    colunas_saida = ['nome_do_prestador', 'serie_score', 'score_inicial', 'score_final', 'tendencia_score', 'meses_com_dados']
+    df_base = df_atendimentos[df_atendimentos['nome_do_prestador'].isin(prestadores)]
+    if df_base.empty:
+        return pd.DataFrame(columns=colunas_saida)
+
+    mes = df_base['data_abertura_atendimento'].dt.to_period('M')
+    meses = pd.period_range(mes.min(), mes.max(), freq='M')
+    nomes = pd.Index(sorted(set(prestadores)))
+    # Converte para texto só os nomes distintos (a categoria validada na carga), não cada linha
+    codigos, distintos = pd.factorize(df_base['nome_do_prestador'])
+    idx_prestador = nomes.get_indexer(pd.Index(distintos).astype(str))[codigos]
+    idx_mes = mes.array.asi8 - meses[0].ordinal
+
+    # Agregados aditivos por célula (prestador, mês): atendimentos, reembolsos, intermediações,
+    # soma e contagem do tempo de chegada, promotores, detratores e total de avaliações NPS
+    agregados = np.zeros((len(nomes), len(meses), 8))
+    tempo = df_base['tempo_chegada_min'].to_numpy(dtype=float)
+    tempo_valido = ~np.isnan(tempo)
+    np.add.at(agregados[:, :, 0], (idx_prestador, idx_mes), 1)
+    np.add.at(agregados[:, :, 1], (idx_prestador, idx_mes), df_base['is_reembolso'].to_numpy(dtype=float))
+    np.add.at(agregados[:, :, 2], (idx_prestador, idx_mes), df_base['is_intermediacao'].to_numpy(dtype=float))
+    np.add.at(agregados[:, :, 3], (idx_prestador, idx_mes), np.where(tempo_valido, tempo, 0))
+    np.add.at(agregados[:, :, 4], (idx_prestador, idx_mes), tempo_valido.astype(float))
+
+    colunas_nps = {'id_prestador', 'mes_ano', 'nps_promotores', 'nps_detratores', 'nps_neutros'}
+    if colunas_nps.issubset(df_nps_prestador.columns) and isinstance(df_nps_prestador['mes_ano'].dtype, pd.PeriodDtype):
+        # NPS ligado às linhas da matriz pelo ID canônico (um ID pode cobrir mais de uma grafia nos atendimentos)
+        linhas_por_id = pd.DataFrame({'id_prestador': df_base['id_prestador'].to_numpy(), 'linha': idx_prestador}).drop_duplicates()
+        df_nps = df_nps_prestador.dropna(subset=['mes_ano']).merge(linhas_por_id, on='id_prestador')
+        nps_idx_prestador = df_nps['linha'].to_numpy()
+        nps_offset = df_nps['mes_ano'].array.asi8 - meses[0].ordinal
+        validos = (nps_idx_prestador >= 0) & (nps_offset >= 0) & (nps_offset < len(meses))
+        chave = (nps_idx_prestador[validos], nps_offset[validos])
+        promotores = df_nps['nps_promotores'].to_numpy(dtype=float)[validos]
+        detratores = df_nps['nps_detratores'].to_numpy(dtype=float)[validos]
+        neutros = df_nps['nps_neutros'].to_numpy(dtype=float)[validos]
+        np.add.at(agregados[:, :, 5], chave, promotores)
+        np.add.at(agregados[:, :, 6], chave, detratores)
+        np.add.at(agregados[:, :, 7], chave, promotores + detratores + neutros)
+
+    # Janela móvel por diferença de somas acumuladas ao longo do eixo dos meses
+    acumulado = np.cumsum(agregados, axis=1)
+    if janela_meses > 1:
+        janela = acumulado.copy()
+        janela[:, janela_meses:, :] -= acumulado[:, :-janela_meses, :]
+    else:
+        janela = agregados
+
+    total = janela[:, :, 0]
+    com_dados = total > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_reembolso = np.where(com_dados, janela[:, :, 1] / total * 100, np.nan)
+        pct_intermediacao = np.where(com_dados, janela[:, :, 2] / total * 100, np.nan)
+        media_tempo = np.where(janela[:, :, 4] > 0, janela[:, :, 3] / janela[:, :, 4], np.nan)
+        media_nps = np.where(janela[:, :, 7] > 0, (janela[:, :, 5] - janela[:, :, 6]) / janela[:, :, 7] * 100, 0)
+    media_nps = np.where(com_dados, media_nps, np.nan)
+
+    # Mesma normalização de calculate_prestador_score, aplicada mês a mês (eixo dos prestadores)
+    def normalizar(valores):
+        maximo = np.nanmax(np.where(com_dados, valores, -np.inf), axis=0)
+        maximo = np.where(maximo > 0, maximo, 1)
+        return valores / maximo
+
+    mediana_tempo = np.nanmedian(np.where(com_dados, media_tempo, np.nan), axis=0) if com_dados.any() else 0
+    media_tempo = np.where(com_dados & np.isnan(media_tempo), mediana_tempo, media_tempo)
+
+    pesos = pesos or PESOS_SCORE_PRESTADOR
+    score = (
+        normalizar(np.where(com_dados, total, np.nan)) * pesos['atendimentos'] +
+        media_nps / 100 * pesos['nps'] +
+        (1 - normalizar(media_tempo)) * pesos['tempo_chegada'] +
+        (1 - normalizar(pct_reembolso)) * pesos['reembolso'] +
+        (1 - normalizar(pct_intermediacao)) * pesos['intermediacao']
+    ) * overload_factor(overload_by_month(df_atendimentos, nomes, meses, janela_meses))
+    score = np.where(com_dados, score, np.nan)
+
+    min_score = np.nanmin(np.where(com_dados, score, np.inf), axis=0)
+    max_score = np.nanmax(np.where(com_dados, score, -np.inf), axis=0)
+    amplitude = max_score - min_score
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.where(amplitude > 0, (score - min_score) / amplitude * 100, 50)
+    score = np.where(com_dados, score, np.nan)
+
+    # Inclinação por mínimos quadrados (pontos de score por mês), ignorando meses sem dados
+    x = np.broadcast_to(np.arange(len(meses), dtype=float), score.shape)
+    n = com_dados.sum(axis=1)
+    sx = np.where(com_dados, x, 0).sum(axis=1)
+    sy = np.where(com_dados, score, 0).sum(axis=1)
+    sxx = np.where(com_dados, x * x, 0).sum(axis=1)
+    sxy = np.where(com_dados, x * np.nan_to_num(score), 0).sum(axis=1)
+    denominador = n * sxx - sx * sx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inclinacao = np.where((n >= 2) & (denominador > 0), (n * sxy - sx * sy) / denominador, 0.0)
+
+    primeiro = np.argmax(com_dados, axis=1)
+    ultimo = len(meses) - 1 - np.argmax(com_dados[:, ::-1], axis=1)
+    linhas = np.arange(len(nomes))
+
+    df_tendencia = pd.DataFrame({
+        'nome_do_prestador': nomes,
+        'serie_score': [np.round(serie[~np.isnan(serie)], 2).tolist() for serie in score],
+        'score_inicial': score[linhas, primeiro],
+        'score_final': score[linhas, ultimo],
+        'tendencia_score': inclinacao,
+        'meses_com_dados': n
+    })
+    return df_tendencia[df_tendencia['meses_com_dados'] > 0].reset_index(drop=True)
+
+# --- FUNÇÃO DE SUGESTÕES (Texto puro) ---
+def get_prestador_sugestao_acao(df_completo):
+    """
+    Gera sugestões de ação simples, em texto puro, para todos os prestadores de uma vez.
+    Os quartis são calculados uma única vez e cada regra é uma máscara vetorizada.
+    """
+    # Usar quartis para limiares dinâmicos
+    q75_reembolso = df_completo['pct_reembolso'].quantile(0.75)
+    q75_intermediacao = df_completo['pct_intermediacao'].quantile(0.75)
+    q75_tmc = df_completo['media_tempo_chegada'].quantile(0.75)
+    q25_nps = df_completo['media_nps'].quantile(0.25)
+
+    regras = [
+        (df_completo['status_score'] == 'Precisa de Atenção', 'Performance geral crítica. Avaliar treinamento ou revisão de contrato.'),
+        ((df_completo['media_nps'] <= q25_nps) & (df_completo['media_nps'] < 75), 'NPS baixo. Investigar causas de insatisfação do cliente.'),
+        ((df_completo['pct_reembolso'] > q75_reembolso) & (df_completo['pct_reembolso'] > 0), 'Alto percentual de reembolso. Rever processos ou precificação.'),
+        ((df_completo['pct_intermediacao'] > q75_intermediacao) & (df_completo['pct_intermediacao'] > 0), 'Alto percentual de intermediação. Aumentar capacidade ou eficiência.'),
+        (df_completo['media_tempo_chegada'] > q75_tmc, 'Tempo médio de chegada elevado. Otimizar logística ou realocação.'),
+        (df_completo.get('tendencia_score', pd.Series(0, index=df_completo.index)) < TREND_DECLINE_THRESHOLD, 'Score em queda nos últimos meses. Acompanhar de perto e agir preventivamente.'),
+    ]
+    if 'sobrecarga' in df_completo.columns:
+        pico = df_completo['pico_diario'].round().astype('Int64').astype(str).to_numpy(dtype=object)
+        regras.append((
+            df_completo['sobrecarga'].fillna(False).astype(bool),
+            "Sobrecarga em dias de pico (até " + pico + " atendimentos/dia). Redistribuir demanda ou ampliar equipe."
+        ))
+
+    sugestoes = np.full(len(df_completo), '', dtype=object)
+    for mascara, texto in regras:
+        mascara = mascara.to_numpy(dtype=bool)
+        sugestoes = np.where(mascara, np.where(sugestoes == '', texto, sugestoes + "; " + texto), sugestoes)
+    return pd.Series(
+        np.where(sugestoes == '', "Bom desempenho. Nenhuma ação crítica necessária.", sugestoes),
+        index=df_completo.index
+    )
+
+@st.cache_data(max_entries=32, hash_funcs={
+    PandasBackend: lambda backend: (backend.df, backend.df_nps_prestador),
+    DuckDBBackend: lambda backend: backend.paths,
+    PolarsBackend: lambda backend: backend.paths,
+    SnapshotBackend: lambda backend: (backend.versao, backend.combinacao),
+    ResultCacheBackend: lambda backend: (backend.versao_dados, backend.origem.nome, json.dumps(backend.parametros, default=str, sort_keys=True))
+})
+def aggregate_prestadores(backend, filtros=None):
+    """Agrega os atendimentos filtrados por prestador (em cache por seleção de filtros)."""
+    return add_prestador_rates(backend.agregado_prestadores(filtros))
+
+def add_prestador_rates(df_prestadores_agg):
+    """Percentuais de reembolso e intermediação sobre o agregado por prestador."""
+    df_prestadores_agg['pct_reembolso'] = (df_prestadores_agg['num_reembolsos'] / df_prestadores_agg['total_atendimentos'] * 100).fillna(0)
+    df_prestadores_agg['pct_intermediacao'] = (df_prestadores_agg['num_intermediacoes'] / df_prestadores_agg['total_atendimentos'] * 100).fillna(0)
+    return df_prestadores_agg
+
+# --- Snapshots em Lote (gerados por snapshots.py, lidos quando os filtros coincidem) ---
+SNAPSHOT_TABELAS_BACKEND = ['agregado_prestadores', 'agregado_cidades', 'cms_por_prestador', 'cms_ofensores']
+
+def compute_snapshot_tables(df, df_nps_prestador):
+    """
+    Tabelas de um snapshot para uma seleção já filtrada: os agregados que o dashboard lê no lugar
+    do backend e os relatórios prontos (score, índice de capilaridade e ofensores de CMS, com os padrões da página).
+    """
+    backend = PandasBackend(df, df_nps_prestador=df_nps_prestador)
+    tabelas = {nome: getattr(backend, nome)() for nome in SNAPSHOT_TABELAS_BACKEND}
+    df_cidades = add_capilaridade_rates(tabelas['agregado_cidades'].copy())
+    tabelas['score_prestador'] = calculate_prestador_score(add_prestador_rates(tabelas['agregado_prestadores'].copy()), df_atendimentos=df)
+    tabelas['indice_capilaridade'] = calculate_capilaridade_index(df_cidades[df_cidades['num_servicos'] >= MIN_ATTENDANCES_FOR_CITY_ANALYSIS].copy())
+    tabelas['ofensores_cms'] = flag_cms_offenders(tabelas['cms_ofensores'], cms_robust_stats(df))
+    return tabelas
+
+def snapshot_key(filtros):
+    """(uf, segmento) do snapshot equivalente aos filtros, ou None se a seleção não for uma combinação do lote."""
+    if filtros['selected_insurers'] is not None or filtros['selected_municipios'] is not None:
+        return None
+    chave = []
+    for selecao in (filtros['selected_states'], filtros['selected_segments']):
+        if selecao is None:
+            chave.append(ALL_OPTION)
+        elif len(selecao) == 1:
+            chave.append(str(selecao[0]))
+        else:
+            return None
+    return tuple(chave)
+
+@st.cache_data(ttl=300)
+def list_snapshots():
+    """Manifestos dos snapshots em disco, do mais recente para o mais antigo."""
+    manifestos = []
+    versoes = sorted(os.listdir(SNAPSHOTS_DIR), reverse=True) if os.path.isdir(SNAPSHOTS_DIR) else []
+    for versao in versoes:
+        try:
+            with open(os.path.join(SNAPSHOTS_DIR, versao, 'manifest.json'), encoding='utf-8') as arquivo:
+                manifestos.append(json.load(arquivo))
+        except (OSError, json.JSONDecodeError):
+            continue # Pasta temporária ou incompleta
+    return manifestos
+
+def find_snapshot(filtros, fontes, versao_dados):
+    """
+    Snapshot mais recente das mesmas fontes, gerado sobre a mesma versão (impressão digital) dos dados
+    carregados, cujo período e combinação (uf, segmento) coincidem exatamente com os filtros.
+    Retorna (manifesto, combinação) ou None; manifestos sem impressão digital nunca são usados.
+    """
+    chave = snapshot_key(filtros)
+    if chave is None:
+        return None
+    for manifesto in list_snapshots():
+        if (
+            manifesto['fontes'] == list(fontes) and manifesto.get('versao_dados') == versao_dados
+            and manifesto['inicio'] == str(filtros['start_date']) and manifesto['fim'] == str(filtros['end_date'])
+            and list(chave) in manifesto['combinacoes']
+        ):
+            return manifesto, chave
+    return None
+
+@st.cache_data(max_entries=32)
+def load_snapshot_tables(versao, uf, segmento):
+    """
+    Lê as linhas da combinação (uf, segmento) de cada tabela do snapshot. Cada tabela é um único Parquet,
+    sem particionamento: `filters=` descarta as linhas das outras combinações na leitura, mas o arquivo é lido inteiro.
+    """
+    filtro = [('snapshot_uf', '==', uf), ('snapshot_segmento', '==', segmento)]
+    return {
+        tabela: pd.read_parquet(os.path.join(SNAPSHOTS_DIR, versao, f"{tabela}.parquet"), filters=filtro).drop(columns=['snapshot_uf', 'snapshot_segmento'])
+        for tabela in SNAPSHOT_TABELAS_BACKEND
+    }
+
+# --- Editor de Pesos (What-if) ---
+def load_weight_profiles():
+    """Lê os perfis de pesos salvos em disco (arquivo JSON ao lado do script)."""
+    try:
+        with open(WEIGHT_PROFILES_PATH, encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_weight_profile(chave, nome, pesos):
+    """
+    Grava o perfil sobre o conteúdo atual do arquivo (relido aqui), para não descartar perfis que outras
+    sessões salvaram depois que esta começou; a escrita passa por um temporário e os.replace.
+    """
+    perfis_sessao = st.session_state.setdefault('perfis_pesos', load_weight_profiles())
+    perfis_sessao.setdefault(chave, {})[nome] = pesos
+    perfis = load_weight_profiles()
+    perfis.setdefault(chave, {})[nome] = pesos
+    try:
+        temporario = f"{WEIGHT_PROFILES_PATH}.{os.getpid()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(perfis, arquivo, ensure_ascii=False, indent=2)
+        os.replace(temporario, WEIGHT_PROFILES_PATH)
+    except OSError as e:
+        st.warning(f"Perfil salvo apenas nesta sessão. Não foi possível gravar '{WEIGHT_PROFILES_PATH}': {e}")
+        return
+    st.session_state['perfis_pesos'] = perfis
+
+def weight_editor(chave, pesos_padrao, rotulos):
+    """
+    Renderiza o editor de pesos com perfis nomeados e retorna os pesos normalizados (soma 1).
+    Os pesos são aplicados sobre componentes já normalizados, então o ranking é recalculado sem reagregar atendimentos.
+    """
+    perfis = st.session_state.setdefault('perfis_pesos', load_weight_profiles())
+    perfis_chave = {'Padrão': pesos_padrao, **perfis.get(chave, {})}
+
+    def aplicar_perfil():
+        perfil = perfis_chave[st.session_state[f"{chave}_perfil"]]
+        for nome in pesos_padrao:
+            st.session_state[f"{chave}_peso_{nome}"] = int(round(perfil.get(nome, 0) * 100))
+
+    with st.expander("⚖️ Simulação de Pesos (What-if)"):
+        st.selectbox("Perfil de Pesos", list(perfis_chave), key=f"{chave}_perfil", on_change=aplicar_perfil)
+        colunas = st.columns(len(pesos_padrao))
+        valores = {}
+        for coluna, nome in zip(colunas, pesos_padrao):
+            st.session_state.setdefault(f"{chave}_peso_{nome}", int(round(pesos_padrao[nome] * 100)))
+            with coluna:
+                valores[nome] = st.slider(rotulos[nome], min_value=0, max_value=100, step=5, key=f"{chave}_peso_{nome}")
+
+        total = sum(valores.values())
+        pesos = {nome: valor / total for nome, valor in valores.items()} if total > 0 else dict(pesos_padrao)
+        st.caption("Pesos efetivos (normalizados para somar 100%): " + " | ".join(f"{rotulos[nome]}: {peso:.0%}" for nome, peso in pesos.items()))
+
+        col_nome, col_salvar = st.columns([3, 1])
+        with col_nome:
+            nome_perfil = st.text_input("Nome do Perfil", key=f"{chave}_nome_perfil", placeholder="Ex.: Foco em Qualidade")
+        with col_salvar:
+            st.markdown("<div style='margin-top: 1.75rem;'></div>", unsafe_allow_html=True)
+            if st.button("Salvar Perfil", key=f"{chave}_salvar_perfil", use_container_width=True) and nome_perfil.strip():
+                save_weight_profile(chave, nome_perfil.strip(), pesos)
+                st.success(f"Perfil '{nome_perfil.strip()}' salvo.")
+    return pesos
+
+# --- PÁGINA PRINCIPAL DO STREAMLIT (VERSÃO FINAL AJUSTADA) ---
+@st.fragment
+def score_prestador_fragment(df_atendimentos_filtrado, df_nps_prestador, df_prestadores_agg, sketches=None, drilldown=None, comparacao=None):
+    """Ranking, tendência e plano de ação do score. Fragmento: os controles da página reexecutam só esta seção."""
+    # --- FILTRO DE ANÁLISE NA PÁGINA PRINCIPAL ---
+    st.markdown("---")
+    min_atendimentos = st.number_input(
+        label="Defina o Mínimo de Atendimentos por Prestador", 
+        min_value=1, 
+        value=5, 
+        step=1,
+        help="Apenas prestadores com um número de atendimentos igual ou superior a este valor serão exibidos na análise."
+    )
+    modo_tendencia = st.radio(
+        "Modo da Tendência do Score",
+        options=["Mensal", f"Janela Móvel ({TREND_WINDOW_MONTHS} meses)"],
+        horizontal=True,
+        help="Mensal calcula o score de cada mês isoladamente; a janela móvel suaviza a série somando os últimos meses (~90 dias)."
+    )
+    
+    pesos = weight_editor('score_prestador', PESOS_SCORE_PRESTADOR, {
+        'atendimentos': 'Total de Atendimentos',
+        'nps': 'NPS Médio',
+        'tempo_chegada': 'Tempo Médio de Chegada',
+        'reembolso': '% Reembolso',
+        'intermediacao': '% Intermediação'
+    })
+
+    # APLICAÇÃO DO FILTRO DE MÍNIMO DE ATENDIMENTOS
+    df_prestadores_filtrado = df_prestadores_agg[df_prestadores_agg['total_atendimentos'] >= min_atendimentos].copy()
+
+    if df_prestadores_filtrado.empty:
+        st.warning(f"Nenhum prestador encontrado com {min_atendimentos} ou mais atendimentos para os filtros aplicados.")
+        return
+
+    # A matriz de componentes fica em cache por filtro; mudar os pesos é só um produto matriz-vetor
+    df_prestadores_filtrado = fill_prestador_metrics(df_prestadores_filtrado)
+    if sketches is not None:
+        df_prestadores_filtrado = add_monthly_count_means(df_prestadores_filtrado, df_atendimentos_filtrado, 'prestador')
+    componentes = cached_prestador_components(df_prestadores_filtrado, 'percentil' if sketches is not None else 'maximo', _sketches=sketches)
+
+    # Carga diária/horária: prestadores sobrecarregados em dias de pico perdem SOBRECARGA_PENALIDADE do score ponderado
+    df_prestadores_filtrado = add_provider_workload(df_prestadores_filtrado, df_atendimentos_filtrado)
+    df_prestadores_scored = score_from_components(
+        df_prestadores_filtrado, componentes, pesos, percentil=sketches is not None,
+        fator=overload_factor(df_prestadores_filtrado['sobrecarga'])
+    )
+
+    # --- TENDÊNCIA DO SCORE (uma passada sobre os agregados mensais) ---
+    df_tendencia = calculate_prestador_score_trend(
+        df_atendimentos_filtrado,
+        df_nps_prestador,
+        df_prestadores_scored['nome_do_prestador'].astype(str).tolist(),
+        janela_meses=1 if modo_tendencia == "Mensal" else TREND_WINDOW_MONTHS,
+        pesos=pesos
+    )
+    df_prestadores_scored = pd.merge(df_prestadores_scored, df_tendencia[['nome_do_prestador', 'tendencia_score']], on='nome_do_prestador', how='left')
+    df_prestadores_scored['tendencia_score'] = df_prestadores_scored['tendencia_score'].fillna(0)
+    df_prestadores_scored['sugestao_acao'] = get_prestador_sugestao_acao(df_prestadores_scored)
+
+    # --- KPIs GERAIS DA REDE ---
+    st.markdown("---")
+    st.subheader("Desempenho Geral da Rede")
+    
+    avg_score = df_prestadores_scored['score_prestador'].mean()
+    avg_atendimentos = df_prestadores_scored['total_atendimentos'].mean()
+    avg_nps = df_prestadores_scored['media_nps'].mean()
+    avg_tmc = df_prestadores_scored['media_tempo_chegada'].mean()
+    
+    # Comparação entre períodos: uma agregação por (periodo, prestador), com os mesmos pesos e mínimo
+    df_score_periodos = None
+    delta_score = None
+    if comparacao is not None:
+        df_score_periodos = score_by_period(comparacao['df'], df_nps_prestador, min_atendimentos, sketches, pesos)
+        delta_score = delta_pontos(df_score_periodos['score_prestador_base'].mean(), df_score_periodos['score_prestador_comparacao'].mean(), "pts")
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Score Médio da Rede", f"{avg_score:.2f}", delta=delta_score)
+    col2.metric("Média de Atendimentos", f"{avg_atendimentos:.1f}")
+    col3.metric("NPS Médio", f"{avg_nps:.1f}")
+    col4.metric("TMC Médio (min)", f"{avg_tmc:.0f}")
+
+    # --- RANKING COMPLETO DE PRESTADORES ---
+    st.markdown("---")
+    st.subheader("Ranking Completo de Prestadores")
+    st.markdown("Análise detalhada de todos os prestadores que atendem aos critérios de filtro. Use as setas para ordenar.")
+
+    df_ranking = df_prestadores_scored.rename(columns={
+        'nome_do_prestador': 'Prestador',
+        'total_atendimentos': 'Atendimentos',
+        'media_nps': 'NPS Médio',
+        'media_tempo_chegada': 'TMC Médio (min)',
+        'pct_reembolso': '% Reembolso',
+        'pct_intermediacao': '% Intermediação',
+        'score_prestador': 'Score',
+        'status_score': 'Status',
+        'carga_p90_diaria': 'Carga p90/Dia',
+        'pico_diario': 'Pico Diário',
+        'pico_horario': 'Pico Horário',
+        'sobrecarga': 'Sobrecarga'
+    })[[
+        'Prestador', 'Score', 'Status', 'Atendimentos', 'NPS Médio', 'TMC Médio (min)',
+        '% Reembolso', '% Intermediação', 'Carga p90/Dia', 'Pico Diário', 'Pico Horário', 'Sobrecarga'
+    ]].sort_values('Score', ascending=True)
+    if drilldown is not None:
+        st.caption("Selecione uma linha para ver o detalhamento do prestador.")
+
+    evento_ranking = st.dataframe(
+        df_ranking
+        .style
+        .background_gradient(cmap='RdYlGn', subset=['Score'])
+        .bar(subset=['Atendimentos'], color='#1f77b4')
+        .format({
+            'Score': '{:.2f}',
+            'NPS Médio': '{:.2f}',
+            'TMC Médio (min)': '{:.0f}',
+            '% Reembolso': '{:.2f}%',
+            '% Intermediação': '{:.2f}%',
+            'Carga p90/Dia': '{:.1f}',
+        }),
+        use_container_width=True,
+        height=600,
+        on_select='rerun' if drilldown is not None else 'ignore',
+        selection_mode='single-row',
+        key='ranking_prestadores'
+    )
+    
+    # DOWNLOAD DOS DADOS
+    st.download_button(
+        label="Baixar Ranking Completo (XLSX)",
+        data=functools.partial(to_xlsx_bytes, df_prestadores_scored, 'Score_Prestadores_Completo'),
+        file_name='score_prestadores_completo.xlsx',
+        mime=XLSX_MIME
+    )
+
+    if drilldown is not None and evento_ranking.selection.rows:
+        display_entity_drilldown(drilldown, 'prestador', df_ranking.iloc[evento_ranking.selection.rows[0]]['Prestador'])
+
+    if df_score_periodos is not None:
+        display_period_comparison(
+            df_score_periodos,
+            {
+                'nome_do_prestador': 'Prestador',
+                'score_prestador_base': 'Score (Base)',
+                'score_prestador_comparacao': 'Score (Comparação)',
+                'delta_score_prestador': 'Δ Score',
+                'total_atendimentos_base': 'Atendimentos (Base)',
+                'total_atendimentos_comparacao': 'Atendimentos (Comparação)'
+            },
+            'delta_score_prestador', comparacao['rotulos']
+        )
+
+    # --- TENDÊNCIA DO SCORE ---
+    st.markdown("---")
+    st.subheader("Tendência do Score por Prestador")
+    st.markdown(f"Evolução do score no modo **{modo_tendencia}**. A tendência é a inclinação da reta ajustada à série (pontos de score por mês); valores negativos indicam piora.")
+
+    if not df_tendencia.empty:
+        st.dataframe(
+            df_tendencia.sort_values('tendencia_score', ascending=True).rename(columns={
+                'nome_do_prestador': 'Prestador',
+                'serie_score': 'Evolução do Score',
+                'score_inicial': 'Score Inicial',
+                'score_final': 'Score Final',
+                'tendencia_score': 'Tendência (pts/mês)',
+                'meses_com_dados': 'Meses com Dados'
+            }),
+            column_config={
+                'Evolução do Score': st.column_config.LineChartColumn('Evolução do Score', y_min=0, y_max=100),
+                'Score Inicial': st.column_config.NumberColumn(format='%.2f'),
+                'Score Final': st.column_config.NumberColumn(format='%.2f'),
+                'Tendência (pts/mês)': st.column_config.NumberColumn(format='%.2f'),
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+    else:
+        st.info("Não há meses suficientes para calcular a tendência do score com os filtros aplicados.")
+
+    # --- PLANO DE AÇÃO EM CARDS (APÓS O RANKING) ---
+    st.markdown("---")
+    st.subheader("Plano de Ação: Foco nos Principais Pontos de Melhoria")
+    st.info("Recomendações para os 20 prestadores com os menores scores ou com score em queda, priorizando os que mais pioraram.")
+    
+    df_offenders = df_prestadores_scored[
+        df_prestadores_scored['status_score'].isin(['Precisa de Atenção', 'Regular']) |
+        (df_prestadores_scored['tendencia_score'] < TREND_DECLINE_THRESHOLD)
+    ].sort_values(['tendencia_score', 'score_prestador'], ascending=True).head(20)
+
+    if not df_offenders.empty:
+        for index, row in df_offenders.iterrows():
+            with st.container(border=True):
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    st.markdown(f"**Prestador:** {row['nome_do_prestador']}")
+                    st.markdown(f"**Sugestões:** {row['sugestao_acao']}")
+                with col2:
+                    st.metric(label="Score", value=f"{row['score_prestador']:.2f}", delta=f"{row['tendencia_score']:.2f} pts/mês")
+                    # Usando st.markdown para o status para evitar o delta/seta
+                    st.markdown(f"**Status:** <span style='color: #d62728;'>{row['status_score']}</span>", unsafe_allow_html=True)
+                
+    else:
+        st.success("🎉 Nenhum prestador com status 'Regular' ou 'Precisa de Atenção' encontrado. Ótimo resultado!")
+
+def page_score_prestador(df_atendimentos_filtrado, df_nps_prestador, sketches=None, backend=None, filtros=None, drilldown=None, comparacao=None):
+    st.title("Score de Performance do Prestador")
+    st.markdown("Análise de performance da rede de prestadores com foco em KPIs e ações corretivas.")
+
+    if df_atendimentos_filtrado.empty:
+        st.info("Nenhum dado de atendimento disponível para os filtros selecionados.")
+        return
+    
+    # --- PROCESSAMENTO DE DADOS ---
+    backend = backend or PandasBackend(df_atendimentos_filtrado, df_nps_prestador=df_nps_prestador)
+    df_prestadores_agg = aggregate_prestadores(backend, filtros)
+
+    # Controles e análise no fragmento: mínimo, modo da tendência e pesos não reexecutam o script inteiro
+    score_prestador_fragment(df_atendimentos_filtrado, df_nps_prestador, df_prestadores_agg, sketches, drilldown, comparacao)
+
+    # --- EXPANDER COM A METODOLOGIA ---
+    with st.expander("💡 Entenda a Metodologia do Score"):
+        st.markdown(r"""
+        O **Score do Prestador** é um índice de 0 a 100 que consolida múltiplos KPIs para avaliar a performance.
+
+        - **Componentes e Pesos (padrão, ajustáveis em 'Simulação de Pesos'):**
+          - **Total de Atendimentos (25%):** Maior volume é positivo.
+          - **NPS Médio (30%):** Satisfação do cliente é crucial.
+          - **Tempo Médio de Chegada (TMC) (20%):** Menor tempo é melhor.
+          - **Percentual de Reembolso (15%):** Menor percentual é melhor.
+          - **Percentual de Intermediação (10%):** Menor percentual é melhor.
+
+        - **Normalização:** por padrão cada componente é dividido pelo maior valor da seleção; no modo 'Percentil (Robusto)' usa-se o percentil do prestador na distribuição histórica mensal das UFs e segmentos selecionados, com o volume tomado como média de atendimentos por mês ativo.
+        - **Sobrecarga:** prestadores cujo dia de pico supera o p99 dos atendimentos diários de toda a rede (e chega a pelo menos 5 atendimentos) perdem 10% do score ponderado.
+        - **Tendência:** o mesmo score é recalculado mês a mês (ou em janela móvel de 3 meses) a partir de agregados mensais acumulados, e a inclinação da série indica se o prestador está melhorando ou piorando.
+
+        **Fórmula Simplificada:**
+        $$ \text{Score} = f(\text{Atendimentos}, \text{NPS}, \text{TMC}, \text{Reembolso}, \text{Intermediação}) $$
+        """)
+
+def format_pt_br(value, precision=0):
+    if pd.isna(value):
+        return "N/A"
+    if precision == 0:
+        formatted = f"{value:,.0f}"
+    else:
+        formatted = f"{value:,.{precision}f}"
+    return formatted.replace(",", "X").replace(".", ",").replace("X", ".")
+
+@st.fragment
+def nps_ranking_fragment(df_nps_agg, coluna, rotulo, rotulo_plural, mensagem_vazio, chave_slider):
+    """Top 10 melhor/pior NPS. Fragmento: mover o slider reexecuta só esta seção."""
+    min_avaliacoes = st.slider(f"Mínimo de Avaliações para {rotulo_plural}", min_value=1, max_value=50, value=10, key=chave_slider)
+    df_nps_filtered = df_nps_agg[df_nps_agg['total_avaliacoes'] >= min_avaliacoes]
+
+    if not df_nps_filtered.empty:
+        col_nps_best, col_nps_worst = st.columns(2)
+
+        for coluna_layout, titulo, crescente in [(col_nps_best, 'Melhor', False), (col_nps_worst, 'Pior', True)]:
+            with coluna_layout:
+                st.markdown(f"#### Top 10 {rotulo_plural} ({titulo} NPS)")
+                st.dataframe(
+                    df_nps_filtered.sort_values('nps_score', ascending=crescente).head(10)
+                    .rename(columns={coluna: rotulo, 'nps_score': 'NPS Médio', 'total_avaliacoes': 'Qtd. Avaliações'}).style.format({
+                        'NPS Médio': lambda x: format_pt_br(x, 1),
+                        'Qtd. Avaliações': lambda x: format_pt_br(x, 0)
+                    }),
+                    use_container_width=True
+                )
+    else:
+        st.info(mensagem_vazio.format(min_avaliacoes))
+
+def page_qualidade_nps(df_atendimentos_filtrado, df_nps_cidade_full, df_nps_prestador, backend=None, filtros=None):
+    st.title("Qualidade")
+    st.markdown("Esta seção exibe a evolução do Net Promoter Score (NPS), o Tempo Médio de Chegada do Prestador e os rankings de qualidade por cidade e prestador.")
+
+    backend = backend or PandasBackend(df_atendimentos_filtrado, df_nps_cidade_full, df_nps_prestador)
+
+    if not df_nps_cidade_full.empty:
+        df_nps_evolucao = backend.nps_por('cidade', 'mes_ano_dt')
+
+        df_nps_evolucao['total_responses'] = df_nps_evolucao['promotores'] + df_nps_evolucao['detratores'] + df_nps_evolucao['neutros']
+        df_nps_evolucao['nps_score'] = np.where(
+            df_nps_evolucao['total_responses'] > 0,
+            ((df_nps_evolucao['promotores'] - df_nps_evolucao['detratores']) / df_nps_evolucao['total_responses']) * 100,
+            np.nan
+        )
+        df_nps_evolucao = df_nps_evolucao.dropna(subset=['nps_score']).sort_values('mes_ano_dt')
+
+        st.markdown("---")
+        st.subheader("Evolução do Net Promoter Score (NPS) Geral")
+        if not df_nps_evolucao.empty:
+            fig_nps = plotly_figure(
+                'qualidade.nps_evolucao', df_nps_evolucao[['mes_ano_dt', 'nps_score']],
+                lambda dados: px.line(
+                    dados,
+                    x='mes_ano_dt',
+                    y='nps_score',
+                    title='Evolução Mensal do NPS Geral',
+                    labels={'mes_ano_dt': 'Mês/Ano', 'nps_score': 'NPS'},
+                    markers=True
+                ).update_xaxes(dtick="M1", tickformat="%b\n%Y").update_yaxes(range=[-100, 100])
+            )
+            st.plotly_chart(fig_nps, use_container_width=True)
+        else:
+            st.info("Nenhum dado disponível para a evolução mensal do NPS.")
+    else:
+        st.info("Nenhum dado de NPS por cidade disponível para calcular a evolução do NPS geral.")
+    
+    st.markdown("---")
+    st.subheader("NPS por Cidade")
+    st.info("Visualize as cidades com melhor e pior desempenho no NPS. Isso pode indicar onde focar esforços de melhoria de serviço.")
+
+    if df_nps_cidade_full.empty:
+        st.warning("Nenhum dado de NPS por cidade disponível para esta análise. Verifique o arquivo 'processed_nps_by_city.parquet'.")
+    else:
+        df_nps_cidade_agg = backend.nps_por('cidade', 'municipio')
+
+        df_nps_cidade_agg['total_avaliacoes'] = df_nps_cidade_agg['promotores'] + df_nps_cidade_agg['detratores'] + df_nps_cidade_agg['neutros']
+        df_nps_cidade_agg['nps_score'] = np.where(
+            df_nps_cidade_agg['total_avaliacoes'] > 0,
+            ((df_nps_cidade_agg['promotores'] - df_nps_cidade_agg['detratores']) / df_nps_cidade_agg['total_avaliacoes']) * 100,
+            np.nan
+        )
+        
+        df_nps_cidade_agg = df_nps_cidade_agg.dropna(subset=['nps_score'])
+
+        nps_ranking_fragment(
+            df_nps_cidade_agg, 'municipio', 'Cidade', 'Cidades',
+            "Nenhuma cidade encontrada com NPS calculado e pelo menos {} avaliações.", "min_eval_city_nps_table"
+        )
+
+        if 'uf' in df_nps_cidade_full.columns:
+            st.markdown("#### Mapa do NPS por Município")
+            df_nps_mapa = aggregate_nps(df_nps_cidade_full, ['uf', 'municipio'])
+            total_mapa = df_nps_mapa['promotores'] + df_nps_mapa['detratores'] + df_nps_mapa['neutros']
+            df_nps_mapa['nps_score'] = np.where(total_mapa > 0, (df_nps_mapa['promotores'] - df_nps_mapa['detratores']) / total_mapa.where(total_mapa > 0) * 100, np.nan)
+            municipality_map(df_nps_mapa, 'nps_score')
+        st.markdown("**Sugestão:** Implementar programas de incentivo ou treinamento nas cidades com baixo NPS, e replicar as melhores práticas das cidades com alto NPS.")
+
+
+    st.markdown("---")
+    st.subheader("NPS por Prestador")
+    st.info("Identifique os prestadores com melhor e pior performance no NPS. Use esta informação para reconhecimento ou para planos de desenvolvimento.")
+
+    if df_nps_prestador.empty:
+        st.warning("Nenhum dado de NPS por prestador disponível para esta análise. Verifique o arquivo 'processed_nps_by_provider.parquet'.")
+    else:
+        df_nps_prestador_agg = backend.nps_por('prestador', 'nome_do_prestador')
+
+        df_nps_prestador_agg['total_avaliacoes'] = df_nps_prestador_agg['promotores'] + df_nps_prestador_agg['detratores'] + df_nps_prestador_agg['neutros']
+        df_nps_prestador_agg['nps_score'] = np.where(
+            df_nps_prestador_agg['total_avaliacoes'] > 0,
+            ((df_nps_prestador_agg['promotores'] - df_nps_prestador_agg['detratores']) / df_nps_prestador_agg['total_avaliacoes']) * 100,
+            np.nan
+        )
+
+        df_nps_prestador_agg = df_nps_prestador_agg.dropna(subset=['nps_score'])
+
+        nps_ranking_fragment(
+            df_nps_prestador_agg, 'nome_do_prestador', 'Prestador', 'Prestadores',
+            "Nenhum prestador encontrado com NPS calculado e pelo menos {} avaliações.", "min_eval_provider_nps_table"
+        )
+        st.markdown("**Sugestão:** Avaliar treinamentos específicos ou programas de mentoria para prestadores com baixo NPS. Reconhecer e aprender com os de alto desempenho.")
+
+    st.markdown("---")
+    st.header("Distribuição do TMC por Segmento e Seguradora")
+
+    if df_atendimentos_filtrado.empty or 'tempo_chegada_min' not in df_atendimentos_filtrado.columns:
+        st.warning("Dados de atendimentos ou coluna 'tempo_chegada_min' não disponíveis para a análise de TMC.")
+    else:
+        col_tmc_segmento, col_tmc_seguradora = st.columns(2)
+
+        with col_tmc_segmento:
+            st.subheader("TMC por Segmento")
+            tmc_por_segmento = backend.tmc_por('segmento', filtros)
+            tmc_por_segmento['tempo_chegada_min'] = tmc_por_segmento['tempo_chegada_min'].fillna(0)
+            st.dataframe(
+                tmc_por_segmento.rename(columns={'tempo_chegada_min': 'TMC Médio (min)'}).style.format(
+                    {'TMC Médio (min)': lambda x: format_pt_br(x, 0)}
+                ),
+                use_container_width=True
+            )
+
+        with col_tmc_seguradora:
+            st.subheader("TMC por Seguradora")
+            tmc_por_seguradora = backend.tmc_por('seguradora', filtros)
+            tmc_por_seguradora['tempo_chegada_min'] = tmc_por_seguradora['tempo_chegada_min'].fillna(0)
+            st.dataframe(
+                tmc_por_seguradora.rename(columns={'tempo_chegada_min': 'TMC Médio (min)'}).style.format(
+                    {'TMC Médio (min)': lambda x: format_pt_br(x, 0)}
+                ),
+                use_container_width=True
+            )
+
+    st.markdown("---")
+    st.header("SLA do Tempo de Chegada")
+    st.markdown("Defina limites de SLA e percentis do **Tempo Médio de Chegada (TMC)** e compare prestadores, cidades, segmentos e seguradoras pelo **% de atendimentos dentro do SLA**.")
+    if df_atendimentos_filtrado.empty or 'tempo_chegada_min' not in df_atendimentos_filtrado.columns:
+        st.warning("Dados de atendimentos ou coluna 'tempo_chegada_min' não disponíveis para a análise de SLA.")
+    else:
+        sla_fragment(df_atendimentos_filtrado)
+
+# --- Prévia Aproximada (amostra estratificada por UF × segmento) ---
+# KPIs de cada página que a prévia estima, com a mesma fórmula da página: (rótulo, coluna somada, base, formato).
+# Base None = linhas da seleção; a própria coluna = linhas com valor (média); outra coluna = soma dela.
+# O Score Prestador não entra: seus KPIs são médias por prestador, que uma amostra de linhas não estima bem.
+APPROX_KPIS = {
+    'Capilaridade': [
+        ("TMC (min)", 'tempo_chegada_min', 'tempo_chegada_min', 'min'),
+        ("Perc. Reembolso", 'is_reembolso', None, 'pct'),
+        ("Perc. Intermediação", 'is_intermediacao', None, 'pct'),
+    ],
+    'Financeiro': [
+        ("Gasto Total", 'val_total_items', None, 'total_moeda'),
+        ("CMS Médio", 'val_total_items', None, 'moeda'),
+        ("Total de Reembolso", 'val_reembolso', None, 'total_moeda'),
+        ("% Gasto c/ Reembolso", 'val_reembolso', 'val_total_items', 'pct'),
+        ("P/ Serv. Intermediação", 'is_intermediacao', None, 'pct'),
+    ],
+}
+
+def stratified_sample_kpis(df, kpis, tamanho=None, semente=0):
+    """
+    Estimativas dos KPIs `kpis` (entradas de APPROX_KPIS) a partir de uma amostra estratificada por (uf, segmento),
+    com alocação proporcional (mínimo esperado de 2 linhas por estrato) e IC de 95%. Cada KPI é uma razão
+    Σy/Σx: os totais são Σ N_h·ȳ_h e a variância vem da linearização, Σ N_h²·(1 - n_h/N_h)·s²_h(y - R·x)/n_h / X².
+    O custo é de poucas passadas vetorizadas (bincount) sobre os códigos das categorias,
+    independente de quantas cidades ou prestadores a página agrega depois.
+    """
+    tamanho = tamanho or APPROX_AMOSTRA_LINHAS
+    n_segmentos = len(df['segmento'].cat.categories) + 1
+    estratos = (df['uf'].cat.codes.to_numpy(np.int64) + 1) * n_segmentos + df['segmento'].cat.codes.to_numpy(np.int64) + 1
+    n_estratos = int(estratos.max()) + 1
+    tamanhos = np.bincount(estratos, minlength=n_estratos).astype(np.float64)
+
+    rng = np.random.default_rng(semente)
+    fracao = np.maximum(tamanho / len(df), 2 / np.maximum(tamanhos, 1))
+    amostra = np.flatnonzero(rng.random(len(df)) < fracao[estratos])
+    e = estratos[amostra]
+    n = np.bincount(e, minlength=n_estratos).astype(np.float64)
+    observados = n > 0
+    # Estratos sem linha na amostra são redistribuídos entre os demais
+    pesos = np.where(observados, tamanhos, 0.0) * len(df) / tamanhos[observados].sum()
+    correcao = 1 - np.divide(n, tamanhos, out=np.ones_like(n), where=tamanhos > 0)
+
+    def valores(coluna):
+        # Soma como na página: valores ausentes não contam
+        return np.nan_to_num(df[coluna].to_numpy(dtype=np.float64, na_value=np.nan)[amostra])
+
+    def total(y):
+        return float(np.sum(pesos * np.divide(np.bincount(e, weights=y, minlength=n_estratos), n, out=np.zeros_like(n), where=observados)))
+
+    estimativas = {}
+    for rotulo, coluna, base, _ in kpis:
+        y = valores(coluna)
+        if base is None:
+            x = np.ones_like(y)
+        elif base == coluna:
+            x = df[coluna].notna().to_numpy()[amostra].astype(np.float64)
+        else:
+            x = valores(base)
+        total_x = total(x)
+        if total_x == 0:
+            estimativas[rotulo] = (np.nan, np.nan)
+            continue
+        razao = total(y) / total_x
+        residuo = y - razao * x
+        media = np.divide(np.bincount(e, weights=residuo, minlength=n_estratos), n, out=np.zeros_like(n), where=observados)
+        soma_quadrados = np.bincount(e, weights=residuo * residuo, minlength=n_estratos)
+        variancias = np.divide(soma_quadrados - n * media ** 2, n - 1, out=np.zeros_like(n), where=n > 1).clip(min=0)
+        variancia = np.sum(np.divide(pesos ** 2 * correcao * variancias, n, out=np.zeros_like(n), where=observados))
+        estimativas[rotulo] = (razao, float(1.96 * np.sqrt(variancia)) / total_x)
+    estimativas['linhas_amostra'] = len(amostra)
+    return estimativas
+
+def format_approximate_kpi(valor, margem, formato, linhas):
+    """Texto do KPI estimado no formato da página, com a margem do IC de 95%."""
+    if formato == 'total_moeda':
+        return f"R$ {format_pt_br(valor * linhas, 2)} ± {format_pt_br(margem * linhas, 2)}"
+    if formato == 'moeda':
+        return f"R$ {format_pt_br(valor, 2)} ± {format_pt_br(margem, 2)}"
+    if formato == 'pct':
+        return f"{format_pt_br(valor * 100, 2)}% ± {format_pt_br(margem * 100, 2)} p.p."
+    return f"{format_pt_br(valor, 0)} min ± {format_pt_br(margem, 1)}"
+
+def render_approximate_preview(df, pagina):
+    """
+    Mostra os KPIs da página estimados por amostra antes do cálculo exato. Devolve o placeholder,
+    que main() esvazia quando a página termina: os valores exatos da página substituem a prévia, um a um.
+    """
+    kpis = APPROX_KPIS[pagina]
+    estimativas = stratified_sample_kpis(df, kpis)
+
+    area = st.empty()
+    with area.container(border=True):
+        st.caption(
+            f"Prévia aproximada: amostra estratificada por UF × segmento com {format_pt_br(estimativas['linhas_amostra'])} "
+            f"de {format_pt_br(len(df))} atendimentos (IC de 95%). Os valores exatos substituem esta prévia ao fim do cálculo."
+        )
+        for coluna, (rotulo, _, _, formato) in zip(st.columns(len(kpis)), kpis):
+            coluna.metric(f"{rotulo} (aprox.)", format_approximate_kpi(*estimativas[rotulo], formato, len(df)))
+    return area
+
+def main():
+    # Inicializa o estado de login
+    if 'logged_in' not in st.session_state:
+        st.session_state['logged_in'] = False
+
+    # Telemetria do rerun: contagem e sessões ativas (endpoint /metrics na porta lateral)
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    metricas = get_metrics()
+    metricas.contar('reruns_total')
+    contexto = get_script_run_ctx()
+    if contexto is not None:
+        metricas.registrar_sessao(contexto.session_id)
+
+    if not st.session_state['logged_in']:
+        login_page()
+    else:
+        # Carrega os dados em cache
+        # Status com o progresso de cada fonte; removido da página quando a carga termina
+        area_carga = st.empty()
+        # (fora do `with`, para que os avisos de fontes ausentes continuem no corpo da página)
+        status_carga = area_carga.status("Carregando e processando dados...")
+        with metricas.cronometrar('carga_dados_segundos'):
+            df_atendimentos_full, df_nps_cidade_full, df_nps_prestador = load_and_prepare_data(
+                ATENDIMENTO_FILE_PATH, NPS_CIDADE_PATH, NPS_PRESTADOR_PATH,
+                _progresso=lambda rotulo, concluidas, total: status_carga.update(
+                    label=f"Carregando e processando dados... {rotulo} pronto ({concluidas}/{total})"
+                )
+            )
+        area_carga.empty()
+        
+        if df_atendimentos_full.empty:
+            st.error("Nenhum dado de atendimentos válido disponível. Verifique o arquivo de origem.")
+            st.stop()
+
+        from streamlit_option_menu import option_menu
+
+        # --- BARRA LATERAL ESTRUTURADA ---
+        with st.sidebar:
+            st.markdown("<h1 style='text-align: center;'>Score do Prestador</h1>", unsafe_allow_html=True)
+            # 1. CABEÇALHO COM LOGO E TÍTULO
+            try:
+                st.image(LOGO_PATH)
+                st.markdown("<div style='margin-top: 1rem;'></div>", unsafe_allow_html=True)
+            except FileNotFoundError:
+                st.warning("Arquivo 'logo.png' não encontrado. Coloque-o na mesma pasta do script.")
+            
+
+            # 2. MENU DE NAVEGAÇÃO PRINCIPAL
+            selected_page = option_menu(
+                menu_title=None,
+                # Ordem ajustada para manter todas as páginas
+                options=["Informações", "Score Prestador", "Capilaridade", "Financeiro", "Qualidade"], 
+                # Ícones correspondentes à nova ordem
+                icons=["info-circle-fill", "graph-up-arrow", "globe2", "currency-dollar", "award"], 
+                menu_icon="cast",
+                default_index=0,
+                styles={
+                    "container": {"padding": "0!important", "background-color": "#FFFFFF"},
+                    "icon": {"color": "#2021D4", "font-size": "20px"},
+                    "nav-link": {"font-size": "16px", "text-align": "left", "margin":"0px", "--hover-color": "#E6F0F8"},
+                    "nav-link-selected": {"background-color": "#2021D4", "color": "white", "font-weight": "bold"},
+                    "icon-selected": {"color": "white"},
+                }
+            )
+
+
+            # 3. FILTROS DE DADOS
+            st.markdown("### ⚙️ Filtros de Dados")
+            
+            indice_filtros = build_filter_index(df_atendimentos_full)
+            min_date_data = indice_filtros['data_min']
+            max_date_data = indice_filtros['data_max']
+
+            # Seguradora -> Segmento e Estado -> Cidade em cascata, a partir das adjacências pré-calculadas
+            seguradora_selecionada = resolve_selection(
+                st.multiselect("Seguradora", [ALL_OPTION] + indice_filtros['opcoes']['seguradora'], default=[ALL_OPTION])
+            )
+
+            segmento_options = [ALL_OPTION] + cascade_options(indice_filtros, 'segmentos_por_seguradora', seguradora_selecionada, 'segmento')
+            segmento_selecionado = resolve_selection(st.multiselect("Segmento", segmento_options, default=[ALL_OPTION]))
+
+            estado_selecionado = resolve_selection(
+                st.multiselect("Estado", [ALL_OPTION] + indice_filtros['opcoes']['uf'], default=[ALL_OPTION])
+            )
+
+            municipio_options = [ALL_OPTION] + cascade_options(indice_filtros, 'municipios_por_uf', estado_selecionado, 'municipio')
+            municipio_selecionado = resolve_selection(st.multiselect("Cidade", municipio_options, default=[ALL_OPTION]))
+
+            data_inicio, data_fim = st.date_input(
+                "Período de Análise",
+                value=(min_date_data, max_date_data),
+                min_value=min_date_data,
+                max_value=max_date_data,
+                format="DD/MM/YYYY"
+            )
+
+            # Modo de comparação: período base (acima) contra um período de comparação
+            # Padrão: o período de mesma duração imediatamente anterior à base (sem dados antes da base, não há comparação)
+            fim_comparacao_padrao = data_inicio - datetime.timedelta(days=1)
+            sem_periodo_anterior = fim_comparacao_padrao < min_date_data
+            comparar_periodos = st.toggle(
+                "Comparar Períodos",
+                disabled=sem_periodo_anterior,
+                help="Mostra a variação de cada KPI e de cada entidade ranqueada entre o período de análise (base) e um período de comparação."
+                + (" Indisponível: não há dados anteriores ao período de análise." if sem_periodo_anterior else "")
+            )
+            if comparar_periodos and not sem_periodo_anterior:
+                inicio_comparacao_padrao = max(fim_comparacao_padrao - (data_fim - data_inicio), min_date_data)
+                periodo_comparacao = st.date_input(
+                    "Período de Comparação",
+                    value=(inicio_comparacao_padrao, fim_comparacao_padrao),
+                    min_value=min_date_data,
+                    max_value=max_date_data,
+                    format="DD/MM/YYYY"
+                )
+                # Enquanto só uma data foi escolhida, o intervalo está incompleto e a comparação fica suspensa
+                if len(periodo_comparacao) == 2:
+                    comparacao_inicio, comparacao_fim = periodo_comparacao
+                else:
+                    st.caption("Selecione a data final do período de comparação.")
+                    comparar_periodos = False
+            else:
+                comparar_periodos = False
+
+            normalizacao = st.selectbox(
+                "Normalização dos Scores",
+                NORMALIZACAO_OPTIONS,
+                index=0,
+                help="'Máximo da Seleção' divide cada componente pelo maior valor filtrado. 'Percentil (Robusto)' usa o percentil de cada componente na distribuição histórica das UFs e segmentos selecionados, sendo pouco sensível a outliers."
+            )
+
+            # Relatório de qualidade da versão dos dados em uso (gerado na carga)
+            versao_dados = dataset_fingerprint(df_atendimentos_full, df_nps_cidade_full, df_nps_prestador)
+            display_quality_report(load_quality_report(versao_dados))
+
+            # 4. RODAPÉ COM DATA DE ATUALIZAÇÃO E BOTÃO SAIR
+            st.markdown("<div style='margin-top: 1rem;'></div>", unsafe_allow_html=True)
+            st.caption("Última Atualização: 09/07/2025") 
+
+            if st.button("Sair", use_container_width=True):
+                st.session_state['logged_in'] = False
+                st.session_state.pop('username', None)
+                st.rerun()
+            
+            
+
+        # --- APLICAÇÃO DOS FILTROS ---
+        with metricas.cronometrar('filtros_segundos'):
+            # Comparação entre períodos: a união dos dois períodos é filtrada e rotulada numa única passada,
+            # e o período base da página sai dessa mesma união
+            comparacao = None
+            if comparar_periodos and selected_page in ("Score Prestador", "Capilaridade", "Financeiro"):
+                comparacao = {
+                    'df': label_periods(
+                        df_atendimentos_full, segmento_selecionado, seguradora_selecionada, estado_selecionado, municipio_selecionado,
+                        (data_inicio, data_fim), (comparacao_inicio, comparacao_fim)
+                    ),
+                    'rotulos': {
+                        PERIODO_BASE: f"{data_inicio:%d/%m/%Y} a {data_fim:%d/%m/%Y}",
+                        PERIODO_COMPARACAO: f"{comparacao_inicio:%d/%m/%Y} a {comparacao_fim:%d/%m/%Y}"
+                    }
+                }
+                df_filtrado = comparacao['df'][comparacao['df']['periodo'] == PERIODO_BASE].drop(columns='periodo')
+            else:
+                df_filtrado = apply_filters(
+                    df_atendimentos_full,
+                    segmento_selecionado,
+                    seguradora_selecionada,
+                    estado_selecionado,
+                    municipio_selecionado,
+                    data_inicio,
+                    data_fim
+                )
+        
+        if df_filtrado.empty:
+            st.info("Nenhum dado corresponde aos filtros selecionados.")
+
+        # Backend das agregações das páginas: pandas em memória (padrão), DuckDB ou Polars sobre os Parquet.
+        # df_filtrado acima é montado com qualquer backend (as páginas também leem linhas), então a memória é a mesma.
+        filtros_sidebar = {
+            'selected_segments': segmento_selecionado,
+            'selected_insurers': seguradora_selecionada,
+            'selected_states': estado_selecionado,
+            'selected_municipios': municipio_selecionado,
+            'start_date': data_inicio,
+            'end_date': data_fim
+        }
+        backend = filtros = None
+        if QUERY_BACKEND in ('duckdb', 'polars'):
+            get_backend = get_duckdb_backend if QUERY_BACKEND == 'duckdb' else get_polars_backend
+            backend = get_backend(ATENDIMENTO_FILE_PATH, NPS_CIDADE_PATH, NPS_PRESTADOR_PATH, _fontes_ids=(df_atendimentos_full, df_nps_prestador))
+            filtros = filtros_sidebar
+
+        # Snapshot do lote noturno (snapshots.py): usado quando os filtros coincidem exatamente com uma combinação
+        snapshot = find_snapshot(filtros_sidebar, (ATENDIMENTO_FILE_PATH, NPS_CIDADE_PATH, NPS_PRESTADOR_PATH), versao_dados)
+        metricas.contar('cache_resultados_total', camada='snapshot', resultado='falha' if snapshot is None else 'acerto')
+        if snapshot is not None:
+            manifesto, (uf_snapshot, segmento_snapshot) = snapshot
+            backend = SnapshotBackend(
+                load_snapshot_tables(manifesto['versao'], uf_snapshot, segmento_snapshot),
+                backend or PandasBackend(df_filtrado, df_nps_cidade_full, df_nps_prestador),
+                manifesto['versao'], (uf_snapshot, segmento_snapshot)
+            )
+            st.sidebar.caption(f"Agregados lidos do snapshot {manifesto['versao']}.")
+        else:
+            # Cache em disco por (conteúdo dos dados, consulta, seleção): sobrevive a reinícios e é compartilhado entre réplicas
+            backend = ResultCacheBackend(
+                backend or PandasBackend(df_filtrado, df_nps_cidade_full, df_nps_prestador),
+                get_result_cache(),
+                versao_dados,
+                filtros_sidebar
+            )
+
+        # Drilldown por prestador/município: índices CSR sobre os dados completos
+        drilldown = None
+        if selected_page in ("Score Prestador", "Capilaridade"):
+            drilldown = {
+                'df': df_atendimentos_full,
+                'df_nps_cidade': df_nps_cidade_full,
+                'df_nps_prestador': df_nps_prestador,
+                'filtros': filtros_sidebar,
+                'indices': build_drilldown_indices(df_atendimentos_full, df_nps_cidade_full, df_nps_prestador)
+            }
+
+        sketches_prestador = sketches_cidade = None
+        if normalizacao == NORMALIZACAO_OPTIONS[1] and selected_page in ("Score Prestador", "Capilaridade"):
+            sketches_particoes = build_partition_sketches(df_atendimentos_full)
+            sketches_prestador = merge_partition_sketches(sketches_particoes, 'prestador', estado_selecionado, segmento_selecionado)
+            sketches_cidade = merge_partition_sketches(sketches_particoes, 'cidade', estado_selecionado, segmento_selecionado)
+        
+        # Seleções muito grandes: KPIs aproximados primeiro, substituídos pela página exata quando ela termina
+        previa = None
+        if APPROX_MIN_LINHAS and selected_page in APPROX_KPIS and len(df_filtrado) >= APPROX_MIN_LINHAS:
+            previa = render_approximate_preview(df_filtrado, selected_page)
+
+        # --- RENDERIZAÇÃO DA PÁGINA SELECIONADA (TODAS AS OPÇÕES RESTAURADAS) ---
+        try:
+            with metricas.cronometrar('pagina_segundos', pagina=selected_page):
+                if selected_page == "Informações":
+                    page_informacao()
+                elif selected_page == "Score Prestador":
+                    page_score_prestador(df_filtrado, df_nps_prestador, sketches_prestador, backend, filtros, drilldown, comparacao)
+                elif selected_page == "Capilaridade":
+                    page_capilaridade(df_filtrado, sketches_cidade, backend, filtros, drilldown, comparacao)
+                elif selected_page == "Financeiro":
+                    page_financeiro(df_filtrado, backend, filtros, comparacao)
+                elif selected_page == "Qualidade":
+                    page_qualidade_nps(df_filtrado, df_nps_cidade_full, df_nps_prestador, backend, filtros)
+        finally:
+            if previa is not None:
+                previa.empty() # Também quando a página interrompe o script (st.stop)
+
+        # Pré-cálculo das outras páginas com a mesma seleção (o snapshot, quando usado, já está pronto).
+        # Um novo rerun da sessão cancela o pré-cálculo dela que ainda não começou.
+        if PREFETCH_ENABLED and isinstance(backend, ResultCacheBackend) and not df_filtrado.empty:
+            anterior = st.session_state.get('_prefetch')
+            if anterior is not None:
+                anterior.cancel()
+            st.session_state['_prefetch'] = get_prefetcher().agendar(backend, filtros, selected_page)
+
+
+# --- Execução Principal ---
+if __name__ == "__main__":
+    # Supondo que a função inject_css() é chamada aqui
+    # inject_css() 
+    main()
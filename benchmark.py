@@ -0,0 +1,413 @@
+"""
+Medições de desempenho do dashboard Streamlit.py.
+
+Uso:
+    python benchmark.py startup [--repeticoes 5]
+    python benchmark.py backends --atendimentos A.parquet --nps-cidade C.parquet --nps-prestador P.parquet [--uf SP]
+    python benchmark.py carga --atendimentos A.parquet --nps-cidade C.parquet --nps-prestador P.parquet [--latencia 0.5]
+    python benchmark.py sessoes [--tamanhos 20000 200000] [--sessoes 8] [--workers 1] [--passos 15]
+
+Cada medição roda em um processo Python novo, para refletir o custo de uma partida a frio.
+"""
+import argparse
+import http.server
+import json
+import os
+import random
+import resource
+import tempfile
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "Streamlit.py")
+
+IMPORT_SNIPPET = """
+import sys, time
+sys.path.insert(0, {app_dir!r})
+t = time.perf_counter()
+import Streamlit
+elapsed = time.perf_counter() - t
+pandas = sys.modules.get('pandas')
+print(elapsed, pandas is not None)
+"""
+
+# O script mede a si mesmo dentro de uma execução real do Streamlit (com ScriptRunContext),
+# antes de o AppTest montar a árvore de elementos (que por si só importa pandas).
+LOGIN_SCRIPT = """
+import runpy, sys, time
+import streamlit as st
+t = time.perf_counter()
+runpy.run_path({app_path!r}, run_name='__main__')
+st.session_state['_bench'] = (time.perf_counter() - t, 'pandas' in sys.modules)
+"""
+
+LOGIN_SNIPPET = """
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_string({script!r}, default_timeout=120).run()
+assert not at.exception, [e.value for e in at.exception]
+assert any(ti.label == 'Usuário' for ti in at.text_input), 'Formulário de login não renderizado'
+elapsed, carregado = at.session_state['_bench']
+print(elapsed, carregado)
+"""
+
+
+def run_snippet(snippet):
+    resultado = subprocess.run(
+        [sys.executable, "-c", snippet],
+        capture_output=True, text=True, cwd=APP_DIR, check=True
+    )
+    return resultado.stdout.strip().splitlines()[-1].split()
+
+
+def bench_startup(repeticoes):
+    tempos_import, tempos_login, pandas_carregado = [], [], []
+    for _ in range(repeticoes):
+        elapsed, carregado = run_snippet(IMPORT_SNIPPET.format(app_dir=APP_DIR))
+        tempos_import.append(float(elapsed))
+        pandas_carregado.append(carregado == 'True')
+        elapsed, carregado = run_snippet(LOGIN_SNIPPET.format(script=LOGIN_SCRIPT.format(app_path=APP_PATH)))
+        tempos_login.append(float(elapsed))
+        pandas_carregado.append(carregado == 'True')
+
+    print(f"Importação a frio de Streamlit.py: mediana {statistics.median(tempos_import):.3f}s (n={repeticoes})")
+    print(f"Tempo até a tela de login (execução do script, processo novo): mediana {statistics.median(tempos_login):.3f}s (n={repeticoes})")
+    print(f"pandas executado antes do login: {'sim' if any(pandas_carregado) else 'não'}")
+
+
+def normalizar_frame(df):
+    """Deixa os resultados dos dois backends comparáveis: texto como str, números como float, ordem estável."""
+    df = df.reset_index(drop=True).copy()
+    for coluna in df.columns:
+        if df[coluna].dtype.kind in 'biuf':
+            df[coluna] = df[coluna].astype(float)
+        elif df[coluna].dtype.kind != 'M':
+            df[coluna] = df[coluna].astype(str)
+    return df.sort_values(list(df.columns[:3])).reset_index(drop=True)
+
+
+def bench_backends(args):
+    sys.path.insert(0, APP_DIR)
+    import pandas as pd
+    import Streamlit as app
+
+    paths = (args.atendimentos, args.nps_cidade, args.nps_prestador)
+    t = time.perf_counter()
+    df, df_nps_cidade, df_nps_prestador = app.load_and_prepare_data(*paths)
+    print(f"Carga pandas (load_and_prepare_data): {time.perf_counter() - t:.3f}s ({len(df)} linhas)")
+    backends = [app.PandasBackend(df, df_nps_cidade, df_nps_prestador)]
+    for classe in (app.DuckDBBackend, app.PolarsBackend):
+        t = time.perf_counter()
+        backends.append(classe(*paths, app.provider_id_table(df, df_nps_prestador)))
+        print(f"Abertura {classe.nome} (consultas sobre os Parquet): {time.perf_counter() - t:.3f}s")
+
+    filtros = {
+        'selected_segments': None,
+        'selected_insurers': None,
+        'selected_states': args.uf or None,
+        'selected_municipios': None,
+        'start_date': df['data_abertura_atendimento'].min().date(),
+        'end_date': df['data_abertura_atendimento'].max().date()
+    }
+    consultas = {
+        'agregado_cidades': lambda backend: backend.agregado_cidades(filtros),
+        'agregado_prestadores': lambda backend: backend.agregado_prestadores(filtros),
+        'cms_por_prestador': lambda backend: backend.cms_por_prestador(filtros),
+        'cms_por_faixa_tempo': lambda backend: backend.cms_por_faixa_tempo(filtros),
+        'cms_ofensores': lambda backend: backend.cms_ofensores(filtros),
+        'tmc_por_segmento': lambda backend: backend.tmc_por('segmento', filtros),
+        'nps_por_municipio': lambda backend: backend.nps_por('cidade', 'municipio')
+    }
+
+    print(f"{'consulta':<24}" + ''.join(f"{backend.nome + ' (s)':>14}" for backend in backends) + "  resultado")
+    for nome, consulta in consultas.items():
+        tempos_medianos, resultados = [], []
+        for backend in backends:
+            tempos = []
+            for _ in range(args.repeticoes):
+                t = time.perf_counter()
+                resultado = consulta(backend)
+                tempos.append(time.perf_counter() - t)
+            tempos_medianos.append(statistics.median(tempos))
+            resultados.append(resultado)
+        divergentes = []
+        for backend, resultado in zip(backends[1:], resultados[1:]):
+            try:
+                pd.testing.assert_frame_equal(
+                    normalizar_frame(resultados[0]), normalizar_frame(resultado),
+                    check_dtype=False, rtol=1e-6
+                )
+            except AssertionError as erro:
+                divergentes.append(f"{backend.nome}: {str(erro).splitlines()[0]}")
+        status = 'igual' if not divergentes else 'DIFERENTE (' + '; '.join(divergentes) + ')'
+        print(f"{nome:<24}" + ''.join(f"{tempo:>14.4f}" for tempo in tempos_medianos) + f"  {status}")
+
+def servidor_local(arquivos, latencia):
+    """Servidor HTTP local que imita as URLs remotas: serve {'/nome.parquet': caminho} com atraso fixo."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latencia)
+            caminho = arquivos.get(self.path)
+            if caminho is None:
+                self.send_error(404)
+                return
+            with open(caminho, 'rb') as arquivo:
+                conteudo = arquivo.read()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(conteudo)))
+            self.end_headers()
+            self.wfile.write(conteudo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def bench_carga(args):
+    sys.path.insert(0, APP_DIR)
+    import Streamlit as app
+
+    arquivos = {'/atendimentos.parquet': args.atendimentos, '/nps_cidade.parquet': args.nps_cidade, '/nps_prestador.parquet': args.nps_prestador}
+    servidor = servidor_local(arquivos, args.latencia)
+    base = f"http://127.0.0.1:{servidor.server_address[1]}"
+    urls = [f"{base}/atendimentos.parquet", f"{base}/nps_cidade.parquet", f"{base}/nps_prestador.parquet"]
+
+    tempos_sequencial, tempos_concorrente = [], []
+    for _ in range(args.repeticoes):
+        t = time.perf_counter()
+        app.fetch_source(urls[0], app.prepare_atendimentos)
+        app.fetch_source(urls[1], app.prepare_nps)
+        app.fetch_source(urls[2], app.prepare_nps)
+        tempos_sequencial.append(time.perf_counter() - t)
+
+        app.load_and_prepare_data.clear()
+        progresso = []
+        t = time.perf_counter()
+        df, df_nps_cidade, df_nps_prestador = app.load_and_prepare_data(*urls, _progresso=lambda rotulo, *_: progresso.append(rotulo))
+        tempos_concorrente.append(time.perf_counter() - t)
+        assert len(progresso) == 3 and not df.empty and not df_nps_cidade.empty and not df_nps_prestador.empty
+
+    print(f"Carga sequencial (latência {args.latencia}s por requisição): mediana {statistics.median(tempos_sequencial):.3f}s")
+    print(f"Carga concorrente (load_and_prepare_data): mediana {statistics.median(tempos_concorrente):.3f}s")
+
+    # Degradação: fonte de NPS ausente (404) não interrompe a carga dos atendimentos
+    app.load_and_prepare_data.clear()
+    df, df_nps_cidade, df_nps_prestador = app.load_and_prepare_data(urls[0], f"{base}/ausente.parquet", urls[2])
+    print(f"NPS por cidade ausente: atendimentos={len(df)} linhas, NPS cidade vazio={df_nps_cidade.empty}, NPS prestador={len(df_nps_prestador)} linhas")
+    servidor.shutdown()
+
+
+def gerar_dados_sinteticos(linhas, pasta, semente=0):
+    """Grava atendimentos, NPS por cidade e NPS por prestador sintéticos (mesmo esquema das fontes reais) em `pasta`."""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(semente)
+    ufs = ['SP', 'RJ', 'MG', 'GO', 'PE', 'BA', 'PR', 'RS']
+    municipios = {uf: [f"{uf} CIDADE {i}" for i in range(max(linhas // 2000, 5))] for uf in ufs}
+    prestadores = [f"PRESTADOR {i} LTDA" for i in range(max(linhas // 100, 20))]
+    uf = rng.choice(ufs, linhas)
+    df = pd.DataFrame({
+        'protocolo_atendimento': np.arange(linhas).astype(str),
+        'data_abertura_atendimento': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 300 * 24 * 60, linhas), unit='min'),
+        'segmento': rng.choice(['AUTO', 'RESID', 'VIDA', 'OUTRO'], linhas),
+        'seguradora': rng.choice(['ALFA', 'BETA', 'GAMA'], linhas),
+        'uf': uf,
+        'municipio': [municipios[u][k % len(municipios[u])] for u, k in zip(uf, rng.integers(0, 1 << 30, linhas))],
+        'nome_do_prestador': rng.choice(prestadores, linhas),
+        'is_reembolso': rng.random(linhas) < 0.05,
+        'is_intermediacao': rng.random(linhas) < 0.1,
+        'tempo_chegada_min': rng.gamma(2, 30, linhas),
+        'val_total_items': rng.lognormal(5.3, 0.6, linhas)
+    })
+    df['gerou_reembolso'] = df['is_reembolso']
+    df['val_reembolso'] = np.where(df['is_reembolso'], df['val_total_items'], 0.0)
+
+    def nps(chaves):
+        meses = [f"2025-{mes:02d}" for mes in range(1, 11)]
+        df_nps = chaves.loc[chaves.index.repeat(len(meses))].reset_index(drop=True)
+        df_nps['mes_ano'] = meses * len(chaves)
+        for coluna, maximo in [('nps_promotores', 10), ('nps_neutros', 3), ('nps_detratores', 4)]:
+            df_nps[coluna] = rng.integers(0, maximo, len(df_nps)).astype(float)
+        total = (df_nps['nps_promotores'] + df_nps['nps_neutros'] + df_nps['nps_detratores']).clip(lower=1)
+        df_nps['nps_score_calculado'] = (df_nps['nps_promotores'] - df_nps['nps_detratores']) / total * 100
+        return df_nps
+
+    caminhos = tuple(os.path.join(pasta, nome) for nome in ('atendimentos.parquet', 'nps_cidade.parquet', 'nps_prestador.parquet'))
+    df.to_parquet(caminhos[0])
+    nps(df[['uf', 'municipio']].drop_duplicates().reset_index(drop=True)).to_parquet(caminhos[1])
+    nps(pd.DataFrame({'nome_do_prestador': prestadores})).to_parquet(caminhos[2])
+    return caminhos
+
+
+# Sessão autenticada de verdade (login_page) com as fontes apontando para os arquivos sintéticos.
+# O option_menu é um componente customizado que o AppTest não aciona: a página vem do session_state.
+SESSAO_SCRIPT = """
+import sys
+sys.path.insert(0, {app_dir!r})
+import streamlit as st
+import streamlit_option_menu
+streamlit_option_menu.option_menu = lambda **kwargs: st.session_state.get('_pagina', 'Informações')
+import Streamlit as app
+app.ATENDIMENTO_FILE_PATH, app.NPS_CIDADE_PATH, app.NPS_PRESTADOR_PATH = {caminhos!r}
+app.main()
+"""
+
+PAGINAS = ["Informações", "Score Prestador", "Capilaridade", "Financeiro", "Qualidade"]
+
+
+def executar_sessoes(worker, sessoes, passos, caminhos, semente):
+    """
+    Um processo = uma instância do servidor: as sessões rodam em threads concorrentes e compartilham
+    os caches do Streamlit, como no servidor real. Retorna as latências de cada rerun e o uso do processo.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    script = SESSAO_SCRIPT.format(app_dir=APP_DIR, caminhos=tuple(caminhos))
+    latencias, erros = [], []
+
+    def rerun(at, acao):
+        t = time.perf_counter()
+        at.run()
+        latencias.append((acao, time.perf_counter() - t))
+        erros.extend(f"{acao}: {excecao.value}" for excecao in at.exception)
+
+    def trocar_pagina(at, rng):
+        at.session_state['_pagina'] = rng.choice(PAGINAS)
+        return 'pagina'
+
+    def filtrar(at, rng):
+        filtro = rng.choice([elemento for elemento in at.sidebar.multiselect if elemento.label in ('Estado', 'Segmento')])
+        opcoes = [opcao for opcao in filtro.options if opcao != 'TODOS']
+        filtro.set_value(['TODOS'] if rng.random() < 0.3 or not opcoes else [rng.choice(opcoes)])
+        return 'filtro'
+
+    def mover_controle(at, rng):
+        controles = [*at.main.number_input, *at.main.slider]
+        if not controles:
+            return trocar_pagina(at, rng)
+        controle = rng.choice(controles)
+        minimo = int(controle.min if controle.min is not None else 1)
+        maximo = int(controle.max if controle.max is not None else minimo + 50)
+        controle.set_value(rng.randint(minimo, maximo))
+        return 'controle'
+
+    def sessao(indice):
+        rng = random.Random(semente + worker * 1000 + indice)
+        at = AppTest.from_string(script, default_timeout=600)
+        rerun(at, 'tela_login')
+        at.text_input(key='username_input').input('maxpar')
+        at.text_input(key='password_input').input('Max!Q@W')
+        next(botao for botao in at.button if botao.label == 'Entrar').click()
+        rerun(at, 'login')
+        for _ in range(passos):
+            rerun(at, rng.choice([trocar_pagina, filtrar, mover_controle, mover_controle])(at, rng))
+
+    threads = [threading.Thread(target=sessao, args=(indice,)) for indice in range(sessoes)]
+    t = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'worker': worker,
+        'duracao_s': time.perf_counter() - t,
+        'latencias': latencias,
+        'erros': erros,
+        'cpu_s': uso.ru_utime + uso.ru_stime,
+        'rss_pico_mb': uso.ru_maxrss / 1024  # ru_maxrss em KiB no Linux
+    }
+
+
+def percentis(valores):
+    import numpy as np
+    return np.percentile(valores, [50, 95, 99]) if valores else [float('nan')] * 3
+
+
+def bench_sessoes(args):
+    for linhas in args.tamanhos:
+        with tempfile.TemporaryDirectory() as pasta:
+            caminhos = gerar_dados_sinteticos(linhas, pasta)
+            # spawn: cada worker começa a frio, como uma réplica recém-iniciada
+            sessoes_por_worker = [args.sessoes // args.workers + (worker < args.sessoes % args.workers) for worker in range(args.workers)]
+            with ProcessPoolExecutor(max_workers=args.workers, mp_context=get_context('spawn')) as executor:
+                resultados = list(executor.map(
+                    executar_sessoes, range(args.workers), sessoes_por_worker,
+                    [args.passos] * args.workers, [caminhos] * args.workers, [args.semente] * args.workers
+                ))
+
+        latencias = [latencia for resultado in resultados for _, latencia in resultado['latencias']]
+        p50, p95, p99 = percentis(latencias)
+        print(f"\n{linhas} linhas, {args.sessoes} sessões em {args.workers} worker(s), {args.passos} interações por sessão")
+        print(f"  reruns: {len(latencias)}  p50 {p50:.3f}s  p95 {p95:.3f}s  p99 {p99:.3f}s")
+        por_acao = {}
+        for resultado in resultados:
+            for acao, latencia in resultado['latencias']:
+                por_acao.setdefault(acao, []).append(latencia)
+        for acao, valores in sorted(por_acao.items()):
+            p50, p95, p99 = percentis(valores)
+            print(f"  {acao:<12} n={len(valores):<4} p50 {p50:.3f}s  p95 {p95:.3f}s  p99 {p99:.3f}s")
+        for resultado in resultados:
+            print(
+                f"  worker {resultado['worker']}: {resultado['duracao_s']:.1f}s de parede, CPU {resultado['cpu_s']:.1f}s "
+                f"({resultado['cpu_s'] / resultado['duracao_s'] * 100:.0f}% de um núcleo), RSS pico {resultado['rss_pico_mb']:.0f} MB"
+            )
+        erros = [erro for resultado in resultados for erro in resultado['erros']]
+        if erros:
+            print(f"  {len(erros)} exceção(ões); primeira: {erros[0]}")
+        if args.json:
+            with open(args.json, 'a', encoding='utf-8') as arquivo:
+                arquivo.write(json.dumps({'linhas': linhas, 'sessoes': args.sessoes, 'workers': args.workers, 'resultados': resultados}) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do dashboard de Score do Prestador.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    parser_startup = subparsers.add_parser("startup", help="Mede a importação a frio e o tempo até a tela de login.")
+    parser_startup.add_argument("--repeticoes", type=int, default=5)
+
+    parser_backends = subparsers.add_parser("backends", help="Compara as agregações das páginas em pandas, DuckDB e Polars.")
+    parser_backends.add_argument("--atendimentos", required=True)
+    parser_backends.add_argument("--nps-cidade", required=True)
+    parser_backends.add_argument("--nps-prestador", required=True)
+    parser_backends.add_argument("--uf", nargs="*", help="Filtra por UF (padrão: todas)")
+    parser_backends.add_argument("--repeticoes", type=int, default=5)
+
+    parser_carga = subparsers.add_parser("carga", help="Mede a carga das três fontes por HTTP local, sequencial vs concorrente.")
+    parser_carga.add_argument("--atendimentos", required=True)
+    parser_carga.add_argument("--nps-cidade", required=True)
+    parser_carga.add_argument("--nps-prestador", required=True)
+    parser_carga.add_argument("--latencia", type=float, default=0.5, help="Atraso por requisição, em segundos")
+    parser_carga.add_argument("--repeticoes", type=int, default=3)
+
+    parser_sessoes = subparsers.add_parser("sessoes", help="Teste de carga: N sessões concorrentes (login, filtros, páginas e controles) via AppTest.")
+    parser_sessoes.add_argument("--tamanhos", type=int, nargs="+", default=[20000, 200000], help="Linhas de atendimentos sintéticos por rodada")
+    parser_sessoes.add_argument("--sessoes", type=int, default=8, help="Sessões simultâneas no total")
+    parser_sessoes.add_argument("--workers", type=int, default=1, help="Processos (instâncias do servidor) entre os quais as sessões são divididas")
+    parser_sessoes.add_argument("--passos", type=int, default=15, help="Interações por sessão após o login")
+    parser_sessoes.add_argument("--semente", type=int, default=0)
+    parser_sessoes.add_argument("--json", help="Acrescenta os resultados brutos (latências por rerun) a este arquivo JSON Lines")
+
+    args = parser.parse_args()
+    if args.comando == "startup":
+        bench_startup(args.repeticoes)
+    elif args.comando == "backends":
+        bench_backends(args)
+    elif args.comando == "carga":
+        bench_carga(args)
+    elif args.comando == "sessoes":
+        bench_sessoes(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Geometrias pré-simplificadas dos municípios para o mapa coroplético do dashboard Streamlit.py.
+
+Uso:
+    python mapas.py BR_Municipios_2022.geojson [--campo-nome NM_MUN] [--campo-uf SIGLA_UF] [--campo-codigo CD_MUN]
+
+Lê a malha municipal do IBGE em GeoJSON (EPSG:4674/4326) e grava um TopoJSON por nível de detalhe em
+mapas/municipios_<nivel>.topo.json (níveis e tamanhos de grade em app.MAPA_NIVEIS). A simplificação é a
+própria quantização: os vértices são encaixados numa grade do tamanho do nível e os repetidos em sequência,
+assim como as idas e voltas sem área, são removidos. Como vizinhos encaixam a divisa nos mesmos pontos, não surgem frestas entre municípios, e
+cada divisa é gravada uma única vez, como um arco compartilhado pelos dois municípios.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, APP_DIR)
+
+import numpy as np
+
+import Streamlit as app
+
+# Prefixo (2 dígitos) do código IBGE do município -> sigla da UF, para malhas sem a coluna da UF
+UF_POR_CODIGO_IBGE = {
+    '11': 'RO', '12': 'AC', '13': 'AM', '14': 'RR', '15': 'PA', '16': 'AP', '17': 'TO',
+    '21': 'MA', '22': 'PI', '23': 'CE', '24': 'RN', '25': 'PB', '26': 'PE', '27': 'AL', '28': 'SE', '29': 'BA',
+    '31': 'MG', '32': 'ES', '33': 'RJ', '35': 'SP', '41': 'PR', '42': 'SC', '43': 'RS',
+    '50': 'MS', '51': 'MT', '52': 'GO', '53': 'DF'
+}
+
+
+def remover_espinhos(pontos):
+    """
+    Remove do anel aberto os vértices repetidos em sequência e as idas e voltas (A, B, A) que a grade cria
+    em trechos mais estreitos que a célula: sem área, elas só gerariam junções (e arcos) fora das divisas reais.
+    """
+    pilha = []
+    for ponto in map(tuple, pontos):
+        if pilha and pilha[-1] == ponto:
+            continue
+        if len(pilha) >= 2 and pilha[-2] == ponto:
+            pilha.pop()
+            continue
+        pilha.append(ponto)
+    # Espinhos na emenda do anel (o último ponto é vizinho do primeiro)
+    while len(pilha) >= 3:
+        if pilha[-1] == pilha[0] or pilha[-2] == pilha[0]:
+            pilha.pop()
+        elif pilha[-1] == pilha[1]:
+            pilha.pop(0)
+        else:
+            break
+    return np.array(pilha, dtype=np.int64).reshape(-1, 2)
+
+
+def quantizar_anel(anel, origem, grade):
+    """Encaixa o anel na grade e remove repetidos e espinhos; devolve o anel fechado ou None se ele degenerar."""
+    pontos = np.rint((np.asarray(anel, dtype=float)[:, :2] - origem) / grade).astype(np.int64)
+    if len(pontos) > 1 and np.all(pontos[0] == pontos[-1]):
+        pontos = pontos[:-1]
+    pontos = remover_espinhos(pontos)
+    if len(pontos) < 3 or len(np.unique(pontos, axis=0)) < 3:
+        return None
+    return np.vstack([pontos, pontos[:1]])
+
+
+def poligonos(geometria):
+    if geometria['type'] == 'Polygon':
+        return [geometria['coordinates']]
+    if geometria['type'] == 'MultiPolygon':
+        return geometria['coordinates']
+    return []
+
+
+def cortar_em_arcos(aneis):
+    """
+    Topologia dos anéis quantizados (fechados): cada divisa vira um único arco compartilhado pelos vizinhos.
+    Um ponto é junção quando aparece com pares de vizinhos diferentes (início ou fim de uma divisa comum);
+    os anéis são cortados nas junções e cada arco repetido, em qualquer sentido, é guardado uma vez e
+    referenciado como ~i quando percorrido ao contrário. Retorna (arcos, índices dos arcos de cada anel).
+    """
+    # Anéis abertos começando no menor ponto: o mesmo anel em dois municípios (enclave) fica idêntico
+    abertos = []
+    for anel in aneis:
+        pontos = anel[:-1]
+        abertos.append(np.roll(pontos, -np.lexsort((pontos[:, 1], pontos[:, 0]))[0], axis=0))
+    tamanhos = np.fromiter((len(aberto) for aberto in abertos), dtype=np.int64, count=len(abertos))
+    pontos = np.concatenate(abertos)
+    chaves = (pontos[:, 0] << 32) | pontos[:, 1] # Coordenadas da grade são não negativas (origem no mínimo)
+
+    # Vizinhos de cada ocorrência, dentro do próprio anel (circular)
+    fim = np.cumsum(tamanhos)
+    inicio = fim - tamanhos
+    anel_de = np.repeat(np.arange(len(abertos)), tamanhos)
+    local = np.arange(len(chaves)) - inicio[anel_de]
+    anterior = chaves[inicio[anel_de] + (local - 1) % tamanhos[anel_de]]
+    seguinte = chaves[inicio[anel_de] + (local + 1) % tamanhos[anel_de]]
+    pares = np.unique(np.column_stack([chaves, np.minimum(anterior, seguinte), np.maximum(anterior, seguinte)]), axis=0)
+    chaves_pares, contagem = np.unique(pares[:, 0], return_counts=True)
+    juncoes = np.isin(chaves, chaves_pares[contagem > 1])
+
+    arcos, indices = [], {}
+
+    def registrar(arco):
+        chave = arco.tobytes()
+        if chave not in indices:
+            reverso = np.ascontiguousarray(arco[::-1]).tobytes()
+            if reverso in indices:
+                return ~indices[reverso]
+            indices[chave] = len(arcos)
+            arcos.append(arco)
+        return indices[chave]
+
+    aneis_arcos = []
+    for posicao, aberto in enumerate(abertos):
+        cortes = np.flatnonzero(juncoes[inicio[posicao]:fim[posicao]])
+        if len(cortes) == 0:
+            aneis_arcos.append([registrar(np.vstack([aberto, aberto[:1]]))])
+            continue
+        girado = np.roll(aberto, -cortes[0], axis=0)
+        fechado = np.vstack([girado, girado[:1]])
+        limites = np.r_[cortes - cortes[0], len(aberto)]
+        aneis_arcos.append([registrar(fechado[a:b + 1]) for a, b in zip(limites[:-1], limites[1:])])
+    return arcos, aneis_arcos
+
+
+def gerar_topojson(features, grade, origem, campos):
+    """
+    TopoJSON quantizado (transform = grade e origem) com arcos compartilhados entre vizinhos, codificados em deltas.
+    Municípios cujos anéis somem na grade viram um quadrado de uma célula no centro do maior anel,
+    para que nenhum município desapareça do mapa nos níveis mais grosseiros.
+    """
+    aneis, estruturas, propriedades_municipios = [], [], []
+    for feature in features:
+        propriedades = feature.get('properties') or {}
+        codigo = str(propriedades.get(campos['codigo'], ''))
+        uf = propriedades.get(campos['uf']) or UF_POR_CODIGO_IBGE.get(codigo[:2], '')
+        poligonos_aneis = []
+        for poligono in poligonos(feature['geometry']):
+            posicoes = []
+            for anel in poligono:
+                pontos = quantizar_anel(anel, origem, grade)
+                if pontos is not None:
+                    posicoes.append(len(aneis))
+                    aneis.append(pontos)
+            if posicoes:
+                poligonos_aneis.append(posicoes)
+        if not poligonos_aneis:
+            # Município menor que a célula da grade: um quadrado de uma célula no centro do maior anel
+            maior = max((anel for poligono in poligonos(feature['geometry']) for anel in poligono[:1]), key=len)
+            centro = np.rint((np.asarray(maior, dtype=float)[:, :2].mean(axis=0) - origem) / grade).astype(np.int64)
+            poligonos_aneis.append([len(aneis)])
+            aneis.append(centro + np.array([[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]))
+        estruturas.append(poligonos_aneis)
+        propriedades_municipios.append({'codigo': codigo, 'nome': propriedades.get(campos['nome'], ''), 'uf': uf})
+
+    arcos, aneis_arcos = cortar_em_arcos(aneis)
+    geometrias = []
+    for poligonos_aneis, propriedades in zip(estruturas, propriedades_municipios):
+        poligonos_arcos = [[aneis_arcos[posicao] for posicao in posicoes] for posicoes in poligonos_aneis]
+        geometrias.append({
+            'type': 'MultiPolygon' if len(poligonos_arcos) > 1 else 'Polygon',
+            'arcs': poligonos_arcos if len(poligonos_arcos) > 1 else poligonos_arcos[0],
+            'properties': propriedades
+        })
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [grade, grade], 'translate': [float(origem[0]), float(origem[1])]},
+        'objects': {'municipios': {'type': 'GeometryCollection', 'geometries': geometrias}},
+        'arcs': [np.vstack([arco[:1], np.diff(arco, axis=0)]).tolist() for arco in arcos]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera os TopoJSON pré-simplificados dos municípios usados no mapa do dashboard.")
+    parser.add_argument("geojson", help="Malha municipal (GeoJSON) do IBGE")
+    parser.add_argument("--campo-nome", default="NM_MUN")
+    parser.add_argument("--campo-uf", default="SIGLA_UF", help="Se ausente na malha, a UF vem do prefixo do código IBGE")
+    parser.add_argument("--campo-codigo", default="CD_MUN")
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    with open(args.geojson, encoding='utf-8') as arquivo:
+        features = json.load(arquivo)['features']
+    vertices = np.concatenate([
+        np.asarray(anel, dtype=float)[:, :2] for feature in features for poligono in poligonos(feature['geometry']) for anel in poligono
+    ])
+    origem = vertices.min(axis=0)
+    print(f"Leitura: {time.perf_counter() - t:.1f}s ({len(features)} municípios, {len(vertices)} vértices)")
+
+    os.makedirs(app.MAPAS_DIR, exist_ok=True)
+    campos = {'nome': args.campo_nome, 'uf': args.campo_uf, 'codigo': args.campo_codigo}
+    for nivel, grade in app.MAPA_NIVEIS.items():
+        t = time.perf_counter()
+        topologia = gerar_topojson(features, grade, origem, campos)
+        destino = os.path.join(app.MAPAS_DIR, f"municipios_{nivel}.topo.json")
+        with open(f"{destino}.tmp", 'w', encoding='utf-8') as arquivo:
+            json.dump(topologia, arquivo, ensure_ascii=False, separators=(',', ':'))
+        os.replace(f"{destino}.tmp", destino)
+        pontos = sum(len(arco) for arco in topologia['arcs'])
+        print(f"{nivel}: grade {grade}°, {pontos} vértices, {os.path.getsize(destino) / 1e6:.1f} MB em {time.perf_counter() - t:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Lote de snapshots do dashboard Streamlit.py: score do prestador, índice de capilaridade e ofensores
+de CMS para cada combinação (uf, segmento), incluindo as visões nacionais (TODOS).
+
+Uso:
+    python snapshots.py [--atendimentos A.parquet --nps-cidade C.parquet --nps-prestador P.parquet]
+                        [--inicio AAAA-MM-DD --fim AAAA-MM-DD] [--processos 4] [--manter 7]
+
+Cada execução grava uma nova versão em snapshots/<AAAAMMDDTHHMMSS>/ (uma tabela Parquet por resultado,
+com as colunas snapshot_uf e snapshot_segmento, e um manifest.json com a impressão digital dos dados).
+O dashboard lê o snapshot mais recente quando as fontes, a impressão digital dos dados carregados,
+o período e a combinação dos filtros coincidem exatamente.
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, APP_DIR)
+
+import pandas as pd
+
+import Streamlit as app
+
+_DADOS = {}
+
+
+def iniciar_processo(df, df_nps_prestador):
+    """Recebe os dados uma vez por processo do pool (e não uma vez por combinação)."""
+    _DADOS['df'] = df
+    _DADOS['df_nps_prestador'] = df_nps_prestador
+
+
+def calcular_combinacao(combinacao, inicio, fim):
+    uf, segmento = combinacao
+    df = app.apply_filters(
+        _DADOS['df'],
+        None if segmento == app.ALL_OPTION else [segmento],
+        None,
+        None if uf == app.ALL_OPTION else [uf],
+        None,
+        inicio,
+        fim
+    )
+    if df.empty:
+        return combinacao, None
+    return combinacao, app.compute_snapshot_tables(df, _DADOS['df_nps_prestador'])
+
+
+def gravar_snapshot(resultados, manifesto):
+    """Grava a versão numa pasta temporária e a renomeia no fim: o dashboard nunca vê um snapshot pela metade."""
+    destino = os.path.join(app.SNAPSHOTS_DIR, manifesto['versao'])
+    temporario = os.path.join(app.SNAPSHOTS_DIR, f".{manifesto['versao']}.tmp")
+    os.makedirs(temporario, exist_ok=True)
+    for tabela in manifesto['tabelas']:
+        partes = [
+            tabelas[tabela].assign(snapshot_uf=uf, snapshot_segmento=segmento)
+            for (uf, segmento), tabelas in resultados.items()
+        ]
+        df_tabela = pd.concat(partes, ignore_index=True)
+        # Categorias diferentes entre as combinações viram texto; a leitura filtra as linhas por snapshot_uf/snapshot_segmento
+        for coluna in df_tabela.columns:
+            if isinstance(df_tabela[coluna].dtype, pd.CategoricalDtype):
+                df_tabela[coluna] = df_tabela[coluna].astype(str)
+        df_tabela.to_parquet(os.path.join(temporario, f"{tabela}.parquet"), index=False)
+    with open(os.path.join(temporario, 'manifest.json'), 'w', encoding='utf-8') as arquivo:
+        json.dump(manifesto, arquivo, ensure_ascii=False, indent=2)
+    os.replace(temporario, destino)
+    return destino
+
+
+def remover_versoes_antigas(manter):
+    versoes = sorted(nome for nome in os.listdir(app.SNAPSHOTS_DIR) if not nome.startswith('.'))
+    for versao in versoes[:-manter] if manter > 0 else []:
+        shutil.rmtree(os.path.join(app.SNAPSHOTS_DIR, versao), ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera snapshots versionados do score, capilaridade e ofensores de CMS por UF x segmento.")
+    parser.add_argument("--atendimentos", default=app.ATENDIMENTO_FILE_PATH)
+    parser.add_argument("--nps-cidade", default=app.NPS_CIDADE_PATH)
+    parser.add_argument("--nps-prestador", default=app.NPS_PRESTADOR_PATH)
+    parser.add_argument("--inicio", type=datetime.date.fromisoformat, help="Início do período (padrão: primeira data dos dados)")
+    parser.add_argument("--fim", type=datetime.date.fromisoformat, help="Fim do período (padrão: última data dos dados)")
+    parser.add_argument("--processos", type=int, default=os.cpu_count(), help="Tamanho do pool de processos")
+    parser.add_argument("--manter", type=int, default=7, help="Quantidade de versões mantidas em disco (0 = todas)")
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    fontes = [args.atendimentos, args.nps_cidade, args.nps_prestador]
+    df, df_nps_cidade, df_nps_prestador = app.load_and_prepare_data(*fontes)
+    inicio = args.inicio or df['data_abertura_atendimento'].min().date()
+    fim = args.fim or df['data_abertura_atendimento'].max().date()
+    print(f"Carga: {time.perf_counter() - t:.1f}s ({len(df)} linhas, período {inicio} a {fim})")
+
+    ufs = [app.ALL_OPTION] + sorted(df['uf'].astype(str).unique())
+    segmentos = [app.ALL_OPTION] + sorted(df['segmento'].astype(str).unique())
+    combinacoes = [(uf, segmento) for uf in ufs for segmento in segmentos]
+
+    t = time.perf_counter()
+    resultados = {}
+    with ProcessPoolExecutor(max_workers=args.processos, initializer=iniciar_processo, initargs=(df, df_nps_prestador)) as executor:
+        futures = [executor.submit(calcular_combinacao, combinacao, inicio, fim) for combinacao in combinacoes]
+        for future in as_completed(futures):
+            combinacao, tabelas = future.result()
+            if tabelas is not None:
+                resultados[combinacao] = tabelas
+    print(f"Cálculo: {time.perf_counter() - t:.1f}s ({len(resultados)} de {len(combinacoes)} combinações com dados, {args.processos} processos)")
+
+    agora = datetime.datetime.now()
+    manifesto = {
+        'versao': agora.strftime('%Y%m%dT%H%M%S'),
+        'gerado_em': agora.isoformat(timespec='seconds'),
+        'fontes': fontes,
+        'linhas': len(df),
+        'versao_dados': app.dataset_fingerprint(df, df_nps_cidade, df_nps_prestador),
+        'inicio': str(inicio),
+        'fim': str(fim),
+        'combinacoes': sorted([list(combinacao) for combinacao in resultados]),
+        'tabelas': list(next(iter(resultados.values()))) if resultados else []
+    }
+    destino = gravar_snapshot(resultados, manifesto)
+    remover_versoes_antigas(args.manter)
+    print(f"Snapshot gravado em {destino}")
+
+
+if __name__ == "__main__":
+    main()